@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+class CartConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'cart'
+
+    def ready(self):
+        import cart.signals  # Import signals when app is ready
@@ -0,0 +1,101 @@
+# cart/batch.py
+"""
+Áp dụng một lô thao tác giỏ hàng (thêm, đặt lại số lượng, xóa) một lần: khôi phục giỏ hàng
+sau khi đăng nhập, mua lại đơn cũ, thêm tất cả từ danh sách yêu thích. Các API thêm/sửa/xóa
+một mục cũng dùng cùng đường này với lô một thao tác.
+
+- Giỏ hàng được sửa trong cache dưới khóa của giỏ hàng (cart/store.py), tồn kho lấy từ ảnh
+  chụp biến thể (một lần get_many cho cả lô) trừ đi số lượng khách khác đang giữ
+  (cart/reservations.py, một truy vấn cho cả lô)
+- Các thao tác được áp dụng lần lượt, tồn kho được kiểm tra theo số lượng cuối cùng của từng
+  biến thể; thao tác không hợp lệ chỉ bị bỏ qua và được báo lỗi trong kết quả, không làm hỏng cả lô
+- Giỏ hàng chỉ tăng version một lần cho cả lô; việc ghi xuống DB do write-behind đảm nhận
+"""
+from .reservations import held_quantities
+from .store import mutate_cart, get_variant_snapshots, new_line
+
+OUT_OF_STOCK_MESSAGE = 'Sản phẩm này đã hết hàng'
+NOT_FOUND_MESSAGE = 'Biến thể sản phẩm không tồn tại'
+NOT_IN_CART_MESSAGE = 'Sản phẩm không có trong giỏ hàng'
+
+
+def stock_exceeded_message(stock):
+    return f'Số lượng yêu cầu vượt quá tồn kho. Chỉ còn {stock} sản phẩm.'
+
+
+def _result(index, operation, status, quantity=None, message=None):
+    return {
+        'index': index,
+        'op': operation['op'],
+        'variant_id': operation['variant_id'],
+        'status': status,
+        'quantity': quantity,
+        'message': message,
+    }
+
+
+def _apply(lines, operations, snapshots, held=None):
+    """
+    Áp dụng các thao tác lên các dòng giỏ hàng (sửa trực tiếp lines), trả về kết quả từng thao tác.
+    held: {variant_id: số lượng khách khác đang giữ}, được trừ khỏi tồn kho trong ảnh chụp
+    """
+    held = held or {}
+    results = []
+    for index, operation in enumerate(operations):
+        variant_id = operation['variant_id']
+        line = lines.get(variant_id)
+        current = line.quantity if line else 0
+
+        if operation['op'] == 'remove':
+            if line is None:
+                results.append(_result(index, operation, 'error', 0, NOT_IN_CART_MESSAGE))
+                continue
+            del lines[variant_id]
+            results.append(_result(index, operation, 'ok', 0))
+            continue
+
+        snapshot = snapshots.get(variant_id)
+        if snapshot is None:
+            results.append(_result(index, operation, 'error', current, NOT_FOUND_MESSAGE))
+            continue
+        if operation['op'] == 'update' and line is None:
+            results.append(_result(index, operation, 'error', 0, NOT_IN_CART_MESSAGE))
+            continue
+
+        quantity = current + operation['quantity'] if operation['op'] == 'add' else operation['quantity']
+        stock = snapshot['stock'] - held.get(variant_id, 0)
+        if stock <= 0:
+            results.append(_result(index, operation, 'error', current, OUT_OF_STOCK_MESSAGE))
+            continue
+        if stock < quantity:
+            results.append(_result(index, operation, 'error', current, stock_exceeded_message(stock)))
+            continue
+        lines[variant_id] = line._replace(quantity=quantity) if line else new_line(quantity)
+        results.append(_result(index, operation, 'ok', quantity))
+    return results
+
+
+def apply_cart_operations(user, operations):
+    """
+    Áp dụng các thao tác (op, variant_id, quantity) vào giỏ hàng của user.
+    Trả về (trạng thái giỏ hàng, ảnh chụp các biến thể, kết quả từng thao tác,
+    id biến thể có dòng được tạo/cập nhật, id các dòng đã xóa)
+    """
+    snapshots = get_variant_snapshots({operation['variant_id'] for operation in operations})
+    # Tồn kho có thể bán: không tính hàng khách khác đang giữ khi thanh toán
+    stocked_ids = {operation['variant_id'] for operation in operations if operation['op'] != 'remove'}
+    held = held_quantities(stocked_ids, exclude_user=user) if stocked_ids else {}
+    removed = {}
+
+    def mutation(lines):
+        before = dict(lines)
+        results = _apply(lines, operations, snapshots, held)
+        removed.update({variant_id: before[variant_id] for variant_id in before if variant_id not in lines})
+        changed = [variant_id for variant_id, line in lines.items() if before.get(variant_id) != line]
+        return results, changed
+
+    state, (results, changed_variant_ids) = mutate_cart(user.id, mutation)
+    removed_item_ids = [
+        line.item_id if line.item_id is not None else -variant_id for variant_id, line in removed.items()
+    ]
+    return state, snapshots, results, changed_variant_ids, removed_item_ids
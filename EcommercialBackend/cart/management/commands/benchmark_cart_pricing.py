@@ -0,0 +1,76 @@
+# cart/management/commands/benchmark_cart_pricing.py
+import random
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from cart.models import CartItem
+from cart.pricing import price_cart
+from products.models import Product, ProductVariant
+from products.pricing import get_variant_price
+
+
+def legacy_cart_totals(items):
+    """Cách tính cũ của serializer giỏ hàng (duyệt giỏ nhiều lần, tính lại giá từng mục)"""
+    total_items = sum(item.quantity for item in items)
+    total_price = 0
+    for item in items:
+        total_price += get_variant_price(item.variant) * item.quantity
+    lines = []
+    for item in items:
+        price = get_variant_price(item.variant)
+        lines.append((price, get_variant_price(item.variant) * item.quantity))
+    return total_items, total_price, lines
+
+
+class Command(BaseCommand):
+    help = 'Đo thời gian tính giá giỏ hàng (cart/pricing.py) với giỏ hàng giả lập trong bộ nhớ (không dùng DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 20, 200],
+                            help='Số mục trong giỏ hàng')
+        parser.add_argument('--iterations', type=int, default=2000,
+                            help='Số lần tính cho mỗi kích thước')
+        parser.add_argument('--shops', type=int, default=5,
+                            help='Số cửa hàng trong giỏ hàng')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _cart_items(self, rng, size, shops):
+        """Mục giỏ hàng giả lập; khoảng một nửa biến thể không có giá riêng (lấy giá sản phẩm)"""
+        items = []
+        for index in range(1, size + 1):
+            product = Product(id=index, shop_id=rng.randint(1, shops), price=Decimal(rng.randint(50, 500) * 1000),
+                              sale_price=Decimal(rng.randint(40, 50) * 1000) if rng.random() < 0.3 else None)
+            variant = ProductVariant(id=index, product=product,
+                                     price=Decimal(rng.randint(50, 500) * 1000) if rng.random() < 0.5 else None)
+            items.append(CartItem(id=index, variant=variant, quantity=rng.randint(1, 5)))
+        return items
+
+    def _measure(self, function, items, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function(items)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        for size in options['sizes']:
+            items = self._cart_items(rng, size, options['shops'])
+
+            pricing = price_cart(items)
+            total_items, total_price, _ = legacy_cart_totals(items)
+            if (pricing.total_items, pricing.subtotal) != (total_items, total_price):
+                self.stderr.write(f"Kết quả không khớp với cách tính cũ ở giỏ {size} mục")
+
+            for label, function in (('cách cũ', legacy_cart_totals), ('price_cart', price_cart)):
+                timings = self._measure(function, items, options['iterations'])
+                p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+                self.stdout.write(
+                    f"{size} mục, {label}: trung bình {np.mean(timings):.4f}ms, p50 {p50:.4f}ms, "
+                    f"p95 {p95:.4f}ms, p99 {p99:.4f}ms"
+                )
+        self.stdout.write(self.style.SUCCESS('Hoàn tất đo hiệu năng.'))
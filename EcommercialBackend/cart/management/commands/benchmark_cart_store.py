@@ -0,0 +1,87 @@
+# cart/management/commands/benchmark_cart_store.py
+import random
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from cart.store import (
+    CartState, CartLine, VARIANT_SNAPSHOT_PREFIX, VARIANT_SNAPSHOT_TIMEOUT, CART_STATE_TIMEOUT,
+    _cache, _state_key, get_cart_state, get_variant_snapshots, render_cart, cart_etag
+)
+
+# User giả lập (id âm để không trùng user thật)
+BENCHMARK_USER_ID = -1
+
+
+class Command(BaseCommand):
+    help = ('Đo thời gian đọc giỏ hàng từ kho giỏ hàng (cart/store.py): trạng thái + ảnh chụp biến thể '
+            'giả lập trong cache, render như GET /api/cart/ (không dùng DB)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 20, 100],
+                            help='Số mục trong giỏ hàng')
+        parser.add_argument('--iterations', type=int, default=2000,
+                            help='Số lần đọc cho mỗi kích thước')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _snapshot(self, rng, variant_id):
+        return {
+            'id': variant_id,
+            'product_id': variant_id,
+            'product_slug': f'san-pham-{variant_id}',
+            'product_name': f'Sản phẩm {variant_id}',
+            'sku': f'SKU-{variant_id}',
+            'image_url': f'https://res.cloudinary.com/demo/image/upload/{variant_id}.jpg',
+            'image_derivatives': {},
+            'attributes': [
+                {'name': 'color', 'display_name': 'Màu', 'value': 'red', 'display_value': 'Đỏ'},
+                {'name': 'size', 'display_name': 'Kích thước', 'value': 'M', 'display_value': 'M'},
+            ],
+            'stock': rng.randint(1, 100),
+            'shop_id': rng.randint(1, 5),
+            'shop_name': 'Cửa hàng',
+            'price': Decimal(rng.randint(50, 500) * 1000),
+            'stamp': str(variant_id),
+        }
+
+    def _prepare(self, rng, size):
+        cache = _cache()
+        variant_ids = range(10 ** 9, 10 ** 9 + size)
+        cache.set_many(
+            {f"{VARIANT_SNAPSHOT_PREFIX}{variant_id}": self._snapshot(rng, variant_id) for variant_id in variant_ids},
+            VARIANT_SNAPSHOT_TIMEOUT
+        )
+        lines = {variant_id: CartLine(rng.randint(1, 5), None, '2025-01-01T00:00:00+07:00')
+                 for variant_id in variant_ids}
+        state = CartState(BENCHMARK_USER_ID, None, 1, 1, None, None, lines)
+        cache.set(_state_key(BENCHMARK_USER_ID), state, CART_STATE_TIMEOUT)
+        return variant_ids
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        request = Request(APIRequestFactory().get('/api/cart/'))
+        for size in options['sizes']:
+            variant_ids = self._prepare(rng, size)
+
+            timings = []
+            for _ in range(options['iterations']):
+                started = time.perf_counter()
+                state = get_cart_state(BENCHMARK_USER_ID)
+                snapshots = get_variant_snapshots(state.lines)
+                cart_etag(request, state, snapshots)
+                render_cart(request, state, snapshots)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+            self.stdout.write(
+                f"{size} mục: trung bình {np.mean(timings):.3f}ms, p50 {p50:.3f}ms, "
+                f"p95 {p95:.3f}ms, p99 {p99:.3f}ms"
+            )
+            _cache().delete_many(
+                [_state_key(BENCHMARK_USER_ID)] + [f"{VARIANT_SNAPSHOT_PREFIX}{variant_id}" for variant_id in variant_ids]
+            )
+        self.stdout.write(self.style.SUCCESS('Hoàn tất đo hiệu năng.'))
@@ -0,0 +1,25 @@
+# cart/management/commands/release_expired_reservations.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.reservations import release_expired_reservations, SWEEP_BATCH_SIZE, SWEEP_INTERVAL
+
+
+class Command(BaseCommand):
+    help = 'Xóa các lượt giữ hàng đã hết hạn (chạy định kỳ bằng cron, hoặc --loop để chạy liên tục)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+                            help='Số lượt giữ xóa trong mỗi lô')
+        parser.add_argument('--loop', action='store_true',
+                            help='Chạy liên tục, mỗi --interval giây một lần')
+        parser.add_argument('--interval', type=int, default=SWEEP_INTERVAL)
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_reservations(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Đã trả lại {released} lượt giữ hàng hết hạn.'))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -1,10 +1,14 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 from core.models import User
 from products.models import ProductVariant
 
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='carts')
+    # Tăng sau mỗi thay đổi của giỏ hàng (client dùng để so khớp trạng thái cục bộ)
+    version = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -14,6 +18,12 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.email}"
 
+    def touch(self):
+        """Ghi nhận giỏ hàng vừa thay đổi: tăng version (nguyên tử) và cập nhật updated_at"""
+        Cart.objects.filter(pk=self.pk).update(version=F('version') + 1, updated_at=timezone.now())
+        self.version, self.updated_at = Cart.objects.filter(pk=self.pk).values_list('version', 'updated_at').get()
+        return self.version
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -30,6 +40,30 @@ class CartItem(models.Model):
         return f"{self.quantity} x {self.variant.product.name}"
 
 
+class StockReservation(models.Model):
+    """
+    Giữ hàng tạm thời của khách cho một biến thể khi bắt đầu thanh toán (xem cart/reservations.py).
+    Hết hạn sau expires_at; tồn kho có thể bán = stock - tổng các lượt giữ còn hiệu lực
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stock_reservations'
+        unique_together = ('user', 'variant')
+        indexes = [
+            # Tổng số lượng đang được giữ của một biến thể (các lượt chưa hết hạn)
+            models.Index(fields=['variant', 'expires_at'], name='reservation_variant_exp_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} giữ {self.quantity} x {self.variant.sku}"
+
+
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlists')
     product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='wishlist_users')
@@ -0,0 +1,139 @@
+# cart/pricing.py
+"""
+Tính giá giỏ hàng trong một lượt duyệt các mục: giá hiệu lực từng mục, thành tiền, tạm tính
+theo cửa hàng, phí vận chuyển và tổng cộng. Kết quả (CartPricing) được dùng chung cho
+giỏ hàng hiển thị (cart/store.py) và CreateOrderSerializer để giá hiển thị và giá đặt hàng
+luôn khớp nhau.
+
+- Giá hiệu lực theo products/pricing.py (variant.sale_price -> variant.price -> giá sản phẩm);
+  các mục cần được lấy kèm variant__product (select_related/prefetch_related)
+- Đơn hàng hiện được tạo chung cho nhiều cửa hàng với một mức phí vận chuyển (SHIPPING_FEE);
+  shipping_estimate của từng cửa hàng là phí nếu cửa hàng đó giao riêng
+"""
+from decimal import Decimal
+from typing import NamedTuple
+
+from products.pricing import get_variant_price
+
+SHIPPING_FEE = Decimal('30000')
+
+ZERO = Decimal('0')
+
+
+class PricedLine(NamedTuple):
+    """Giá của một mục giỏ hàng"""
+    item_id: int
+    variant_id: int
+    product_id: int
+    shop_id: int
+    quantity: int
+    unit_price: Decimal
+    line_total: Decimal
+
+
+class ShopSubtotal(NamedTuple):
+    """Tạm tính của các mục thuộc một cửa hàng"""
+    shop_id: int
+    item_ids: tuple
+    total_items: int
+    subtotal: Decimal
+    shipping_estimate: Decimal
+
+    def as_dict(self):
+        return {
+            'shop_id': self.shop_id,
+            'item_ids': list(self.item_ids),
+            'total_items': self.total_items,
+            'subtotal': self.subtotal,
+            'shipping_estimate': self.shipping_estimate,
+        }
+
+
+class CartPricing(NamedTuple):
+    """Kết quả tính giá của một tập mục giỏ hàng"""
+    lines: tuple
+    shops: tuple
+    total_items: int
+    subtotal: Decimal
+    shipping_fee: Decimal
+    discount_amount: Decimal
+    grand_total: Decimal
+    lines_by_item: dict
+
+    def line(self, item_id):
+        """Giá của mục giỏ hàng theo id (None nếu mục không nằm trong lần tính)"""
+        return self.lines_by_item.get(item_id)
+
+    def totals(self):
+        """Các tổng của giỏ hàng (dùng cho phản hồi API)"""
+        return {
+            'total_items': self.total_items,
+            'total_price': self.subtotal,
+            'shipping_fee': self.shipping_fee,
+            'discount_amount': self.discount_amount,
+            'grand_total': self.grand_total,
+            'shops': [shop.as_dict() for shop in self.shops],
+        }
+
+
+def estimate_shipping_fee(shop_subtotals):
+    """Phí vận chuyển của một đơn gồm các cửa hàng trên (hiện là phí cố định cho mỗi đơn)"""
+    return SHIPPING_FEE if shop_subtotals else ZERO
+
+
+def price_cart(items, discount_amount=ZERO):
+    """
+    Tính giá cho các mục giỏ hàng (CartItem đã lấy kèm variant và variant__product)
+    trong một lượt duyệt duy nhất
+    """
+    return price_lines(
+        (
+            (item.id, item.variant.id, item.variant.product.id, item.variant.product.shop_id, item.quantity,
+             get_variant_price(item.variant, item.variant.product))
+            for item in items
+        ),
+        discount_amount,
+    )
+
+
+def price_lines(rows, discount_amount=ZERO):
+    """
+    Tính giá từ các dòng (item_id, variant_id, product_id, shop_id, quantity, unit_price) đã có sẵn
+    giá hiệu lực (ví dụ giỏ hàng trong cache - cart/store.py)
+    """
+    lines = []
+    shops = {}
+    total_items = 0
+    subtotal = ZERO
+
+    for item_id, variant_id, product_id, shop_id, quantity, unit_price in rows:
+        line_total = unit_price * quantity
+        line = PricedLine(item_id, variant_id, product_id, shop_id, quantity, unit_price, line_total)
+        lines.append(line)
+        total_items += quantity
+        subtotal += line_total
+
+        shop = shops.get(shop_id)
+        if shop is None:
+            shop = shops[shop_id] = [[], 0, ZERO]
+        shop[0].append(item_id)
+        shop[1] += quantity
+        shop[2] += line_total
+
+    shop_subtotals = tuple(
+        ShopSubtotal(shop_id=shop_id, item_ids=tuple(item_ids), total_items=quantity,
+                     subtotal=shop_total, shipping_estimate=SHIPPING_FEE)
+        for shop_id, (item_ids, quantity, shop_total) in shops.items()
+    )
+    shipping_fee = estimate_shipping_fee(shop_subtotals)
+
+    return CartPricing(
+        lines=tuple(lines),
+        shops=shop_subtotals,
+        total_items=total_items,
+        subtotal=subtotal,
+        shipping_fee=shipping_fee,
+        discount_amount=discount_amount,
+        grand_total=subtotal + shipping_fee - discount_amount if lines else ZERO,
+        lines_by_item={line.item_id: line for line in lines},
+    )
@@ -0,0 +1,195 @@
+# cart/reservations.py
+"""
+Giữ hàng có thời hạn (StockReservation) khi khách bắt đầu thanh toán, để hàng bán chạy không
+hết giữa chừng lúc khách đang nhập địa chỉ.
+
+- Tồn kho có thể bán = ProductVariant.stock - tổng các lượt giữ còn hiệu lực (expires_at > now)
+  của khách khác; lượt giữ không trừ vào stock nên hết hạn là tự được trả lại
+- reserve_stock khóa các biến thể (select_for_update, theo thứ tự id để tránh deadlock), kiểm tra
+  tồn kho có thể bán rồi tạo/gia hạn lượt giữ cho cả lựa chọn (tất cả hoặc không)
+- CreateOrderSerializer khóa các biến thể theo cùng cách, trừ tồn kho và xóa lượt giữ của khách
+  trong cùng transaction với đơn hàng
+- ReservationSweeper (luồng nền) và lệnh release_expired_reservations xóa các lượt giữ đã hết hạn
+  theo lô qua chỉ mục expires_at, không phải quét các biến thể
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.db import bulk_upsert
+from products.models import ProductVariant
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+# Thời gian giữ hàng kể từ lần giữ (hoặc gia hạn) gần nhất
+RESERVATION_TTL = timedelta(minutes=15)
+# Chu kỳ dọn các lượt giữ đã hết hạn (giây)
+SWEEP_INTERVAL = 60
+SWEEP_BATCH_SIZE = 1000
+
+
+class ReservationError(Exception):
+    """Không đủ tồn kho có thể bán để giữ hàng; errors là thông tin từng biến thể thiếu hàng"""
+
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors
+
+
+def lock_variants(variant_ids):
+    """Khóa các biến thể (kèm sản phẩm) theo thứ tự id, trả về {variant_id: variant}"""
+    return {
+        variant.id: variant
+        for variant in ProductVariant.objects.select_for_update().select_related('product').filter(
+            id__in=list(variant_ids)
+        ).order_by('id')
+    }
+
+
+def held_quantities(variant_ids, exclude_user=None):
+    """Số lượng đang được giữ (chưa hết hạn) của các biến thể, bỏ qua lượt giữ của exclude_user"""
+    queryset = StockReservation.objects.filter(variant_id__in=list(variant_ids), expires_at__gt=timezone.now())
+    if exclude_user is not None:
+        queryset = queryset.exclude(user=exclude_user)
+    return dict(queryset.values('variant_id').annotate(held=Sum('quantity')).values_list('variant_id', 'held'))
+
+
+def available_stock(variants, exclude_user=None):
+    """Tồn kho có thể bán {variant_id: stock - số lượng người khác đang giữ}"""
+    held = held_quantities([variant.id for variant in variants], exclude_user)
+    return {variant.id: variant.stock - held.get(variant.id, 0) for variant in variants}
+
+
+def reserve_stock(user, quantities, ttl=RESERVATION_TTL):
+    """
+    Giữ hàng cho các biến thể {variant_id: số lượng} của user (thay cho các lượt giữ trước đó).
+    Trả về thời điểm hết hạn; ReservationError nếu có biến thể không đủ tồn kho có thể bán
+    """
+    with transaction.atomic():
+        variants = lock_variants(quantities)
+        available = available_stock(variants.values(), exclude_user=user)
+
+        errors = []
+        for variant_id, quantity in quantities.items():
+            variant = variants.get(variant_id)
+            if variant is None:
+                errors.append({'variant_id': variant_id, 'requested': quantity, 'available': 0,
+                               'message': 'Biến thể sản phẩm không tồn tại'})
+            elif available[variant_id] < quantity:
+                errors.append({
+                    'variant_id': variant_id,
+                    'requested': quantity,
+                    'available': max(available[variant_id], 0),
+                    'message': f"Sản phẩm '{variant.product.name}' không đủ tồn kho. "
+                               f"Hiện tại chỉ còn {max(available[variant_id], 0)} sản phẩm."
+                })
+        if errors:
+            raise ReservationError('Không đủ hàng để giữ cho đơn hàng', errors)
+
+        now = timezone.now()
+        expires_at = now + ttl
+        StockReservation.objects.filter(user=user).exclude(variant_id__in=list(quantities)).delete()
+        bulk_upsert(
+            StockReservation,
+            [
+                StockReservation(user=user, variant_id=variant_id, quantity=quantity, expires_at=expires_at,
+                                 created_at=now, updated_at=now)
+                for variant_id, quantity in quantities.items()
+            ],
+            unique_fields=['user', 'variant'],
+            update_fields=['quantity', 'expires_at', 'updated_at'],
+        )
+
+    sweeper.ensure_running()
+    return expires_at
+
+
+def release_reservations(user, variant_ids=None):
+    """Trả lại hàng đang giữ của user (tất cả hoặc các biến thể chỉ định), trả về số lượt giữ đã xóa"""
+    queryset = StockReservation.objects.filter(user=user)
+    if variant_ids is not None:
+        queryset = queryset.filter(variant_id__in=list(variant_ids))
+    deleted, _ = queryset.delete()
+    return deleted
+
+
+def release_expired_reservations(batch_size=SWEEP_BATCH_SIZE):
+    """Xóa các lượt giữ đã hết hạn theo lô (theo chỉ mục expires_at), trả về số lượt đã xóa"""
+    now = timezone.now()
+    released = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+                'id', flat=True
+            )[:batch_size]
+        )
+        if not ids:
+            return released
+        StockReservation.objects.filter(id__in=ids, expires_at__lte=now).delete()
+        released += len(ids)
+
+
+class ReservationSweeper:
+    """Luồng nền định kỳ dọn các lượt giữ hàng đã hết hạn"""
+
+    def __init__(self, sweep_interval=SWEEP_INTERVAL):
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = {
+            'released_reservations': 0,
+            'sweep_count': 0,
+            'last_sweep_at': None,
+            'last_error': None,
+        }
+
+    def sweep(self):
+        try:
+            released = release_expired_reservations()
+        except Exception as e:
+            logger.exception("Không thể dọn các lượt giữ hàng đã hết hạn")
+            with self._lock:
+                self._stats['last_error'] = str(e)
+            return 0
+        with self._lock:
+            self._stats['released_reservations'] += released
+            self._stats['sweep_count'] += 1
+            self._stats['last_sweep_at'] = timezone.now()
+            self._stats['last_error'] = None
+        return released
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'sweep_interval': self.sweep_interval,
+                'worker_alive': bool(self._worker and self._worker.is_alive()),
+                **self._stats,
+            }
+
+    def ensure_running(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='stock-reservation-sweeper', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            finally:
+                # Luồng nền tự mở kết nối DB riêng, đóng lại sau mỗi lần dọn
+                connections.close_all()
+
+
+sweeper = ReservationSweeper()
@@ -0,0 +1,41 @@
+# cart/signals.py
+"""
+Xóa ảnh chụp biến thể của giỏ hàng (cart/store.py) khi dữ liệu hiển thị hoặc giá thay đổi.
+Các thay đổi qua queryset.update()/bulk_* không phát signal chỉ hiện ra sau
+VARIANT_SNAPSHOT_TIMEOUT giây.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from products.models import Product, ProductVariant, VariantAttributeValue
+from .store import invalidate_variant_snapshots
+
+
+def _invalidate_snapshots_on_commit(variant_ids):
+    variant_ids = list(variant_ids)
+    if variant_ids:
+        transaction.on_commit(lambda: invalidate_variant_snapshots(variant_ids))
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_snapshot_on_variant_change(sender, instance, **kwargs):
+    """Giá, tồn kho, ảnh của biến thể (kể cả khi trừ tồn kho lúc đặt hàng)"""
+    _invalidate_snapshots_on_commit([instance.id])
+
+
+@receiver(post_save, sender=VariantAttributeValue)
+@receiver(post_delete, sender=VariantAttributeValue)
+def invalidate_snapshot_on_variant_attribute_change(sender, instance, **kwargs):
+    _invalidate_snapshots_on_commit([instance.variant_id])
+
+
+@receiver(post_save, sender=Product)
+def invalidate_snapshots_on_product_save(sender, instance, created, **kwargs):
+    """Tên, slug, giá của sản phẩm nằm trong ảnh chụp của mọi biến thể"""
+    if created:
+        return
+    _invalidate_snapshots_on_commit(
+        ProductVariant.objects.filter(product_id=instance.id).values_list('id', flat=True)
+    )
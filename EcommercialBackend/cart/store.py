@@ -0,0 +1,646 @@
+# cart/store.py
+"""
+Kho giỏ hàng nằm trong cache (cache 'carts' dùng chung giữa các tiến trình), ghi xuống DB sau
+(write-behind).
+
+- Mỗi giỏ hàng là một CartState gọn trong cache: version, version đã ghi xuống DB và các dòng
+  {variant_id: CartLine(số lượng, id CartItem đã ghi, thời điểm thêm)}. Đọc giỏ hàng chỉ cần
+  cache (trạng thái giỏ + ảnh chụp biến thể), không truy vấn DB; lần đầu (hoặc khi cache mất)
+  trạng thái được nạp lại từ carts/cart_items
+- Thay đổi khi duyệt hàng (thêm, sửa, xóa, lô thao tác) chỉ ghi vào cache dưới khóa của giỏ
+  hàng (cache.add) và tăng version; không lấy được khóa sau CART_LOCK_WAIT thì request bị từ chối
+  (CartBusyError, 409) chứ không sửa giỏ hàng khi không có khóa
+- Id các giỏ hàng chờ ghi nằm trong một Redis set của cache giỏ hàng (dùng chung, không mất khi
+  tiến trình bị tắt); CartWriteBehind của mọi tiến trình ghi dồn các giỏ này xuống CartItem theo
+  chu kỳ FLUSH_INTERVAL, khi đặt hàng giỏ hàng được ghi ngay (flush_cart) rồi đối chiếu với DB
+  trong CreateOrderSerializer
+- Ghi xuống DB không giữ khóa cache: dòng Cart được khóa (select_for_update) và chỉ ghi khi
+  version trong cache mới hơn version trong DB, nên các lần ghi chạy song song không ghi đè
+  trạng thái mới bằng trạng thái cũ
+- Dòng chưa ghi xuống DB chưa có id CartItem: API dùng id tạm -variant_id, id này vẫn dùng
+  được sau khi dòng đã được ghi (find_variant)
+- Ảnh chụp biến thể (tên, ảnh, thuộc tính, giá hiệu lực, tồn kho) được cache VARIANT_SNAPSHOT_TIMEOUT
+  giây và bị xóa khi biến thể/sản phẩm/thuộc tính thay đổi (cart/signals.py); tồn kho hiển thị có
+  thể cũ tối đa chừng đó, tồn kho luôn được kiểm tra lại với DB khi đặt hàng
+"""
+import atexit
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import connections, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.fields import DateTimeField
+
+from core.derivatives import get_image_derivatives, get_image_preferences, select_image_url
+from core.responses.exceptions import CustomError
+from products.cards import get_product_card
+from products.models import ProductVariant, VariantAttributeValue
+from products.pricing import get_variant_price
+from .models import Cart, CartItem
+from .pricing import price_lines
+
+logger = logging.getLogger(__name__)
+
+CART_CACHE_ALIAS = 'carts'
+CART_STATE_PREFIX = 'cart_state:'
+CART_LOCK_PREFIX = 'cart_lock:'
+VARIANT_SNAPSHOT_PREFIX = 'cart_variant:'
+# Redis set chứa id các user có giỏ hàng chờ ghi xuống DB
+DIRTY_CARTS_KEY = 'cart_dirty'
+
+# Giỏ hàng không hoạt động bị xóa khỏi cache sau 7 ngày (nạp lại từ DB khi cần)
+CART_STATE_TIMEOUT = 7 * 24 * 3600
+VARIANT_SNAPSHOT_TIMEOUT = 60
+# Khóa chỉ bao các thao tác trên cache (và lần nạp giỏ hàng từ DB khi cache trống)
+CART_LOCK_TIMEOUT = 5
+# Thời gian chờ tối đa để lấy khóa giỏ hàng (giây)
+CART_LOCK_WAIT = 2
+# Chu kỳ ghi dồn các giỏ hàng đã thay đổi xuống DB (giây)
+FLUSH_INTERVAL = 30
+
+_datetime_field = DateTimeField()
+
+
+class CartBusyError(CustomError):
+    """Không lấy được khóa giỏ hàng (một request khác đang sửa giỏ hàng quá lâu)"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Giỏ hàng đang được cập nhật, vui lòng thử lại'
+    default_code = 'cart_busy'
+
+
+class CartLine(NamedTuple):
+    """Một dòng giỏ hàng trong cache"""
+    quantity: int
+    # id CartItem đã ghi xuống DB (None nếu chưa ghi)
+    item_id: int
+    created_at: str
+
+
+class CartState(NamedTuple):
+    """Giỏ hàng trong cache"""
+    user_id: int
+    cart_id: int
+    version: int
+    persisted_version: int
+    created_at: str
+    updated_at: str
+    lines: dict
+
+    @property
+    def dirty(self):
+        """Có thay đổi chưa ghi xuống DB"""
+        return self.version != self.persisted_version
+
+    def public_item_id(self, variant_id):
+        """id của dòng trả về cho client: id CartItem, hoặc -variant_id khi dòng chưa được ghi"""
+        item_id = self.lines[variant_id].item_id
+        return item_id if item_id is not None else -variant_id
+
+    def find_variant(self, item_id):
+        """Biến thể của dòng có id (id CartItem hoặc id tạm -variant_id), None nếu không có"""
+        if item_id < 0:
+            return -item_id if -item_id in self.lines else None
+        for variant_id, line in self.lines.items():
+            if line.item_id == item_id:
+                return variant_id
+        return None
+
+
+def _cache():
+    return caches[CART_CACHE_ALIAS]
+
+
+def _state_key(user_id):
+    return f"{CART_STATE_PREFIX}{user_id}"
+
+
+def _format_datetime(value):
+    return _datetime_field.to_representation(value) if value else None
+
+
+@contextmanager
+def _cart_lock(user_id):
+    """Khóa giỏ hàng của user giữa các tiến trình (cache.add); quá CART_LOCK_WAIT thì CartBusyError"""
+    cache = _cache()
+    key = f"{CART_LOCK_PREFIX}{user_id}"
+    token = secrets.token_hex(8)
+    deadline = time.monotonic() + CART_LOCK_WAIT
+    acquired = cache.add(key, token, CART_LOCK_TIMEOUT)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.005)
+        acquired = cache.add(key, token, CART_LOCK_TIMEOUT)
+    if not acquired:
+        logger.warning("Không lấy được khóa giỏ hàng của user %s", user_id)
+        raise CartBusyError()
+    try:
+        yield
+    finally:
+        # Không xóa khóa đã hết hạn và được request khác lấy lại
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def load_cart_state(user_id):
+    """Đọc giỏ hàng của user từ DB"""
+    row = Cart.objects.filter(user_id=user_id).order_by('id').values_list(
+        'id', 'version', 'created_at', 'updated_at'
+    ).first()
+    if row is None:
+        return CartState(user_id, None, 0, 0, None, None, {})
+
+    cart_id, version, created_at, updated_at = row
+    lines = {
+        variant_id: CartLine(quantity, item_id, _format_datetime(item_created_at))
+        for item_id, variant_id, quantity, item_created_at in CartItem.objects.filter(cart_id=cart_id).order_by(
+            'id'
+        ).values_list('id', 'variant_id', 'quantity', 'created_at')
+    }
+    return CartState(user_id, cart_id, version, version, _format_datetime(created_at),
+                     _format_datetime(updated_at), lines)
+
+
+def get_cart_state(user_id):
+    """Giỏ hàng của user từ cache (nạp từ DB nếu chưa có)"""
+    cache = _cache()
+    state = cache.get(_state_key(user_id))
+    if state is None:
+        state = load_cart_state(user_id)
+        # add: không ghi đè trạng thái vừa được một request khác ghi vào
+        if not cache.add(_state_key(user_id), state, CART_STATE_TIMEOUT):
+            state = cache.get(_state_key(user_id)) or state
+    return state
+
+
+def mutate_cart(user_id, mutation):
+    """
+    Thay đổi giỏ hàng trong cache: mutation(lines) sửa trực tiếp dict các dòng và trả về kết quả.
+    Giỏ hàng chỉ được tăng version (và chờ ghi xuống DB) khi các dòng thực sự thay đổi.
+    Trả về (trạng thái mới, kết quả của mutation)
+    """
+    with _cart_lock(user_id):
+        state = get_cart_state(user_id)
+        lines = dict(state.lines)
+        result = mutation(lines)
+        if lines != state.lines:
+            state = state._replace(
+                version=state.version + 1,
+                updated_at=_format_datetime(timezone.now()),
+                lines=lines,
+            )
+            _cache().set(_state_key(user_id), state, CART_STATE_TIMEOUT)
+            write_behind.mark(user_id)
+    return state, result
+
+
+def new_line(quantity):
+    return CartLine(quantity, None, _format_datetime(timezone.now()))
+
+
+def invalidate_cart(user_id):
+    """Xóa giỏ hàng khỏi cache (lần đọc sau nạp lại từ DB)"""
+    _cache().delete(_state_key(user_id))
+
+
+def _persist(state):
+    """
+    Ghi các dòng của giỏ hàng xuống carts/cart_items (ghi phần chênh lệch với DB),
+    trả về trạng thái đã ghi (kèm id CartItem của các dòng).
+    DB đã có version này hoặc mới hơn (một lần ghi song song đã commit trước) thì không ghi
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().filter(user_id=state.user_id).order_by('id').first()
+        if cart is None:
+            cart = Cart.objects.create(user_id=state.user_id, version=state.version)
+            is_newer = True
+        else:
+            is_newer = cart.version < state.version
+
+        # Biến thể đã bị xóa khỏi catalog thì bỏ khỏi giỏ hàng
+        variant_ids = set(ProductVariant.objects.filter(id__in=list(state.lines)).values_list('id', flat=True))
+        lines = {variant_id: line for variant_id, line in state.lines.items() if variant_id in variant_ids}
+        if is_newer:
+            _write_lines(cart, lines, state.version, now)
+
+        # Đọc lại id của các dòng (MySQL không trả về id của bulk_create)
+        item_ids = dict(CartItem.objects.filter(cart=cart).values_list('variant_id', 'id'))
+
+    lines = {
+        variant_id: line._replace(item_id=item_ids[variant_id])
+        for variant_id, line in lines.items() if variant_id in item_ids
+    }
+    return state._replace(
+        cart_id=cart.id,
+        persisted_version=state.version,
+        created_at=state.created_at or _format_datetime(cart.created_at),
+        lines=lines,
+    )
+
+
+def _write_lines(cart, lines, version, now):
+    """Ghi phần chênh lệch giữa các dòng và cart_items của giỏ hàng (trong transaction của _persist)"""
+    existing = {
+        variant_id: (item_id, quantity)
+        for item_id, variant_id, quantity in CartItem.objects.filter(cart=cart).values_list(
+            'id', 'variant_id', 'quantity'
+        )
+    }
+
+    to_create = [
+        CartItem(cart=cart, variant_id=variant_id, quantity=line.quantity)
+        for variant_id, line in lines.items() if variant_id not in existing
+    ]
+    to_update = [
+        CartItem(id=existing[variant_id][0], quantity=line.quantity, updated_at=now)
+        for variant_id, line in lines.items()
+        if variant_id in existing and existing[variant_id][1] != line.quantity
+    ]
+    removed_item_ids = [item_id for variant_id, (item_id, quantity) in existing.items() if variant_id not in lines]
+
+    if to_create:
+        CartItem.objects.bulk_create(to_create)
+    if to_update:
+        CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+    if removed_item_ids:
+        CartItem.objects.filter(id__in=removed_item_ids).delete()
+    Cart.objects.filter(pk=cart.pk).update(version=version, updated_at=now)
+
+
+def _mark_persisted(persisted):
+    """Cập nhật cache sau khi giỏ hàng đã được ghi (giữ các thay đổi mới hơn nếu có)"""
+    try:
+        with _cart_lock(persisted.user_id):
+            state = _cache().get(_state_key(persisted.user_id))
+            if state is None:
+                return
+            if state.version == persisted.version:
+                state = persisted
+            else:
+                lines = {
+                    variant_id: line._replace(item_id=persisted.lines[variant_id].item_id)
+                    if variant_id in persisted.lines else line
+                    for variant_id, line in state.lines.items()
+                }
+                state = state._replace(
+                    cart_id=persisted.cart_id,
+                    persisted_version=max(state.persisted_version, persisted.version),
+                    lines=lines,
+                )
+            _cache().set(_state_key(persisted.user_id), state, CART_STATE_TIMEOUT)
+    except CartBusyError:
+        # Cache vẫn coi giỏ hàng là chưa ghi: lần ghi sau không ghi lại vì DB đã có version này
+        write_behind.mark(persisted.user_id)
+        return
+    if state.dirty:
+        write_behind.mark(persisted.user_id)
+
+
+def flush_cart(user_id):
+    """
+    Ghi giỏ hàng của user xuống DB nếu có thay đổi chưa ghi. Trả về trạng thái giỏ hàng
+    (kèm id CartItem); cache chỉ được đánh dấu đã ghi khi transaction được commit
+    """
+    state = get_cart_state(user_id)
+    if not state.dirty:
+        return state
+    persisted = _persist(state)
+    transaction.on_commit(lambda: _mark_persisted(persisted))
+    return persisted
+
+
+def checkout_completed(user_id, variant_ids, version):
+    """
+    Bỏ các dòng đã đặt hàng khỏi giỏ hàng trong cache (các dòng này đã bị xóa khỏi DB,
+    version là version của Cart trong DB sau khi đặt hàng)
+    """
+    try:
+        with _cart_lock(user_id):
+            state = _cache().get(_state_key(user_id))
+            if state is None:
+                return
+            lines = {variant_id: line for variant_id, line in state.lines.items() if variant_id not in variant_ids}
+            # Thay đổi chưa ghi phải có version mới hơn DB để lần ghi sau không bị bỏ qua
+            new_version = max(state.version + 1, version + 1 if state.dirty else version)
+            # Giỏ hàng đã khớp với DB thì vẫn khớp sau khi bỏ các dòng này (nếu version cũng khớp)
+            in_sync = not state.dirty and new_version == version
+            state = state._replace(
+                version=new_version,
+                persisted_version=new_version if in_sync else state.persisted_version,
+                updated_at=_format_datetime(timezone.now()),
+                lines=lines,
+            )
+            _cache().set(_state_key(user_id), state, CART_STATE_TIMEOUT)
+    except CartBusyError:
+        # Không để các dòng đã đặt hàng còn lại trong cache (và bị ghi lại xuống DB)
+        logger.warning("Nạp lại giỏ hàng của user %s từ DB sau khi đặt hàng", user_id)
+        invalidate_cart(user_id)
+        return
+    if state.dirty:
+        write_behind.mark(user_id)
+
+
+def checkout_completed_on_commit(user_id, variant_ids, version):
+    transaction.on_commit(lambda: checkout_completed(user_id, set(variant_ids), version))
+
+
+# --- Ảnh chụp biến thể ---
+
+def _variant_queryset():
+    return ProductVariant.objects.select_related('product__card').prefetch_related(
+        Prefetch('attribute_values',
+                 queryset=VariantAttributeValue.objects.select_related('attribute_value__attribute'))
+    )
+
+
+def _variant_snapshot(variant, card, image_derivatives):
+    """Dữ liệu của biến thể cần để hiển thị và tính giá giỏ hàng"""
+    product = variant.product
+    # Ảnh của biến thể (nếu có) hoặc ảnh đại diện của sản phẩm, kèm sẵn map ảnh phái sinh
+    if variant.image_url:
+        image_url, derivatives = variant.image_url, image_derivatives.get(variant.image_url, {})
+    elif card:
+        image_url, derivatives = card.thumbnail_url, card.thumbnail_derivatives
+        if derivatives is None:
+            derivatives = image_derivatives.get(image_url, {})
+    else:
+        image_url, derivatives = None, {}
+    return {
+        'id': variant.id,
+        'product_id': product.id,
+        'product_slug': product.slug,
+        'product_name': product.name,
+        'sku': variant.sku,
+        'image_url': image_url,
+        'image_derivatives': derivatives,
+        'attributes': [
+            {
+                'name': attr_value.attribute_value.attribute.name,
+                'display_name': attr_value.attribute_value.attribute.display_name,
+                'value': attr_value.attribute_value.value,
+                'display_value': attr_value.attribute_value.display_value,
+            }
+            for attr_value in variant.attribute_values.all()
+        ],
+        'stock': variant.stock,
+        'shop_id': product.shop_id,
+        'shop_name': card.shop_name if card else None,
+        'price': get_variant_price(variant, product),
+        # Dấu thay đổi của dữ liệu hiển thị (dùng cho ETag)
+        'stamp': f"{variant.updated_at.timestamp()}:{product.updated_at.timestamp()}:"
+                 f"{card.updated_at.timestamp() if card else ''}:{variant.stock}",
+    }
+
+
+def get_variant_snapshots(variant_ids):
+    """Ảnh chụp các biến thể {variant_id: snapshot} (biến thể đã bị xóa không có trong kết quả)"""
+    cache = _cache()
+    keys = {f"{VARIANT_SNAPSHOT_PREFIX}{variant_id}": variant_id for variant_id in variant_ids}
+    snapshots = {keys[key]: snapshot for key, snapshot in cache.get_many(list(keys)).items()}
+    missing = [variant_id for variant_id in keys.values() if variant_id not in snapshots]
+    if missing:
+        variants = list(_variant_queryset().filter(id__in=missing))
+        cards = {variant.id: get_product_card(variant.product) for variant in variants}
+        image_derivatives = get_image_derivatives(
+            [variant.image_url for variant in variants if variant.image_url]
+            + [card.thumbnail_url for card in cards.values() if card and card.thumbnail_derivatives is None]
+        )
+        loaded = {
+            variant.id: _variant_snapshot(variant, cards[variant.id], image_derivatives) for variant in variants
+        }
+        cache.set_many(
+            {f"{VARIANT_SNAPSHOT_PREFIX}{variant_id}": snapshot for variant_id, snapshot in loaded.items()},
+            VARIANT_SNAPSHOT_TIMEOUT
+        )
+        snapshots.update(loaded)
+    return snapshots
+
+
+def invalidate_variant_snapshots(variant_ids):
+    _cache().delete_many([f"{VARIANT_SNAPSHOT_PREFIX}{variant_id}" for variant_id in variant_ids])
+
+
+# --- Hiển thị ---
+
+def price_state(state, snapshots):
+    """Tính giá giỏ hàng trong cache (cart/pricing.py), bỏ qua các biến thể không còn tồn tại"""
+    return price_lines(
+        (state.public_item_id(variant_id), variant_id, snapshot['product_id'], snapshot['shop_id'],
+         line.quantity, snapshot['price'])
+        for variant_id, line in state.lines.items()
+        for snapshot in (snapshots.get(variant_id),) if snapshot is not None
+    )
+
+
+def render_item(state, variant_id, snapshot, pricing, image_preferences):
+    """Một dòng giỏ hàng (dạng trả về của các API giỏ hàng)"""
+    size, image_format = image_preferences
+    image_url = select_image_url(snapshot['image_url'], snapshot['image_derivatives'], size, image_format)
+    item_id = state.public_item_id(variant_id)
+    line = pricing.line(item_id)
+    return {
+        'id': item_id,
+        'variant': variant_id,
+        'variant_details': {
+            'id': variant_id,
+            'product_id': snapshot['product_id'],
+            'product_slug': snapshot['product_slug'],
+            'product_name': snapshot['product_name'],
+            'sku': snapshot['sku'],
+            'image_url': image_url,
+            'attributes': snapshot['attributes'],
+            'stock': snapshot['stock'],
+            'shop_id': snapshot['shop_id'],
+            'shop_name': snapshot['shop_name'],
+        },
+        'quantity': line.quantity,
+        'price': line.unit_price,
+        'total_price': line.line_total,
+        'created_at': state.lines[variant_id].created_at,
+    }
+
+
+def render_items(request, state, snapshots, pricing, variant_ids):
+    image_preferences = get_image_preferences({'request': request})
+    return [
+        render_item(state, variant_id, snapshots[variant_id], pricing, image_preferences)
+        for variant_id in variant_ids if variant_id in state.lines and variant_id in snapshots
+    ]
+
+
+def render_cart(request, state, snapshots):
+    """Toàn bộ giỏ hàng (dạng trả về của GET /api/cart/)"""
+    pricing = price_state(state, snapshots)
+    return {
+        'id': state.cart_id,
+        'user': state.user_id,
+        'version': state.version,
+        'items': render_items(request, state, snapshots, pricing, state.lines),
+        'total_items': pricing.total_items,
+        'total_price': pricing.subtotal,
+        'shipping_fee': pricing.shipping_fee,
+        'grand_total': pricing.grand_total,
+        'shops': [shop.as_dict() for shop in pricing.shops],
+        'created_at': state.created_at,
+        'updated_at': state.updated_at,
+    }
+
+
+def cart_etag(request, state, snapshots):
+    """ETag của giỏ hàng: version, dữ liệu hiển thị của các biến thể và tham số ảnh của request"""
+    stamps = [snapshots[variant_id]['stamp'] for variant_id in state.lines if variant_id in snapshots]
+    raw = f"{state.user_id}:{state.version}:{stamps}:{request.GET.urlencode()}"
+    return f'"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+
+# --- Ghi sau ---
+
+class _RedisDirtyCarts:
+    """Id các giỏ hàng chờ ghi trong một Redis set của cache giỏ hàng (dùng chung giữa các tiến trình)"""
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._key = cache.make_and_validate_key(DIRTY_CARTS_KEY)
+
+    def _client(self):
+        return self._cache._cache.get_client(self._key, write=True)
+
+    def add(self, user_id):
+        self._client().sadd(self._key, user_id)
+
+    def discard(self, user_id):
+        self._client().srem(self._key, user_id)
+
+    def members(self):
+        return [int(user_id) for user_id in self._client().sscan_iter(self._key)]
+
+    def __len__(self):
+        return self._client().scard(self._key)
+
+
+class _LocalDirtyCarts:
+    """Id các giỏ hàng chờ ghi trong bộ nhớ tiến trình (cache giỏ hàng LocMem khi DEBUG/chạy test)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._user_ids = set()
+
+    def add(self, user_id):
+        with self._lock:
+            self._user_ids.add(user_id)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._user_ids.discard(user_id)
+
+    def members(self):
+        with self._lock:
+            return list(self._user_ids)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._user_ids)
+
+
+class CartWriteBehind:
+    """
+    Ghi dồn các giỏ hàng đã thay đổi xuống DB theo chu kỳ. Danh sách giỏ hàng chờ ghi nằm trong
+    cache giỏ hàng nên luồng ghi của bất kỳ tiến trình nào cũng ghi được (kể cả giỏ hàng của
+    tiến trình đã bị tắt)
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = None
+        self._worker = None
+        self._stats = {
+            'flushed_carts': 0,
+            'failed_carts': 0,
+            'last_flush_at': None,
+            'last_flush_duration_ms': None,
+            'last_error': None,
+        }
+
+    @property
+    def dirty(self):
+        if self._dirty is None:
+            cache = _cache()
+            self._dirty = _RedisDirtyCarts(cache) if isinstance(cache, RedisCache) else _LocalDirtyCarts()
+        return self._dirty
+
+    def mark(self, user_id):
+        """Ghi nhận giỏ hàng của user cần được ghi xuống DB"""
+        self._ensure_worker()
+        self.dirty.add(user_id)
+
+    def flush(self):
+        """Ghi tất cả giỏ hàng đang chờ xuống DB, trả về số giỏ hàng đã ghi"""
+        with self._flush_lock:
+            pending = self.dirty.members()
+            if not pending:
+                return 0
+
+            started = time.monotonic()
+            flushed = 0
+            for user_id in pending:
+                # Bỏ khỏi danh sách trước khi ghi: thay đổi đến trong lúc ghi sẽ đánh dấu lại
+                self.dirty.discard(user_id)
+                try:
+                    flush_cart(user_id)
+                    flushed += 1
+                except Exception as e:
+                    logger.exception("Không thể ghi giỏ hàng của user %s", user_id)
+                    self.dirty.add(user_id)
+                    with self._lock:
+                        self._stats['failed_carts'] += 1
+                        self._stats['last_error'] = str(e)
+
+            with self._lock:
+                self._stats['flushed_carts'] += flushed
+                self._stats['last_flush_at'] = timezone.now()
+                self._stats['last_flush_duration_ms'] = round((time.monotonic() - started) * 1000, 2)
+            return flushed
+
+    def metrics(self):
+        pending_carts = len(self.dirty)
+        with self._lock:
+            return {
+                'pending_carts': pending_carts,
+                'flush_interval': self.flush_interval,
+                'worker_alive': bool(self._worker and self._worker.is_alive()),
+                **self._stats,
+            }
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='cart-write-behind', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                # Luồng nền tự mở kết nối DB riêng, đóng lại sau mỗi lần ghi
+                connections.close_all()
+
+
+write_behind = CartWriteBehind()
+
+# Ghi nốt các giỏ hàng còn lại khi tiến trình tắt bình thường
+atexit.register(write_behind.flush)
@@ -0,0 +1,280 @@
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from core.models import Address, User
+from orders.serializers import CreateOrderSerializer
+from products.models import Category, Product, ProductVariant
+from shops.models import Shop
+from .batch import apply_cart_operations, stock_exceeded_message
+from .models import Cart, CartItem, StockReservation
+from .reservations import ReservationError, held_quantities, release_expired_reservations, reserve_stock, sweeper
+from .store import (
+    CART_CACHE_ALIAS, CART_LOCK_PREFIX, CartBusyError, _persist, checkout_completed, flush_cart, get_cart_state,
+    invalidate_cart, mutate_cart, write_behind,
+)
+
+
+class CartTestCase(TestCase):
+    """Dữ liệu chung: một biến thể còn 5 sản phẩm, hai khách hàng (cache giỏ hàng LocMem)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner@example.com', 'pw', full_name='Owner', role='shop_owner')
+        cls.alice = User.objects.create_user('alice@example.com', 'pw', full_name='Alice')
+        cls.bob = User.objects.create_user('bob@example.com', 'pw', full_name='Bob')
+        cls.address = Address.objects.create(
+            user=cls.alice, recipient_name='Alice', phone='0900000000', province='Hà Nội', district='Ba Đình',
+            ward='Phúc Xá', street_address='1 Phố Huế'
+        )
+        shop = Shop.objects.create(owner=owner, name='Cửa hàng')
+        category = Category.objects.create(name='Áo thun')
+        cls.product = Product.objects.create(
+            shop=shop, category=category, name='Áo thun trắng', slug='ao-thun-trang', price=100000, stock=8
+        )
+        cls.variant = ProductVariant.objects.create(product=cls.product, sku='AT-M', price=100000, stock=5)
+        cls.other_variant = ProductVariant.objects.create(product=cls.product, sku='AT-L', price=100000, stock=3)
+
+    def setUp(self):
+        caches[CART_CACHE_ALIAS].clear()
+        for user_id in write_behind.dirty.members():
+            write_behind.dirty.discard(user_id)
+        # Không chạy luồng nền (ghi giỏ hàng, dọn lượt giữ) trong lúc test
+        for patcher in (mock.patch.object(write_behind, '_ensure_worker'),
+                        mock.patch.object(sweeper, 'ensure_running')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_to_cart(self, user, variant, quantity):
+        state, snapshots, results, changed, removed = apply_cart_operations(
+            user, [{'op': 'add', 'variant_id': variant.id, 'quantity': quantity}]
+        )
+        return results[0]
+
+    def place_order(self, user, variant_ids):
+        serializer = CreateOrderSerializer(
+            data={'address_id': self.address.id, 'payment_method': 'cod',
+                  'cart_item_ids': [-variant_id for variant_id in variant_ids]},
+            context={'request': SimpleNamespace(user=user)}
+        )
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            return serializer.save()
+
+
+class StockReservationTests(CartTestCase):
+    def test_other_users_hold_blocks_reservation(self):
+        reserve_stock(self.bob, {self.variant.id: 4})
+
+        with self.assertRaises(ReservationError) as raised:
+            reserve_stock(self.alice, {self.variant.id: 2})
+        self.assertEqual(raised.exception.errors[0]['available'], 1)
+        self.assertFalse(StockReservation.objects.filter(user=self.alice).exists())
+
+    def test_own_hold_is_excluded(self):
+        reserve_stock(self.alice, {self.variant.id: 5})
+
+        # Giữ lại (gia hạn) cả tồn kho không bị chính lượt giữ trước đó chặn
+        reserve_stock(self.alice, {self.variant.id: 5})
+        self.assertEqual(held_quantities([self.variant.id], exclude_user=self.alice), {})
+        self.assertEqual(held_quantities([self.variant.id], exclude_user=self.bob), {self.variant.id: 5})
+        self.assertEqual(StockReservation.objects.get(user=self.alice).quantity, 5)
+
+    def test_expired_holds_no_longer_count(self):
+        StockReservation.objects.create(
+            user=self.bob, variant=self.variant, quantity=5, expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+        self.assertEqual(held_quantities([self.variant.id], exclude_user=self.alice), {})
+        reserve_stock(self.alice, {self.variant.id: 5})
+
+    def test_release_expired_reservations_deletes_only_expired_holds(self):
+        expired = timezone.now() - timedelta(minutes=1)
+        StockReservation.objects.create(user=self.bob, variant=self.variant, quantity=1, expires_at=expired)
+        StockReservation.objects.create(user=self.bob, variant=self.other_variant, quantity=1, expires_at=expired)
+        reserve_stock(self.alice, {self.variant.id: 2})
+
+        self.assertEqual(release_expired_reservations(batch_size=1), 2)
+        self.assertEqual(list(StockReservation.objects.values_list('user_id', flat=True)), [self.alice.id])
+
+    def test_cart_add_and_update_respect_other_users_holds(self):
+        reserve_stock(self.bob, {self.variant.id: 4})
+
+        result = self.add_to_cart(self.alice, self.variant, 2)
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result['message'], stock_exceeded_message(1))
+        self.assertEqual(self.add_to_cart(self.alice, self.variant, 1)['status'], 'ok')
+
+        state, snapshots, results, changed, removed = apply_cart_operations(
+            self.alice, [{'op': 'update', 'variant_id': self.variant.id, 'quantity': 3}]
+        )
+        self.assertEqual(results[0]['status'], 'error')
+
+    def test_add_to_cart_api_rejects_variant_held_by_others(self):
+        reserve_stock(self.bob, {self.variant.id: 5})
+        client = APIClient()
+        client.force_authenticate(self.alice)
+
+        response = client.post('/api/cart/', {'variant_id': self.variant.id, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Lượt giữ của chính khách không chặn khách thêm vào giỏ hàng
+        client.force_authenticate(self.bob)
+        response = client.post('/api/cart/', {'variant_id': self.variant.id, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_checkout_turns_own_hold_into_stock_decrement(self):
+        self.add_to_cart(self.alice, self.variant, 2)
+        reserve_stock(self.alice, {self.variant.id: 2})
+        reserve_stock(self.bob, {self.variant.id: 3})
+
+        self.place_order(self.alice, [self.variant.id])
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 3)
+        self.assertFalse(StockReservation.objects.filter(user=self.alice).exists())
+        self.assertEqual(held_quantities([self.variant.id]), {self.variant.id: 3})
+
+    def test_checkout_rejected_when_stock_is_held_by_others(self):
+        self.add_to_cart(self.alice, self.variant, 2)
+        reserve_stock(self.bob, {self.variant.id: 4})
+
+        with self.assertRaises(serializers.ValidationError):
+            self.place_order(self.alice, [self.variant.id])
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 5)
+
+
+class CartStoreTests(CartTestCase):
+    def cart_items(self, user):
+        return dict(CartItem.objects.filter(cart__user=user).values_list('variant_id', 'quantity'))
+
+    def flush(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            return flush_cart(user.id)
+
+    def test_busy_lock_rejects_mutation_without_releasing_other_owner(self):
+        lock_key = f"{CART_LOCK_PREFIX}{self.alice.id}"
+        caches[CART_CACHE_ALIAS].add(lock_key, 'other-request', 5)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+
+        with mock.patch('cart.store.CART_LOCK_WAIT', 0.05), self.assertLogs('cart.store', 'WARNING'):
+            with self.assertRaises(CartBusyError):
+                mutate_cart(self.alice.id, lambda lines: lines.clear())
+            response = client.post('/api/cart/', {'variant_id': self.variant.id, 'quantity': 1}, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(caches[CART_CACHE_ALIAS].get(lock_key), 'other-request')
+        self.assertEqual(get_cart_state(self.alice.id).lines, {})
+
+    def test_write_behind_flush_persists_dirty_carts(self):
+        self.add_to_cart(self.alice, self.variant, 2)
+        self.assertEqual(write_behind.dirty.members(), [self.alice.id])
+        self.assertEqual(self.cart_items(self.alice), {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(write_behind.flush(), 1)
+
+        self.assertEqual(self.cart_items(self.alice), {self.variant.id: 2})
+        self.assertEqual(write_behind.dirty.members(), [])
+        state = get_cart_state(self.alice.id)
+        self.assertFalse(state.dirty)
+        self.assertIsNotNone(state.lines[self.variant.id].item_id)
+
+    def test_mutation_during_flush_is_kept_and_flushed_later(self):
+        self.add_to_cart(self.alice, self.variant, 1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            flush_cart(self.alice.id)
+        # Khách sửa giỏ hàng sau khi đã ghi xuống DB nhưng trước khi cache được đánh dấu đã ghi
+        self.add_to_cart(self.alice, self.variant, 1)
+        for callback in callbacks:
+            callback()
+
+        state = get_cart_state(self.alice.id)
+        self.assertTrue(state.dirty)
+        self.assertEqual(state.lines[self.variant.id].quantity, 2)
+        self.assertIsNotNone(state.lines[self.variant.id].item_id)
+        self.assertIn(self.alice.id, write_behind.dirty.members())
+
+        self.flush(self.alice)
+        self.assertEqual(self.cart_items(self.alice), {self.variant.id: 2})
+
+    def test_stale_state_does_not_overwrite_newer_cart(self):
+        self.add_to_cart(self.alice, self.variant, 1)
+        stale = get_cart_state(self.alice.id)
+        self.add_to_cart(self.alice, self.variant, 2)
+        self.flush(self.alice)
+
+        # Một lần ghi song song chậm hơn với trạng thái cũ
+        _persist(stale)
+
+        self.assertEqual(self.cart_items(self.alice), {self.variant.id: 3})
+        self.assertEqual(Cart.objects.get(user=self.alice).version, 2)
+
+    def test_flush_after_lost_cache_keeps_persisted_cart(self):
+        self.add_to_cart(self.alice, self.variant, 1)
+        self.flush(self.alice)
+        self.add_to_cart(self.alice, self.variant, 1)
+
+        # Cache mất trạng thái (bị xóa/khởi động lại) khi giỏ hàng vẫn nằm trong danh sách chờ ghi
+        invalidate_cart(self.alice.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            write_behind.flush()
+
+        self.assertEqual(self.cart_items(self.alice), {self.variant.id: 1})
+        state = get_cart_state(self.alice.id)
+        self.assertFalse(state.dirty)
+        self.assertEqual(state.lines[self.variant.id].quantity, 1)
+
+    def test_checkout_removes_ordered_lines_from_cache(self):
+        self.add_to_cart(self.alice, self.variant, 2)
+        self.add_to_cart(self.alice, self.other_variant, 1)
+
+        self.place_order(self.alice, [self.variant.id])
+
+        state = get_cart_state(self.alice.id)
+        self.assertEqual(list(state.lines), [self.other_variant.id])
+        self.assertFalse(state.dirty)
+        self.assertEqual(state.version, Cart.objects.get(user=self.alice).version)
+        self.assertEqual(self.cart_items(self.alice), {self.other_variant.id: 1})
+
+    def test_checkout_keeps_pending_changes_newer_than_the_order(self):
+        self.add_to_cart(self.alice, self.variant, 2)
+        self.add_to_cart(self.alice, self.other_variant, 1)
+        self.flush(self.alice)
+        self.add_to_cart(self.alice, self.other_variant, 1)
+
+        # Đơn hàng (ở tiến trình khác) vừa xóa dòng của variant khỏi DB
+        cart = Cart.objects.get(user=self.alice)
+        CartItem.objects.filter(cart=cart, variant=self.variant).delete()
+        checkout_completed(self.alice.id, {self.variant.id}, cart.touch())
+
+        state = get_cart_state(self.alice.id)
+        self.assertEqual(list(state.lines), [self.other_variant.id])
+        self.assertTrue(state.dirty)
+        self.assertGreater(state.version, cart.version)
+
+        self.flush(self.alice)
+        self.assertEqual(self.cart_items(self.alice), {self.other_variant.id: 2})
+
+    def test_checkout_rejects_cart_changed_elsewhere(self):
+        self.add_to_cart(self.alice, self.variant, 2)
+        self.flush(self.alice)
+        # Giỏ hàng trong DB bị thay đổi ngoài cache
+        CartItem.objects.filter(cart__user=self.alice).update(quantity=3)
+
+        with self.assertRaisesMessage(serializers.ValidationError, 'Giỏ hàng đã thay đổi'):
+            self.place_order(self.alice, [self.variant.id])
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 5)
+        # Cache được nạp lại từ DB để khách nhìn thấy giỏ hàng hiện tại
+        self.assertEqual(get_cart_state(self.alice.id).lines[self.variant.id].quantity, 3)
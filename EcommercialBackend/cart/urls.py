@@ -1,7 +1,21 @@
 # cart/urls.py
-from django.urls import path
+from django.urls import path, register_converter
 from . import views
 
+
+class SignedIntConverter:
+    """Số nguyên có dấu: mục giỏ hàng chưa ghi xuống DB có id tạm âm (-variant_id, xem cart/store.py)"""
+    regex = '-?[0-9]+'
+
+    def to_python(self, value):
+        return int(value)
+
+    def to_url(self, value):
+        return str(value)
+
+
+register_converter(SignedIntConverter, 'signed_int')
+
 urlpatterns = [
     # Giỏ hàng
     # GET: Lấy giỏ hàng của người dùng
@@ -9,8 +23,15 @@ urlpatterns = [
     # DELETE: Xóa toàn bộ giỏ hàng
     path('', views.CartView.as_view(), name='cart'),
 
+    # POST: Áp dụng một lô thao tác thêm/cập nhật/xóa (?response=delta để chỉ nhận phần thay đổi)
+    path('batch/', views.CartBatchView.as_view(), name='cart-batch'),
+
+    # POST: Giữ hàng có thời hạn cho các mục đã chọn khi bắt đầu thanh toán
+    # DELETE: Trả lại hàng đang giữ
+    path('reserve/', views.CartReservationView.as_view(), name='cart-reserve'),
+
     # Mục giỏ hàng
     # PUT: Cập nhật số lượng mục trong giỏ hàng
     # DELETE: Xóa mục khỏi giỏ hàng
-    path('items/<int:item_id>/', views.CartItemView.as_view(), name='cart-item'),
+    path('items/<signed_int:item_id>/', views.CartItemView.as_view(), name='cart-item'),
 ]
\ No newline at end of file
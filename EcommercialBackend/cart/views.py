@@ -1,89 +1,132 @@
 # cart/views.py
-from django.shortcuts import get_object_or_404
+"""
+API giỏ hàng.
+
+- Giỏ hàng được đọc và sửa trong cache (cart/store.py), thay đổi được ghi xuống DB sau
+  (write-behind) hoặc khi đặt hàng; id của mục chưa được ghi là id tạm -variant_id
+- GET trả về toàn bộ giỏ hàng kèm ETag; client gửi lại If-None-Match và nhận 304 khi giỏ
+  hàng (version) và dữ liệu hiển thị (giá, tồn kho, thẻ sản phẩm) không đổi
+- Các thao tác thay đổi (POST, PUT, DELETE mục, lô thao tác) mặc định trả về toàn bộ giỏ hàng;
+  với ?response=delta chỉ trả về các mục vừa thay đổi, các tổng tính lại và version mới để
+  client tự cập nhật trạng thái cục bộ
+- Khi bắt đầu thanh toán client giữ hàng cho các mục đã chọn (cart/reservations.py)
+"""
+from django.http import Http404
+from django.utils.http import parse_etags
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from .models import Cart, CartItem
-from products.models import ProductVariant
-from .serializers import CartSerializer, AddToCartSerializer, UpdateCartItemSerializer
+from .models import CartItem
+from .batch import apply_cart_operations
+from .reservations import reserve_stock, release_reservations, ReservationError, RESERVATION_TTL
+from .serializers import AddToCartSerializer, UpdateCartItemSerializer, CartBatchSerializer, ReserveStockSerializer
+from .store import (
+    get_cart_state, get_variant_snapshots, mutate_cart, price_state, render_cart, render_items, cart_etag
+)
+
+DELTA_RESPONSE = 'delta'
+
+
+def wants_delta(request):
+    return request.query_params.get('response') == DELTA_RESPONSE
+
+
+def _cart_snapshots(state, snapshots=None):
+    """Ảnh chụp biến thể của mọi dòng trong giỏ hàng (dùng lại các ảnh chụp đã có)"""
+    snapshots = dict(snapshots or {})
+    missing = [variant_id for variant_id in state.lines if variant_id not in snapshots]
+    if missing:
+        snapshots.update(get_variant_snapshots(missing))
+    return snapshots
+
+
+def delta_data(request, state, snapshots, variant_id=None, removed_item_id=None):
+    """Mục vừa thay đổi (nếu còn) cùng các tổng tính lại và version của giỏ hàng"""
+    snapshots = _cart_snapshots(state, snapshots)
+    pricing = price_state(state, snapshots)
+    items = render_items(request, state, snapshots, pricing, [variant_id]) if variant_id is not None else []
+    return {
+        'cart_id': state.cart_id,
+        'version': state.version,
+        'item': items[0] if items else None,
+        'removed_item_id': removed_item_id,
+        **pricing.totals(),
+    }
+
+
+def batch_delta_data(request, state, snapshots, changed_variant_ids, removed_item_ids):
+    """Các mục được tạo/cập nhật bởi lô thao tác cùng các tổng tính lại và version của giỏ hàng"""
+    snapshots = _cart_snapshots(state, snapshots)
+    pricing = price_state(state, snapshots)
+    return {
+        'cart_id': state.cart_id,
+        'version': state.version,
+        'items': render_items(request, state, snapshots, pricing, changed_variant_ids),
+        'removed_item_ids': removed_item_ids,
+        **pricing.totals(),
+    }
+
+
+def cart_response_data(request, state, snapshots, variant_id=None, removed_item_id=None):
+    """Dữ liệu trả về sau khi thay đổi giỏ hàng: delta hoặc toàn bộ giỏ hàng"""
+    if wants_delta(request):
+        return delta_data(request, state, snapshots, variant_id, removed_item_id)
+    return render_cart(request, state, _cart_snapshots(state, snapshots))
+
+
+def find_cart_item(request, item_id):
+    """Trạng thái giỏ hàng và biến thể của mục item_id (403/404 nếu mục không thuộc giỏ hàng)"""
+    state = get_cart_state(request.user.id)
+    variant_id = state.find_variant(item_id)
+    if variant_id is not None:
+        return state, variant_id, None
+    if item_id > 0 and CartItem.objects.filter(id=item_id).exclude(cart__user=request.user).exists():
+        return state, None, status.HTTP_403_FORBIDDEN
+    raise Http404
 
 
 class CartView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    
+
     def get(self, request):
-        """Lấy giỏ hàng của người dùng hiện tại"""
-        # Dùng prefetch_related và select_related để giảm số lượng truy vấn
-        cart, created = Cart.objects.prefetch_related(
-            'items',
-            'items__variant',
-            'items__variant__attribute_values',
-            'items__variant__attribute_values__attribute_value',
-            'items__variant__attribute_values__attribute_value__attribute',
-            'items__variant__product',
-            'items__variant__product__images',
-            'items__variant__product__shop'
-        ).get_or_create(user=request.user)
-        
-        serializer = CartSerializer(cart)
-        
+        """Lấy giỏ hàng của người dùng hiện tại (304 nếu khớp If-None-Match)"""
+        # Trạng thái giỏ hàng và dữ liệu biến thể đều lấy từ cache
+        state = get_cart_state(request.user.id)
+        snapshots = get_variant_snapshots(state.lines)
+
+        etag = cart_etag(request, state, snapshots)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
         return Response({
             'status': 'success',
             'message': 'Đã lấy giỏ hàng thành công',
-            'data': serializer.data
-        }, status=status.HTTP_200_OK)
-    
+            'data': render_cart(request, state, snapshots)
+        }, status=status.HTTP_200_OK, headers=headers)
+
     def post(self, request):
         """Thêm sản phẩm vào giỏ hàng"""
-        serializer = AddToCartSerializer(data=request.data)
+        serializer = AddToCartSerializer(data=request.data, context={'request': request})
 
         if serializer.is_valid():
             variant_id = serializer.validated_data['variant_id']
             quantity = serializer.validated_data['quantity']
 
-            # Lấy hoặc tạo giỏ hàng
-            cart, created = Cart.objects.get_or_create(user=request.user)
-
-            # Lấy biến thể sản phẩm
-            variant = get_object_or_404(ProductVariant, id=variant_id)
-
-            # Kiểm tra tồn kho
-            if variant.stock < quantity:
+            # Cộng dồn số lượng nếu sản phẩm đã có trong giỏ hàng, kiểm tra tồn kho
+            state, snapshots, results, changed, removed = apply_cart_operations(
+                request.user, [{'op': 'add', 'variant_id': variant_id, 'quantity': quantity}]
+            )
+            if results[0]['status'] != 'ok':
                 return Response({
                     'status': 'error',
-                    'message': f'Số lượng yêu cầu vượt quá tồn kho. Chỉ còn {variant.stock} sản phẩm.'
+                    'message': results[0]['message']
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Kiểm tra xem sản phẩm đã có trong giỏ hàng chưa
-            cart_item, item_created = CartItem.objects.get_or_create(
-                cart=cart,
-                variant=variant,
-                defaults={'quantity': quantity}
-            )
-
-            # Nếu sản phẩm đã có trong giỏ hàng thì cập nhật số lượng
-            if not item_created:
-                new_quantity = cart_item.quantity + quantity
-                # Kiểm tra tồn kho một lần nữa
-                if variant.stock < new_quantity:
-                    return Response({
-                        'status': 'error',
-                        'message': f'Số lượng yêu cầu vượt quá tồn kho. Chỉ còn {variant.stock} sản phẩm.'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-                cart_item.quantity = new_quantity
-                cart_item.save()
-
-            # Cập nhật thời gian cập nhật giỏ hàng
-            cart.save()  # Tự động cập nhật updated_at
-
-            # Trả về giỏ hàng đã cập nhật
-            serializer = CartSerializer(cart)
-
             return Response({
                 'status': 'success',
                 'message': 'Đã thêm sản phẩm vào giỏ hàng thành công',
-                'data': serializer.data
+                'data': cart_response_data(request, state, snapshots, variant_id=variant_id)
             }, status=status.HTTP_200_OK)
 
         return Response({
@@ -94,18 +137,16 @@ class CartView(APIView):
 
     def delete(self, request):
         """Xóa toàn bộ giỏ hàng"""
-        cart = Cart.objects.filter(user=request.user).first()
+        state = get_cart_state(request.user.id)
 
-        if cart:
+        if state.cart_id is not None or state.lines:
             # Xóa tất cả các mục trong giỏ hàng
-            CartItem.objects.filter(cart=cart).delete()
-
-            # Cập nhật thời gian cập nhật giỏ hàng
-            cart.save()  # Tự động cập nhật updated_at
+            state, result = mutate_cart(request.user.id, lambda lines: lines.clear())
 
             return Response({
                 'status': 'success',
-                'message': 'Đã xóa toàn bộ giỏ hàng thành công'
+                'message': 'Đã xóa toàn bộ giỏ hàng thành công',
+                'data': {'cart_id': state.cart_id, 'version': state.version}
             }, status=status.HTTP_200_OK)
 
         return Response({
@@ -116,103 +157,161 @@ class CartView(APIView):
 
 class CartItemView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    
+
     def put(self, request, item_id):
         """Cập nhật số lượng mục trong giỏ hàng"""
-        # Tìm mục giỏ hàng
-        cart_item = get_object_or_404(CartItem, id=item_id)
-        
-        # Kiểm tra quyền sở hữu
-        if cart_item.cart.user != request.user:
+        # Tìm mục giỏ hàng và kiểm tra quyền sở hữu
+        state, variant_id, error_status = find_cart_item(request, item_id)
+        if error_status:
             return Response({
                 'status': 'error',
                 'message': 'Bạn không có quyền cập nhật mục này'
-            }, status=status.HTTP_403_FORBIDDEN)
-        
+            }, status=error_status)
+
         # Xác thực dữ liệu
         serializer = UpdateCartItemSerializer(data=request.data)
-        
+
         if serializer.is_valid():
             quantity = serializer.validated_data['quantity']
-            
-            # Kiểm tra tồn kho
-            if cart_item.variant.stock < quantity:
+
+            # Cập nhật số lượng (kiểm tra tồn kho)
+            state, snapshots, results, changed, removed = apply_cart_operations(
+                request.user, [{'op': 'update', 'variant_id': variant_id, 'quantity': quantity}]
+            )
+            if results[0]['status'] != 'ok':
                 return Response({
                     'status': 'error',
-                    'message': f'Số lượng yêu cầu vượt quá tồn kho. Chỉ còn {cart_item.variant.stock} sản phẩm.'
+                    'message': results[0]['message']
                 }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Cập nhật số lượng
-            cart_item.quantity = quantity
-            cart_item.save()
-            
-            # Cập nhật thời gian cập nhật giỏ hàng
-            cart_item.cart.save()  # Tự động cập nhật updated_at
-            
-            # Trả về giỏ hàng đã cập nhật với dữ liệu đã được tối ưu
-            cart = Cart.objects.prefetch_related(
-                'items',
-                'items__variant',
-                'items__variant__attribute_values',
-                'items__variant__attribute_values__attribute_value',
-                'items__variant__attribute_values__attribute_value__attribute',
-                'items__variant__product',
-                'items__variant__product__images',
-                'items__variant__product__shop'
-            ).get(id=cart_item.cart.id)
-            
-            cart_serializer = CartSerializer(cart)
-            
+
             return Response({
                 'status': 'success',
                 'message': 'Đã cập nhật mục giỏ hàng thành công',
-                'data': cart_serializer.data
+                'data': cart_response_data(request, state, snapshots, variant_id=variant_id)
             }, status=status.HTTP_200_OK)
-        
+
         return Response({
             'status': 'error',
             'message': 'Không thể cập nhật mục giỏ hàng',
             'errors': serializer.errors
         }, status=status.HTTP_400_BAD_REQUEST)
-    
+
     def delete(self, request, item_id):
         """Xóa mục khỏi giỏ hàng"""
-        # Tìm mục giỏ hàng
-        cart_item = get_object_or_404(CartItem, id=item_id)
-        
-        # Kiểm tra quyền sở hữu
-        if cart_item.cart.user != request.user:
+        # Tìm mục giỏ hàng và kiểm tra quyền sở hữu
+        state, variant_id, error_status = find_cart_item(request, item_id)
+        if error_status:
             return Response({
                 'status': 'error',
                 'message': 'Bạn không có quyền xóa mục này'
-            }, status=status.HTTP_403_FORBIDDEN)
-        
-        # Lưu trữ ID cart để có thể truy vấn lại sau khi xóa
-        cart_id = cart_item.cart.id
-        
+            }, status=error_status)
+
         # Xóa mục giỏ hàng
-        cart_item.delete()
-        
-        # Truy vấn lại giỏ hàng đầy đủ
-        cart = Cart.objects.prefetch_related(
-            'items',
-            'items__variant',
-            'items__variant__attribute_values',
-            'items__variant__attribute_values__attribute_value',
-            'items__variant__attribute_values__attribute_value__attribute',
-            'items__variant__product',
-            'items__variant__product__images',
-            'items__variant__product__shop'
-        ).get(id=cart_id)
-        
-        # Cập nhật thời gian cập nhật giỏ hàng
-        cart.save()  # Tự động cập nhật updated_at
-        
-        # Trả về giỏ hàng đã cập nhật
-        cart_serializer = CartSerializer(cart)
-        
+        state, snapshots, results, changed, removed = apply_cart_operations(
+            request.user, [{'op': 'remove', 'variant_id': variant_id}]
+        )
+        if results[0]['status'] != 'ok':
+            raise Http404
+
         return Response({
             'status': 'success',
             'message': 'Đã xóa mục giỏ hàng thành công',
-            'data': cart_serializer.data
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            'data': cart_response_data(request, state, snapshots, removed_item_id=removed[0])
+        }, status=status.HTTP_200_OK)
+
+
+class CartBatchView(APIView):
+    """
+    Áp dụng nhiều thao tác giỏ hàng trong một request (khôi phục giỏ hàng, mua lại, thêm tất cả
+    từ danh sách yêu thích) - xem cart/batch.py. Thao tác lỗi được báo trong kết quả, các thao tác
+    còn lại vẫn được áp dụng
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'status': 'error',
+                'message': 'Danh sách thao tác không hợp lệ',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        state, snapshots, results, changed_variant_ids, removed_item_ids = apply_cart_operations(
+            request.user, serializer.validated_data['operations']
+        )
+        failed = sum(1 for result in results if result['status'] != 'ok')
+
+        if wants_delta(request):
+            data = batch_delta_data(request, state, snapshots, changed_variant_ids, removed_item_ids)
+        else:
+            data = {'cart': render_cart(request, state, _cart_snapshots(state, snapshots))}
+
+        return Response({
+            'status': 'success',
+            'message': f'Đã áp dụng {len(results) - failed}/{len(results)} thao tác giỏ hàng',
+            'data': {'results': results, **data}
+        }, status=status.HTTP_200_OK)
+
+
+class CartReservationView(APIView):
+    """Giữ hàng có thời hạn cho các mục giỏ hàng khi bắt đầu thanh toán"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """Giữ (hoặc gia hạn) hàng cho các mục đã chọn, thay cho lượt giữ trước đó"""
+        serializer = ReserveStockSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'status': 'error',
+                'message': 'Dữ liệu không hợp lệ',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        state = get_cart_state(request.user.id)
+        item_ids = serializer.validated_data.get('cart_item_ids')
+        if item_ids is None:
+            variant_ids = list(state.lines)
+        else:
+            variant_ids = [state.find_variant(item_id) for item_id in item_ids]
+            if None in variant_ids:
+                return Response({
+                    'status': 'error',
+                    'message': 'Có mục không tồn tại hoặc không thuộc về giỏ hàng của bạn'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        if not variant_ids:
+            return Response({
+                'status': 'error',
+                'message': 'Vui lòng chọn ít nhất một sản phẩm để thanh toán'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        quantities = {variant_id: state.lines[variant_id].quantity for variant_id in variant_ids}
+        try:
+            expires_at = reserve_stock(request.user, quantities)
+        except ReservationError as e:
+            return Response({
+                'status': 'error',
+                'message': e.message,
+                'errors': e.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'status': 'success',
+            'message': f'Đã giữ hàng trong {int(RESERVATION_TTL.total_seconds() // 60)} phút',
+            'data': {
+                'expires_at': expires_at,
+                'items': [
+                    {'id': state.public_item_id(variant_id), 'variant_id': variant_id, 'quantity': quantity}
+                    for variant_id, quantity in quantities.items()
+                ],
+            }
+        }, status=status.HTTP_200_OK)
+
+    def delete(self, request):
+        """Trả lại toàn bộ hàng đang giữ (khách rời trang thanh toán)"""
+        released = release_reservations(request.user)
+        return Response({
+            'status': 'success',
+            'message': 'Đã trả lại hàng đang giữ',
+            'data': {'released': released}
+        }, status=status.HTTP_200_OK)
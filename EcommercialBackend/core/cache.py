@@ -0,0 +1,13 @@
+# core/cache.py
+"""
+Cache dùng chung giữa các tiến trình (alias 'shared' trong settings.CACHES, Redis qua
+SHARED_CACHE_URL). Cache 'default' là LocMemCache của từng tiến trình nên chỉ dùng cho dữ liệu
+chấp nhận được việc mỗi worker có một bản; version/khóa/dữ liệu cần được mọi worker thấy ngay
+khi thay đổi phải nằm trong shared_cache.
+"""
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+SHARED_CACHE_ALIAS = 'shared'
+
+shared_cache = ConnectionProxy(caches, SHARED_CACHE_ALIAS)
@@ -0,0 +1,22 @@
+# core/db.py
+"""
+Tiện ích ghi DB dùng chung.
+
+bulk_upsert: chèn hoặc cập nhật hàng loạt theo khóa unique. MySQL (ON DUPLICATE KEY UPDATE)
+không cho chỉ định cột xung đột - Django báo NotSupportedError nếu truyền unique_fields - và
+tự áp dụng mọi khóa unique của bảng; SQLite/PostgreSQL (ON CONFLICT) lại bắt buộc có unique_fields.
+Các bảng dùng hàm này chỉ được có một khóa unique (ngoài id) là unique_fields.
+"""
+from django.db import connections, router
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=None):
+    """Chèn objs, bản ghi trùng unique_fields thì cập nhật update_fields"""
+    objs = list(objs)
+    if not objs:
+        return objs
+    connection = connections[router.db_for_write(model)]
+    kwargs = {'update_conflicts': True, 'update_fields': update_fields, 'batch_size': batch_size}
+    if connection.features.supports_update_conflicts_with_target:
+        kwargs['unique_fields'] = unique_fields
+    return model.objects.bulk_create(objs, **kwargs)
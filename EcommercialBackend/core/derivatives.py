@@ -0,0 +1,227 @@
+# core/derivatives.py
+"""
+Ảnh phái sinh: mỗi ảnh tải lên qua core.media được thu nhỏ thành một bộ kích thước
+cố định (settings.MEDIA_DERIVATIVE_SIZES) và mã hóa lại theo từng định dạng
+(settings.MEDIA_DERIVATIVE_FORMATS, mặc định WebP và JPEG).
+
+- Việc tạo ảnh chạy trong thread pool riêng của MediaService, request không phải chờ
+- Kích thước, số byte của từng ảnh phái sinh được lưu trong MediaDerivative
+- select_image_url() chọn URL phù hợp nhất theo kích thước/định dạng yêu cầu,
+  quay về ảnh gốc nếu chưa có ảnh phái sinh
+- Khi tạo xong, signal derivatives_ready được phát để các app làm mới dữ liệu
+  phi chuẩn hóa (ví dụ thẻ sản phẩm)
+"""
+import hashlib
+import io
+import logging
+import os
+import posixpath
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+from .models import MediaDerivative
+
+logger = logging.getLogger(__name__)
+
+# Cạnh dài tối đa (px) của từng kích thước
+DEFAULT_DERIVATIVE_SIZES = {'thumb': 200, 'card': 400, 'large': 1024}
+DEFAULT_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+DEFAULT_IMAGE_SIZE = 'card'
+DEFAULT_IMAGE_FORMAT = 'webp'
+
+FORMAT_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+ENCODE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+DERIVATIVE_CACHE_PREFIX = 'media_derivatives:'
+DERIVATIVE_CACHE_TIMEOUT = 3600
+# Ảnh chưa có phái sinh được cache ngắn hơn để sớm nhận kết quả mới
+MISSING_CACHE_TIMEOUT = 60
+
+# Gửi khi ảnh phái sinh của một ảnh gốc đã được tạo (kwargs: source_url, derivatives)
+derivatives_ready = Signal()
+
+
+def get_derivative_sizes():
+    return getattr(settings, 'MEDIA_DERIVATIVE_SIZES', DEFAULT_DERIVATIVE_SIZES)
+
+
+def get_derivative_formats():
+    return getattr(settings, 'MEDIA_DERIVATIVE_FORMATS', DEFAULT_DERIVATIVE_FORMATS)
+
+
+def _prepare_mode(image, image_format):
+    """JPEG không có kênh alpha: ghép lên nền trắng; WebP giữ nguyên độ trong suốt"""
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if image_format == 'jpeg':
+        if has_alpha:
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB') if image.mode != 'RGB' else image
+    return image.convert('RGBA' if has_alpha else 'RGB') if image.mode not in ('RGB', 'RGBA') else image
+
+
+def render_derivatives(data, sizes=None, formats=None):
+    """
+    Tạo ảnh phái sinh từ dữ liệu ảnh gốc.
+    Trả về danh sách (kích thước, định dạng, bytes, rộng, cao); không phóng to ảnh nhỏ,
+    các kích thước lớn hơn ảnh gốc chỉ tạo một lần ở kích thước gốc
+    """
+    sizes = sizes or get_derivative_sizes()
+    formats = formats or get_derivative_formats()
+
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        source.load()
+
+    longest_side = max(source.size)
+    results = []
+    for size, max_side in sorted(sizes.items(), key=lambda item: item[1]):
+        image = source.copy()
+        if max_side < longest_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        for image_format in formats:
+            buffer = io.BytesIO()
+            _prepare_mode(image, image_format).save(buffer, **ENCODE_OPTIONS[image_format])
+            results.append((size, image_format, buffer.getvalue(), image.width, image.height))
+        if max_side >= longest_side:
+            break
+    return results
+
+
+def _derivative_name(source_url, size, image_format):
+    stem = os.path.splitext(posixpath.basename(urlparse(source_url).path))[0] or 'image'
+    return f"{stem}_{size}.{FORMAT_EXTENSIONS[image_format]}"
+
+
+def build_derivatives(backend, source_url, data, folder):
+    """Tạo, tải lên và ghi nhận ảnh phái sinh của một ảnh gốc, trả về map phái sinh"""
+    rendered = render_derivatives(data)
+    records = []
+    for size, image_format, content, width, height in rendered:
+        url = backend.upload(
+            ContentFile(content, name=_derivative_name(source_url, size, image_format)),
+            f"{folder}/derivatives"
+        )
+        records.append(MediaDerivative(
+            source_url=source_url,
+            size=size,
+            format=image_format,
+            url=url,
+            width=width,
+            height=height,
+            bytes=len(content)
+        ))
+
+    with transaction.atomic():
+        MediaDerivative.objects.filter(source_url=source_url).delete()
+        MediaDerivative.objects.bulk_create(records)
+
+    derivatives = _to_map(records)
+    cache.set(_cache_key(source_url), derivatives, DERIVATIVE_CACHE_TIMEOUT)
+    derivatives_ready.send(sender=MediaDerivative, source_url=source_url, derivatives=derivatives)
+    return derivatives
+
+
+def _to_map(records):
+    derivatives = {}
+    for record in records:
+        derivatives.setdefault(record.size, {})[record.format] = {
+            'url': record.url,
+            'width': record.width,
+            'height': record.height,
+            'bytes': record.bytes,
+        }
+    return derivatives
+
+
+def _cache_key(source_url):
+    # URL có thể chứa ký tự không hợp lệ với một số backend cache
+    return f"{DERIVATIVE_CACHE_PREFIX}{hashlib.md5(source_url.encode('utf-8')).hexdigest()}"
+
+
+def load_image_derivatives(urls):
+    """Map phái sinh của nhiều ảnh gốc đọc trực tiếp từ DB (một truy vấn, không qua cache)"""
+    grouped = {url: [] for url in urls if url}
+    if grouped:
+        for record in MediaDerivative.objects.filter(source_url__in=list(grouped)):
+            grouped[record.source_url].append(record)
+    return {url: _to_map(records) for url, records in grouped.items()}
+
+
+def get_image_derivatives(urls):
+    """
+    Map phái sinh cho nhiều ảnh gốc: {url: {kích thước: {định dạng: {url, width, height, bytes}}}}.
+    Đọc từ cache, phần còn thiếu lấy bằng một truy vấn
+    """
+    urls = list({url for url in urls if url})
+    if not urls:
+        return {}
+
+    keys = {_cache_key(url): url for url in urls}
+    cached = cache.get_many(list(keys))
+    result = {keys[key]: value for key, value in cached.items()}
+
+    missing = [url for url in urls if url not in result]
+    for url, derivatives in load_image_derivatives(missing).items():
+        result[url] = derivatives
+        if derivatives:
+            cache.set(_cache_key(url), derivatives, DERIVATIVE_CACHE_TIMEOUT)
+        else:
+            # add: không ghi đè kết quả vừa được build_derivatives() đặt vào cache
+            cache.add(_cache_key(url), derivatives, MISSING_CACHE_TIMEOUT)
+    return result
+
+
+def get_image_preferences(context):
+    """
+    Kích thước/định dạng ảnh mà client yêu cầu qua ?image_size=thumb|card|large
+    và ?image_format=webp|jpeg (mặc định card + WebP)
+    """
+    request = (context or {}).get('request')
+    params = getattr(request, 'query_params', None) or {}
+    size = params.get('image_size', DEFAULT_IMAGE_SIZE)
+    image_format = params.get('image_format', DEFAULT_IMAGE_FORMAT)
+    if size != 'original' and size not in get_derivative_sizes():
+        size = DEFAULT_IMAGE_SIZE
+    if image_format not in FORMAT_EXTENSIONS:
+        image_format = DEFAULT_IMAGE_FORMAT
+    return size, image_format
+
+
+def select_image_url(url, derivatives=None, size=DEFAULT_IMAGE_SIZE, image_format=DEFAULT_IMAGE_FORMAT):
+    """
+    URL ảnh phù hợp nhất cho kích thước/định dạng yêu cầu:
+    ưu tiên đúng kích thước, nếu không có thì kích thước lớn hơn gần nhất, rồi nhỏ hơn gần nhất;
+    ưu tiên đúng định dạng, sau đó JPEG. Không có ảnh phái sinh thì trả về ảnh gốc
+    """
+    if not url or size == 'original':
+        return url
+    if derivatives is None:
+        derivatives = get_image_derivatives([url]).get(url, {})
+    if not derivatives:
+        return url
+
+    sizes = get_derivative_sizes()
+    target = sizes.get(size, 0)
+    available = sorted(derivatives, key=lambda name: sizes.get(name, 0))
+    larger = [name for name in available if sizes.get(name, 0) >= target]
+    smaller = [name for name in reversed(available) if sizes.get(name, 0) < target]
+    for name in larger + smaller:
+        formats = derivatives[name]
+        for candidate in (image_format, 'jpeg'):
+            if candidate in formats:
+                return formats[candidate]['url']
+        if formats:
+            return next(iter(formats.values()))['url']
+    return url
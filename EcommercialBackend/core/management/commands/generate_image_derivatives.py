@@ -0,0 +1,115 @@
+# core/management/commands/generate_image_derivatives.py
+import ast
+import json
+import os
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.derivatives import build_derivatives
+from core.media import media_service
+from core.models import MediaDerivative
+
+SOURCES = ('products', 'variants', 'shops', 'reviews')
+DOWNLOAD_TIMEOUT = 30
+
+
+def _parse_image_list(value):
+    """Review.images / OrderReview.images: danh sách URL dạng JSON (dữ liệu cũ có thể là repr của list)"""
+    if not value:
+        return []
+    for parser in (json.loads, ast.literal_eval):
+        try:
+            urls = parser(value)
+        except (ValueError, SyntaxError):
+            continue
+        return [url for url in urls if isinstance(url, str)] if isinstance(urls, list) else []
+    return []
+
+
+def collect_source_urls(sources):
+    """Các URL ảnh gốc theo nguồn: {url: thư mục lưu ảnh phái sinh}"""
+    from products.models import ProductImage, ProductVariant
+    from reviews.models import Review, OrderReview
+    from shops.models import Shop
+
+    urls = {}
+    if 'products' in sources:
+        for url in ProductImage.objects.filter(upload_status='ready').values_list('image_url', flat=True).iterator():
+            urls.setdefault(url, 'products')
+    if 'variants' in sources:
+        for url in ProductVariant.objects.exclude(image_url__isnull=True).values_list('image_url', flat=True).iterator():
+            urls.setdefault(url, 'variants')
+    if 'shops' in sources:
+        for logo, banner in Shop.objects.values_list('logo', 'banner').iterator():
+            urls.setdefault(logo, 'shops')
+            urls.setdefault(banner, 'shops')
+    if 'reviews' in sources:
+        for model in (Review, OrderReview):
+            for images in model.objects.exclude(images__isnull=True).values_list('images', flat=True).iterator():
+                for url in _parse_image_list(images):
+                    urls.setdefault(url, 'reviews')
+    urls.pop(None, None)
+    urls.pop('', None)
+    return urls
+
+
+def read_source_image(url):
+    """Đọc ảnh gốc: file trong MEDIA_ROOT (LocalMediaBackend) hoặc tải qua HTTP"""
+    media_url = settings.MEDIA_URL
+    if url.startswith(media_url):
+        with open(os.path.join(settings.MEDIA_ROOT, url[len(media_url):]), 'rb') as source:
+            return source.read()
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+        return response.read()
+
+
+class Command(BaseCommand):
+    help = 'Tạo ảnh phái sinh (thu nhỏ / WebP) cho các ảnh đã tải lên trước đây'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='append', choices=SOURCES,
+                            help='Nguồn ảnh cần xử lý (mặc định: tất cả)')
+        parser.add_argument('--force', action='store_true',
+                            help='Tạo lại cả ảnh đã có ảnh phái sinh')
+        parser.add_argument('--limit', type=int, default=None, help='Số ảnh tối đa cần xử lý')
+        parser.add_argument('--workers', type=int, default=4, help='Số luồng xử lý song song')
+
+    def handle(self, *args, **options):
+        urls = collect_source_urls(set(options['source'] or SOURCES))
+        if not options['force']:
+            done = set(MediaDerivative.objects.filter(
+                source_url__in=list(urls)
+            ).values_list('source_url', flat=True).distinct())
+            urls = {url: folder for url, folder in urls.items() if url not in done}
+        items = list(urls.items())[:options['limit']]
+
+        self.stdout.write(f"Đang tạo ảnh phái sinh cho {len(items)} ảnh...")
+        started = time.monotonic()
+        created = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(self._process, url, folder): url for url, folder in items}
+            for future in as_completed(futures):
+                error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {error}")
+                else:
+                    created += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã xử lý {created} ảnh, {failed} ảnh lỗi trong {time.monotonic() - started:.1f}s.'
+        ))
+
+    def _process(self, url, folder):
+        try:
+            build_derivatives(media_service.backend, url, read_source_image(url), f"{folder}/backfill")
+            return None
+        except Exception as e:
+            return str(e)
+        finally:
+            connections.close_all()
@@ -0,0 +1,274 @@
+# core/media.py
+"""
+Dịch vụ tải lên media dùng chung (ảnh sản phẩm, logo/banner cửa hàng, ảnh đánh giá).
+
+- Backend có thể thay thế qua settings.MEDIA_BACKEND:
+    core.media.CloudinaryBackend  -> Cloudinary (mặc định)
+    core.media.LocalMediaBackend  -> lưu vào MEDIA_ROOT (dùng khi test / offline)
+- Nhiều file được tải lên song song bằng một thread pool dùng chung
+  (settings.MEDIA_UPLOAD_WORKERS), nên thời gian của request ~ thời gian tải một file
+- Chế độ bất đồng bộ (settings.MEDIA_UPLOAD_ASYNC): sau khi transaction commit, file được
+  lưu tạm xuống đĩa và tải lên nền (request không chờ dịch vụ media), callback gắn URL cuối
+  cùng vào bản ghi; transaction rollback thì không có file tạm nào được tạo
+- Sau mỗi lần tải ảnh lên, ảnh phái sinh (thu nhỏ / WebP) được tạo trong một
+  thread pool riêng (settings.MEDIA_DERIVATIVES, xem core/derivatives.py)
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudinary.uploader
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEDIA_BACKEND = 'core.media.CloudinaryBackend'
+DEFAULT_UPLOAD_WORKERS = 6
+DEFAULT_DERIVATIVE_WORKERS = 2
+
+
+class CloudinaryBackend:
+    """Tải file lên Cloudinary, trả về secure_url"""
+
+    def upload(self, file, folder):
+        upload_result = cloudinary.uploader.upload(file, folder=folder)
+        return upload_result.get('secure_url')
+
+
+class LocalMediaBackend:
+    """Lưu file vào MEDIA_ROOT, trả về URL theo MEDIA_URL"""
+
+    def __init__(self, location=None, base_url=None):
+        self.storage = FileSystemStorage(location=location, base_url=base_url)
+
+    def upload(self, file, folder):
+        if isinstance(file, str):
+            with open(file, 'rb') as staged_file:
+                return self._save(staged_file, folder, os.path.basename(file))
+        return self._save(file, folder, getattr(file, 'name', '') or '')
+
+    def _save(self, file, folder, name):
+        extension = os.path.splitext(name)[1].lower()
+        saved_name = self.storage.save(f"{folder}/{uuid.uuid4().hex}{extension}", file)
+        return self.storage.url(saved_name)
+
+
+class MediaBatch:
+    """
+    Một lô file cần tải lên vào cùng thư mục.
+    Ở chế độ đồng bộ lô đã có sẵn urls; ở chế độ bất đồng bộ lô giữ các file của request
+    và chỉ lưu tạm + tải lên khi transaction commit (submit())
+    """
+
+    def __init__(self, service, folder, urls=None, files=None):
+        self.service = service
+        self.folder = folder
+        self.urls = urls
+        self.files = files
+
+    @property
+    def pending(self):
+        return self.files is not None
+
+    def __len__(self):
+        return len(self.files if self.pending else self.urls)
+
+    def submit(self, on_uploaded, on_failed=None):
+        """
+        Lên lịch lưu tạm và tải lên các file sau khi transaction hiện tại commit (rollback thì
+        không lưu gì). on_uploaded(index, url) / on_failed(index, error) được gọi trong luồng nền,
+        on_failed cũng được gọi ngay nếu không lưu tạm được
+        """
+        if not self.pending:
+            return
+        files = list(self.files)
+        transaction.on_commit(
+            lambda: self.service.stage_and_submit(files, self.folder, on_uploaded, on_failed)
+        )
+
+
+class MediaService:
+    """Tải file lên backend đã cấu hình, song song bằng thread pool"""
+
+    def __init__(self, backend=None, max_workers=None, async_uploads=None, derivatives=None):
+        self._backend = backend
+        self._max_workers = max_workers
+        self._async_uploads = async_uploads
+        self._derivatives = derivatives
+        self._executor = None
+        self._derivative_executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            backend_path = getattr(settings, 'MEDIA_BACKEND', DEFAULT_MEDIA_BACKEND)
+            self._backend = import_string(backend_path)()
+        return self._backend
+
+    @property
+    def async_uploads(self):
+        if self._async_uploads is None:
+            return getattr(settings, 'MEDIA_UPLOAD_ASYNC', False)
+        return self._async_uploads
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    max_workers = self._max_workers or getattr(settings, 'MEDIA_UPLOAD_WORKERS', DEFAULT_UPLOAD_WORKERS)
+                    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='media-upload')
+        return self._executor
+
+    @property
+    def derivatives(self):
+        if self._derivatives is None:
+            return getattr(settings, 'MEDIA_DERIVATIVES', True)
+        return self._derivatives
+
+    @property
+    def derivative_executor(self):
+        if self._derivative_executor is None:
+            with self._lock:
+                if self._derivative_executor is None:
+                    max_workers = getattr(settings, 'MEDIA_DERIVATIVE_WORKERS', DEFAULT_DERIVATIVE_WORKERS)
+                    self._derivative_executor = ThreadPoolExecutor(
+                        max_workers=max_workers, thread_name_prefix='media-derivatives'
+                    )
+        return self._derivative_executor
+
+    def upload(self, file, folder):
+        """Tải một file lên, trả về URL (và lên lịch tạo ảnh phái sinh)"""
+        data = _read_bytes(file) if self.derivatives else None
+        url = self.backend.upload(file, folder)
+        if data and url:
+            self.schedule_derivatives(url, data, folder)
+        return url
+
+    def schedule_derivatives(self, source_url, data, folder):
+        """Tạo ảnh phái sinh trong thread pool riêng, trả về Future"""
+        return self.derivative_executor.submit(self._build_derivatives, source_url, data, folder)
+
+    def _build_derivatives(self, source_url, data, folder):
+        from .derivatives import build_derivatives
+
+        try:
+            return build_derivatives(self.backend, source_url, data, folder)
+        except Exception:
+            # File không phải ảnh hoặc lỗi tải lên: vẫn dùng ảnh gốc
+            logger.exception("Không thể tạo ảnh phái sinh cho %s", source_url)
+            return None
+        finally:
+            connections.close_all()
+
+    def upload_all(self, items):
+        """
+        Tải song song danh sách (file, thư mục), trả về danh sách URL theo đúng thứ tự.
+        Nếu có file lỗi, ngoại lệ đầu tiên được ném lại sau khi các file khác hoàn tất
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [self.upload(file, folder) for file, folder in items]
+        futures = [self.executor.submit(self.upload, file, folder) for file, folder in items]
+        return [future.result() for future in futures]
+
+    def upload_many(self, files, folder):
+        """Tải song song nhiều file vào cùng một thư mục"""
+        return self.upload_all((file, folder) for file in files)
+
+    def prepare(self, files, folder, async_uploads=None):
+        """
+        Chuẩn bị một lô file: tải lên ngay (song song) hoặc lưu tạm để tải lên nền
+        tùy theo chế độ bất đồng bộ
+        """
+        files = list(files)
+        if async_uploads is None:
+            async_uploads = self.async_uploads
+        if async_uploads and files:
+            return MediaBatch(self, folder, files=files)
+        return MediaBatch(self, folder, urls=self.upload_many(files, folder))
+
+    def stage(self, files):
+        """Sao chép file tải lên vào thư mục tạm (file của request bị xóa khi request kết thúc)"""
+        staging_dir = getattr(settings, 'MEDIA_STAGING_DIR', None) or tempfile.gettempdir()
+        os.makedirs(staging_dir, exist_ok=True)
+        paths = []
+        try:
+            for file in files:
+                extension = os.path.splitext(getattr(file, 'name', '') or '')[1].lower()
+                fd, path = tempfile.mkstemp(prefix='media-', suffix=extension, dir=staging_dir)
+                paths.append(path)
+                with os.fdopen(fd, 'wb') as staged_file:
+                    if hasattr(file, 'chunks'):
+                        for chunk in file.chunks():
+                            staged_file.write(chunk)
+                    else:
+                        file.seek(0)
+                        shutil.copyfileobj(file, staged_file)
+        except Exception:
+            # Không để lại file tạm của lô lưu dở
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            raise
+        return paths
+
+    def stage_and_submit(self, files, folder, on_uploaded, on_failed=None):
+        """Lưu tạm các file của request rồi tải lên nền (gọi sau khi transaction commit)"""
+        try:
+            staged_paths = self.stage(files)
+        except Exception as e:
+            logger.exception("Không thể lưu tạm %s file để tải lên", len(files))
+            if on_failed is not None:
+                for index in range(len(files)):
+                    on_failed(index, e)
+            return
+        self.submit_staged(staged_paths, folder, on_uploaded, on_failed)
+
+    def submit_staged(self, staged_paths, folder, on_uploaded, on_failed=None):
+        """Tải lên nền các file tạm, mỗi file một tác vụ trong thread pool"""
+        for index, path in enumerate(staged_paths):
+            self.executor.submit(self._upload_staged, index, path, folder, on_uploaded, on_failed)
+
+    def _upload_staged(self, index, path, folder, on_uploaded, on_failed):
+        try:
+            url = self.upload(path, folder)
+            on_uploaded(index, url)
+        except Exception as e:
+            logger.exception("Không thể tải lên file %s", path)
+            if on_failed is not None:
+                try:
+                    on_failed(index, e)
+                except Exception:
+                    logger.exception("Lỗi khi xử lý file tải lên thất bại %s", path)
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            # Luồng nền tự mở kết nối DB riêng, đóng lại sau mỗi tác vụ
+            connections.close_all()
+
+
+def _read_bytes(file):
+    """Đọc toàn bộ nội dung file (đường dẫn hoặc file object) rồi đưa con trỏ về đầu"""
+    if isinstance(file, str):
+        with open(file, 'rb') as source:
+            return source.read()
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    return data
+
+
+media_service = MediaService()
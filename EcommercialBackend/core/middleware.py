@@ -1,6 +1,8 @@
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
 
+PRESERVED_HEADERS = ('ETag', 'Cache-Control')
+
 
 class CustomResponseMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
@@ -16,6 +18,10 @@ class CustomResponseMiddleware(MiddlewareMixin):
             # Định dạng phản hồi
             status_code = response.status_code
 
+            # 304 Not Modified không có nội dung, giữ nguyên (kèm ETag)
+            if status_code == 304:
+                return response
+
             if 200 <= status_code < 300:
                 data = {
                     'success': True,
@@ -31,6 +37,10 @@ class CustomResponseMiddleware(MiddlewareMixin):
 
             # Tạo JsonResponse mới
             new_response = JsonResponse(data, status=status_code)
+            # Giữ lại các header dùng cho cache/điều kiện của phản hồi gốc
+            for header in PRESERVED_HEADERS:
+                if header in response:
+                    new_response[header] = response[header]
             return new_response
 
         return response
\ No newline at end of file
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_province_district_ward'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_url', models.CharField(db_index=True, max_length=255)),
+                ('size', models.CharField(max_length=20)),
+                ('format', models.CharField(max_length=10)),
+                ('url', models.CharField(max_length=255)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('bytes', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'media_derivatives',
+                'unique_together': {('source_url', 'size', 'format')},
+            },
+        ),
+    ]
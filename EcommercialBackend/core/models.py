@@ -140,4 +140,22 @@ class Ward(models.Model):
         unique_together = ['district', 'code']
 
     def __str__(self):
-        return f"{self.name}, {self.district.name}"
\ No newline at end of file
+        return f"{self.name}, {self.district.name}"
+
+class MediaDerivative(models.Model):
+    """Ảnh phái sinh (thu nhỏ / WebP) của một ảnh gốc đã tải lên (xem core/derivatives.py)"""
+    source_url = models.CharField(max_length=255, db_index=True)
+    size = models.CharField(max_length=20)
+    format = models.CharField(max_length=10)
+    url = models.CharField(max_length=255)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    bytes = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'media_derivatives'
+        unique_together = ['source_url', 'size', 'format']
+
+    def __str__(self):
+        return f"{self.source_url} [{self.size}/{self.format}]"
@@ -0,0 +1,211 @@
+# core/pagination.py
+"""
+Phân trang theo con trỏ (keyset) dùng chung cho các API danh sách lớn.
+
+Chế độ này được bật khi request có tham số `cursor` (để trống cho trang đầu):
+    ?cursor=&page_size=20            -> trang đầu
+    ?cursor=<next_cursor>            -> trang tiếp theo
+    ?cursor=...&skip_count=true      -> bỏ qua COUNT(*) tổng số bản ghi
+
+Thay vì OFFSET, mỗi trang lọc theo giá trị khóa sắp xếp của bản ghi cuối
+trang trước (kèm id để phá hòa), nên chi phí mỗi trang là O(page_size) dù
+ở trang sâu đến đâu. Con trỏ được ký bằng SECRET_KEY nên client không thể sửa.
+
+Các view gọi KeysetPagination.paginate(request, queryset) để nhận trang và thông tin phân trang
+cho cả hai chế độ (con trỏ hoặc số trang).
+"""
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework import status
+
+from core.responses.exceptions import CustomError
+
+CURSOR_SALT = 'core.pagination.cursor'
+MAX_PAGE_SIZE = 100
+
+
+def _parse_int(value, default):
+    """Tham số số nguyên của request, default nếu không có hoặc không hợp lệ"""
+    try:
+        return int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+
+class KeysetPagination:
+    """Phân trang keyset theo thứ tự sắp xếp hiện tại của queryset + id"""
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    skip_count_query_param = 'skip_count'
+    # Theo số trang: trang vượt quá số trang thì trả về trang 1 (thay vì trang rỗng)
+    first_page_when_out_of_range = False
+
+    def __init__(self, request, default_page_size=10, max_page_size=MAX_PAGE_SIZE):
+        self.request = request
+        self.page_size = self._get_page_size(default_page_size, max_page_size)
+        self.skip_count = request.query_params.get(self.skip_count_query_param, 'false').lower() == 'true'
+        self.total = None
+        self.next_cursor = None
+        self.has_next = False
+
+    @classmethod
+    def is_requested(cls, request):
+        """Client chọn chế độ con trỏ bằng cách gửi tham số cursor"""
+        return cls.cursor_query_param in request.query_params
+
+    @classmethod
+    def paginate(cls, request, queryset, default_page_size=10):
+        """
+        Phân trang keyset nếu request có tham số cursor, ngược lại theo số trang (page/page_size).
+        Trả về (danh sách bản ghi của trang, thông tin phân trang); total là None khi skip_count
+        """
+        if cls.is_requested(request):
+            paginator = cls(request, default_page_size=default_page_size)
+            return paginator.paginate_queryset(queryset), paginator.get_pagination_data()
+
+        # Số trang/kích thước trang không hợp lệ thì dùng mặc định (trang 1), như Paginator.get_page
+        page = max(1, _parse_int(request.query_params.get('page'), 1))
+        page_size = max(1, min(_parse_int(request.query_params.get(cls.page_size_query_param), default_page_size),
+                               MAX_PAGE_SIZE))
+        total = queryset.count()
+        if cls.first_page_when_out_of_range and page > 1 and (page - 1) * page_size >= total:
+            page = 1
+        start = (page - 1) * page_size
+        return queryset[start:start + page_size], cls.get_page_data(total, page, page_size)
+
+    @staticmethod
+    def get_page_data(total, page, page_size):
+        """Thông tin phân trang theo số trang trả về cho client"""
+        return {
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': (total + page_size - 1) // page_size
+        }
+
+    def _get_page_size(self, default_page_size, max_page_size):
+        page_size = _parse_int(self.request.query_params.get(self.page_size_query_param), default_page_size)
+        return max(1, min(page_size, max_page_size))
+
+    @staticmethod
+    def _get_ordering(queryset):
+        """Danh sách (tên trường, giảm dần?) lấy từ order_by của queryset, luôn kết thúc bằng id"""
+        ordering = []
+        for item in queryset.query.order_by or queryset.model._meta.ordering:
+            if not isinstance(item, str) or '__' in item or item == '?':
+                raise CustomError('Kiểu sắp xếp này không hỗ trợ phân trang con trỏ')
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            ordering.append((name, descending))
+            if name == 'id':
+                break
+        if not ordering or ordering[-1][0] != 'id':
+            # id đi cùng chiều với khóa sắp xếp chính để thứ tự ổn định
+            ordering.append(('id', ordering[0][1] if ordering else True))
+        return ordering
+
+    @staticmethod
+    def _to_python(model, name, value):
+        """Chuyển giá trị trong con trỏ về kiểu của trường model (nếu là trường model)"""
+        if value is None:
+            return None
+        try:
+            return model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            return value
+
+    def _decode_cursor(self, raw_cursor, ordering):
+        try:
+            payload = signing.loads(raw_cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise CustomError('Con trỏ phân trang không hợp lệ', status_code=status.HTTP_400_BAD_REQUEST)
+
+        names = [name for name, _ in ordering]
+        if payload.get('o') != [f"{'-' if desc else ''}{name}" for name, desc in ordering] \
+                or len(payload.get('v', [])) != len(names):
+            raise CustomError('Con trỏ không khớp với kiểu sắp xếp hiện tại', status_code=status.HTTP_400_BAD_REQUEST)
+        return payload['v']
+
+    def _encode_cursor(self, obj, ordering):
+        values = [getattr(obj, name) for name, _ in ordering]
+        payload = {
+            'o': [f"{'-' if desc else ''}{name}" for name, desc in ordering],
+            'v': values,
+        }
+        return signing.dumps(payload, salt=CURSOR_SALT, serializer=_CursorSerializer, compress=True)
+
+    @staticmethod
+    def _build_filter(ordering, values):
+        """
+        Điều kiện "nằm sau bản ghi con trỏ" cho khóa nhiều cột:
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+        """
+        condition = Q()
+        for index, (name, descending) in enumerate(ordering):
+            lookup = 'lt' if descending else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[index]})
+            for prev_index in range(index):
+                clause &= Q(**{ordering[prev_index][0]: values[prev_index]})
+            condition |= clause
+        return condition
+
+    def paginate_queryset(self, queryset):
+        """Trả về danh sách bản ghi của trang hiện tại"""
+        ordering = self._get_ordering(queryset)
+        order_by = [f"{'-' if desc else ''}{name}" for name, desc in ordering]
+
+        if not self.skip_count:
+            self.total = queryset.count()
+
+        raw_cursor = self.request.query_params.get(self.cursor_query_param)
+        page_queryset = queryset.order_by(*order_by)
+        if raw_cursor:
+            values = self._decode_cursor(raw_cursor, ordering)
+            values = [self._to_python(queryset.model, name, value) for (name, _), value in zip(ordering, values)]
+            if any(value is None for value in values):
+                raise CustomError('Không thể phân trang con trỏ theo giá trị rỗng')
+            page_queryset = page_queryset.filter(self._build_filter(ordering, values))
+
+        items = list(page_queryset[:self.page_size + 1])
+        self.has_next = len(items) > self.page_size
+        items = items[:self.page_size]
+        if self.has_next and items:
+            self.next_cursor = self._encode_cursor(items[-1], ordering)
+        return items
+
+    def get_pagination_data(self):
+        """Thông tin phân trang trả về cho client"""
+        return {
+            'mode': 'cursor',
+            'page_size': self.page_size,
+            'next_cursor': self.next_cursor,
+            'has_next': self.has_next,
+            'total': self.total,
+        }
+
+
+class AdminKeysetPagination(KeysetPagination):
+    """Như KeysetPagination, thông tin phân trang theo số trang giữ định dạng của các API quản trị"""
+
+    first_page_when_out_of_range = True
+
+    @staticmethod
+    def get_page_data(total, page, page_size):
+        return {
+            'total': total,
+            'pages': max(1, (total + page_size - 1) // page_size),
+            'current_page': page,
+            'page_size': page_size
+        }
+
+
+class _CursorSerializer(signing.JSONSerializer):
+    """JSON serializer hỗ trợ datetime/Decimal cho giá trị trong con trỏ"""
+
+    def dumps(self, obj):
+        return DjangoJSONEncoder(separators=(',', ':')).encode(obj).encode('latin-1')
@@ -2,7 +2,6 @@ from django.http import Http404
 from rest_framework import status, permissions
 from rest_framework.views import APIView
 from django.contrib.auth import get_user_model
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from .models import OTP
 from .serializers import UserRegistrationSerializer, OTPVerificationSerializer, LoginSerializer, \
     DeleteAccountSerializer, ChangePasswordSerializer, UserUpdateSerializer, ResetPasswordSerializer, \
@@ -11,6 +10,7 @@ from .serializers import UserRegistrationSerializer, OTPVerificationSerializer,
 from .otp_manager import OTPManager
 from core.responses.utils import send_otp_email, send_password_reset_email
 from core.responses.response import APIResponse
+from core.pagination import AdminKeysetPagination
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -621,15 +621,8 @@ class AdminUserListCreateView(APIView):
                 models.Q(phone__icontains=search)
             )
 
-        # Pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-
-        paginator = Paginator(users, page_size)
-        try:
-            users_page = paginator.page(page)
-        except (PageNotAnInteger, EmptyPage):
-            users_page = paginator.page(1)
+        # Pagination (keyset mode when a cursor parameter is given)
+        users_page, pagination = AdminKeysetPagination.paginate(request, users, default_page_size=10)
 
         serializer = AdminUserListSerializer(users_page, many=True)
 
@@ -638,12 +631,7 @@ class AdminUserListCreateView(APIView):
             'message': 'Danh sách người dùng được lấy thành công',
             'data': {
                 'users': serializer.data,
-                'pagination': {
-                    'total': paginator.count,
-                    'pages': paginator.num_pages,
-                    'current_page': page,
-                    'page_size': page_size
-                }
+                'pagination': pagination
             }
         })
 
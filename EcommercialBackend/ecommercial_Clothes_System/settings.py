@@ -10,10 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 
 import cloudinary
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -183,6 +185,24 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Media uploads (core/media.py)
+# MEDIA_BACKEND: 'core.media.CloudinaryBackend' or 'core.media.LocalMediaBackend' (MEDIA_ROOT)
+MEDIA_BACKEND = 'core.media.CloudinaryBackend'
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+# Number of parallel upload threads
+MEDIA_UPLOAD_WORKERS = 6
+# Stage files and upload them in the background (product images are returned as pending)
+MEDIA_UPLOAD_ASYNC = False
+# Resized/WebP derivatives generated after each image upload (core/derivatives.py)
+MEDIA_DERIVATIVES = True
+MEDIA_DERIVATIVE_WORKERS = 2
+MEDIA_DERIVATIVE_SIZES = {'thumb': 200, 'card': 400, 'large': 1024}
+MEDIA_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+
+# Snapshot of the autocomplete prefix index, memory-mapped by every worker (products/autocomplete.py)
+AUTOCOMPLETE_SNAPSHOT_DIR = BASE_DIR / 'var' / 'autocomplete'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -216,10 +236,50 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Kho giỏ hàng (cart/store.py): giỏ hàng và danh sách giỏ chờ ghi xuống DB nằm trong Redis dùng
+# chung giữa các tiến trình (CART_CACHE_URL). LocMemCache (mỗi tiến trình một bản) chỉ được dùng
+# khi DEBUG hoặc chạy test
+if os.environ.get('CART_CACHE_URL'):
+    CART_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CART_CACHE_URL'],
+    }
+elif DEBUG or TESTING:
+    CART_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carts',
+        # Không để giỏ hàng chưa ghi xuống DB bị loại khỏi cache sớm
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+else:
+    raise ImproperlyConfigured('Cần đặt CART_CACHE_URL (Redis) cho kho giỏ hàng khi DEBUG = False')
+
+# Cache dùng chung giữa các tiến trình (core/cache.py): version của các chỉ mục trong bộ nhớ,
+# khóa dựng lại và dữ liệu đã render cần được mọi worker thấy ngay khi thay đổi. Mặc định dùng
+# chung Redis với kho giỏ hàng
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL') or os.environ.get('CART_CACHE_URL')
+if SHARED_CACHE_URL:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': SHARED_CACHE_URL,
+        'KEY_PREFIX': 'shared',
+    }
+elif DEBUG or TESTING:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    }
+else:
+    raise ImproperlyConfigured('Cần đặt SHARED_CACHE_URL (Redis) cho cache dùng chung khi DEBUG = False')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    'carts': CART_CACHE,
+    'shared': SHARED_CACHE,
 }
 
 # Email settings for sending OTP emails
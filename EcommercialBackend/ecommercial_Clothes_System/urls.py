@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -12,4 +14,7 @@ urlpatterns = [
     path('api/payments/', include('payments.urls')),
     path('api/promotions/', include('promotions.urls')),
     path('api/analytics/', include('analytics.urls')),
-]
\ No newline at end of file
+]
+
+# Files stored by core.media.LocalMediaBackend (development only)
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -3,6 +3,10 @@ from rest_framework import serializers
 from .models import Order, OrderItem, OrderTracking
 from core.models import Address
 from products.models import ProductVariant
+from core.derivatives import get_image_preferences
+from products.cards import get_product_thumbnail
+from products.sales_rollup import order_item_rows, record_status_change
+from cart.pricing import price_cart
 from shops.serializers import ShopListSerializer
 from django.db import transaction
 from core.serializers import CustomerInfoSerializer
@@ -39,15 +43,8 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_product_image(self, obj):
-        # Lấy ảnh đại diện của sản phẩm
-        thumbnail = obj.product.images.filter(is_thumbnail=True).first()
-        if thumbnail:
-            return thumbnail.image_url
-        # Lấy ảnh đầu tiên nếu không có thumbnail
-        first_image = obj.product.images.first()
-        if first_image:
-            return first_image.image_url
-        return None
+        # Lấy ảnh đại diện của sản phẩm (từ thẻ sản phẩm)
+        return get_product_thumbnail(obj.product, *get_image_preferences(self.context))
 
     def get_variant_details(self, obj):
         # Trả về thông tin chi tiết của biến thể
@@ -118,29 +115,24 @@ class OrderListSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_items_count(self, obj):
-        return obj.items.count()
+        return len(obj.items.all())
 
     def get_first_product(self, obj):
-        first_item = obj.items.first()
+        # Dùng obj.items.all() để tận dụng prefetch_related của view
+        items = sorted(obj.items.all(), key=lambda item: item.id)
+        first_item = items[0] if items else None
         if not first_item:
             return None
 
-        # Lấy ảnh sản phẩm
+        # Lấy ảnh sản phẩm từ thẻ sản phẩm
         product = first_item.product
-        image_url = None
-        thumbnail = product.images.filter(is_thumbnail=True).first()
-        if thumbnail:
-            image_url = thumbnail.image_url
-        else:
-            first_image = product.images.first()
-            if first_image:
-                image_url = first_image.image_url
+        image_url = get_product_thumbnail(product, *get_image_preferences(self.context))
 
         return {
             'name': product.name,
             'image': image_url,
             'quantity': first_item.quantity,
-            'more_items': obj.items.count() > 1
+            'more_items': len(items) > 1
         }
 
 
@@ -167,43 +159,62 @@ class CreateOrderSerializer(serializers.Serializer):
         user = self.context['request'].user
 
         # Kiểm tra xem các ID có hợp lệ không
-        from cart.models import CartItem, Cart
+        from cart.store import get_cart_state
 
         if not value:
             raise serializers.ValidationError("Vui lòng chọn ít nhất một sản phẩm để thanh toán")
 
-        # Lấy giỏ hàng của người dùng
-        cart = Cart.objects.filter(user=user).first()
-        if not cart:
+        # Lấy giỏ hàng của người dùng (từ cache giỏ hàng, cart/store.py)
+        state = get_cart_state(user.id)
+        if state.cart_id is None and not state.lines:
             raise serializers.ValidationError("Giỏ hàng không tồn tại")
 
-        # Kiểm tra xem tất cả các ID có thuộc về giỏ hàng của người dùng không
-        valid_ids = set(cart.items.values_list('id', flat=True))
+        # Kiểm tra xem tất cả các ID (id mục hoặc id tạm của mục chưa ghi) có thuộc về giỏ hàng không
         for item_id in value:
-            if item_id not in valid_ids:
+            if state.find_variant(item_id) is None:
                 raise serializers.ValidationError(
                     f"Mục giỏ hàng với ID {item_id} không tồn tại hoặc không thuộc về bạn")
 
         return value
 
-    @transaction.atomic
     def create(self, validated_data):
+        # Ghi các thay đổi giỏ hàng còn nằm trong cache xuống DB trước khi đặt hàng
+        from cart.store import flush_cart
+        state = flush_cart(self.context['request'].user.id)
+
+        with transaction.atomic():
+            return self._create_order(validated_data, state)
+
+    def _create_order(self, validated_data, state):
         user = self.context['request'].user
         address_id = validated_data.get('address_id')
         payment_method = validated_data.get('payment_method')
         notes = validated_data.get('notes', '')
         cart_item_ids = validated_data.get('cart_item_ids', [])
 
-        # Lấy giỏ hàng của người dùng
+        # Lấy giỏ hàng của người dùng (khóa để các lần ghi giỏ hàng khác chờ đến khi đặt hàng xong)
         from cart.models import Cart, CartItem
-        cart = Cart.objects.filter(user=user).first()
+        from cart.store import get_cart_state, invalidate_cart, checkout_completed_on_commit
+        cart = Cart.objects.select_for_update().filter(user=user).order_by('id').first()
 
         if not cart:
             raise serializers.ValidationError("Giỏ hàng không tồn tại")
 
+        # Các biến thể đã chọn (id tạm -variant_id của mục chưa ghi vẫn được chấp nhận)
+        selected_quantities = {}
+        for item_id in cart_item_ids:
+            variant_id = state.find_variant(item_id)
+            if variant_id is not None:
+                selected_quantities[variant_id] = state.lines[variant_id].quantity
+
+        # Khóa các biến thể đã chọn (theo thứ tự id) trước khi đọc tồn kho, để các đơn hàng
+        # và lượt giữ hàng đồng thời không bán quá tồn kho
+        from cart.reservations import lock_variants, held_quantities, release_reservations
+        lock_variants(selected_quantities)
+
         # Lấy các mục đã chọn từ giỏ hàng
         selected_items = CartItem.objects.filter(
-            id__in=cart_item_ids,
+            variant_id__in=list(selected_quantities),
             cart=cart
         ).select_related(
             'variant',
@@ -214,43 +225,38 @@ class CreateOrderSerializer(serializers.Serializer):
         if not selected_items:
             raise serializers.ValidationError("Không tìm thấy sản phẩm nào đã chọn trong giỏ hàng")
 
-        # Kiểm tra tồn kho cho tất cả các mục đã chọn
+        # Đối chiếu giỏ hàng trong cache với DB: khác nhau nghĩa là giỏ hàng vừa bị thay đổi ở nơi khác
+        # (hoặc cache đã mất thay đổi) - đơn hàng không được tạo từ dữ liệu khách chưa nhìn thấy
+        if {item.variant_id: item.quantity for item in selected_items} != selected_quantities:
+            if not get_cart_state(user.id).dirty:
+                invalidate_cart(user.id)
+            raise serializers.ValidationError("Giỏ hàng đã thay đổi, vui lòng kiểm tra lại giỏ hàng trước khi đặt hàng")
+
+        # Kiểm tra tồn kho có thể bán cho tất cả các mục đã chọn: tồn kho trừ số lượng
+        # khách khác đang giữ (lượt giữ của chính khách này được chuyển thành đơn hàng)
         from .utils import check_variant_availability
-        
+
+        held = held_quantities(selected_quantities, exclude_user=user)
         for cart_item in selected_items:
             variant = cart_item.variant
-            is_available, error_message = check_variant_availability(variant, cart_item.quantity)
+            is_available, error_message = check_variant_availability(
+                variant, cart_item.quantity, reserved=held.get(variant.id, 0)
+            )
             if not is_available:
                 raise serializers.ValidationError(error_message)
 
-        # Tính tổng tiền cho các mục đã chọn
-        total_amount = 0
-        shipping_fee = 30000  # Có thể tính toán phí vận chuyển dựa trên logic nghiệp vụ
-        discount_amount = 0  # Có thể áp dụng giảm giá nếu có
-
-        for cart_item in selected_items:
-            variant = cart_item.variant
-            # Lấy giá sản phẩm
-            price = variant.sale_price if variant.sale_price else variant.price
-            if not price:
-                product = variant.product
-                price = product.sale_price if product.sale_price else product.price
-
-            # Tính tổng tiền
-            subtotal = price * cart_item.quantity
-            total_amount += subtotal
-
-        # Cộng phí vận chuyển, trừ giảm giá
-        final_amount = total_amount + shipping_fee - discount_amount
+        # Tính giá các mục đã chọn, phí vận chuyển và tổng cộng trong một lượt (cart/pricing.py),
+        # dùng cùng cách tính với giỏ hàng hiển thị cho khách
+        pricing = price_cart(selected_items)
 
         # Tạo đơn hàng
         address = Address.objects.get(id=address_id)
         order = Order.objects.create(
             user=user,
             address=address,
-            total_amount=final_amount,
-            shipping_fee=shipping_fee,
-            discount_amount=discount_amount,
+            total_amount=pricing.grand_total,
+            shipping_fee=pricing.shipping_fee,
+            discount_amount=pricing.discount_amount,
             payment_method=payment_method,
             notes=notes
         )
@@ -260,14 +266,7 @@ class CreateOrderSerializer(serializers.Serializer):
             variant = cart_item.variant
             product = variant.product
             shop = product.shop
-
-            # Lấy giá sản phẩm
-            price = variant.sale_price if variant.sale_price else variant.price
-            if not price:
-                price = product.sale_price if product.sale_price else product.price
-
-            # Tính tổng tiền của mục
-            subtotal = price * cart_item.quantity
+            line = pricing.line(cart_item.id)
 
             # Tạo mục đơn hàng
             OrderItem.objects.create(
@@ -276,8 +275,8 @@ class CreateOrderSerializer(serializers.Serializer):
                 variant=variant,
                 shop=shop,
                 quantity=cart_item.quantity,
-                price=price,
-                subtotal=subtotal
+                price=line.unit_price,
+                subtotal=line.line_total
             )
 
             # Sử dụng các hàm tiện ích để cập nhật tồn kho
@@ -301,8 +300,13 @@ class CreateOrderSerializer(serializers.Serializer):
             created_by=user
         )
 
-        # Xóa các mục đã chọn khỏi giỏ hàng
+        # Hàng đang giữ đã được trừ vào tồn kho
+        release_reservations(user, selected_quantities)
+
+        # Xóa các mục đã chọn khỏi giỏ hàng (cả trong cache sau khi commit)
         selected_items.delete()
+        cart.touch()
+        checkout_completed_on_commit(user.id, selected_quantities, cart.version)
 
         return order
 
@@ -434,6 +438,7 @@ class BulkUpdateOrderStatusSerializer(serializers.Serializer):
         tracking_items = []
         updated_orders = []
         updated_order_items = []
+        sales_rows = []
 
         for order in orders:
             # Cập nhật trạng thái đơn hàng
@@ -459,6 +464,7 @@ class BulkUpdateOrderStatusSerializer(serializers.Serializer):
 
             # Cập nhật trạng thái các mục đơn hàng
             for item in order_items:
+                sales_rows.extend(order_item_rows([item]))
                 item.status = new_status
                 item.updated_at = timezone.now()
                 updated_order_items.append(item)
@@ -470,6 +476,7 @@ class BulkUpdateOrderStatusSerializer(serializers.Serializer):
         # Bulk update các mục đơn hàng
         if updated_order_items:
             OrderItem.objects.bulk_update(updated_order_items, ['status', 'updated_at'])
+            record_status_change(sales_rows, new_status)
 
         # Bulk create các tracking item
         if tracking_items:
@@ -512,7 +519,9 @@ class UpdateOrderStatusSerializer(serializers.Serializer):
 
         # Cập nhật trạng thái của tất cả các mục đơn hàng nếu cần
         if user.role != 'customer':  # Người bán hoặc admin mới có thể cập nhật trạng thái mục
+            sales_rows = order_item_rows(instance.items.all())
             instance.items.all().update(status=new_status)
+            record_status_change(sales_rows, new_status)
 
         return instance
 
@@ -536,8 +545,10 @@ class UpdateOrderItemStatusSerializer(serializers.Serializer):
             raise serializers.ValidationError("Bạn không phải là chủ cửa hàng của sản phẩm này")
 
         # Cập nhật trạng thái mục đơn hàng
+        sales_rows = order_item_rows([instance])
         instance.status = new_status
         instance.save(update_fields=['status', 'updated_at'])
+        record_status_change(sales_rows, new_status)
 
         # Tạo bản ghi theo dõi đơn hàng
         OrderTracking.objects.create(
@@ -615,29 +626,24 @@ class OrderListForShopSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_items_count(self, obj):
-        return obj.items.count()
+        return len(obj.items.all())
 
     def get_first_product(self, obj):
-        first_item = obj.items.first()
+        # Dùng obj.items.all() để tận dụng prefetch_related của view
+        items = sorted(obj.items.all(), key=lambda item: item.id)
+        first_item = items[0] if items else None
         if not first_item:
             return None
 
-        # Lấy ảnh sản phẩm
+        # Lấy ảnh sản phẩm từ thẻ sản phẩm
         product = first_item.product
-        image_url = None
-        thumbnail = product.images.filter(is_thumbnail=True).first()
-        if thumbnail:
-            image_url = thumbnail.image_url
-        else:
-            first_image = product.images.first()
-            if first_image:
-                image_url = first_image.image_url
+        image_url = get_product_thumbnail(product, *get_image_preferences(self.context))
 
         return {
             'name': product.name,
             'image': image_url,
             'quantity': first_item.quantity,
-            'more_items': obj.items.count() > 1
+            'more_items': len(items) > 1
         }
 
     def get_customer(self, obj):
@@ -725,7 +731,9 @@ class CancelOrderSerializer(serializers.Serializer):
         )
 
         # Cập nhật trạng thái của tất cả các mục đơn hàng
+        sales_rows = order_item_rows(instance.items.all())
         instance.items.all().update(status='cancelled', updated_at=timezone.now())
+        record_status_change(sales_rows, 'cancelled')
 
         # Khôi phục tồn kho cho các sản phẩm
         for item in instance.items.all():
@@ -807,7 +815,9 @@ class ConfirmOrderReceivedSerializer(serializers.Serializer):
             created_by=user
         )
         # Cập nhật trạng thái của tất cả các mục đơn hàng
+        sales_rows = order_item_rows(instance.items.all())
         instance.items.all().update(status='received', updated_at=timezone.now())
+        record_status_change(sales_rows, 'received')
         # # Cập nhật trạng thái thanh toán nếu là thanh toán khi nhận hàng (COD)
         # if instance.payment_method == 'cod' and instance.payment_status != 'paid':
         #     instance.payment_status = 'paid'
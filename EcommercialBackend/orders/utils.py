@@ -28,14 +28,16 @@ def increase_product_stock(product, quantity):
     else:
         product.save(update_fields=['stock'])
 
-def check_variant_availability(variant, quantity_needed):
+def check_variant_availability(variant, quantity_needed, reserved=0):
     """
     Kiểm tra xem variant có đủ số lượng tồn kho không
+    (reserved: số lượng khách khác đang giữ, xem cart/reservations.py)
     Trả về (bool, str): (đủ hàng hay không, thông báo lỗi nếu không đủ)
     """
-    if variant.stock < quantity_needed:
+    available = variant.stock - reserved
+    if available < quantity_needed:
         product_name = variant.product.name
-        return False, f"Sản phẩm '{product_name}' không đủ tồn kho. Hiện tại chỉ còn {variant.stock} sản phẩm."
+        return False, f"Sản phẩm '{product_name}' không đủ tồn kho. Hiện tại chỉ còn {max(available, 0)} sản phẩm."
     return True, ""
 
 def update_product_status_based_on_variants(product):
@@ -55,7 +57,8 @@ def update_product_status_based_on_variants(product):
 def decrease_variant_stock(variant, quantity):
     """Decrease stock for a product variant"""
     variant.stock -= quantity
-    variant.save()
+    # Save only stock so the cached product detail payload stays valid (stock is overlaid on read)
+    variant.save(update_fields=['stock', 'updated_at'])
 
     # Update product stock status if needed
     product = variant.product
@@ -64,15 +67,16 @@ def decrease_variant_stock(variant, quantity):
 
     if total_stock == 0 and product.status != 'out_of_stock':
         product.status = 'out_of_stock'
-        product.save()
+        product.save(update_fields=['status', 'updated_at'])
 
 def increase_variant_stock(variant, quantity):
     """Increase stock for a product variant"""
     variant.stock += quantity
-    variant.save()
+    # Save only stock so the cached product detail payload stays valid (stock is overlaid on read)
+    variant.save(update_fields=['stock', 'updated_at'])
 
     # Update product stock status if needed
     product = variant.product
     if product.status == 'out_of_stock' and variant.stock > 0:
         product.status = 'active'
-        product.save()
\ No newline at end of file
+        product.save(update_fields=['status', 'updated_at'])
\ No newline at end of file
@@ -24,7 +24,7 @@ from rest_framework import status, permissions
 from django.db.models import Q, Sum, Count, F
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.core.paginator import Paginator
+from core.pagination import KeysetPagination
 
 from .models import Order, OrderItem, OrderTracking
 from products.models import Product
@@ -46,8 +46,8 @@ class AdminOrderListView(APIView):
         payment_status = request.query_params.get('payment_status')
         order_by = request.query_params.get('order_by', '-created_at')
 
-        # Bắt đầu truy vấn
-        orders = Order.objects.all()
+        # Bắt đầu truy vấn (tải trước khách hàng và thẻ sản phẩm cho OrderListSerializer)
+        orders = Order.objects.select_related('user').prefetch_related('items__product__card')
 
         # Áp dụng bộ lọc
         if status_filter:
@@ -86,17 +86,8 @@ class AdminOrderListView(APIView):
         else:
             orders = orders.order_by('-created_at')
 
-        # Phân trang
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-
-        paginator = Paginator(orders, page_size)
-        total_count = paginator.count
-
-        try:
-            orders_page = paginator.page(page)
-        except Exception:
-            orders_page = paginator.page(1)
+        # Phân trang (keyset nếu có tham số cursor, ngược lại theo số trang)
+        orders_page, pagination = KeysetPagination.paginate(request, orders, default_page_size=10)
 
         serializer = OrderListSerializer(orders_page, many=True)
 
@@ -105,12 +96,7 @@ class AdminOrderListView(APIView):
             'message': 'Đã lấy danh sách đơn hàng thành công',
             'data': {
                 'orders': serializer.data,
-                'pagination': {
-                    'total': total_count,
-                    'page': page,
-                    'page_size': page_size,
-                    'total_pages': paginator.num_pages
-                }
+                'pagination': pagination
             }
         }, status=status.HTTP_200_OK)
 
@@ -127,7 +113,7 @@ class AdminOrderDetailView(APIView):
         order = Order.objects.prefetch_related(
             'items',
             'items__product',
-            'items__product__images',
+            'items__product__card',
             'items__variant',
             'items__variant__attribute_values',
             'items__variant__attribute_values__attribute_value',
@@ -199,22 +185,14 @@ class AdminUpdateOrderItemStatusView(APIView):
 
             updated_item = serializer.save()
 
-            # Cập nhật sold_count nếu cần
+            # Số lượng đã bán được ghi nhận khi lưu trạng thái (xem products/sales_rollup.py)
             completed_statuses = ['delivered', 'received', 'received_reviewed']
 
             if new_status in completed_statuses and old_status not in completed_statuses:
-                Product.objects.filter(pk=order_item.product.pk).update(
-                    sold_count=F('sold_count') + order_item.quantity
-                )
                 if updated_item.order.payment_status != 'success':
                     updated_item.order.payment_status = 'success'
                     updated_item.order.save(update_fields=['payment_status'])
 
-            elif old_status in completed_statuses and new_status in ['cancelled', 'returned']:
-                Product.objects.filter(pk=order_item.product.pk).update(
-                    sold_count=F('sold_count') - order_item.quantity
-                )
-
             # Trả về thông tin đơn hàng đã cập nhật
             order_serializer = OrderDetailSerializer(updated_item.order)
 
@@ -423,22 +401,12 @@ class BulkUpdateOrderStatusView(APIView):
         if serializer.is_valid():
             result = serializer.save()
 
-            # Cập nhật sold_count nếu trạng thái là trạng thái hoàn thành
+            # Số lượng đã bán được ghi nhận trong serializer (xem products/sales_rollup.py)
             new_status = result.get('status')
             completed_statuses = ['delivered', 'received', 'received_reviewed']
 
             if new_status in completed_statuses:
                 order_ids = result.get('order_ids', [])
-                order_items = OrderItem.objects.filter(order_id__in=order_ids)
-
-                product_quantities = order_items.values('product').annotate(
-                    total_quantity=Sum('quantity')
-                )
-
-                for pq in product_quantities:
-                    Product.objects.filter(pk=pq['product']).update(
-                        sold_count=F('sold_count') + pq['total_quantity']
-                    )
 
                 # Cập nhật trạng thái thanh toán thành công cho tất cả đơn hàng
                 Order.objects.filter(
@@ -486,7 +454,9 @@ class OrderListView(APIView):
         end_date = request.query_params.get('end_date')
 
         # Bắt đầu truy vấn
-        orders = Order.objects.filter(user=user).order_by('-created_at')
+        orders = Order.objects.filter(user=user).select_related('user').prefetch_related(
+            'items__product__card'
+        ).order_by('-created_at')
 
         # Áp dụng bộ lọc
         if status_filter:
@@ -504,15 +474,8 @@ class OrderListView(APIView):
         if end_date:
             orders = orders.filter(created_at__lte=end_date)
 
-        # Phân trang
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-
-        start = (page - 1) * page_size
-        end = start + page_size
-
-        total_count = orders.count()
-        orders = orders[start:end]
+        # Phân trang (keyset nếu có tham số cursor, ngược lại theo số trang)
+        orders, pagination = KeysetPagination.paginate(request, orders, default_page_size=10)
 
         serializer = OrderListSerializer(orders, many=True)
 
@@ -521,12 +484,7 @@ class OrderListView(APIView):
             'message': 'Đã lấy danh sách đơn hàng thành công',
             'data': {
                 'orders': serializer.data,
-                'pagination': {
-                    'total': total_count,
-                    'page': page,
-                    'page_size': page_size,
-                    'total_pages': (total_count + page_size - 1) // page_size
-                }
+                'pagination': pagination
             }
         }, status=status.HTTP_200_OK)
 
@@ -551,7 +509,7 @@ class OrderDetailView(APIView):
         order = Order.objects.prefetch_related(
             'items',
             'items__product',
-            'items__product__images',
+            'items__product__card',
             'items__variant',
             'items__variant__attribute_values',
             'items__variant__attribute_values__attribute_value',
@@ -683,23 +641,15 @@ class UpdateOrderItemStatusView(APIView):
 
             updated_item = serializer.save()
 
-            # Cập nhật sold_count của sản phẩm nếu cần
+            # Số lượng đã bán được ghi nhận khi lưu trạng thái (xem products/sales_rollup.py)
             completed_statuses = ['delivered', 'received', 'received_reviewed']
 
             if new_status in completed_statuses and old_status not in completed_statuses:
-                Product.objects.filter(pk=order_item.product.pk).update(
-                    sold_count=F('sold_count') + order_item.quantity
-                )
                 # Cập nhật trạng thái thanh toán thành công
                 if updated_item.order.payment_status != 'success':
                     updated_item.order.payment_status = 'success'
                     updated_item.order.save(update_fields=['payment_status'])
 
-            elif old_status in completed_statuses and new_status in ['cancelled', 'returned']:
-                Product.objects.filter(pk=order_item.product.pk).update(
-                    sold_count=F('sold_count') - order_item.quantity
-                )
-
             order_serializer = OrderDetailSerializer(updated_item.order)
             return Response({
                 'status': 'success',
@@ -729,7 +679,9 @@ class SellerOrdersView(APIView):
         end_date = request.query_params.get('end_date')
 
         # Lấy tất cả đơn hàng có sản phẩm từ cửa hàng của người bán
-        orders = Order.objects.filter(items__shop__owner=user).distinct().order_by('-created_at')
+        orders = Order.objects.filter(items__shop__owner=user).select_related('user').prefetch_related(
+            'items__product__card'
+        ).distinct().order_by('-created_at')
 
         # Áp dụng bộ lọc
         if status_filter:
@@ -749,15 +701,8 @@ class SellerOrdersView(APIView):
         if end_date:
             orders = orders.filter(created_at__lte=end_date)
 
-        # Phân trang
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-
-        start = (page - 1) * page_size
-        end = start + page_size
-
-        total_count = orders.count()
-        orders = orders[start:end]
+        # Phân trang (keyset nếu có tham số cursor, ngược lại theo số trang)
+        orders, pagination = KeysetPagination.paginate(request, orders, default_page_size=10)
 
         serializer = OrderListSerializer(orders, many=True)
 
@@ -766,12 +711,7 @@ class SellerOrdersView(APIView):
             'message': 'Đã lấy danh sách đơn hàng cho người bán thành công',
             'data': {
                 'orders': serializer.data,
-                'pagination': {
-                    'total': total_count,
-                    'page': page,
-                    'page_size': page_size,
-                    'total_pages': (total_count + page_size - 1) // page_size
-                }
+                'pagination': pagination
             }
         }, status=status.HTTP_200_OK)
 
@@ -0,0 +1,725 @@
+# products/autocomplete.py
+"""
+Gợi ý khi gõ (typeahead): tên sản phẩm, danh mục, cửa hàng và các truy vấn tìm kiếm phổ biến.
+
+- Mỗi mục gợi ý là một dòng AutocompleteTerm (loại, id, tên hiển thị, trọng số theo số lượng
+  bán / số lần tìm kiếm), được làm mới khi sản phẩm, danh mục, cửa hàng thay đổi (xem
+  products/signals.py) và khi số lần tìm kiếm được ghi xuống DB
+- Khóa là tên đã bỏ dấu, chữ thường (giống chỉ mục tìm kiếm), tính từ đầu tên và từ đầu
+  các từ tiếp theo ("thun" khớp "Áo thun nam"). Các khóa được sắp xếp và ghi thành snapshot
+  (file .npy/.bin) rồi mở bằng mmap: các worker dùng chung page cache của hệ điều hành,
+  không tiến trình nào phải tự dựng chỉ mục
+- Truy vấn là tìm nhị phân khoảng khóa có cùng tiền tố rồi chọn các khóa nặng nhất; với các
+  tiền tố có quá nhiều khóa (SCAN_LIMIT), danh sách mục nặng nhất được tính sẵn khi dựng
+- Thay đổi sau snapshot được đọc từ AutocompleteTerm (updated_at) vào một lớp phủ nhỏ trong
+  bộ nhớ của từng tiến trình; khi lớp phủ quá lớn, snapshot mới được dựng ở luồng nền
+- Version của lớp phủ và khóa dựng snapshot nằm trong cache dùng chung giữa các worker
+  (core/cache.py), nên chỉ một worker dựng snapshot tại một thời điểm
+- Trọng số theo số lượng bán chỉ được cập nhật khi mục được làm mới hoặc khi chạy
+  rebuild_autocomplete_index (nên chạy định kỳ), xem benchmark_autocomplete
+"""
+import atexit
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction, connections
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from core.cache import shared_cache
+from core.db import bulk_upsert
+from shops.models import Shop
+from .models import Product, Category, AutocompleteTerm, SearchQueryStat
+from .search import tokenize
+from .category_tree import get_descendant_ids
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_KINDS = ('product', 'category', 'shop', 'query')
+
+# Trọng số nhân thêm theo loại mục (danh mục/cửa hàng gom doanh số của nhiều sản phẩm)
+KIND_WEIGHTS = {
+    'product': 1.0,
+    'category': 0.8,
+    'shop': 0.8,
+    'query': 1.2,
+}
+
+DEFAULT_SUGGESTION_LIMIT = 10
+MAX_SUGGESTION_LIMIT = 20
+
+MAX_KEY_LENGTH = 64
+# Số khóa tối đa của một mục: từ đầu tên và từ đầu các từ tiếp theo
+MAX_KEYS_PER_ITEM = 4
+# Khoảng khóa lớn hơn ngưỡng này dùng danh sách tính sẵn thay vì quét
+SCAN_LIMIT = 20000
+# Số mục nặng nhất lấy ra cho mỗi tiền tố (dư để bù các mục đã bị lớp phủ thay thế)
+CANDIDATES_PER_PREFIX = 50
+# Độ sâu tối đa (byte) của các tiền tố được tính sẵn
+PRECOMPUTED_PREFIX_BYTES = 24
+
+# Truy vấn được gợi ý khi đã được tìm ít nhất chừng này lần
+MIN_QUERY_COUNT = 3
+MAX_QUERY_LENGTH = 100
+
+TERM_BATCH_SIZE = 1000
+# Số mục trong lớp phủ để kích hoạt dựng snapshot mới
+OVERLAY_REBUILD_THRESHOLD = 5000
+SYNC_OVERLAP = timedelta(seconds=60)
+# Chu kỳ kiểm tra snapshot mới khi version không đổi (giây)
+SNAPSHOT_CHECK_INTERVAL = 30
+
+AUTOCOMPLETE_VERSION_KEY = 'autocomplete:version'
+BUILD_LOCK_KEY = 'autocomplete:build_lock'
+BUILD_LOCK_TIMEOUT = 1800
+
+CURRENT_FILE = 'CURRENT'
+
+# Các trường của Product ảnh hưởng đến mục gợi ý
+AUTOCOMPLETE_PRODUCT_FIELDS = {'name', 'status', 'shop', 'shop_id'}
+
+# Bộ đệm số lần tìm kiếm trong tiến trình
+QUERY_FLUSH_INTERVAL = 60
+QUERY_FLUSH_THRESHOLD = 500
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_checked_at = 0.0
+
+_query_lock = threading.Lock()
+_pending_queries = Counter()
+_query_worker = None
+# Đánh thức luồng ghi sớm hơn chu kỳ khi bộ đệm đầy
+_query_flush_requested = threading.Event()
+
+
+def normalize_prefix(text, max_length=MAX_KEY_LENGTH):
+    """Chuẩn hóa chuỗi người dùng gõ giống khóa của chỉ mục"""
+    return ' '.join(tokenize(text))[:max_length]
+
+
+def item_keys(text):
+    """Các khóa của một mục: tên đã chuẩn hóa tính từ đầu và từ các từ tiếp theo"""
+    tokens = tokenize(text)
+    keys = []
+    for start in range(min(len(tokens), MAX_KEYS_PER_ITEM)):
+        key = ' '.join(tokens[start:])[:MAX_KEY_LENGTH].encode()
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _popularity_weight(kind, popularity):
+    return KIND_WEIGHTS[kind] * math.log1p(max(popularity or 0, 0))
+
+
+# ---------------------------------------------------------------------------
+# Nguồn dữ liệu (AutocompleteTerm)
+# ---------------------------------------------------------------------------
+
+def _load_products(ids):
+    rows = Product.objects.filter(id__in=ids).values_list('id', 'name', 'status', 'sold_count', 'shop__status')
+    return {
+        product_id: (name, _popularity_weight('product', sold_count),
+                     product_status == 'active' and shop_status == 'active')
+        for product_id, name, product_status, sold_count, shop_status in rows
+    }
+
+
+def _group_popularity(field, ids):
+    """Tổng số lượng bán (cộng số sản phẩm đang bán) theo danh mục/cửa hàng"""
+    rows = Product.objects.filter(**{f'{field}__in': ids}, status='active').values(field).annotate(
+        sold=Sum('sold_count'), count=Count('id')
+    ).order_by().values_list(field, 'sold', 'count')
+    return {key: (sold or 0) + count for key, sold, count in rows}
+
+
+def _load_categories(ids):
+    # Danh mục cha gom cả sản phẩm của các danh mục con (theo chỉ mục cây danh mục)
+    subtrees = {category_id: get_descendant_ids(category_id) for category_id in ids}
+    direct = _group_popularity('category_id', {
+        descendant_id for descendant_ids in subtrees.values() for descendant_id in descendant_ids
+    })
+    popularity = {
+        category_id: sum(direct.get(descendant_id, 0) for descendant_id in descendant_ids)
+        for category_id, descendant_ids in subtrees.items()
+    }
+    return {
+        category_id: (name, _popularity_weight('category', popularity[category_id]),
+                      category_status == 'active' and popularity[category_id] > 0)
+        for category_id, name, category_status in Category.objects.filter(id__in=ids).values_list(
+            'id', 'name', 'status'
+        )
+    }
+
+
+def _load_shops(ids):
+    popularity = _group_popularity('shop_id', ids)
+    return {
+        shop_id: (name, _popularity_weight('shop', popularity.get(shop_id, 0)),
+                  shop_status == 'active' and shop_id in popularity)
+        for shop_id, name, shop_status in Shop.objects.filter(id__in=ids).values_list('id', 'name', 'status')
+    }
+
+
+def _load_queries(ids):
+    return {
+        query_id: (query, _popularity_weight('query', search_count), search_count >= MIN_QUERY_COUNT)
+        for query_id, query, search_count in SearchQueryStat.objects.filter(id__in=ids).values_list(
+            'id', 'query', 'search_count'
+        )
+    }
+
+
+_LOADERS = {
+    'product': _load_products,
+    'category': _load_categories,
+    'shop': _load_shops,
+    'query': _load_queries,
+}
+
+_SOURCES = {
+    'product': Product,
+    'category': Category,
+    'shop': Shop,
+    'query': SearchQueryStat,
+}
+
+
+def refresh_autocomplete_terms(kind, object_ids):
+    """Tính lại các mục gợi ý của một loại; đối tượng đã bị xóa được đánh dấu không hoạt động"""
+    object_ids = list(set(object_ids))
+    if not object_ids:
+        return
+
+    for start in range(0, len(object_ids), TERM_BATCH_SIZE):
+        batch_ids = object_ids[start:start + TERM_BATCH_SIZE]
+        loaded = _LOADERS[kind](batch_ids)
+        terms = []
+        for object_id in batch_ids:
+            text, weight, is_active = loaded.get(object_id, ('', 0.0, False))
+            terms.append(AutocompleteTerm(
+                kind=kind, object_id=object_id, text=(text or '')[:255], weight=weight,
+                is_active=is_active and bool(tokenize(text)),
+            ))
+        bulk_upsert(
+            AutocompleteTerm, terms, unique_fields=['kind', 'object_id'],
+            update_fields=['text', 'weight', 'is_active', 'updated_at'],
+        )
+    invalidate_autocomplete_index()
+
+
+def refresh_autocomplete_terms_on_commit(kind, object_ids):
+    object_ids = list(object_ids)
+    if object_ids:
+        transaction.on_commit(lambda: refresh_autocomplete_terms(kind, object_ids))
+
+
+def rebuild_autocomplete_terms(batch_size=TERM_BATCH_SIZE, stdout=None):
+    """Tính lại toàn bộ AutocompleteTerm theo lô id của từng loại"""
+    total = 0
+    for kind in AUTOCOMPLETE_KINDS:
+        model = _SOURCES[kind]
+        last_id = 0
+        while True:
+            batch_ids = list(
+                model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not batch_ids:
+                break
+            refresh_autocomplete_terms(kind, batch_ids)
+            total += len(batch_ids)
+            last_id = batch_ids[-1]
+            if stdout:
+                stdout.write(f"Đã làm mới {total} mục gợi ý ({kind})")
+
+        # Mục của đối tượng không còn tồn tại
+        AutocompleteTerm.objects.filter(kind=kind, is_active=True).exclude(
+            object_id__in=model.objects.values('id')
+        ).update(is_active=False, updated_at=timezone.now())
+    return total
+
+
+# ---------------------------------------------------------------------------
+# Số lần tìm kiếm (truy vấn phổ biến)
+# ---------------------------------------------------------------------------
+
+def record_search_query(query):
+    """
+    Ghi nhận một lần tìm kiếm; số lần được gom trong tiến trình và được luồng nền ghi xuống DB
+    theo lô, request tìm kiếm không phải chờ ghi
+    """
+    normalized = normalize_prefix(query, MAX_QUERY_LENGTH)
+    if not normalized:
+        return
+    _ensure_query_worker()
+    with _query_lock:
+        _pending_queries[normalized] += 1
+        should_flush = sum(_pending_queries.values()) >= QUERY_FLUSH_THRESHOLD
+    if should_flush:
+        _query_flush_requested.set()
+
+
+def _ensure_query_worker():
+    global _query_worker
+    if _query_worker is not None and _query_worker.is_alive():
+        return
+    with _query_lock:
+        if _query_worker is not None and _query_worker.is_alive():
+            return
+        _query_worker = threading.Thread(target=_run_query_worker, name='search-query-counter', daemon=True)
+        _query_worker.start()
+
+
+def _run_query_worker():
+    while True:
+        _query_flush_requested.wait(QUERY_FLUSH_INTERVAL)
+        _query_flush_requested.clear()
+        try:
+            flush_search_queries()
+        finally:
+            # Luồng nền tự mở kết nối DB riêng, đóng lại sau mỗi lần ghi
+            connections.close_all()
+
+
+def flush_search_queries():
+    """Ghi các lần tìm kiếm đang chờ xuống SearchQueryStat và làm mới gợi ý của các truy vấn"""
+    with _query_lock:
+        pending = dict(_pending_queries)
+        _pending_queries.clear()
+    if not pending:
+        return 0
+
+    try:
+        with transaction.atomic():
+            SearchQueryStat.objects.bulk_create(
+                [SearchQueryStat(query=query) for query in pending], ignore_conflicts=True
+            )
+            # Gom các truy vấn có cùng số lần cần cộng vào một câu UPDATE
+            by_count = {}
+            for query, count in pending.items():
+                by_count.setdefault(count, []).append(query)
+            for count, queries in by_count.items():
+                SearchQueryStat.objects.filter(query__in=queries).update(search_count=F('search_count') + count)
+            query_ids = list(SearchQueryStat.objects.filter(
+                query__in=list(pending), search_count__gte=MIN_QUERY_COUNT
+            ).values_list('id', flat=True))
+            refresh_autocomplete_terms_on_commit('query', query_ids)
+    except Exception:
+        logger.exception("Không thể ghi số lần tìm kiếm")
+        return 0
+    return sum(pending.values())
+
+
+atexit.register(flush_search_queries)
+
+
+# ---------------------------------------------------------------------------
+# Snapshot (mmap)
+# ---------------------------------------------------------------------------
+
+def _top_items(key_weights, key_items, start, end, count):
+    """Chỉ số các mục (không trùng) nặng nhất trong khoảng khóa [start, end)"""
+    weights = np.asarray(key_weights[start:end])
+    take = min(end - start, count * MAX_KEYS_PER_ITEM)
+    if take < end - start:
+        positions = np.argpartition(weights, -take)[-take:]
+    else:
+        positions = np.arange(end - start)
+    positions = positions[np.argsort(-weights[positions], kind='stable')]
+    items = np.asarray(key_items[start:end])[positions]
+    return list(dict.fromkeys(items.tolist()))[:count]
+
+
+def _blob(chunks):
+    """(bytes nối liền, mảng offset int64 độ dài n+1)"""
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(chunk) for chunk in chunks], dtype=np.int64), out=offsets[1:])
+    return b''.join(chunks), offsets
+
+
+def _precompute_heavy_prefixes(keys, key_weights, key_items):
+    """{tiền tố: [chỉ số mục]} cho các tiền tố có nhiều hơn SCAN_LIMIT khóa"""
+    heavy = {}
+    if len(keys) <= SCAN_LIMIT:
+        return heavy
+
+    # Ma trận các byte đầu của khóa (đệm 0), các khóa cùng tiền tố nằm liền nhau
+    heads = np.frombuffer(
+        b''.join(key[:PRECOMPUTED_PREFIX_BYTES].ljust(PRECOMPUTED_PREFIX_BYTES, b'\0') for key in keys),
+        dtype=np.uint8,
+    ).reshape(len(keys), PRECOMPUTED_PREFIX_BYTES)
+
+    ranges = [(0, len(keys))]
+    for depth in range(PRECOMPUTED_PREFIX_BYTES):
+        next_ranges = []
+        for lo, hi in ranges:
+            column = heads[lo:hi, depth]
+            bounds = np.flatnonzero(column[1:] != column[:-1]) + 1
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [hi - lo]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                # Byte 0: khóa đã kết thúc ở độ sâu này (trùng với tiền tố cha)
+                if end - start <= SCAN_LIMIT or column[start] == 0:
+                    continue
+                prefix = keys[lo + start][:depth + 1]
+                heavy[prefix] = _top_items(key_weights, key_items, lo + start, lo + end, CANDIDATES_PER_PREFIX)
+                next_ranges.append((lo + start, lo + end))
+        ranges = next_ranges
+        if not ranges:
+            break
+    return heavy
+
+
+def write_snapshot(items, directory, synced_at=None):
+    """
+    Ghi snapshot từ danh sách (kind, object_id, text, weight) vào thư mục mới bên trong directory
+    và chuyển CURRENT sang snapshot đó. Trả về đường dẫn snapshot
+    """
+    items = list(items)
+    kind_codes = {kind: code for code, kind in enumerate(AUTOCOMPLETE_KINDS)}
+
+    entries = []
+    for item_index, (_, _, text, _) in enumerate(items):
+        entries.extend((key, item_index) for key in item_keys(text))
+    entries.sort()
+
+    keys = [key for key, _ in entries]
+    item_weights = np.array([weight for _, _, _, weight in items], dtype=np.float32)
+    key_items = np.array([item_index for _, item_index in entries], dtype=np.int32)
+    key_weights = item_weights[key_items] if len(key_items) else np.zeros(0, dtype=np.float32)
+    heavy = _precompute_heavy_prefixes(keys, key_weights, key_items)
+
+    os.makedirs(directory, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}-{os.getpid()}"
+    path = os.path.join(directory, name)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(tmp_path)
+
+    key_blob, key_offsets = _blob(keys)
+    text_blob, text_offsets = _blob([text.encode() for _, _, text, _ in items])
+    heavy_blob, heavy_offsets = _blob(list(heavy))
+    heavy_top = np.full((len(heavy), CANDIDATES_PER_PREFIX), -1, dtype=np.int32)
+    for row, top in enumerate(heavy.values()):
+        heavy_top[row, :len(top)] = top
+
+    arrays = {
+        'key_offsets': key_offsets,
+        'key_items': key_items,
+        'key_weights': key_weights,
+        'item_kinds': np.array([kind_codes[kind] for kind, _, _, _ in items], dtype=np.int8),
+        'item_ids': np.array([object_id for _, object_id, _, _ in items], dtype=np.int64),
+        'item_weights': item_weights,
+        'text_offsets': text_offsets,
+        'heavy_offsets': heavy_offsets,
+        'heavy_top': heavy_top,
+    }
+    for array_name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{array_name}.npy'), array)
+    for blob_name, blob in (('keys', key_blob), ('texts', text_blob), ('heavy_keys', heavy_blob)):
+        with open(os.path.join(tmp_path, f'{blob_name}.bin'), 'wb') as f:
+            f.write(blob)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({
+            'items': len(items),
+            'keys': len(keys),
+            'heavy_prefixes': len(heavy),
+            'synced_at': (synced_at or timezone.now()).isoformat(),
+        }, f)
+    os.rename(tmp_path, path)
+
+    # Đổi con trỏ CURRENT một cách nguyên tử
+    current_tmp = os.path.join(directory, f'{CURRENT_FILE}.{os.getpid()}.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(directory, CURRENT_FILE))
+
+    # Giữ lại snapshot liền trước cho các tiến trình đang mở (mmap vẫn hợp lệ sau khi xóa file)
+    snapshots = sorted(
+        entry for entry in os.listdir(directory)
+        if entry.startswith('snapshot-') and not entry.endswith('.tmp') and entry != name
+    )
+    for entry in snapshots[:-1]:
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return path
+
+
+def _map_file(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class AutocompleteSnapshot:
+    """Snapshot chỉ đọc của chỉ mục tiền tố, các mảng được mở bằng mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.synced_at = datetime.fromisoformat(self.meta['synced_at'])
+
+        def load(array_name):
+            return np.load(os.path.join(path, f'{array_name}.npy'), mmap_mode='r')
+
+        self.key_offsets = load('key_offsets')
+        self.key_items = load('key_items')
+        self.key_weights = load('key_weights')
+        self.item_kinds = load('item_kinds')
+        self.item_ids = load('item_ids')
+        self.item_weights = load('item_weights')
+        self.text_offsets = load('text_offsets')
+        self.keys = _map_file(os.path.join(path, 'keys.bin'))
+        self.texts = _map_file(os.path.join(path, 'texts.bin'))
+        self.size = len(self.key_items)
+
+        # Danh sách tính sẵn nhỏ (vài nghìn tiền tố), đọc hẳn vào bộ nhớ
+        with open(os.path.join(path, 'heavy_keys.bin'), 'rb') as f:
+            heavy_blob = f.read()
+        heavy_offsets = load('heavy_offsets').tolist()
+        heavy_top = np.load(os.path.join(path, 'heavy_top.npy'))
+        self.heavy = {
+            heavy_blob[heavy_offsets[row]:heavy_offsets[row + 1]]: [item for item in top if item >= 0]
+            for row, top in enumerate(heavy_top.tolist())
+        }
+
+    def _key_head(self, position, length):
+        start = int(self.key_offsets[position])
+        end = min(int(self.key_offsets[position + 1]), start + length)
+        return self.keys[start:end]
+
+    def prefix_range(self, prefix):
+        """Khoảng [start, end) các khóa bắt đầu bằng prefix (bytes)"""
+        length = len(prefix)
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_head(mid, length) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_head(mid, length) <= prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def top_items(self, prefix, count=CANDIDATES_PER_PREFIX):
+        """Chỉ số các mục nặng nhất có khóa bắt đầu bằng prefix"""
+        heavy = self.heavy.get(prefix)
+        if heavy is not None:
+            return heavy[:count]
+        start, end = self.prefix_range(prefix)
+        if start >= end:
+            return []
+        return _top_items(self.key_weights, self.key_items, start, end, count)
+
+    def item(self, item_index):
+        """(kind, object_id, text, weight) của một mục"""
+        start, end = int(self.text_offsets[item_index]), int(self.text_offsets[item_index + 1])
+        return (
+            AUTOCOMPLETE_KINDS[self.item_kinds[item_index]],
+            int(self.item_ids[item_index]),
+            self.texts[start:end].decode(),
+            float(self.item_weights[item_index]),
+        )
+
+
+def _snapshot_dir():
+    return str(getattr(settings, 'AUTOCOMPLETE_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'var', 'autocomplete')))
+
+
+def _current_snapshot_path():
+    directory = _snapshot_dir()
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(directory, name) if name else None
+
+
+def build_autocomplete_snapshot(stdout=None):
+    """Dựng snapshot mới từ các AutocompleteTerm đang hoạt động, trả về số mục"""
+    # Mốc đồng bộ lấy trước khi đọc: thay đổi trong lúc dựng sẽ được lớp phủ đọc lại
+    synced_at = timezone.now()
+    items = list(AutocompleteTerm.objects.filter(is_active=True).values_list(
+        'kind', 'object_id', 'text', 'weight'
+    ).iterator(chunk_size=TERM_BATCH_SIZE))
+    if stdout:
+        stdout.write(f"Đang ghi snapshot {len(items)} mục gợi ý...")
+    write_snapshot(items, _snapshot_dir(), synced_at)
+
+    # Mục không hoạt động cũ hơn snapshot không còn cần cho lớp phủ
+    AutocompleteTerm.objects.filter(is_active=False, updated_at__lt=synced_at - SYNC_OVERLAP).delete()
+    invalidate_autocomplete_index()
+    return len(items)
+
+
+def rebuild_autocomplete_index(refresh_terms=True, batch_size=TERM_BATCH_SIZE, stdout=None):
+    """Làm mới toàn bộ mục gợi ý (trọng số theo số lượng bán hiện tại) rồi dựng snapshot"""
+    if refresh_terms:
+        rebuild_autocomplete_terms(batch_size, stdout)
+    return build_autocomplete_snapshot(stdout)
+
+
+def _build_in_background():
+    """Dựng snapshot ở luồng nền (một tiến trình tại một thời điểm, khóa nằm trong cache dùng chung)"""
+    if not shared_cache.add(BUILD_LOCK_KEY, 1, BUILD_LOCK_TIMEOUT):
+        return
+
+    def run():
+        try:
+            rebuild_autocomplete_index(refresh_terms=not AutocompleteTerm.objects.exists())
+        except Exception:
+            logger.exception("Không thể dựng snapshot gợi ý tìm kiếm")
+        finally:
+            shared_cache.delete(BUILD_LOCK_KEY)
+            connections.close_all()
+
+    threading.Thread(target=run, name='autocomplete-build', daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Chỉ mục trong tiến trình: snapshot + lớp phủ
+# ---------------------------------------------------------------------------
+
+class AutocompleteIndex:
+    """Snapshot dùng chung (mmap) cộng lớp phủ các mục thay đổi sau snapshot"""
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.synced_at = snapshot.synced_at if snapshot else None
+        # (kind, object_id) -> (text, weight), None nếu mục đã không còn hoạt động
+        self.overlay = {}
+        self._overlay_keys = []
+        self._item_keys = {}
+
+    def apply(self, rows):
+        """Đưa các dòng (kind, object_id, text, weight, is_active) vào lớp phủ"""
+        for kind, object_id, text, weight, is_active in rows:
+            item = (kind, object_id)
+            for key in self._item_keys.pop(item, ()):
+                position = bisect.bisect_left(self._overlay_keys, (key, item))
+                if position < len(self._overlay_keys) and self._overlay_keys[position] == (key, item):
+                    del self._overlay_keys[position]
+            if not is_active:
+                self.overlay[item] = None
+                continue
+            self.overlay[item] = (text, weight)
+            keys = item_keys(text)
+            self._item_keys[item] = keys
+            for key in keys:
+                bisect.insort(self._overlay_keys, (key, item))
+
+    def suggest(self, query, limit=DEFAULT_SUGGESTION_LIMIT):
+        """Danh sách gợi ý (type, id, text) cho chuỗi đang gõ, sắp theo trọng số giảm dần"""
+        prefix = normalize_prefix(query).encode()
+        if not prefix:
+            return []
+
+        candidates = {}
+        position = bisect.bisect_left(self._overlay_keys, (prefix,))
+        while position < len(self._overlay_keys) and self._overlay_keys[position][0].startswith(prefix):
+            item = self._overlay_keys[position][1]
+            entry = self.overlay.get(item)
+            if entry is not None:
+                candidates[item] = (entry[1], entry[0])
+            position += 1
+
+        if self.snapshot is not None:
+            for item_index in self.snapshot.top_items(prefix):
+                kind, object_id, text, weight = self.snapshot.item(item_index)
+                # Mục có trong lớp phủ đã được thay thế (đổi tên, ngừng bán...)
+                if (kind, object_id) not in self.overlay:
+                    candidates.setdefault((kind, object_id), (weight, text))
+
+        ranked = sorted(candidates.items(), key=lambda entry: (-entry[1][0], entry[0]))[:limit]
+        return [
+            {'type': kind, 'id': None if kind == 'query' else object_id, 'text': text}
+            for (kind, object_id), (_, text) in ranked
+        ]
+
+
+def invalidate_autocomplete_index():
+    """Tăng version: các tiến trình đọc lại thay đổi vào lớp phủ ở lần truy vấn sau"""
+    try:
+        shared_cache.incr(AUTOCOMPLETE_VERSION_KEY)
+    except ValueError:
+        shared_cache.set(AUTOCOMPLETE_VERSION_KEY, 2, None)
+
+
+def _get_version():
+    version = shared_cache.get(AUTOCOMPLETE_VERSION_KEY)
+    if version is None:
+        shared_cache.add(AUTOCOMPLETE_VERSION_KEY, 1, None)
+        version = shared_cache.get(AUTOCOMPLETE_VERSION_KEY, 1)
+    return version
+
+
+def _sync_index(index):
+    """Đọc các AutocompleteTerm thay đổi từ lần đồng bộ trước vào lớp phủ"""
+    started = timezone.now()
+    rows = AutocompleteTerm.objects.filter(updated_at__gte=index.synced_at - SYNC_OVERLAP).values_list(
+        'kind', 'object_id', 'text', 'weight', 'is_active'
+    )
+    index.apply(rows.iterator(chunk_size=TERM_BATCH_SIZE))
+    index.synced_at = started
+
+
+def get_autocomplete_index():
+    """Chỉ mục gợi ý của tiến trình (mở snapshot mới nhất và đồng bộ lớp phủ khi cần)"""
+    global _index, _index_version, _checked_at
+
+    version = _get_version()
+    now = time.monotonic()
+    if _index is not None and _index_version == version and now - _checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return _index
+
+    with _lock:
+        if _index is not None and _index_version == version and now - _checked_at < SNAPSHOT_CHECK_INTERVAL:
+            return _index
+
+        path = _current_snapshot_path()
+        index = _index
+        if path is None:
+            # Chưa có snapshot: dựng ở luồng nền, tạm thời không có gợi ý
+            _build_in_background()
+            index = AutocompleteIndex()
+        elif index is None or index.snapshot is None or index.snapshot.path != path:
+            try:
+                index = AutocompleteIndex(AutocompleteSnapshot(path))
+            except (OSError, ValueError):
+                logger.exception("Không thể mở snapshot gợi ý tìm kiếm %s", path)
+                index = _index or AutocompleteIndex()
+
+        if index.snapshot is not None:
+            _sync_index(index)
+            if len(index.overlay) > OVERLAY_REBUILD_THRESHOLD:
+                _build_in_background()
+
+        _index, _index_version, _checked_at = index, version, now
+    return _index
+
+
+def suggest(query, limit=DEFAULT_SUGGESTION_LIMIT):
+    """Gợi ý khi gõ cho chuỗi query"""
+    return get_autocomplete_index().suggest(query, min(limit, MAX_SUGGESTION_LIMIT))
@@ -0,0 +1,151 @@
+# products/cards.py
+"""
+Thẻ sản phẩm (ProductCard) phi chuẩn hóa cho các danh sách.
+
+Các serializer danh sách (sản phẩm, giỏ hàng, đơn hàng, đánh giá) chỉ cần đọc
+product.card (kèm select_related/prefetch_related) thay vì truy vấn ảnh đại
+diện, cửa hàng, danh mục cho từng dòng.
+Thẻ được làm mới khi sản phẩm, hình ảnh, tên cửa hàng/danh mục thay đổi
+(xem products/signals.py) và khi số lượng đã bán được cập nhật.
+"""
+from django.db import transaction
+
+from core.db import bulk_upsert
+from core.derivatives import load_image_derivatives, select_image_url, DEFAULT_IMAGE_FORMAT
+
+from .models import Product, ProductImage, ProductCard
+from .pricing import get_effective_price
+
+# Các trường của Product ảnh hưởng đến nội dung thẻ
+CARD_PRODUCT_FIELDS = {'price', 'sale_price', 'rating', 'sold_count', 'shop', 'shop_id', 'category', 'category_id'}
+
+CARD_BATCH_SIZE = 500
+
+CARD_UPDATE_FIELDS = [
+    'thumbnail_url', 'thumbnail_derivatives', 'effective_price', 'shop_name', 'category_name', 'rating', 'sold_count', 'updated_at'
+]
+
+
+def _get_thumbnails(product_ids):
+    """Ảnh đại diện của từng sản phẩm (ảnh is_thumbnail, nếu không có thì ảnh đầu tiên đã tải lên xong)"""
+    thumbnails = {}
+    images = ProductImage.objects.filter(product_id__in=product_ids, upload_status='ready').order_by(
+        'product_id', '-is_thumbnail', 'id'
+    ).values_list('product_id', 'image_url')
+    for product_id, image_url in images:
+        thumbnails.setdefault(product_id, image_url)
+    return thumbnails
+
+
+def refresh_product_cards(product_ids):
+    """Tính lại thẻ cho một nhóm sản phẩm (ghi đè thẻ cũ)"""
+    product_ids = list(product_ids)
+
+    for start in range(0, len(product_ids), CARD_BATCH_SIZE):
+        batch_ids = product_ids[start:start + CARD_BATCH_SIZE]
+        rows = Product.objects.filter(id__in=batch_ids).values_list(
+            'id', 'price', 'sale_price', 'min_price', 'rating', 'sold_count', 'shop__name', 'category__name'
+        )
+        thumbnails = _get_thumbnails(batch_ids)
+        derivatives = load_image_derivatives(thumbnails.values())
+
+        cards = [
+            ProductCard(
+                product_id=product_id,
+                thumbnail_url=thumbnails.get(product_id),
+                thumbnail_derivatives=derivatives.get(thumbnails.get(product_id), {}),
+                # Giá thấp nhất khách hàng phải trả (gồm giá biến thể), xem products/pricing.py
+                effective_price=min_price if min_price is not None else get_effective_price(price, sale_price),
+                shop_name=shop_name,
+                category_name=category_name,
+                rating=rating or 0,
+                sold_count=sold_count or 0,
+            )
+            for product_id, price, sale_price, min_price, rating, sold_count, shop_name, category_name in rows
+        ]
+        bulk_upsert(ProductCard, cards, unique_fields=['product'], update_fields=CARD_UPDATE_FIELDS)
+
+    # Pool sản phẩm nổi bật chứa payload dựng từ thẻ
+    from .featured import update_featured_pools
+    update_featured_pools(product_ids)
+
+
+def refresh_product_card(product_id):
+    """Tính lại thẻ của một sản phẩm"""
+    refresh_product_cards([product_id])
+
+
+def refresh_product_cards_on_commit(product_ids):
+    """Làm mới thẻ sau khi transaction hiện tại được commit"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: refresh_product_cards(product_ids))
+
+
+def rebuild_product_cards(batch_size=CARD_BATCH_SIZE, stdout=None):
+    """Dựng lại toàn bộ thẻ sản phẩm theo từng lô id"""
+    last_id = 0
+    total = 0
+    while True:
+        batch_ids = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch_ids:
+            break
+        refresh_product_cards(batch_ids)
+        total += len(batch_ids)
+        last_id = batch_ids[-1]
+        if stdout:
+            stdout.write(f"Đã cập nhật thẻ cho {total} sản phẩm")
+    return total
+
+
+def get_product_card(product):
+    """
+    Lấy thẻ của sản phẩm. Nếu sản phẩm chưa có thẻ (dữ liệu cũ chưa được dựng lại)
+    thì tạo ngay để lần đọc sau không phải tính lại
+    """
+    try:
+        return product.card
+    except ProductCard.DoesNotExist:
+        refresh_product_card(product.id)
+        card = ProductCard.objects.filter(product_id=product.id).first()
+        product.card = card
+        return card
+
+
+def get_product_thumbnail(product, size=None, image_format=None):
+    """
+    URL ảnh đại diện của sản phẩm lấy từ thẻ.
+    Nếu có size, chọn ảnh phái sinh phù hợp (xem core.derivatives.select_image_url)
+    """
+    card = get_product_card(product)
+    if not card:
+        return None
+    if size is None:
+        return card.thumbnail_url
+    return select_image_url(card.thumbnail_url, card.thumbnail_derivatives, size, image_format or DEFAULT_IMAGE_FORMAT)
+
+
+def get_card_payload(product, size=None, image_format=None):
+    """
+    Dữ liệu thẻ gọn cho các danh sách phụ (bán chạy, thường được mua cùng...).
+    Queryset cần select_related('card') để không phát sinh truy vấn theo từng dòng
+    """
+    card = get_product_card(product)
+    thumbnail = card.thumbnail_url if card else None
+    if card and size is not None:
+        thumbnail = select_image_url(thumbnail, card.thumbnail_derivatives, size, image_format or DEFAULT_IMAGE_FORMAT)
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'thumbnail': thumbnail,
+        'price': product.price,
+        'effective_price': card.effective_price if card else product.price,
+        'shop_id': product.shop_id,
+        'shop_name': card.shop_name if card else None,
+        'category_name': card.category_name if card else None,
+        'rating': product.rating,
+        'sold_count': product.sold_count,
+    }
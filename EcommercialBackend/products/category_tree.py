@@ -0,0 +1,164 @@
+# products/category_tree.py
+"""
+Chỉ mục cây danh mục dùng chung trong tiến trình.
+
+Toàn bộ cây được dựng từ 2 truy vấn (danh mục + số sản phẩm theo danh mục):
+- duyệt tiền thứ tự (pre-order) để mỗi danh mục ứng với một đoạn liên tiếp
+  [start, end) trong danh sách id, nên "tất cả danh mục con cháu" chỉ là một lát cắt
+- số sản phẩm active được cộng dồn từ lá lên gốc
+
+Chỉ mục được đánh dấu cũ qua một version trong cache dùng chung giữa các worker
+(core/cache.py) khi danh mục thay đổi hoặc khi sản phẩm đổi danh mục/trạng thái; mỗi worker
+dựng lại chỉ mục của mình ở lần đọc sau.
+"""
+import threading
+
+from django.db.models import Count, Q
+
+from core.cache import shared_cache
+from .models import Category, Product
+
+TREE_VERSION_KEY = 'category_tree:version'
+
+# Các trường của Product ảnh hưởng đến số sản phẩm của danh mục
+TREE_PRODUCT_FIELDS = {'category', 'category_id', 'status'}
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+
+
+class CategoryTreeIndex:
+    """Cây danh mục đã được làm phẳng theo thứ tự duyệt tiền thứ tự"""
+
+    def __init__(self, categories, product_counts):
+        self.nodes = {category['id']: category for category in categories}
+        self.children = {category_id: [] for category_id in self.nodes}
+        self.root_ids = []
+        for category in categories:
+            parent_id = category['parent_id']
+            if parent_id in self.nodes:
+                self.children[parent_id].append(category['id'])
+            else:
+                self.root_ids.append(category['id'])
+
+        # Duyệt tiền thứ tự bằng ngăn xếp (tránh giới hạn đệ quy với cây sâu)
+        self.order = []
+        self.intervals = {}
+        stack = [(category_id, False) for category_id in reversed(self.root_ids)]
+        while stack:
+            category_id, visited = stack.pop()
+            if visited:
+                self.intervals[category_id] = (self.intervals[category_id][0], len(self.order))
+                continue
+            self.intervals[category_id] = (len(self.order), None)
+            self.order.append(category_id)
+            stack.append((category_id, True))
+            stack.extend((child_id, False) for child_id in reversed(self.children[category_id]))
+
+        # Số sản phẩm trực tiếp và số sản phẩm active cộng dồn cả cây con
+        self.direct_counts = {category_id: 0 for category_id in self.nodes}
+        self.active_counts = {category_id: 0 for category_id in self.nodes}
+        for category_id, total, active in product_counts:
+            if category_id in self.nodes:
+                self.direct_counts[category_id] = total
+                self.active_counts[category_id] = active
+
+        self.rolled_up_counts = dict(self.active_counts)
+        for category_id in reversed(self.order):
+            parent_id = self.nodes[category_id]['parent_id']
+            if parent_id in self.rolled_up_counts:
+                self.rolled_up_counts[parent_id] += self.rolled_up_counts[category_id]
+
+    def __contains__(self, category_id):
+        return category_id in self.intervals
+
+    def descendant_ids(self, category_id, include_self=True):
+        """Id của danh mục và toàn bộ danh mục con cháu"""
+        category_id = int(category_id)
+        if category_id not in self.intervals:
+            return [category_id] if include_self else []
+        start, end = self.intervals[category_id]
+        return self.order[start if include_self else start + 1:end]
+
+    def product_count(self, category_id):
+        """Số sản phẩm active trong danh mục và toàn bộ cây con"""
+        return self.rolled_up_counts.get(int(category_id), 0)
+
+    def _node_data(self, category_id, status_filter=None):
+        node = self.nodes[category_id]
+        return {
+            'id': node['id'],
+            'name': node['name'],
+            'image': node['image'],
+            'description': node['description'],
+            'status': node['status'],
+            'product_count': self.direct_counts[category_id],
+            'total_product_count': self.rolled_up_counts[category_id],
+            'children': [
+                self._node_data(child_id, status_filter) for child_id in self.children[category_id]
+                if not status_filter or self.nodes[child_id]['status'] == status_filter
+            ],
+        }
+
+    def tree_data(self, status_filter=None):
+        """Dữ liệu dạng cây bắt đầu từ các danh mục gốc (lọc theo trạng thái nếu có)"""
+        return [
+            self._node_data(root_id, status_filter) for root_id in self.root_ids
+            if not status_filter or self.nodes[root_id]['status'] == status_filter
+        ]
+
+    def subtree_data(self, category_id):
+        """Dữ liệu dạng cây của một danh mục"""
+        category_id = int(category_id)
+        if category_id not in self.intervals:
+            return None
+        return self._node_data(category_id)
+
+
+def build_category_tree():
+    """Dựng chỉ mục cây từ cơ sở dữ liệu"""
+    categories = list(
+        Category.objects.order_by('id').values('id', 'parent_id', 'name', 'image', 'description', 'status')
+    )
+    product_counts = Product.objects.values('category_id').annotate(
+        total=Count('id'),
+        active=Count('id', filter=Q(status='active'))
+    ).values_list('category_id', 'total', 'active')
+    return CategoryTreeIndex(categories, product_counts)
+
+
+def _get_version():
+    version = shared_cache.get(TREE_VERSION_KEY)
+    if version is None:
+        shared_cache.add(TREE_VERSION_KEY, 1, None)
+        version = shared_cache.get(TREE_VERSION_KEY, 1)
+    return version
+
+
+def invalidate_category_tree():
+    """Đánh dấu chỉ mục cây là cũ ở mọi tiến trình"""
+    try:
+        shared_cache.incr(TREE_VERSION_KEY)
+    except ValueError:
+        shared_cache.set(TREE_VERSION_KEY, 2, None)
+
+
+def get_category_tree():
+    """Lấy chỉ mục cây của tiến trình hiện tại (dựng lại nếu version đã thay đổi)"""
+    global _index, _index_version
+
+    version = _get_version()
+    if _index is not None and _index_version == version:
+        return _index
+
+    with _lock:
+        if _index is None or _index_version != version:
+            _index = build_category_tree()
+            _index_version = version
+        return _index
+
+
+def get_descendant_ids(category_id, include_self=True):
+    """Id của danh mục và toàn bộ danh mục con cháu"""
+    return get_category_tree().descendant_ids(category_id, include_self)
@@ -0,0 +1,87 @@
+# products/detail_cache.py
+"""
+Cache dữ liệu chi tiết sản phẩm (payload đã render của ProductDetailSerializer).
+
+- Khi chưa có cache: render với select_related/prefetch_related đầy đủ
+- Cache bị xóa đúng theo sản phẩm khi sản phẩm, biến thể, hình ảnh, tag,
+  thuộc tính biến thể, cửa hàng hoặc danh mục thay đổi (xem products/signals.py)
+- Tồn kho, trạng thái, lượt xem... luôn được ghi đè từ dữ liệu mới đọc,
+  nên payload trong cache không bao giờ hiển thị tồn kho cũ
+- Payload nằm trong cache dùng chung (core/cache.py) để lần xóa của worker ghi có hiệu lực
+  với mọi worker
+"""
+from core.cache import shared_cache
+
+from .models import Product, ProductVariant
+
+DETAIL_CACHE_PREFIX = 'product_detail:'
+DETAIL_CACHE_TIMEOUT = 600
+
+# Các trường được đọc mới từ bản ghi Product mỗi lần trả về
+FRESH_PRODUCT_FIELDS = ['stock', 'status', 'view_count', 'sold_count', 'rating']
+
+# Lưu Product chỉ thay đổi các trường này không cần xóa cache (đã được ghi đè khi đọc)
+OVERLAY_ONLY_FIELDS = set(FRESH_PRODUCT_FIELDS) | {'updated_at'}
+
+# Lưu ProductVariant chỉ thay đổi tồn kho không cần xóa cache
+VARIANT_OVERLAY_ONLY_FIELDS = {'stock', 'updated_at'}
+
+
+def _cache_key(product_id):
+    return f"{DETAIL_CACHE_PREFIX}{product_id}"
+
+
+def get_detail_queryset():
+    """Queryset tải trước toàn bộ dữ liệu ProductDetailSerializer cần"""
+    return Product.objects.select_related(
+        'shop', 'shop__owner', 'category'
+    ).prefetch_related(
+        'images',
+        'variants__attribute_values__attribute_value__attribute',
+        'tags__tag',
+    )
+
+
+def render_product_detail(product_id):
+    """Render payload chi tiết sản phẩm (không qua cache)"""
+    from .serializers import ProductDetailSerializer
+
+    product = get_detail_queryset().get(id=product_id)
+    return ProductDetailSerializer(product).data
+
+
+def _overlay_fresh_fields(payload, product):
+    """Ghi đè tồn kho (sản phẩm và từng biến thể) và các bộ đếm bằng dữ liệu mới"""
+    for field in FRESH_PRODUCT_FIELDS:
+        payload[field] = getattr(product, field)
+    payload['rating'] = str(product.rating)
+
+    variant_stock = dict(ProductVariant.objects.filter(product_id=product.id).values_list('id', 'stock'))
+    payload['variants'] = [
+        {**variant, 'stock': variant_stock[variant['id']]}
+        for variant in payload.get('variants', [])
+        if variant['id'] in variant_stock
+    ]
+    return payload
+
+
+def get_product_detail(product):
+    """
+    Payload chi tiết của sản phẩm: lấy từ cache (render nếu chưa có),
+    sau đó ghi đè các trường thay đổi thường xuyên từ bản ghi product vừa đọc
+    """
+    key = _cache_key(product.id)
+    payload = shared_cache.get(key)
+    if payload is None:
+        payload = render_product_detail(product.id)
+        shared_cache.set(key, payload, DETAIL_CACHE_TIMEOUT)
+    return _overlay_fresh_fields(dict(payload), product)
+
+
+def invalidate_product_detail(product_ids):
+    """Xóa cache chi tiết của các sản phẩm"""
+    if isinstance(product_ids, int):
+        product_ids = [product_ids]
+    keys = [_cache_key(product_id) for product_id in product_ids]
+    if keys:
+        shared_cache.delete_many(keys)
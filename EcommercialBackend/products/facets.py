@@ -0,0 +1,248 @@
+# products/facets.py
+"""
+Bộ đếm facet cho trang danh sách sản phẩm theo danh mục.
+
+Mỗi phạm vi danh mục được dựng thành một chỉ mục gọn (lưu trong cache):
+- danh sách id sản phẩm active (vị trí trong danh sách là vị trí bit)
+- một bitmap (số nguyên Python) cho mỗi giá trị facet: cửa hàng, khoảng giá,
+  mức đánh giá, giá trị thuộc tính (màu, kích thước, chất liệu...)
+
+Số lượng của mỗi giá trị facet được tính bằng AND + đếm bit với các bộ lọc
+đang áp dụng (bỏ qua bộ lọc của chính nhóm facet đó), không cần GROUP BY.
+"""
+from bisect import bisect_left
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from .models import Product, VariantAttributeValue
+
+FACET_CACHE_PREFIX = 'product_facets:v2'
+FACET_VERSION_KEY = 'product_facets:version'
+FACET_CACHE_TIMEOUT = 600
+
+# Các trường của Product ảnh hưởng đến facet
+FACET_PRODUCT_FIELDS = {'shop', 'shop_id', 'category', 'category_id', 'price', 'sale_price', 'rating', 'status'}
+
+# Các cột được so sánh trước/sau khi lưu để biết chỉ mục facet có cần làm mới không
+FACET_PRODUCT_COLUMNS = ('shop_id', 'category_id', 'price', 'sale_price', 'rating', 'status')
+
+# Các loại thuộc tính được dùng làm facet / bộ lọc
+ATTRIBUTE_FACET_TYPES = ['color', 'size', 'material']
+
+# Khoảng giá (VND): (min, max) với max=None là không giới hạn
+PRICE_BUCKETS = [
+    (0, 100000),
+    (100000, 200000),
+    (200000, 500000),
+    (500000, 1000000),
+    (1000000, None),
+]
+
+# Mức đánh giá hiển thị trong facet: sản phẩm có rating >= mức
+RATING_BANDS = [4, 3, 2, 1]
+
+
+def _make_bitmap(positions, size):
+    """Dựng bitmap từ danh sách vị trí"""
+    buffer = bytearray((size + 7) // 8)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _full_bitmap(size):
+    return (1 << size) - 1
+
+
+def _get_version():
+    version = cache.get(FACET_VERSION_KEY)
+    if version is None:
+        cache.add(FACET_VERSION_KEY, 1, None)
+        version = cache.get(FACET_VERSION_KEY, 1)
+    return version
+
+
+def invalidate_facets():
+    """Đánh dấu toàn bộ chỉ mục facet là cũ (sẽ được dựng lại khi cần)"""
+    try:
+        cache.incr(FACET_VERSION_KEY)
+    except ValueError:
+        cache.set(FACET_VERSION_KEY, 2, None)
+
+
+def build_facet_index(category_ids=None):
+    """Dựng chỉ mục facet cho một tập danh mục (None = toàn bộ sản phẩm active)"""
+    products = Product.objects.filter(status='active')
+    if category_ids:
+        products = products.filter(category_id__in=category_ids)
+
+    rows = list(products.order_by('id').values_list(
+        'id', 'shop_id', 'shop__name', 'price', 'min_price', 'max_price', 'rating'
+    ))
+    product_ids = [row[0] for row in rows]
+    size = len(product_ids)
+    positions = {product_id: index for index, product_id in enumerate(product_ids)}
+
+    members = {}
+    labels = {}
+
+    def add(key, position, label=None):
+        members.setdefault(key, []).append(position)
+        if label is not None and key not in labels:
+            labels[key] = label
+
+    prices = []
+    ratings = []
+    for index, (product_id, shop_id, shop_name, price, min_price, max_price, rating) in enumerate(rows):
+        # Khoảng giá hiệu lực (products/pricing.py), dữ liệu cũ chưa tính thì dùng giá gốc
+        price = min_price if min_price is not None else price
+        prices.append((float(price), float(max_price if max_price is not None else price)))
+        add(('shop', shop_id), index, {'id': shop_id, 'name': shop_name})
+
+        for bucket_index, (low, high) in enumerate(PRICE_BUCKETS):
+            if price >= low and (high is None or price < high):
+                add(('price', bucket_index), index)
+                break
+
+        rating = rating or Decimal('0')
+        ratings.append(float(rating))
+        for band in RATING_BANDS:
+            if rating >= band:
+                add(('rating', band), index)
+
+    attribute_rows = VariantAttributeValue.objects.filter(
+        variant__product_id__in=products.values('id'),
+        attribute_value__attribute__attribute_type__in=ATTRIBUTE_FACET_TYPES
+    ).values_list(
+        'variant__product_id',
+        'attribute_value__attribute__attribute_type',
+        'attribute_value__value',
+        'attribute_value__display_value',
+        'attribute_value__color_code',
+    ).distinct()
+
+    for product_id, attribute_type, value, display_value, color_code in attribute_rows:
+        position = positions.get(product_id)
+        if position is None:
+            continue
+        add(('attr:' + attribute_type, value.lower()), position, {
+            'value': value,
+            'display_value': display_value,
+            'color_code': color_code,
+        })
+
+    return {
+        'ids': product_ids,
+        'prices': prices,
+        'ratings': ratings,
+        'bitmaps': {key: _make_bitmap(values, size) for key, values in members.items()},
+        'labels': labels,
+    }
+
+
+def get_facet_index(category_id=None, category_ids=None):
+    """Lấy chỉ mục facet từ cache (dựng lại nếu chưa có hoặc đã cũ)"""
+    cache_key = f"{FACET_CACHE_PREFIX}:{_get_version()}:{category_id or 'all'}"
+    index = cache.get(cache_key)
+    if index is None:
+        index = build_facet_index(category_ids)
+        cache.set(cache_key, index, FACET_CACHE_TIMEOUT)
+    return index
+
+
+class FacetCounter:
+    """Tính số lượng facet cho một tập bộ lọc trên một chỉ mục facet"""
+
+    def __init__(self, index):
+        self.index = index
+        self.size = len(index['ids'])
+        self.base = _full_bitmap(self.size)
+        self.group_filters = {}
+
+    def restrict_to_ids(self, product_ids):
+        """Giới hạn theo tập id (ví dụ kết quả tìm kiếm) - không thuộc nhóm facet nào"""
+        ids = self.index['ids']
+        positions = []
+        for product_id in product_ids:
+            position = bisect_left(ids, product_id)
+            if position < self.size and ids[position] == product_id:
+                positions.append(position)
+        self.base &= _make_bitmap(positions, self.size)
+
+    def filter_shop(self, shop_id):
+        """shop_id là số nguyên đã được kiểm tra ở view"""
+        self.group_filters['shop'] = self.index['bitmaps'].get(('shop', shop_id), 0)
+
+    def filter_price(self, min_price=None, max_price=None):
+        # Sản phẩm có khoảng giá hiệu lực giao với khoảng lọc
+        positions = [
+            position for position, (low, high) in enumerate(self.index['prices'])
+            if (min_price is None or high >= min_price) and (max_price is None or low <= max_price)
+        ]
+        self.group_filters['price'] = _make_bitmap(positions, self.size)
+
+    def filter_rating(self, min_rating):
+        # Đúng ngưỡng của bộ lọc danh sách (rating >= min_rating), không làm tròn về mức facet
+        positions = [position for position, rating in enumerate(self.index['ratings']) if rating >= min_rating]
+        self.group_filters['rating'] = _make_bitmap(positions, self.size)
+
+    def filter_attribute(self, attribute_type, values):
+        bitmap = 0
+        for value in values:
+            bitmap |= self.index['bitmaps'].get(('attr:' + attribute_type, value.lower()), 0)
+        self.group_filters['attr:' + attribute_type] = bitmap
+
+    def _mask(self, exclude_group=None):
+        mask = self.base
+        for group, bitmap in self.group_filters.items():
+            if group != exclude_group:
+                mask &= bitmap
+        return mask
+
+    def _count(self, key, mask):
+        return (self.index['bitmaps'].get(key, 0) & mask).bit_count()
+
+    def counts(self):
+        """Trả về số lượng của từng giá trị facet dưới các bộ lọc hiện tại"""
+        bitmaps = self.index['bitmaps']
+        labels = self.index['labels']
+
+        shop_mask = self._mask('shop')
+        shops = [
+            {**labels[key], 'count': self._count(key, shop_mask)}
+            for key in bitmaps if key[0] == 'shop'
+        ]
+        shops = sorted([shop for shop in shops if shop['count']], key=lambda shop: -shop['count'])
+
+        price_mask = self._mask('price')
+        price_ranges = [
+            {'min_price': low, 'max_price': high, 'count': self._count(('price', bucket_index), price_mask)}
+            for bucket_index, (low, high) in enumerate(PRICE_BUCKETS)
+        ]
+
+        rating_mask = self._mask('rating')
+        ratings = [
+            {'min_rating': band, 'count': self._count(('rating', band), rating_mask)}
+            for band in RATING_BANDS
+        ]
+
+        attributes = {}
+        for attribute_type in ATTRIBUTE_FACET_TYPES:
+            group = 'attr:' + attribute_type
+            mask = self._mask(group)
+            values = [
+                {**labels[key], 'count': self._count(key, mask)}
+                for key in bitmaps if key[0] == group
+            ]
+            attributes[attribute_type] = sorted(
+                [value for value in values if value['count']], key=lambda value: -value['count']
+            )
+
+        return {
+            'total': self._mask().bit_count(),
+            'shops': shops,
+            'price_ranges': price_ranges,
+            'ratings': ratings,
+            'attributes': attributes,
+        }
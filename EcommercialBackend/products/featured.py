@@ -0,0 +1,204 @@
+# products/featured.py
+"""
+Pool sản phẩm nổi bật dựng sẵn trong cache.
+
+Mỗi pool (toàn bộ sản phẩm hoặc cây con của một danh mục) gồm danh sách id đã
+xếp hạng theo (rating, sold_count) cùng payload ProductSerializer đã render sẵn.
+Mỗi request chỉ lấy pool từ cache rồi chọn ngẫu nhiên, không truy vấn DB.
+
+- Pool được dựng lại định kỳ (hết hạn mềm sau FEATURED_POOL_REFRESH giây,
+  một request dựng lại trong khi các request khác vẫn dùng pool cũ)
+- Khi rating, sold_count, trạng thái... của sản phẩm thay đổi, các pool đã dựng
+  được cập nhật tăng dần (chỉ render lại các sản phẩm thay đổi), xem products/signals.py
+"""
+import random
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from core.derivatives import select_image_url
+
+from .models import Product
+from .category_tree import get_category_tree
+
+FEATURED_POOL_PREFIX = 'featured_pool:'
+FEATURED_REGISTRY_KEY = 'featured_pool:registry'
+FEATURED_LOCK_PREFIX = 'featured_pool:lock:'
+
+# Số sản phẩm ứng viên trong mỗi pool (request chọn trong top limit * 3)
+FEATURED_POOL_SIZE = 150
+MAX_FEATURED_LIMIT = FEATURED_POOL_SIZE // 3
+# Hết hạn mềm: sau thời gian này pool được dựng lại
+FEATURED_POOL_REFRESH = 300
+# Hết hạn thật trong cache
+FEATURED_POOL_TIMEOUT = 3600
+FEATURED_LOCK_TIMEOUT = 30
+
+ALL_SCOPE = 'all'
+
+# Lưu Product chỉ thay đổi các trường này không cần cập nhật pool
+FEATURED_IGNORED_FIELDS = {'view_count', 'stock', 'updated_at'}
+
+
+def _pool_key(scope):
+    return f"{FEATURED_POOL_PREFIX}{scope}"
+
+
+def _rank(product):
+    return [float(product.rating or 0), product.sold_count or 0, product.id]
+
+
+def _featured_queryset():
+    return Product.objects.filter(status='active').select_related('card')
+
+
+def _render(products):
+    """Payload đã render và thông tin ảnh đại diện (để chọn ảnh phái sinh khi trả về)"""
+    from .serializers import ProductSerializer
+
+    payloads = {}
+    thumbnails = {}
+    for product, data in zip(products, ProductSerializer(products, many=True).data):
+        payloads[product.id] = data
+        card = getattr(product, 'card', None)
+        thumbnails[product.id] = (
+            (card.thumbnail_url, card.thumbnail_derivatives) if card else (None, {})
+        )
+    return payloads, thumbnails
+
+
+def _scope_category_ids(scope):
+    """Id danh mục thuộc pool (None: toàn bộ sản phẩm)"""
+    if scope == ALL_SCOPE:
+        return None
+    return set(get_category_tree().descendant_ids(scope))
+
+
+def build_featured_pool(scope=ALL_SCOPE):
+    """Dựng pool: một truy vấn lấy top sản phẩm (kèm thẻ), render payload và lưu cache"""
+    products = _featured_queryset()
+    category_ids = _scope_category_ids(scope)
+    if category_ids is not None:
+        products = products.filter(category_id__in=category_ids)
+    products = list(products.order_by('-rating', '-sold_count', '-id')[:FEATURED_POOL_SIZE])
+
+    payloads, thumbnails = _render(products)
+    entry = {
+        'ids': [product.id for product in products],
+        'ranks': {product.id: _rank(product) for product in products},
+        'payloads': payloads,
+        'thumbnails': thumbnails,
+        'expires_at': time.time() + FEATURED_POOL_REFRESH,
+    }
+    cache.set(_pool_key(scope), entry, FEATURED_POOL_TIMEOUT)
+    _register_scope(scope)
+    return entry
+
+
+def _register_scope(scope):
+    registry = cache.get(FEATURED_REGISTRY_KEY) or set()
+    if scope not in registry:
+        cache.set(FEATURED_REGISTRY_KEY, registry | {scope}, None)
+
+
+def get_featured_pool(scope=ALL_SCOPE):
+    """
+    Lấy pool từ cache; dựng lại nếu chưa có, hoặc nếu đã hết hạn mềm và
+    request này giành được khóa (các request khác tiếp tục dùng pool cũ)
+    """
+    entry = cache.get(_pool_key(scope))
+    if entry is None:
+        return build_featured_pool(scope)
+    if entry['expires_at'] <= time.time() and cache.add(f"{FEATURED_LOCK_PREFIX}{scope}", 1, FEATURED_LOCK_TIMEOUT):
+        try:
+            return build_featured_pool(scope)
+        finally:
+            cache.delete(f"{FEATURED_LOCK_PREFIX}{scope}")
+    return entry
+
+
+def sample_featured_products(limit, scope=ALL_SCOPE, size=None, image_format=None):
+    """
+    Chọn ngẫu nhiên `limit` sản phẩm trong top limit * 3 của pool,
+    ảnh đại diện được chọn theo kích thước/định dạng yêu cầu
+    """
+    limit = min(limit, MAX_FEATURED_LIMIT)
+    entry = get_featured_pool(scope)
+    candidates = entry['ids'][:limit * 3]
+    selected = candidates if len(candidates) <= limit else random.sample(candidates, limit)
+
+    result = []
+    for product_id in selected:
+        data = dict(entry['payloads'][product_id])
+        if size is not None:
+            thumbnail_url, derivatives = entry['thumbnails'][product_id]
+            data['thumbnail'] = select_image_url(thumbnail_url, derivatives, size, image_format)
+        result.append(data)
+    return result
+
+
+def update_featured_pools(product_ids):
+    """
+    Cập nhật tăng dần các pool đã dựng cho các sản phẩm đã thay đổi:
+    bỏ sản phẩm khỏi pool, rồi chèn lại theo hạng mới nếu vẫn đủ điều kiện
+    """
+    product_ids = set(product_ids)
+    registry = cache.get(FEATURED_REGISTRY_KEY)
+    if not product_ids or not registry:
+        return
+
+    keys = {_pool_key(scope): scope for scope in registry}
+    entries = cache.get_many(list(keys))
+    if not entries:
+        return
+
+    products = list(_featured_queryset().filter(id__in=product_ids))
+    payloads, thumbnails = _render(products)
+
+    for key, entry in entries.items():
+        category_ids = _scope_category_ids(keys[key])
+        ranks = {
+            product_id: rank for product_id, rank in entry['ranks'].items()
+            if product_id not in product_ids
+        }
+        for product in products:
+            if category_ids is None or product.category_id in category_ids:
+                ranks[product.id] = _rank(product)
+
+        ids = sorted(ranks, key=lambda product_id: ranks[product_id], reverse=True)[:FEATURED_POOL_SIZE]
+        for product in products:
+            if product.id in ranks:
+                entry['payloads'][product.id] = payloads[product.id]
+                entry['thumbnails'][product.id] = thumbnails[product.id]
+
+        # Pool đầy bị hụt (sản phẩm bị loại) thì lấy thêm các ứng viên kế tiếp ngoài pool
+        if len(entry['ids']) >= FEATURED_POOL_SIZE and len(ids) < FEATURED_POOL_SIZE:
+            backfill = _backfill_candidates(category_ids, ids, FEATURED_POOL_SIZE - len(ids))
+            backfill_payloads, backfill_thumbnails = _render(backfill)
+            for product in backfill:
+                ranks[product.id] = _rank(product)
+                ids.append(product.id)
+            entry['payloads'].update(backfill_payloads)
+            entry['thumbnails'].update(backfill_thumbnails)
+        kept = set(ids)
+        for field in ('payloads', 'thumbnails'):
+            entry[field] = {product_id: value for product_id, value in entry[field].items() if product_id in kept}
+        entry['ids'] = ids
+        entry['ranks'] = {product_id: ranks[product_id] for product_id in ids}
+        cache.set(key, entry, FEATURED_POOL_TIMEOUT)
+
+
+def _backfill_candidates(category_ids, exclude_ids, count):
+    """Các sản phẩm xếp hạng cao nhất của pool ngoài exclude_ids (đứng sau toàn bộ pool hiện tại)"""
+    products = _featured_queryset().exclude(id__in=exclude_ids)
+    if category_ids is not None:
+        products = products.filter(category_id__in=category_ids)
+    return list(products.order_by('-rating', '-sold_count', '-id')[:count])
+
+
+def update_featured_pools_on_commit(product_ids):
+    """Cập nhật pool sau khi transaction hiện tại được commit"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: update_featured_pools(product_ids))
@@ -0,0 +1,67 @@
+# products/images.py
+"""
+Tạo bản ghi ProductImage từ file tải lên qua core.media.
+
+- Chế độ đồng bộ: các file được tải lên song song, bản ghi được tạo với URL cuối cùng
+- Chế độ bất đồng bộ: bản ghi được tạo ngay với upload_status='pending' (image_url rỗng),
+  URL được gắn vào khi luồng nền tải lên xong (lỗi -> upload_status='failed')
+"""
+import logging
+
+from core.media import media_service
+
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+
+def product_image_folder(shop_id):
+    return f"shops/{shop_id}/products"
+
+
+def prepare_product_images(shop_id, files, async_uploads=None):
+    """Tải lên ảnh sản phẩm của cửa hàng (chế độ bất đồng bộ: tải lên nền sau khi commit), trả về MediaBatch"""
+    return media_service.prepare(files, product_image_folder(shop_id), async_uploads=async_uploads)
+
+
+def create_product_images(product, batch, start_order=0, thumbnail_index=None):
+    """
+    Tạo bản ghi ảnh cho một lô đã chuẩn bị.
+    thumbnail_index: vị trí ảnh trong lô được đặt làm ảnh đại diện (None nếu không có)
+    """
+    images = []
+    for index in range(len(batch)):
+        images.append(ProductImage.objects.create(
+            product=product,
+            image_url='' if batch.pending else batch.urls[index],
+            upload_status='pending' if batch.pending else 'ready',
+            is_thumbnail=index == thumbnail_index,
+            display_order=start_order + index
+        ))
+
+    if batch.pending:
+        image_ids = [image.id for image in images]
+        batch.submit(
+            lambda index, url: _attach_uploaded_image(image_ids[index], url),
+            lambda index, error: _mark_upload_failed(image_ids[index])
+        )
+    return images
+
+
+def _attach_uploaded_image(image_id, url):
+    """Gắn URL đã tải lên vào ảnh (save để làm mới thẻ sản phẩm và cache chi tiết)"""
+    image = ProductImage.objects.filter(id=image_id).first()
+    if image is None:
+        # Ảnh đã bị xóa trong lúc đang tải lên
+        logger.info("Ảnh sản phẩm %s đã bị xóa trước khi tải lên xong", image_id)
+        return
+    image.image_url = url
+    image.upload_status = 'ready'
+    image.save(update_fields=['image_url', 'upload_status'])
+
+
+def _mark_upload_failed(image_id):
+    image = ProductImage.objects.filter(id=image_id).first()
+    if image is not None:
+        image.upload_status = 'failed'
+        image.save(update_fields=['upload_status'])
@@ -0,0 +1,549 @@
+# products/importer.py
+"""
+Nhập sản phẩm hàng loạt cho cửa hàng từ file CSV hoặc JSONL.
+
+File được đọc dạng luồng, gom thành từng lô sản phẩm (CHUNK_SIZE). Mỗi lô:
+- kiểm tra dữ liệu từng dòng (lỗi được ghi lại theo số dòng, dòng lỗi bị bỏ qua)
+- tra cứu Attribute / AttributeValue / Tag theo lô (có cache giữa các lô)
+- ghi Product, ProductImage, ProductVariant, VariantAttributeValue, ProductTag
+  bằng bulk_create trong một transaction
+
+Bộ nhớ sử dụng chỉ phụ thuộc kích thước lô, không phụ thuộc kích thước file.
+
+Định dạng CSV: mỗi dòng là một biến thể, các dòng liên tiếp có cùng product_key
+(hoặc slug/name nếu không có) thuộc cùng một sản phẩm:
+    product_key,name,category_id,price,sale_price,product_type,status,featured,
+    short_description,description,tags,images,sku,variant_price,variant_sale_price,
+    stock,variant_image_url,attr:color,attr:size,...
+    (tags và images phân tách bằng "|")
+
+Định dạng JSONL: mỗi dòng là một sản phẩm
+    {"name": ..., "category_id": ..., "price": ..., "tags": [...], "images": [...],
+     "variants": [{"sku": ..., "price": ..., "stock": ..., "attributes": {"color": "red"}}]}
+"""
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction, connections
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import (
+    Product, ProductImage, ProductVariant, VariantAttributeValue, Tag, ProductTag,
+    Category, ProductImportJob
+)
+from .search import index_products
+from .cards import refresh_product_cards
+from .similar import refresh_feature_vectors
+from .shop_stats import invalidate_shop_stats
+from .autocomplete import refresh_autocomplete_terms
+from .facets import invalidate_facets
+from .category_tree import invalidate_category_tree
+from .variant_writer import AttributeResolver
+from .variant_index import compute_signature
+from .pricing import resolve_variant_price, get_price_range
+
+CHUNK_SIZE = 500
+BULK_BATCH_SIZE = 1000
+# Số lỗi tối đa được lưu lại chi tiết (các lỗi sau đó chỉ được đếm)
+MAX_REPORTED_ERRORS = 1000
+
+ATTRIBUTE_COLUMN_PREFIX = 'attr:'
+LIST_SEPARATOR = '|'
+
+PRODUCT_TYPES = {choice for choice, _ in Product.PRODUCT_TYPE_CHOICES}
+PRODUCT_STATUSES = {choice for choice, _ in Product.STATUS_CHOICES}
+
+logger = logging.getLogger(__name__)
+
+
+class ImportRowError(Exception):
+    """Lỗi dữ liệu của một sản phẩm trong file nhập"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _split_list(value):
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    if not value:
+        return []
+    return [item.strip() for item in str(value).split(LIST_SEPARATOR) if item.strip()]
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def iter_csv_products(stream):
+    """Đọc CSV dạng luồng, gom các dòng liên tiếp của cùng sản phẩm. Trả về (số dòng, dict sản phẩm)"""
+    reader = csv.DictReader(stream)
+    current_key = None
+    current = None
+    current_line = None
+
+    for row in reader:
+        line_no = reader.line_num
+        row = {(key or '').strip(): (value.strip() if isinstance(value, str) else value) for key, value in row.items()}
+        key = row.get('product_key') or row.get('slug') or row.get('name')
+
+        if current is None or key != current_key:
+            if current is not None:
+                yield current_line, current
+            current_key = key
+            current_line = line_no
+            current = {
+                'name': row.get('name'),
+                'slug': row.get('slug'),
+                'category_id': row.get('category_id'),
+                'price': row.get('price'),
+                'sale_price': row.get('sale_price'),
+                'product_type': row.get('product_type'),
+                'status': row.get('status'),
+                'featured': row.get('featured'),
+                'short_description': row.get('short_description'),
+                'description': row.get('description'),
+                'stock': row.get('product_stock'),
+                'tags': _split_list(row.get('tags')),
+                'images': _split_list(row.get('images')),
+                'variants': [],
+            }
+
+        if row.get('sku') or any(column.startswith(ATTRIBUTE_COLUMN_PREFIX) and value
+                                 for column, value in row.items()):
+            current['variants'].append({
+                'sku': row.get('sku'),
+                'price': row.get('variant_price'),
+                'sale_price': row.get('variant_sale_price'),
+                'stock': row.get('stock'),
+                'image_url': row.get('variant_image_url'),
+                'attributes': {
+                    column[len(ATTRIBUTE_COLUMN_PREFIX):]: value
+                    for column, value in row.items()
+                    if column.startswith(ATTRIBUTE_COLUMN_PREFIX) and value
+                },
+            })
+
+    if current is not None:
+        yield current_line, current
+
+
+def iter_jsonl_products(stream):
+    """Đọc JSONL dạng luồng. Dòng không phải JSON hợp lệ được trả về dưới dạng lỗi"""
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ImportRowError({'line': f'JSON không hợp lệ: {e.msg}'})
+            continue
+        if not isinstance(data, dict):
+            yield line_no, ImportRowError({'line': 'Mỗi dòng phải là một đối tượng JSON'})
+            continue
+        yield line_no, data
+
+
+def open_text_stream(binary_file):
+    """Bọc file nhị phân (file upload hoặc file trên đĩa) thành luồng văn bản UTF-8"""
+    return io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+
+
+class ProductImporter:
+    """Nhập sản phẩm cho một cửa hàng theo từng lô"""
+
+    def __init__(self, shop, chunk_size=CHUNK_SIZE, progress_callback=None):
+        self.shop = shop
+        self.chunk_size = chunk_size
+        self.progress_callback = progress_callback
+        self.category_ids = set(Category.objects.values_list('id', flat=True))
+        # Cache tra cứu giữa các lô
+        self.attribute_resolver = AttributeResolver(batch_size=BULK_BATCH_SIZE)
+        self.tag_ids = {}
+        self.slug_prefix = f"{shop.id}-{int(time.time())}"
+        self.stats = {
+            'processed_rows': 0,
+            'created_products': 0,
+            'created_variants': 0,
+            'failed_rows': 0,
+        }
+        self.errors = []
+
+    # ------------------------------------------------------------------
+    # Đọc và kiểm tra dữ liệu
+    # ------------------------------------------------------------------
+    def run(self, stream, file_format):
+        """Nhập toàn bộ file, trả về thống kê"""
+        if file_format == 'jsonl':
+            products = iter_jsonl_products(stream)
+        else:
+            products = iter_csv_products(stream)
+
+        chunk = []
+        for line_no, data in products:
+            chunk.append((line_no, data))
+            if len(chunk) >= self.chunk_size:
+                self._process_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._process_chunk(chunk)
+
+        self._after_import()
+        return self.stats
+
+    def _add_error(self, line_no, errors):
+        self.stats['failed_rows'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': line_no, 'errors': errors})
+
+    @staticmethod
+    def _parse_decimal(value, field, errors, required=False):
+        if value in (None, ''):
+            if required:
+                errors[field] = 'Trường này là bắt buộc'
+            return None
+        try:
+            number = Decimal(str(value))
+        except (InvalidOperation, ValueError):
+            errors[field] = 'Giá trị số không hợp lệ'
+            return None
+        if number < 0:
+            errors[field] = 'Giá trị không được âm'
+            return None
+        return number
+
+    @staticmethod
+    def _parse_int(value, field, errors, default=0):
+        if value in (None, ''):
+            return default
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            errors[field] = 'Số nguyên không hợp lệ'
+            return default
+
+    def _validate(self, line_no, data, index):
+        """Chuẩn hóa và kiểm tra một sản phẩm, ném ImportRowError nếu dữ liệu lỗi"""
+        errors = {}
+
+        name = (data.get('name') or '').strip()
+        if not name:
+            errors['name'] = 'Tên sản phẩm là bắt buộc'
+        elif len(name) > 255:
+            errors['name'] = 'Tên sản phẩm tối đa 255 ký tự'
+
+        category_id = self._parse_int(data.get('category_id'), 'category_id', errors, default=None)
+        if category_id is None and 'category_id' not in errors:
+            errors['category_id'] = 'Danh mục là bắt buộc'
+        elif category_id is not None and category_id not in self.category_ids:
+            errors['category_id'] = 'Danh mục không tồn tại'
+
+        price = self._parse_decimal(data.get('price'), 'price', errors, required=True)
+        sale_price = self._parse_decimal(data.get('sale_price'), 'sale_price', errors)
+        if price is not None and sale_price and sale_price > price:
+            errors['sale_price'] = 'Giá khuyến mãi phải nhỏ hơn giá gốc'
+
+        product_type = data.get('product_type') or 'clothing'
+        if product_type not in PRODUCT_TYPES:
+            errors['product_type'] = f'Loại sản phẩm phải là một trong {sorted(PRODUCT_TYPES)}'
+
+        product_status = data.get('status') or 'active'
+        if product_status not in PRODUCT_STATUSES:
+            errors['status'] = f'Trạng thái phải là một trong {sorted(PRODUCT_STATUSES)}'
+
+        slug = (data.get('slug') or '').strip()
+        if not slug:
+            slug = f"{slugify(name)[:200]}-{self.slug_prefix}-{self.stats['processed_rows'] + index}"
+        elif len(slug) > 255:
+            errors['slug'] = 'Slug tối đa 255 ký tự'
+
+        variants = []
+        seen_skus = set()
+        raw_variants = data.get('variants') or []
+        if not isinstance(raw_variants, list):
+            errors['variants'] = 'variants phải là một danh sách'
+            raw_variants = []
+
+        for position, variant_data in enumerate(raw_variants):
+            if not isinstance(variant_data, dict):
+                errors[f'variants[{position}]'] = 'Biến thể không hợp lệ'
+                continue
+            variant_errors = {}
+            sku = (str(variant_data.get('sku') or '')).strip() or f"{slug}-{position + 1}"
+            if sku in seen_skus:
+                variant_errors['sku'] = f'SKU {sku} bị trùng trong sản phẩm'
+            seen_skus.add(sku)
+
+            variant_price = self._parse_decimal(variant_data.get('price'), 'price', variant_errors)
+            variant_sale_price = self._parse_decimal(variant_data.get('sale_price'), 'sale_price', variant_errors)
+            stock = self._parse_int(variant_data.get('stock'), 'stock', variant_errors)
+
+            attributes = variant_data.get('attributes') or {}
+            if isinstance(attributes, list):
+                attributes = {item.get('name'): item.get('value') for item in attributes if isinstance(item, dict)}
+            if not isinstance(attributes, dict):
+                variant_errors['attributes'] = 'attributes phải là một đối tượng {tên: giá trị}'
+                attributes = {}
+            for attr_name, attr_value in attributes.items():
+                if len(str(attr_name)) > 50 or len(str(attr_value)) > 100:
+                    variant_errors['attributes'] = 'Tên thuộc tính tối đa 50 ký tự, giá trị tối đa 100 ký tự'
+
+            if variant_errors:
+                errors[f'variants[{position}]'] = variant_errors
+                continue
+
+            variant_price = variant_price if variant_price is not None else price
+            variant_sale_price = variant_sale_price if variant_sale_price is not None else sale_price
+            variants.append({
+                'sku': sku[:100],
+                'price': variant_price,
+                'sale_price': variant_sale_price,
+                'effective_price': resolve_variant_price(variant_price, variant_sale_price, price, sale_price),
+                'stock': stock,
+                'image_url': variant_data.get('image_url') or None,
+                'attributes': {
+                    str(attr_name).strip(): str(attr_value).strip()
+                    for attr_name, attr_value in attributes.items()
+                    if attr_name and attr_value not in (None, '')
+                },
+            })
+
+        stock = self._parse_int(data.get('stock'), 'stock', errors, default=None)
+        if stock is None:
+            stock = sum(variant['stock'] for variant in variants)
+
+        if errors:
+            raise ImportRowError(errors)
+
+        min_price, max_price = get_price_range(price, sale_price, [variant['effective_price'] for variant in variants])
+        return {
+            'line': line_no,
+            'product': Product(
+                shop=self.shop,
+                category_id=category_id,
+                name=name,
+                slug=slug,
+                description=data.get('description') or None,
+                short_description=(data.get('short_description') or None),
+                price=price,
+                sale_price=sale_price,
+                min_price=min_price,
+                max_price=max_price,
+                stock=stock,
+                product_type=product_type,
+                status=product_status,
+                featured=_parse_bool(data.get('featured')),
+            ),
+            'images': _split_list(data.get('images')),
+            'tags': _split_list(data.get('tags')),
+            'variants': variants,
+        }
+
+    # ------------------------------------------------------------------
+    # Ghi theo lô
+    # ------------------------------------------------------------------
+    def _process_chunk(self, chunk):
+        """Kiểm tra và ghi một lô sản phẩm"""
+        valid = []
+        for index, (line_no, data) in enumerate(chunk):
+            try:
+                if isinstance(data, ImportRowError):
+                    raise data
+                valid.append(self._validate(line_no, data, index))
+            except ImportRowError as e:
+                self._add_error(line_no, e.errors)
+
+        valid = self._check_uniqueness(valid)
+
+        if valid:
+            try:
+                with transaction.atomic():
+                    product_ids = self._write_chunk(valid)
+            except Exception as e:
+                for item in valid:
+                    self._add_error(item['line'], {'database': str(e)})
+            else:
+                self.stats['created_products'] += len(valid)
+                self.stats['created_variants'] += sum(len(item['variants']) for item in valid)
+                # Sản phẩm đã được tạo: lỗi khi cập nhật chỉ mục không làm các dòng này thành lỗi
+                try:
+                    self._after_chunk(product_ids)
+                except Exception:
+                    logger.exception("Không thể cập nhật chỉ mục cho %s sản phẩm vừa nhập", len(product_ids))
+
+        self.stats['processed_rows'] += len(chunk)
+        if self.progress_callback:
+            self.progress_callback(self.stats, self.errors)
+
+    def _check_uniqueness(self, items):
+        """Loại các sản phẩm trùng slug (trong file hoặc đã có trong DB)"""
+        slugs = [item['product'].slug for item in items]
+        existing = set(Product.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+
+        unique_items = []
+        seen = set()
+        for item in items:
+            slug = item['product'].slug
+            if slug in existing or slug in seen:
+                self._add_error(item['line'], {'slug': f'Slug {slug} đã tồn tại'})
+                continue
+            seen.add(slug)
+            unique_items.append(item)
+        return unique_items
+
+    def _resolve_attributes(self, items):
+        """Tra cứu/tạo Attribute và AttributeValue theo lô, trả về map (tên, giá trị) -> id"""
+        specs = {}
+        for item in items:
+            for variant in item['variants']:
+                for name, value in variant['attributes'].items():
+                    specs.setdefault(name, {'type': None, 'values': {}})['values'][value] = None
+        return self.attribute_resolver.resolve(specs)
+
+    def _resolve_tags(self, items):
+        """Tra cứu/tạo Tag theo lô"""
+        names = {name for item in items for name in item['tags']} - set(self.tag_ids)
+        if names:
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True,
+                                    batch_size=BULK_BATCH_SIZE)
+            self.tag_ids.update(Tag.objects.filter(name__in=names).values_list('name', 'id'))
+
+    def _write_chunk(self, items):
+        """Ghi một lô đã kiểm tra (chạy trong transaction), trả về id sản phẩm đã tạo"""
+        # bulk_create trên MySQL không trả về id nên đọc lại id theo khóa tự nhiên (slug, sku)
+        Product.objects.bulk_create([item['product'] for item in items], batch_size=BULK_BATCH_SIZE)
+        product_ids = dict(Product.objects.filter(
+            slug__in=[item['product'].slug for item in items]
+        ).values_list('slug', 'id'))
+
+        attribute_value_map = self._resolve_attributes(items)
+        images = []
+        variants = []
+        for item in items:
+            product_id = product_ids[item['product'].slug]
+            item['product_id'] = product_id
+            images.extend(
+                ProductImage(product_id=product_id, image_url=image_url,
+                             is_thumbnail=index == 0, display_order=index)
+                for index, image_url in enumerate(item['images'])
+            )
+            variants.extend(
+                ProductVariant(product_id=product_id, sku=variant['sku'], price=variant['price'],
+                               sale_price=variant['sale_price'], effective_price=variant['effective_price'],
+                               stock=variant['stock'],
+                               image_url=variant['image_url'],
+                               signature=compute_signature(
+                                   attribute_value_map[pair] for pair in variant['attributes'].items()
+                               ))
+                for variant in item['variants']
+            )
+        ProductImage.objects.bulk_create(images, batch_size=BULK_BATCH_SIZE)
+        ProductVariant.objects.bulk_create(variants, batch_size=BULK_BATCH_SIZE)
+
+        variant_ids = {
+            (product_id, sku): variant_id
+            for variant_id, product_id, sku in ProductVariant.objects.filter(
+                product_id__in=product_ids.values()
+            ).values_list('id', 'product_id', 'sku')
+        }
+
+        variant_attribute_values = [
+            VariantAttributeValue(
+                variant_id=variant_ids[(item['product_id'], variant['sku'])],
+                attribute_value_id=attribute_value_map[(name, value)]
+            )
+            for item in items for variant in item['variants'] for name, value in variant['attributes'].items()
+        ]
+        VariantAttributeValue.objects.bulk_create(variant_attribute_values, batch_size=BULK_BATCH_SIZE,
+                                                  ignore_conflicts=True)
+
+        self._resolve_tags(items)
+        product_tags = [
+            ProductTag(product_id=item['product_id'], tag_id=self.tag_ids[name])
+            for item in items for name in set(item['tags'])
+        ]
+        ProductTag.objects.bulk_create(product_tags, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+        return list(product_ids.values())
+
+    def _after_chunk(self, product_ids):
+        """
+        bulk_create không phát signal nên cập nhật chỉ mục tìm kiếm, thẻ sản phẩm, vector tương tự
+        và mục gợi ý thủ công
+        """
+        index_products(product_ids)
+        refresh_product_cards(product_ids)
+        refresh_feature_vectors(product_ids)
+        refresh_autocomplete_terms('product', product_ids)
+
+    def _after_import(self):
+        if self.stats['created_products']:
+            invalidate_facets()
+            invalidate_category_tree()
+            invalidate_shop_stats([self.shop.id])
+
+
+def detect_format(file_name, requested_format=None):
+    """Xác định định dạng file từ tham số hoặc phần mở rộng"""
+    if requested_format in ('csv', 'jsonl'):
+        return requested_format
+    if file_name and file_name.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def run_import_job(job_id, path):
+    """Chạy một ProductImportJob từ file tạm trên đĩa (dùng trong luồng nền)"""
+    job = ProductImportJob.objects.select_related('shop').get(id=job_id)
+    ProductImportJob.objects.filter(id=job_id).update(status='running', started_at=timezone.now())
+
+    def save_progress(stats, errors):
+        ProductImportJob.objects.filter(id=job_id).update(errors=errors, **stats)
+
+    try:
+        importer = ProductImporter(job.shop, progress_callback=save_progress)
+        with open(path, 'rb') as binary_file:
+            stats = importer.run(open_text_stream(binary_file), job.file_format)
+        ProductImportJob.objects.filter(id=job_id).update(
+            status='completed',
+            errors=importer.errors,
+            message=f"Đã tạo {stats['created_products']} sản phẩm, {stats['failed_rows']} dòng lỗi",
+            finished_at=timezone.now(),
+            **stats
+        )
+    except Exception as e:
+        logger.exception("Nhập sản phẩm thất bại (job %s)", job_id)
+        ProductImportJob.objects.filter(id=job_id).update(
+            status='failed', message=str(e), finished_at=timezone.now()
+        )
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        connections.close_all()
+
+
+def start_import_job(job, uploaded_file):
+    """Lưu file upload ra file tạm (đọc theo từng khối) và chạy job trong luồng nền"""
+    suffix = '.jsonl' if job.file_format == 'jsonl' else '.csv'
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, prefix='product-import-') as temp_file:
+        for chunk in uploaded_file.chunks():
+            temp_file.write(chunk)
+        path = temp_file.name
+
+    worker = threading.Thread(
+        target=run_import_job, args=(job.id, path), name=f'product-import-{job.id}', daemon=True
+    )
+    worker.start()
+    return worker
@@ -0,0 +1,137 @@
+# products/leaderboard.py
+"""
+Bảng xếp hạng sản phẩm bán chạy (toàn sàn hoặc theo cửa hàng).
+
+- Số lượng bán được cộng dồn theo ngày đặt hàng trong ProductSalesDaily, cập nhật
+  tăng dần mỗi khi trạng thái mục đơn hàng chuyển vào/ra nhóm "đã bán"
+  (giao hàng, đã nhận, đã đánh giá) - đơn bị hủy/trả hàng không được tính.
+  Việc ghi nhận thay đổi trạng thái nằm ở products/sales_rollup.py
+- "Top N trong 7/30/90 ngày" là một truy vấn GROUP BY trên bảng ngày (có index),
+  kết quả xếp hạng được cache theo phiên bản, phiên bản tăng khi có thay đổi
+- Dữ liệu hiển thị lấy từ thẻ sản phẩm (một truy vấn cho cả danh sách)
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Product, ProductSalesDaily
+from .cards import get_card_payload
+
+# Trạng thái mục đơn hàng được tính là đã bán (giống sold_count)
+SOLD_STATUSES = ('delivered', 'received', 'received_reviewed')
+
+LEADERBOARD_WINDOWS = (7, 30, 90)
+DEFAULT_LEADERBOARD_LIMIT = 3
+MAX_LEADERBOARD_LIMIT = 50
+
+LEADERBOARD_VERSION_KEY = 'top_sellers:version'
+LEADERBOARD_CACHE_PREFIX = 'top_sellers:'
+LEADERBOARD_CACHE_TIMEOUT = 600
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def sales_delta(old_status, new_status, quantity):
+    """Thay đổi số lượng đã bán khi mục đơn hàng chuyển từ old_status sang new_status"""
+    return quantity * ((new_status in SOLD_STATUSES) - (old_status in SOLD_STATUSES))
+
+
+def sale_day(created_at):
+    """Ngày (theo múi giờ hiện tại) được tính doanh số của mục đơn hàng"""
+    return timezone.localdate(created_at) if timezone.is_aware(created_at) else created_at.date()
+
+
+def apply_sales_deltas(deltas):
+    """Cộng dồn {(product_id, shop_id, ngày): số lượng} vào các bucket ngày"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    # Tạo trước các bucket chưa có, sau đó cộng bằng F() để tránh ghi đè khi cập nhật đồng thời
+    ProductSalesDaily.objects.bulk_create([
+        ProductSalesDaily(product_id=product_id, shop_id=shop_id, day=day, units=0)
+        for product_id, shop_id, day in deltas
+    ], ignore_conflicts=True)
+    for (product_id, shop_id, day), delta in deltas.items():
+        ProductSalesDaily.objects.filter(product_id=product_id, day=day).update(units=F('units') + delta)
+
+    transaction.on_commit(invalidate_leaderboard)
+
+
+def invalidate_leaderboard():
+    """Tăng phiên bản: mọi bảng xếp hạng đã cache bị bỏ qua"""
+    try:
+        cache.incr(LEADERBOARD_VERSION_KEY)
+    except ValueError:
+        cache.set(LEADERBOARD_VERSION_KEY, 1, None)
+
+
+def _get_version():
+    version = cache.get(LEADERBOARD_VERSION_KEY)
+    if version is None:
+        cache.add(LEADERBOARD_VERSION_KEY, 1, None)
+        version = cache.get(LEADERBOARD_VERSION_KEY, 1)
+    return version
+
+
+def get_top_seller_ranking(shop_id=None, days=None, limit=DEFAULT_LEADERBOARD_LIMIT):
+    """
+    [(product_id, total_sold)] giảm dần trong `days` ngày gần nhất (None: toàn thời gian).
+    Một truy vấn trên bảng ngày, kết quả được cache đến khi có thay đổi về số lượng bán
+    """
+    today = timezone.localdate()
+    key = f"{LEADERBOARD_CACHE_PREFIX}{_get_version()}:{shop_id or 'all'}:{days or 'all'}:{limit}:{today}"
+    ranking = cache.get(key)
+    if ranking is not None:
+        return ranking
+
+    rows = ProductSalesDaily.objects.all()
+    if days:
+        rows = rows.filter(day__gte=today - timedelta(days=days - 1))
+    if shop_id:
+        rows = rows.filter(shop_id=shop_id)
+    ranking = list(
+        rows.values('product_id').annotate(
+            total_sold=Sum('units')
+        ).filter(total_sold__gt=0).order_by('-total_sold', 'product_id').values_list(
+            'product_id', 'total_sold'
+        )[:limit]
+    )
+    cache.set(key, ranking, LEADERBOARD_CACHE_TIMEOUT)
+    return ranking
+
+
+def get_top_sellers(shop_id=None, days=None, limit=DEFAULT_LEADERBOARD_LIMIT, size=None, image_format=None):
+    """Bảng xếp hạng kèm dữ liệu thẻ sản phẩm (một truy vấn cho toàn bộ danh sách)"""
+    ranking = get_top_seller_ranking(shop_id, days, min(limit, MAX_LEADERBOARD_LIMIT))
+    products = Product.objects.select_related('card').in_bulk([product_id for product_id, _ in ranking])
+
+    return [
+        {**get_card_payload(products[product_id], size, image_format), 'total_sold': total_sold}
+        for product_id, total_sold in ranking if product_id in products
+    ]
+
+
+def rebuild_sales_buckets(batch_size=REBUILD_BATCH_SIZE):
+    """Dựng lại toàn bộ bucket ngày từ bảng order_items (dùng cho dữ liệu cũ)"""
+    from orders.models import OrderItem
+
+    totals = defaultdict(int)
+    rows = OrderItem.objects.filter(status__in=SOLD_STATUSES).values_list(
+        'product_id', 'shop_id', 'quantity', 'created_at'
+    ).iterator(chunk_size=batch_size)
+    for product_id, shop_id, quantity, created_at in rows:
+        totals[(product_id, shop_id, sale_day(created_at))] += quantity
+
+    with transaction.atomic():
+        ProductSalesDaily.objects.all().delete()
+        ProductSalesDaily.objects.bulk_create([
+            ProductSalesDaily(product_id=product_id, shop_id=shop_id, day=day, units=units)
+            for (product_id, shop_id, day), units in totals.items()
+        ], batch_size=batch_size)
+    transaction.on_commit(invalidate_leaderboard)
+    return len(totals)
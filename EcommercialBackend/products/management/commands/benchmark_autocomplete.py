@@ -0,0 +1,79 @@
+# products/management/commands/benchmark_autocomplete.py
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import (
+    AutocompleteIndex, AutocompleteSnapshot, write_snapshot, normalize_prefix, DEFAULT_SUGGESTION_LIMIT
+)
+
+# Từ giả lập cho tên sản phẩm (có dấu, để đo cả bước chuẩn hóa)
+WORDS = (
+    'áo', 'quần', 'váy', 'đầm', 'thun', 'sơ mi', 'khoác', 'jean', 'kaki', 'nam', 'nữ', 'trẻ em', 'cotton',
+    'lụa', 'len', 'dạ', 'bò', 'ngắn', 'dài', 'tay', 'cổ', 'tròn', 'polo', 'hoodie', 'form rộng', 'ôm',
+    'đen', 'trắng', 'xanh', 'đỏ', 'vàng', 'hồng', 'be', 'xám', 'nâu', 'họa tiết', 'kẻ sọc', 'trơn',
+    'mùa hè', 'mùa đông', 'công sở', 'dạo phố', 'thể thao', 'basic', 'cao cấp', 'giá rẻ', 'hàn quốc',
+)
+
+
+class Command(BaseCommand):
+    help = 'Đo thời gian dựng snapshot và truy vấn gợi ý khi gõ với dữ liệu giả lập (không dùng DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000],
+                            help='Số mục gợi ý trong chỉ mục')
+        parser.add_argument('--queries', type=int, default=2000,
+                            help='Số truy vấn cho mỗi kích thước')
+        parser.add_argument('--limit', type=int, default=DEFAULT_SUGGESTION_LIMIT,
+                            help='Số gợi ý mỗi truy vấn')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _items(self, rng, size):
+        """(kind, id, tên, trọng số) giả lập: tên 3-7 từ, số lượng bán theo phân phối đuôi dài"""
+        lengths = rng.integers(3, 8, size)
+        words = rng.integers(0, len(WORDS), (size, 7))
+        sold = rng.zipf(1.5, size).clip(max=10 ** 6)
+        return [
+            ('product', product_id + 1, ' '.join(WORDS[word] for word in words[product_id, :lengths[product_id]])
+             + f' {product_id % 9973}', float(np.log1p(sold[product_id])))
+            for product_id in range(size)
+        ]
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        limit = options['limit']
+        for size in options['sizes']:
+            self.stdout.write(f"Đang dựng snapshot {size} mục...")
+            items = self._items(rng, size)
+
+            with tempfile.TemporaryDirectory() as directory:
+                started = time.perf_counter()
+                path = write_snapshot(items, directory)
+                build_time = time.perf_counter() - started
+
+                started = time.perf_counter()
+                snapshot = AutocompleteSnapshot(path)
+                open_time = (time.perf_counter() - started) * 1000
+                index = AutocompleteIndex(snapshot)
+
+                # Tiền tố 1-12 ký tự của tên ngẫu nhiên (gồm cả tiền tố rất ngắn, khoảng khóa lớn)
+                timings = []
+                for item_index in rng.integers(0, size, options['queries']).tolist():
+                    name = normalize_prefix(items[item_index][2])
+                    query = name[:int(rng.integers(1, 13))]
+                    started = time.perf_counter()
+                    index.suggest(query, limit)
+                    timings.append((time.perf_counter() - started) * 1000)
+
+                p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+                self.stdout.write(
+                    f"{size} mục: {snapshot.size} khóa, {len(snapshot.heavy)} tiền tố tính sẵn, "
+                    f"dựng {build_time:.1f}s, mở snapshot {open_time:.1f}ms, "
+                    f"truy vấn trung bình {np.mean(timings):.2f}ms, p50 {p50:.2f}ms, p95 {p95:.2f}ms, "
+                    f"p99 {p99:.2f}ms, tối đa {max(timings):.2f}ms"
+                )
+                del index, snapshot
+            del items
+        self.stdout.write(self.style.SUCCESS('Hoàn tất đo hiệu năng.'))
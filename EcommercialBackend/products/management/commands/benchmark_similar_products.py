@@ -0,0 +1,67 @@
+# products/management/commands/benchmark_similar_products.py
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from products.similar import SimilarityIndex, FEATURE_DIM, DEFAULT_SIMILAR_LIMIT, VECTOR_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Đo thời gian truy vấn và độ phủ của chỉ mục sản phẩm tương tự với dữ liệu giả lập (không dùng DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000],
+                            help='Số sản phẩm trong chỉ mục')
+        parser.add_argument('--queries', type=int, default=200,
+                            help='Số truy vấn cho mỗi kích thước')
+        parser.add_argument('--limit', type=int, default=DEFAULT_SIMILAR_LIMIT,
+                            help='Số sản phẩm tương tự mỗi truy vấn')
+        parser.add_argument('--clusters', type=int, default=5000,
+                            help='Số nhóm sản phẩm giả lập (cùng danh mục/cửa hàng...)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _vectors(self, rng, size, clusters):
+        """Vector giả lập: tâm nhóm ngẫu nhiên cộng nhiễu, đã chuẩn hóa"""
+        centers = rng.standard_normal((clusters, FEATURE_DIM), dtype=np.float32)
+        vectors = centers[rng.integers(0, clusters, size)]
+        vectors += 0.7 * rng.standard_normal((size, FEATURE_DIM), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        limit = options['limit']
+        for size in options['sizes']:
+            self.stdout.write(f"Đang dựng chỉ mục {size} sản phẩm...")
+            vectors = self._vectors(rng, size, options['clusters'])
+
+            started = time.perf_counter()
+            index = SimilarityIndex(capacity=size)
+            for start in range(0, size, VECTOR_BATCH_SIZE):
+                end = min(start + VECTOR_BATCH_SIZE, size)
+                index.upsert_many(range(start + 1, end + 1), vectors[start:end], [True] * (end - start))
+            build_time = time.perf_counter() - started
+
+            timings = []
+            hits = 0
+            for product_id in rng.integers(1, size + 1, options['queries']).tolist():
+                vector = index.vector(product_id)
+                started = time.perf_counter()
+                result = index.top_k(vector, limit, exclude_ids={product_id})
+                timings.append((time.perf_counter() - started) * 1000)
+
+                # Kết quả chính xác (quét toàn bộ) để tính độ phủ
+                scores = vectors @ vector
+                scores[product_id - 1] = -np.inf
+                exact = set((np.argpartition(scores, -limit)[-limit:] + 1).tolist())
+                hits += len(exact & {similar_id for similar_id, _ in result})
+
+            p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+            self.stdout.write(
+                f"{size} sản phẩm: bộ nhớ {index.matrix.nbytes / 1024 / 1024:.0f}MB, dựng {build_time:.1f}s, "
+                f"truy vấn trung bình {np.mean(timings):.2f}ms, p50 {p50:.2f}ms, p95 {p95:.2f}ms, p99 {p99:.2f}ms, "
+                f"recall@{limit} {hits / (limit * len(timings)):.3f}"
+            )
+            del index, vectors
+        self.stdout.write(self.style.SUCCESS('Hoàn tất đo hiệu năng.'))
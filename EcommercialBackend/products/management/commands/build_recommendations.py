@@ -0,0 +1,32 @@
+# products/management/commands/build_recommendations.py
+from django.core.management.base import BaseCommand
+
+from products.recommendations import build_recommendations, TOP_K, MIN_CO_COUNT, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Dựng gợi ý "khách hàng cũng mua" từ các đơn hàng (mặc định tăng dần từ lần chạy trước)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Dựng lại toàn bộ từ tất cả đơn hàng')
+        parser.add_argument('--top-k', type=int, default=TOP_K,
+                            help='Số sản phẩm gợi ý tối đa cho mỗi sản phẩm')
+        parser.add_argument('--min-count', type=int, default=MIN_CO_COUNT,
+                            help='Số đơn hàng mua cùng tối thiểu của một cặp')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Số id đơn hàng đọc trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang dựng gợi ý sản phẩm mua cùng...")
+        run = build_recommendations(
+            full=options['full'],
+            top_k=options['top_k'],
+            min_count=options['min_count'],
+            chunk_size=options['chunk_size'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã xử lý {run.orders_processed} đơn hàng ({run.mode}), '
+            f'cập nhật {run.pairs_updated} cặp và gợi ý cho {run.products_refreshed} sản phẩm.'
+        ))
@@ -0,0 +1,46 @@
+# products/management/commands/import_products.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shops.models import Shop
+from products.importer import ProductImporter, CHUNK_SIZE, detect_format, open_text_stream
+
+
+class Command(BaseCommand):
+    help = 'Nhập sản phẩm hàng loạt cho một cửa hàng từ file CSV/JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('shop_id', type=int, help='ID cửa hàng')
+        parser.add_argument('path', help='Đường dẫn file CSV/JSONL')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Định dạng file (mặc định theo phần mở rộng)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Số sản phẩm xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(id=options['shop_id'])
+        except Shop.DoesNotExist:
+            raise CommandError(f"Cửa hàng {options['shop_id']} không tồn tại")
+
+        file_format = detect_format(options['path'], options['format'])
+        started = time.monotonic()
+
+        def report(stats, errors):
+            self.stdout.write(
+                f"Đã xử lý {stats['processed_rows']} sản phẩm "
+                f"({stats['created_variants']} biến thể, {stats['failed_rows']} lỗi)"
+            )
+
+        importer = ProductImporter(shop, chunk_size=options['chunk_size'], progress_callback=report)
+        with open(options['path'], 'rb') as binary_file:
+            stats = importer.run(open_text_stream(binary_file), file_format)
+
+        for error in importer.errors[:20]:
+            self.stdout.write(self.style.WARNING(f"Dòng {error['row']}: {error['errors']}"))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã tạo {stats['created_products']} sản phẩm, {stats['created_variants']} biến thể, "
+            f"{stats['failed_rows']} dòng lỗi trong {elapsed:.1f}s."
+        ))
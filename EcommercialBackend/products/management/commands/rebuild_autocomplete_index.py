@@ -0,0 +1,21 @@
+# products/management/commands/rebuild_autocomplete_index.py
+from django.core.management.base import BaseCommand
+
+from products.autocomplete import rebuild_autocomplete_index, TERM_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Làm mới các mục gợi ý khi gõ (trọng số theo số lượng bán) và dựng lại snapshot chỉ mục tiền tố'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=TERM_BATCH_SIZE,
+                            help='Số đối tượng xử lý trong mỗi lô')
+        parser.add_argument('--snapshot-only', action='store_true',
+                            help='Chỉ dựng lại snapshot từ các mục gợi ý hiện có')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang dựng lại chỉ mục gợi ý tìm kiếm...")
+        total = rebuild_autocomplete_index(
+            refresh_terms=not options['snapshot_only'], batch_size=options['batch_size'], stdout=self.stdout
+        )
+        self.stdout.write(self.style.SUCCESS(f'Đã dựng snapshot với {total} mục gợi ý.'))
@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_product_cards.py
+from django.core.management.base import BaseCommand
+
+from products.cards import rebuild_product_cards, CARD_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại thẻ sản phẩm (ảnh đại diện, giá hiệu lực, tên cửa hàng/danh mục...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=CARD_BATCH_SIZE,
+                            help='Số sản phẩm xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang dựng lại thẻ sản phẩm...")
+        total = rebuild_product_cards(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật thẻ cho {total} sản phẩm.'))
@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_product_prices.py
+from django.core.management.base import BaseCommand
+
+from products.pricing import rebuild_product_prices, PRICE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Tính lại giá hiệu lực của biến thể và khoảng giá (min/max) của toàn bộ sản phẩm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRICE_BATCH_SIZE,
+                            help='Số sản phẩm xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang tính lại giá hiệu lực...")
+        total = rebuild_product_prices(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật giá cho {total} sản phẩm.'))
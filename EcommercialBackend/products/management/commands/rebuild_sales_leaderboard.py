@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_sales_leaderboard.py
+from django.core.management.base import BaseCommand
+
+from products.leaderboard import rebuild_sales_buckets, REBUILD_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại số lượng bán theo ngày (bảng xếp hạng bán chạy) từ các mục đơn hàng đã giao/đã nhận'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REBUILD_BATCH_SIZE,
+                            help='Số mục đơn hàng đọc trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang dựng lại bảng xếp hạng bán chạy...")
+        total = rebuild_sales_buckets(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật {total} bucket ngày.'))
@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_sales_rollup.py
+from django.core.management.base import BaseCommand
+
+from products.sales_rollup import rebuild_sales_rollup, ROLLUP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại số liệu bán hàng (đã bán, doanh thu, trả hàng) của sản phẩm/biến thể và sold_count từ các mục đơn hàng'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE,
+                            help='Số sản phẩm xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang dựng lại số liệu bán hàng...")
+        total = rebuild_sales_rollup(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật số liệu bán hàng cho {total} sản phẩm.'))
@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from products.search import rebuild_index, INDEX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Xây dựng lại chỉ mục tìm kiếm sản phẩm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=INDEX_BATCH_SIZE,
+                            help='Số sản phẩm xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang xây dựng lại chỉ mục tìm kiếm...")
+        total = rebuild_index(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Đã đánh chỉ mục {total} sản phẩm.'))
@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_similar_index.py
+from django.core.management.base import BaseCommand
+
+from products.similar import rebuild_feature_vectors, VECTOR_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Tính lại vector đặc trưng (sản phẩm tương tự) cho toàn bộ sản phẩm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=VECTOR_BATCH_SIZE,
+                            help='Số sản phẩm xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang tính lại vector sản phẩm tương tự...")
+        total = rebuild_feature_vectors(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật vector cho {total} sản phẩm.'))
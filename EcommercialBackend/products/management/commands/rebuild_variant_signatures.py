@@ -0,0 +1,17 @@
+# products/management/commands/rebuild_variant_signatures.py
+from django.core.management.base import BaseCommand
+
+from products.variant_index import rebuild_variant_signatures, SIGNATURE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Tính lại signature (tổ hợp giá trị thuộc tính) cho toàn bộ biến thể sản phẩm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SIGNATURE_BATCH_SIZE,
+                            help='Số biến thể xử lý trong mỗi lô')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Đang tính lại signature biến thể...")
+        total = rebuild_variant_signatures(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật signature cho {total} biến thể.'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_alter_productvariant_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_search_documents',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('frequency', models.FloatField(default=0)),
+                ('doc_length', models.FloatField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_search_postings',
+                'indexes': [models.Index(fields=['term', '-frequency'], name='search_posting_term_freq_idx')],
+                'unique_together': {('term', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('thumbnail_url', models.CharField(blank=True, max_length=255, null=True)),
+                ('effective_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('shop_name', models.CharField(max_length=255)),
+                ('category_name', models.CharField(max_length=100)),
+                ('rating', models.DecimalField(decimal_places=1, default=0, max_digits=2)),
+                ('sold_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='card', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_cards',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='upload_status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('pending', 'Pending'), ('failed', 'Failed')], default='ready', max_length=20),
+        ),
+    ]
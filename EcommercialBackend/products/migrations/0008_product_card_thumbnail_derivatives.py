@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_image_upload_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcard',
+            name='thumbnail_derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
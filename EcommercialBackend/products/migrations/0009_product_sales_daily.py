@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_card_thumbnail_derivatives'),
+        ('shops', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.product')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shops.shop')),
+            ],
+            options={
+                'db_table': 'product_sales_daily',
+                'indexes': [models.Index(fields=['day', 'product', 'units'], name='sales_daily_day_idx'), models.Index(fields=['shop', 'day'], name='sales_daily_shop_day_idx')],
+                'unique_together': {('product', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_signatures(apps, schema_editor):
+    """
+    Tính signature cho các biến thể có từ trước (đang là ''), để /variants/resolve/ tìm được
+    biến thể của các sản phẩm cũ mà không cần chạy rebuild_variant_signatures
+    """
+    from products.variant_index import compute_signature
+
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    VariantAttributeValue = apps.get_model('products', 'VariantAttributeValue')
+
+    last_id = 0
+    while True:
+        variants = list(ProductVariant.objects.filter(id__gt=last_id).order_by('id').only('id')[:BATCH_SIZE])
+        if not variants:
+            return
+        last_id = variants[-1].id
+
+        value_ids = {variant.id: [] for variant in variants}
+        for variant_id, value_id in VariantAttributeValue.objects.filter(
+            variant_id__in=value_ids
+        ).values_list('variant_id', 'attribute_value_id'):
+            value_ids[variant_id].append(value_id)
+
+        changed = []
+        for variant in variants:
+            variant.signature = compute_signature(value_ids[variant.id])
+            if variant.signature:
+                changed.append(variant)
+        ProductVariant.objects.bulk_update(changed, ['signature'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_sales_daily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='signature',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(fields=['product', 'signature'], name='variant_signature_idx'),
+        ),
+        migrations.RunPython(backfill_signatures, migrations.RunPython.noop),
+    ]
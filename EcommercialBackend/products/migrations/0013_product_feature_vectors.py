@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFeatureVector',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feature_vector', serialize=False, to='products.product')),
+                ('vector', models.BinaryField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'product_feature_vectors',
+            },
+        ),
+    ]
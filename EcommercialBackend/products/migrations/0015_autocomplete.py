@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=100, unique=True)),
+                ('search_count', models.IntegerField(default=0)),
+                ('last_searched_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'search_query_stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='AutocompleteTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', 'Product'), ('category', 'Category'), ('shop', 'Shop'), ('query', 'Query')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('text', models.CharField(blank=True, max_length=255)),
+                ('weight', models.FloatField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'autocomplete_terms',
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def backfill_effective_prices(apps, schema_editor):
+    """
+    Tính effective_price của biến thể và min_price/max_price của các sản phẩm có từ trước 0011
+    (còn NULL), để lọc khoảng giá và sắp xếp theo giá không bỏ sót các sản phẩm này
+    """
+    from products.pricing import resolve_variant_price, get_price_range
+
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+
+    last_id = 0
+    while True:
+        products = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').only('id', 'price', 'sale_price')[:BATCH_SIZE]
+        )
+        if not products:
+            return
+        last_id = products[-1].id
+        by_id = {product.id: product for product in products}
+
+        variant_prices = {product_id: [] for product_id in by_id}
+        variants = []
+        for variant in ProductVariant.objects.filter(product_id__in=by_id).only(
+            'id', 'product_id', 'price', 'sale_price', 'effective_price'
+        ):
+            product = by_id[variant.product_id]
+            variant.effective_price = resolve_variant_price(
+                variant.price, variant.sale_price, product.price, product.sale_price
+            )
+            variant_prices[variant.product_id].append(variant.effective_price)
+            variants.append(variant)
+        ProductVariant.objects.bulk_update(variants, ['effective_price'], batch_size=BATCH_SIZE)
+
+        for product in products:
+            product.min_price, product.max_price = get_price_range(
+                product.price, product.sale_price, variant_prices[product.id]
+            )
+        Product.objects.bulk_update(products, ['min_price', 'max_price'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_autocomplete'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_effective_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_backfill_effective_prices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationrun',
+            name='recent_order_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
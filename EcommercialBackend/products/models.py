@@ -1,4 +1,5 @@
 from django.db import models
+from core.models import User
 from shops.models import Shop
 
 
@@ -64,26 +65,42 @@ class Product(models.Model):
     short_description = models.CharField(max_length=255, blank=True, null=True)
     price = models.DecimalField(max_digits=12, decimal_places=2)
     sale_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    # Giá hiệu lực thấp nhất/cao nhất trong các biến thể (xem products/pricing.py)
+    min_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    max_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
     stock = models.IntegerField(default=0)
     product_type = models.CharField(max_length=20, choices=PRODUCT_TYPE_CHOICES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     featured = models.BooleanField(default=False)
     rating = models.DecimalField(max_digits=2, decimal_places=1, default=0)
     view_count = models.IntegerField(default=0)
+    # Bản sao của ProductSalesStats.units_sold (xem products/sales_rollup.py)
     sold_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'products'
+        indexes = [
+            models.Index(fields=['status', 'min_price'], name='product_min_price_idx'),
+            models.Index(fields=['status', 'max_price'], name='product_max_price_idx'),
+            models.Index(fields=['status', 'sold_count'], name='product_sold_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
 class ProductImage(models.Model):
+    UPLOAD_STATUS_CHOICES = (
+        ('ready', 'Ready'),
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    )
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image_url = models.CharField(max_length=255)
+    upload_status = models.CharField(max_length=20, choices=UPLOAD_STATUS_CHOICES, default='ready')
     is_thumbnail = models.BooleanField(default=False)
     display_order = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -135,13 +152,21 @@ class ProductVariant(models.Model):
     sku = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
     sale_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    # Giá khách hàng thực trả (xem products/pricing.py)
+    effective_price = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
     stock = models.IntegerField(default=0)
     image_url = models.CharField(max_length=255, blank=True, null=True)
+    # Băm của các id giá trị thuộc tính (đã sắp xếp), dùng để tra biến thể theo tổ hợp thuộc tính
+    signature = models.CharField(max_length=40, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'product_variants'
+        indexes = [
+            models.Index(fields=['product', 'signature'], name='variant_signature_idx'),
+            models.Index(fields=['product', 'effective_price'], name='variant_effective_price_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.sku}"
@@ -189,3 +214,279 @@ class ProductTag(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.tag.name}"
 
+
+
+class ProductSearchDocument(models.Model):
+    """Thông tin tài liệu của chỉ mục tìm kiếm (độ dài có trọng số dùng cho BM25)"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='search_document')
+    length = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_search_documents'
+
+    def __str__(self):
+        return f"Search document for {self.product_id}"
+
+
+class ProductSearchPosting(models.Model):
+    """Một phần tử của chỉ mục ngược: từ khóa -> sản phẩm"""
+    term = models.CharField(max_length=100)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.FloatField(default=0)
+    doc_length = models.FloatField(default=0)
+
+    class Meta:
+        db_table = 'product_search_postings'
+        unique_together = ('term', 'product')
+        indexes = [
+            models.Index(fields=['term', '-frequency'], name='search_posting_term_freq_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id}"
+
+
+class ProductCard(models.Model):
+    """
+    Bản chiếu "thẻ sản phẩm" đã phi chuẩn hóa dùng cho các danh sách
+    (ảnh đại diện, giá hiệu lực, tên cửa hàng/danh mục, đánh giá, đã bán).
+    Được cập nhật khi sản phẩm hoặc hình ảnh thay đổi (xem products/cards.py)
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='card')
+    thumbnail_url = models.CharField(max_length=255, blank=True, null=True)
+    # Ảnh phái sinh của ảnh đại diện {kích thước: {định dạng: {url, width, height, bytes}}}
+    thumbnail_derivatives = models.JSONField(default=dict, blank=True)
+    effective_price = models.DecimalField(max_digits=12, decimal_places=2)
+    shop_name = models.CharField(max_length=255)
+    category_name = models.CharField(max_length=100)
+    rating = models.DecimalField(max_digits=2, decimal_places=1, default=0)
+    sold_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_cards'
+
+    def __str__(self):
+        return f"Card for {self.product_id}"
+
+
+class ProductSalesDaily(models.Model):
+    """
+    Số lượng đã bán của một sản phẩm theo ngày đặt hàng (chỉ tính mục đơn hàng đã giao/đã nhận).
+    Được cộng/trừ dần khi trạng thái mục đơn hàng thay đổi, dùng cho bảng xếp hạng
+    bán chạy theo khung thời gian (xem products/leaderboard.py)
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'product_sales_daily'
+        unique_together = ('product', 'day')
+        indexes = [
+            models.Index(fields=['day', 'product', 'units'], name='sales_daily_day_idx'),
+            models.Index(fields=['shop', 'day'], name='sales_daily_shop_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.day}: {self.units}"
+
+
+class ProductImportJob(models.Model):
+    """Một lần nhập sản phẩm hàng loạt từ file CSV/JSONL (xem products/importer.py)"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    FORMAT_CHOICES = (
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='product_import_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='product_import_jobs')
+    file_name = models.CharField(max_length=255, blank=True)
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    processed_rows = models.IntegerField(default=0)
+    created_products = models.IntegerField(default=0)
+    created_variants = models.IntegerField(default=0)
+    failed_rows = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'product_import_jobs'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Import #{self.id} for shop {self.shop_id} ({self.status})"
+
+
+class ProductCoPurchase(models.Model):
+    """
+    Số đơn hàng mua cùng lúc hai sản phẩm (ma trận đồng xuất hiện thưa, lưu cả hai chiều).
+    Dòng product == other lưu số đơn hàng có chứa sản phẩm (đường chéo), xem products/recommendations.py
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchases')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'product_co_purchases'
+        unique_together = ('product', 'other')
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.count}"
+
+
+class ProductRecommendation(models.Model):
+    """Top-K sản phẩm thường được mua cùng (đã chuẩn hóa cosine), xem products/recommendations.py"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    co_count = models.IntegerField()
+
+    class Meta:
+        db_table = 'product_recommendations'
+        unique_together = ('product', 'recommended')
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='recommendation_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} ({self.score:.3f})"
+
+
+class RecommendationRun(models.Model):
+    """Một lần chạy job dựng gợi ý "thường được mua cùng" (toàn bộ hoặc tăng dần)"""
+    MODE_CHOICES = (
+        ('full', 'Full'),
+        ('incremental', 'Incremental'),
+    )
+
+    STATUS_CHOICES = (
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    # Id đơn hàng lớn nhất đã được xử lý (lần chạy tăng dần tiếp theo bắt đầu sau id này)
+    last_order_id = models.BigIntegerField(default=0)
+    # Id các đơn hàng đã xử lý trong cửa sổ đọc lại (ORDER_ID_OVERLAP id cuối)
+    recent_order_ids = models.JSONField(default=list, blank=True)
+    orders_processed = models.IntegerField(default=0)
+    pairs_updated = models.IntegerField(default=0)
+    products_refreshed = models.IntegerField(default=0)
+    message = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'recommendation_runs'
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Recommendation run #{self.id} ({self.mode}, {self.status})"
+
+
+class ProductFeatureVector(models.Model):
+    """
+    Vector đặc trưng nội dung của sản phẩm (float32 đã chuẩn hóa: danh mục, tag, thuộc tính,
+    khoảng giá, cửa hàng) dùng cho gợi ý sản phẩm tương tự, xem products/similar.py
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='feature_vector')
+    vector = models.BinaryField()
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = 'product_feature_vectors'
+
+    def __str__(self):
+        return f"Feature vector of product {self.product_id}"
+
+
+class ProductSalesStats(models.Model):
+    """Số liệu bán hàng cộng dồn của sản phẩm (đã bán, doanh thu, trả hàng), xem products/sales_rollup.py"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='sales_stats')
+    units_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units_returned = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_sales_stats'
+
+    def __str__(self):
+        return f"Sales of product {self.product_id}: {self.units_sold}"
+
+
+class VariantSalesStats(models.Model):
+    """Số liệu bán hàng cộng dồn của biến thể"""
+    variant = models.OneToOneField(ProductVariant, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='sales_stats')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variant_sales_stats')
+    units_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units_returned = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'variant_sales_stats'
+
+    def __str__(self):
+        return f"Sales of variant {self.variant_id}: {self.units_sold}"
+
+
+class SearchQueryStat(models.Model):
+    """Số lần một truy vấn tìm kiếm (đã chuẩn hóa) được dùng, nguồn của gợi ý "truy vấn phổ biến\""""
+    query = models.CharField(max_length=100, unique=True)
+    search_count = models.IntegerField(default=0)
+    last_searched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'search_query_stats'
+
+    def __str__(self):
+        return f"{self.query} ({self.search_count})"
+
+
+class AutocompleteTerm(models.Model):
+    """
+    Một mục gợi ý khi gõ (tên sản phẩm, danh mục, cửa hàng hoặc truy vấn phổ biến) kèm trọng số,
+    nguồn của snapshot chỉ mục tiền tố - xem products/autocomplete.py
+    """
+    KIND_CHOICES = (
+        ('product', 'Product'),
+        ('category', 'Category'),
+        ('shop', 'Shop'),
+        ('query', 'Query'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    text = models.CharField(max_length=255, blank=True)
+    weight = models.FloatField(default=0)
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = 'autocomplete_terms'
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id}: {self.text}"
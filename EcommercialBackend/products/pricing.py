@@ -0,0 +1,160 @@
+# products/pricing.py
+"""
+Giá hiệu lực (giá khách hàng thực trả) - cài đặt dùng chung cho sản phẩm,
+biến thể, giỏ hàng, đơn hàng và thẻ sản phẩm.
+
+Thứ tự ưu tiên của một biến thể:
+    variant.sale_price -> variant.price -> product.sale_price -> product.price
+
+- Giá hiệu lực của từng biến thể được lưu trong ProductVariant.effective_price (có index),
+  giá thấp nhất/cao nhất của sản phẩm trong Product.min_price / max_price, dùng cho
+  lọc khoảng giá và sắp xếp theo giá
+- Các cột này được tính lại sau mỗi lần ghi giá sản phẩm/biến thể (xem products/signals.py);
+  các đường ghi bằng bulk_create tự tính khi tạo bản ghi (nhập hàng loạt) hoặc gọi
+  refresh_product_prices_on_commit (products/variant_writer.py); dữ liệu có từ trước được tính
+  bởi migration 0016_backfill_effective_prices, nên các cột này không NULL khi lọc/sắp xếp
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Product, ProductVariant
+from .detail_cache import invalidate_product_detail
+from .facets import invalidate_facets
+
+PRICE_BATCH_SIZE = 500
+
+# Các trường ảnh hưởng đến giá hiệu lực
+PRICE_FIELDS = {'price', 'sale_price'}
+
+
+def get_effective_price(price, sale_price):
+    """Giá hiệu lực: giá khuyến mãi nếu có, ngược lại là giá gốc"""
+    return sale_price if sale_price else price
+
+
+def resolve_variant_price(variant_price, variant_sale_price, product_price, product_sale_price):
+    """Giá hiệu lực của biến thể từ các giá thành phần"""
+    if variant_sale_price:
+        return variant_sale_price
+    if variant_price:
+        return variant_price
+    return get_effective_price(product_price, product_sale_price)
+
+
+def get_variant_price(variant, product=None):
+    """
+    Giá hiệu lực của một biến thể (giỏ hàng, đặt hàng...).
+    Chỉ đọc variant.product khi biến thể không có giá riêng (nên select_related('variant__product'))
+    """
+    if variant.sale_price:
+        return variant.sale_price
+    if variant.price:
+        return variant.price
+    product = product or variant.product
+    return get_effective_price(product.price, product.sale_price)
+
+
+def get_price_range(product_price, product_sale_price, variant_prices):
+    """(min, max) giá hiệu lực của sản phẩm; không có biến thể thì là giá hiệu lực của sản phẩm"""
+    if not variant_prices:
+        price = get_effective_price(product_price, product_sale_price)
+        return price, price
+    return min(variant_prices), max(variant_prices)
+
+
+def price_range_filter(min_price=None, max_price=None):
+    """
+    Điều kiện lọc sản phẩm có ít nhất một mức giá hiệu lực trong khoảng [min_price, max_price]:
+    giá thấp nhất nằm trong khoảng, hoặc có biến thể nằm trong khoảng (index product, effective_price)
+    """
+    bounds = {}
+    if min_price is not None:
+        bounds['gte'] = min_price
+    if max_price is not None:
+        bounds['lte'] = max_price
+    if not bounds:
+        return Q()
+    return Q(**{f'min_price__{lookup}': value for lookup, value in bounds.items()}) | Q(Exists(
+        ProductVariant.objects.filter(
+            product_id=OuterRef('pk'),
+            **{f'effective_price__{lookup}': value for lookup, value in bounds.items()}
+        )
+    ))
+
+
+def refresh_product_prices(product_ids):
+    """
+    Tính lại giá hiệu lực của các biến thể và khoảng giá của các sản phẩm
+    (chỉ ghi các dòng thay đổi), trả về id các sản phẩm có khoảng giá thay đổi
+    """
+    product_ids = list(product_ids)
+    changed_product_ids = []
+
+    for start in range(0, len(product_ids), PRICE_BATCH_SIZE):
+        batch_ids = product_ids[start:start + PRICE_BATCH_SIZE]
+        products = {
+            product.id: product
+            for product in Product.objects.filter(id__in=batch_ids).only(
+                'id', 'price', 'sale_price', 'min_price', 'max_price'
+            )
+        }
+        variant_prices = {product_id: [] for product_id in products}
+        changed_variants = []
+        for variant in ProductVariant.objects.filter(product_id__in=products).only(
+            'id', 'product_id', 'price', 'sale_price', 'effective_price'
+        ):
+            product = products[variant.product_id]
+            price = resolve_variant_price(variant.price, variant.sale_price, product.price, product.sale_price)
+            variant_prices[variant.product_id].append(price)
+            if variant.effective_price != price:
+                variant.effective_price = price
+                changed_variants.append(variant)
+        if changed_variants:
+            ProductVariant.objects.bulk_update(changed_variants, ['effective_price'], batch_size=PRICE_BATCH_SIZE)
+            # Giá hiệu lực của biến thể nằm trong payload chi tiết
+            invalidate_product_detail({variant.product_id for variant in changed_variants})
+
+        changed_products = []
+        for product_id, product in products.items():
+            min_price, max_price = get_price_range(product.price, product.sale_price, variant_prices[product_id])
+            if (product.min_price, product.max_price) != (min_price, max_price):
+                product.min_price, product.max_price = min_price, max_price
+                changed_products.append(product)
+        if changed_products:
+            # bulk_update không phát signal post_save (tránh tính lại vòng lặp)
+            Product.objects.bulk_update(changed_products, ['min_price', 'max_price'], batch_size=PRICE_BATCH_SIZE)
+            changed_product_ids.extend(product.id for product in changed_products)
+
+    if changed_product_ids:
+        # Thẻ sản phẩm hiển thị giá thấp nhất, vector sản phẩm tương tự chứa khoảng giá
+        from .cards import refresh_product_cards
+        from .similar import refresh_feature_vectors
+        refresh_product_cards(changed_product_ids)
+        refresh_feature_vectors(changed_product_ids)
+        invalidate_facets()
+    return changed_product_ids
+
+
+def refresh_product_prices_on_commit(product_ids):
+    """Tính lại giá sau khi transaction hiện tại được commit"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: refresh_product_prices(product_ids))
+
+
+def rebuild_product_prices(batch_size=PRICE_BATCH_SIZE, stdout=None):
+    """Tính lại giá hiệu lực cho toàn bộ sản phẩm theo lô (dùng cho dữ liệu cũ)"""
+    total = 0
+    last_id = 0
+    while True:
+        batch_ids = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch_ids:
+            break
+        refresh_product_prices(batch_ids)
+        total += len(batch_ids)
+        last_id = batch_ids[-1]
+        if stdout:
+            stdout.write(f"Đã cập nhật giá cho {total} sản phẩm")
+    return total
@@ -0,0 +1,310 @@
+# products/recommendations.py
+"""
+Gợi ý "khách hàng cũng mua" dựng từ các đơn hàng (job chạy định kỳ,
+xem management command build_recommendations).
+
+- Ma trận đồng xuất hiện thưa được dựng bằng NumPy theo từng khoảng id đơn hàng:
+  mỗi đơn hàng sinh mọi cặp sản phẩm (a, b) của nó, cặp được mã hóa thành khóa
+  int64 và đếm bằng np.unique. Đường chéo (a, a) là số đơn hàng có chứa a
+- Điểm tương đồng cosine: count(a, b) / sqrt(count(a) * count(b)); mỗi sản phẩm
+  giữ top-K láng giềng trong ProductRecommendation (đọc bằng một truy vấn theo index)
+- Chế độ tăng dần chỉ đọc các đơn hàng sau lần chạy trước (RecommendationRun.last_order_id),
+  cộng dồn vào ProductCoPurchase rồi tính lại top-K cho các sản phẩm có trong các đơn đó.
+  Đơn hàng có id nhỏ hơn nhưng commit sau khi lần chạy trước đọc id lớn nhất sẽ không bị bỏ
+  sót: mỗi lần chạy đọc lại ORDER_ID_OVERLAP id cuối và bỏ qua các đơn đã xử lý
+  (RecommendationRun.recent_order_ids)
+- Điểm trong danh sách của các sản phẩm còn lại có thể lệch nhẹ, và mục đơn hàng bị
+  hủy/trả sau khi đã được xử lý chỉ được loại ở lần chạy toàn bộ tiếp theo
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from core.db import bulk_upsert
+from .models import Product, ProductCoPurchase, ProductRecommendation, RecommendationRun
+
+TOP_K = 20
+MIN_CO_COUNT = 2
+# Số id đơn hàng đọc trong mỗi lô
+CHUNK_SIZE = 50000
+# Đơn hàng có quá nhiều sản phẩm khác nhau (mua sỉ...) bị bỏ qua: số cặp tăng theo bình phương
+MAX_ORDER_ITEMS = 50
+WRITE_BATCH_SIZE = 5000
+# Số id đơn hàng cuối được đọc lại ở lần chạy tăng dần sau (đơn hàng commit muộn)
+ORDER_ID_OVERLAP = 1000
+REFRESH_BATCH_SIZE = 500
+
+# Mục đơn hàng không được tính
+EXCLUDED_STATUSES = ('cancelled', 'returned')
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _load_order_items(first_order_id, last_order_id):
+    """(order_ids, product_ids) của các mục đơn hàng có id đơn hàng trong (first_order_id, last_order_id]"""
+    from orders.models import OrderItem
+
+    rows = OrderItem.objects.filter(
+        order_id__gt=first_order_id, order_id__lte=last_order_id
+    ).exclude(status__in=EXCLUDED_STATUSES).values_list('order_id', 'product_id')
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+    return data[:, 0], data[:, 1]
+
+
+def _group_bounds(sorted_ids):
+    """(vị trí bắt đầu, kích thước) của từng nhóm giá trị liên tiếp trong mảng đã sắp xếp"""
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    return starts, np.diff(np.r_[starts, len(sorted_ids)])
+
+
+def count_pairs(order_ids, product_ids, base, max_order_items=MAX_ORDER_ITEMS):
+    """
+    Đếm số đơn hàng của từng cặp (a, b), gồm cả hai chiều và đường chéo.
+    Trả về (keys, counts) với key = a * base + b, keys tăng dần.
+    Mỗi sản phẩm chỉ được tính một lần trong một đơn hàng
+    """
+    if not len(order_ids):
+        return _EMPTY, _EMPTY
+
+    # Sắp xếp theo (đơn hàng, sản phẩm) và bỏ trùng
+    order = np.lexsort((product_ids, order_ids))
+    order_ids, product_ids = order_ids[order], product_ids[order]
+    unique = np.r_[True, (order_ids[1:] != order_ids[:-1]) | (product_ids[1:] != product_ids[:-1])]
+    order_ids, product_ids = order_ids[unique], product_ids[unique]
+
+    _, sizes = _group_bounds(order_ids)
+    keep = np.repeat(sizes <= max_order_items, sizes)
+    order_ids, product_ids = order_ids[keep], product_ids[keep]
+    if not len(order_ids):
+        return _EMPTY, _EMPTY
+    starts, sizes = _group_bounds(order_ids)
+
+    # Phần tử i của một đơn hàng kích thước s sinh s cặp (i, j) với j chạy trên cả đơn hàng
+    element_sizes = np.repeat(sizes, sizes)
+    element_starts = np.repeat(starts, sizes)
+    left = np.repeat(product_ids, element_sizes)
+    block_offsets = np.repeat(np.cumsum(element_sizes) - element_sizes, element_sizes)
+    right = product_ids[np.repeat(element_starts, element_sizes) + np.arange(len(left)) - block_offsets]
+
+    return np.unique(left * base + right, return_counts=True)
+
+
+def merge_counts(keys, counts, other_keys, other_counts):
+    """Cộng hai ma trận thưa dạng (keys, counts)"""
+    if not len(keys):
+        return other_keys, other_counts
+    if not len(other_keys):
+        return keys, counts
+    merged, inverse = np.unique(np.concatenate([keys, other_keys]), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate([counts, other_counts]))
+    return merged, totals.astype(np.int64)
+
+
+def select_top_k(left, right, counts, left_totals, right_totals, top_k=TOP_K, min_count=MIN_CO_COUNT):
+    """
+    Chuẩn hóa cosine và giữ top-K láng giềng của từng sản phẩm left.
+    Trả về (left, right, counts, scores, ranks) với rank bắt đầu từ 1
+    """
+    keep = (left != right) & (counts >= min_count)
+    left, right, counts = left[keep], right[keep], counts[keep]
+    left_totals, right_totals = left_totals[keep], right_totals[keep]
+    if not len(left):
+        return _EMPTY, _EMPTY, _EMPTY, np.empty(0), _EMPTY
+
+    scores = counts / np.sqrt(np.maximum(left_totals * right_totals, 1))
+    # Theo sản phẩm, điểm giảm dần, rồi số đơn mua cùng giảm dần
+    order = np.lexsort((right, -counts, -scores, left))
+    left, right, counts, scores = left[order], right[order], counts[order], scores[order]
+
+    starts, sizes = _group_bounds(left)
+    ranks = np.arange(len(left)) - np.repeat(starts, sizes)
+    keep = ranks < top_k
+    return left[keep], right[keep], counts[keep], scores[keep], ranks[keep] + 1
+
+
+def _write_recommendations(left, right, counts, scores, ranks):
+    ProductRecommendation.objects.bulk_create((
+        ProductRecommendation(
+            product_id=product_id, recommended_id=recommended_id, rank=rank, score=score, co_count=count
+        )
+        for product_id, recommended_id, count, score, rank in zip(
+            left.tolist(), right.tolist(), counts.tolist(), scores.tolist(), ranks.tolist()
+        )
+    ), batch_size=WRITE_BATCH_SIZE)
+
+
+def _get_bounds():
+    """
+    Id đơn hàng lớn nhất hiện có và cơ số mã hóa cặp (id sản phẩm lớn nhất + 1).
+    Đọc đơn hàng trước: mọi sản phẩm trong các đơn này đều đã tồn tại khi đọc sản phẩm
+    """
+    from orders.models import Order
+
+    max_order_id = Order.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+    base = (Product.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+    return max_order_id, base
+
+
+def _count_orders(first_order_id, last_order_id, base, chunk_size, skip_order_ids=(), stdout=None):
+    """
+    Ma trận đồng xuất hiện của các đơn hàng trong (first_order_id, last_order_id], đọc theo lô,
+    bỏ qua các đơn trong skip_order_ids. Trả về (keys, counts, id các đơn hàng đã đọc)
+    """
+    keys, counts = _EMPTY, _EMPTY
+    skip_order_ids = np.array(sorted(skip_order_ids), dtype=np.int64)
+    processed = []
+    for start in range(first_order_id, last_order_id, chunk_size):
+        order_ids, product_ids = _load_order_items(start, min(start + chunk_size, last_order_id))
+        if len(skip_order_ids):
+            keep = ~np.isin(order_ids, skip_order_ids)
+            order_ids, product_ids = order_ids[keep], product_ids[keep]
+        chunk_keys, chunk_counts = count_pairs(order_ids, product_ids, base)
+        keys, counts = merge_counts(keys, counts, chunk_keys, chunk_counts)
+        processed.append(np.unique(order_ids))
+        if stdout:
+            stdout.write(f"Đã đọc {sum(len(ids) for ids in processed)} đơn hàng ({len(keys)} cặp)")
+    return keys, counts, np.concatenate(processed) if processed else _EMPTY
+
+
+def _recent_order_ids(last_order_id, *order_id_arrays):
+    """Id các đơn hàng đã xử lý nằm trong cửa sổ đọc lại của lần chạy sau"""
+    order_ids = np.unique(np.concatenate([np.asarray(ids, dtype=np.int64) for ids in order_id_arrays]))
+    return order_ids[order_ids > last_order_id - ORDER_ID_OVERLAP].tolist()
+
+
+def _build_full(run, top_k, min_count, chunk_size, stdout=None):
+    max_order_id, base = _get_bounds()
+    keys, counts, order_ids = _count_orders(0, max_order_id, base, chunk_size, stdout=stdout)
+    left, right = np.divmod(keys, base)
+
+    totals = np.zeros(base, dtype=np.int64)
+    diagonal = left == right
+    totals[left[diagonal]] = counts[diagonal]
+    selected = select_top_k(left, right, counts, totals[left], totals[right], top_k, min_count)
+
+    with transaction.atomic():
+        ProductCoPurchase.objects.all().delete()
+        ProductCoPurchase.objects.bulk_create((
+            ProductCoPurchase(product_id=product_id, other_id=other_id, count=count)
+            for product_id, other_id, count in zip(left.tolist(), right.tolist(), counts.tolist())
+        ), batch_size=WRITE_BATCH_SIZE)
+        ProductRecommendation.objects.all().delete()
+        _write_recommendations(*selected)
+
+        run.last_order_id = max_order_id
+        run.recent_order_ids = _recent_order_ids(max_order_id, order_ids)
+        run.orders_processed = len(order_ids)
+        run.pairs_updated = len(keys)
+        run.products_refreshed = len(np.unique(selected[0]))
+        _finish_run(run)
+
+
+def _load_totals(product_ids):
+    """(id sản phẩm tăng dần, số đơn hàng chứa sản phẩm) đọc từ đường chéo"""
+    ids, totals = [], []
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), REFRESH_BATCH_SIZE):
+        rows = ProductCoPurchase.objects.filter(
+            product_id__in=product_ids[start:start + REFRESH_BATCH_SIZE], other_id=F('product_id')
+        ).values_list('product_id', 'count')
+        for product_id, count in rows:
+            ids.append(product_id)
+            totals.append(count)
+    ids, totals = np.array(ids, dtype=np.int64), np.array(totals, dtype=np.int64)
+    order = np.argsort(ids)
+    return ids[order], totals[order]
+
+
+def _lookup(sorted_ids, values, query):
+    """Giá trị ứng với từng id trong query (0 nếu không có)"""
+    if not len(sorted_ids):
+        return np.zeros(len(query), dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_ids, query), len(sorted_ids) - 1)
+    return np.where(sorted_ids[positions] == query, values[positions], 0)
+
+
+def refresh_recommendations(product_ids, top_k=TOP_K, min_count=MIN_CO_COUNT):
+    """Tính lại top-K của các sản phẩm từ ProductCoPurchase (theo lô), trả về số sản phẩm có gợi ý"""
+    product_ids = list(product_ids)
+    refreshed = 0
+    for start in range(0, len(product_ids), REFRESH_BATCH_SIZE):
+        batch_ids = product_ids[start:start + REFRESH_BATCH_SIZE]
+        rows = np.array(list(
+            ProductCoPurchase.objects.filter(product_id__in=batch_ids).values_list('product_id', 'other_id', 'count')
+        ), dtype=np.int64).reshape(-1, 3)
+        left, right, counts = rows[:, 0], rows[:, 1], rows[:, 2]
+
+        total_ids, totals = _load_totals(np.unique(np.concatenate([left, right])).tolist())
+        selected = select_top_k(
+            left, right, counts, _lookup(total_ids, totals, left), _lookup(total_ids, totals, right),
+            top_k, min_count
+        )
+        ProductRecommendation.objects.filter(product_id__in=batch_ids).delete()
+        _write_recommendations(*selected)
+        refreshed += len(np.unique(selected[0]))
+    return refreshed
+
+
+def _build_incremental(run, previous, top_k, min_count, chunk_size, stdout=None):
+    max_order_id, base = _get_bounds()
+    # Đọc lại cửa sổ id cuối của lần trước, bỏ qua các đơn hàng đã được cộng
+    keys, counts, order_ids = _count_orders(
+        max(previous.last_order_id - ORDER_ID_OVERLAP, 0), max_order_id, base, chunk_size,
+        skip_order_ids=previous.recent_order_ids, stdout=stdout
+    )
+    left, right = np.divmod(keys, base)
+    affected = np.unique(left).tolist()
+
+    with transaction.atomic():
+        # Cộng số đếm mới vào các dòng hiện có (theo lô sản phẩm), ghi bằng upsert
+        for start in range(0, len(affected), REFRESH_BATCH_SIZE):
+            batch_ids = affected[start:start + REFRESH_BATCH_SIZE]
+            existing = np.array(list(
+                ProductCoPurchase.objects.filter(product_id__in=batch_ids).values_list('product_id', 'other_id', 'count')
+            ), dtype=np.int64).reshape(-1, 3)
+            existing_keys = existing[:, 0] * base + existing[:, 1]
+            order = np.argsort(existing_keys)
+
+            in_batch = np.isin(left, batch_ids)
+            batch_keys = keys[in_batch]
+            merged = counts[in_batch] + _lookup(existing_keys[order], existing[:, 2][order], batch_keys)
+            batch_left, batch_right = np.divmod(batch_keys, base)
+            bulk_upsert(ProductCoPurchase, (
+                ProductCoPurchase(product_id=product_id, other_id=other_id, count=count)
+                for product_id, other_id, count in zip(batch_left.tolist(), batch_right.tolist(), merged.tolist())
+            ), unique_fields=['product', 'other'], update_fields=['count'], batch_size=WRITE_BATCH_SIZE)
+
+        run.last_order_id = max(max_order_id, previous.last_order_id)
+        run.recent_order_ids = _recent_order_ids(run.last_order_id, previous.recent_order_ids, order_ids)
+        run.orders_processed = len(order_ids)
+        run.pairs_updated = len(keys)
+        run.products_refreshed = refresh_recommendations(affected, top_k, min_count)
+        _finish_run(run)
+
+
+def _finish_run(run):
+    run.status = 'completed'
+    run.finished_at = timezone.now()
+    run.save()
+
+
+def build_recommendations(full=False, top_k=TOP_K, min_count=MIN_CO_COUNT, chunk_size=CHUNK_SIZE, stdout=None):
+    """
+    Dựng gợi ý toàn bộ, hoặc tăng dần từ các đơn hàng sau lần chạy thành công gần nhất
+    (chưa có lần chạy nào thì dựng toàn bộ). Trả về RecommendationRun
+    """
+    previous = None if full else RecommendationRun.objects.filter(status='completed').order_by('-id').first()
+    run = RecommendationRun.objects.create(mode='incremental' if previous else 'full')
+    try:
+        if previous:
+            _build_incremental(run, previous, top_k, min_count, chunk_size, stdout)
+        else:
+            _build_full(run, top_k, min_count, chunk_size, stdout)
+    except Exception as e:
+        run.status = 'failed'
+        run.message = str(e)
+        run.finished_at = timezone.now()
+        run.save()
+        raise
+    return run
@@ -0,0 +1,176 @@
+# products/sales_rollup.py
+"""
+Số liệu bán hàng cộng dồn theo sản phẩm và biến thể (ProductSalesStats, VariantSalesStats):
+số lượng đã bán, doanh thu, số lượng trả hàng. Đây là nguồn duy nhất cho sold_count
+và sắp xếp "phổ biến" của các danh sách.
+
+- Cập nhật tăng dần mỗi khi mục đơn hàng đổi trạng thái: chụp order_item_rows TRƯỚC khi
+  đổi, gọi record_status_change sau khi đổi (đồng thời cập nhật bucket ngày của bảng
+  xếp hạng bán chạy, xem products/leaderboard.py)
+- Product.sold_count là bản sao của ProductSalesStats.units_sold (cột có index, dùng được
+  cho sắp xếp và phân trang con trỏ), được cập nhật trong cùng transaction
+- rebuild_sales_rollup dựng lại toàn bộ từ order_items theo lô sản phẩm
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.db.models.query import QuerySet
+
+from core.db import bulk_upsert
+from .models import Product, ProductSalesStats, VariantSalesStats
+from .leaderboard import SOLD_STATUSES, sales_delta, sale_day, apply_sales_deltas
+from .cards import refresh_product_cards, refresh_product_cards_on_commit
+
+RETURNED_STATUSES = ('returned',)
+
+ROLLUP_BATCH_SIZE = 500
+
+
+def order_item_rows(items):
+    """
+    Ảnh chụp (product_id, variant_id, shop_id, quantity, subtotal, status, created_at) của các
+    mục đơn hàng, cần lấy TRƯỚC khi đổi trạng thái để biết trạng thái cũ
+    """
+    if isinstance(items, QuerySet):
+        return list(items.values_list(
+            'product_id', 'variant_id', 'shop_id', 'quantity', 'subtotal', 'status', 'created_at'
+        ))
+    return [
+        (item.product_id, item.variant_id, item.shop_id, item.quantity, item.subtotal, item.status, item.created_at)
+        for item in items
+    ]
+
+
+def record_status_change(rows, new_status):
+    """Ghi nhận việc các mục đơn hàng (ảnh chụp từ order_item_rows) chuyển sang new_status"""
+    product_deltas = defaultdict(lambda: [0, Decimal('0'), 0])
+    variant_deltas = defaultdict(lambda: [0, Decimal('0'), 0])
+    variant_products = {}
+    daily_deltas = defaultdict(int)
+
+    for product_id, variant_id, shop_id, quantity, subtotal, old_status, created_at in rows:
+        sold = sales_delta(old_status, new_status, quantity)
+        returned = quantity * ((new_status in RETURNED_STATUSES) - (old_status in RETURNED_STATUSES))
+        if not sold and not returned:
+            continue
+        revenue = (subtotal or Decimal('0')) * ((new_status in SOLD_STATUSES) - (old_status in SOLD_STATUSES))
+        for deltas, key in ((product_deltas, product_id), (variant_deltas, variant_id)):
+            deltas[key][0] += sold
+            deltas[key][1] += revenue
+            deltas[key][2] += returned
+        variant_products[variant_id] = product_id
+        if sold:
+            daily_deltas[(product_id, shop_id, sale_day(created_at))] += sold
+
+    apply_sales_deltas(daily_deltas)
+    _apply_rollup_deltas(product_deltas, variant_deltas, variant_products)
+
+
+def _apply_rollup_deltas(product_deltas, variant_deltas, variant_products):
+    if not product_deltas:
+        return
+
+    # Tạo trước các dòng chưa có, sau đó cộng bằng F() để tránh ghi đè khi cập nhật đồng thời
+    ProductSalesStats.objects.bulk_create(
+        [ProductSalesStats(product_id=product_id) for product_id in product_deltas], ignore_conflicts=True
+    )
+    VariantSalesStats.objects.bulk_create([
+        VariantSalesStats(variant_id=variant_id, product_id=variant_products[variant_id])
+        for variant_id in variant_deltas
+    ], ignore_conflicts=True)
+
+    for model, lookup, deltas in (
+        (ProductSalesStats, 'product_id', product_deltas),
+        (VariantSalesStats, 'variant_id', variant_deltas),
+    ):
+        for key, (sold, revenue, returned) in deltas.items():
+            model.objects.filter(**{lookup: key}).update(
+                units_sold=F('units_sold') + sold,
+                revenue=F('revenue') + revenue,
+                units_returned=F('units_returned') + returned,
+            )
+
+    sold_products = [product_id for product_id, (sold, _, _) in product_deltas.items() if sold]
+    for product_id in sold_products:
+        Product.objects.filter(pk=product_id).update(sold_count=F('sold_count') + product_deltas[product_id][0])
+    # Thẻ sản phẩm hiển thị số lượng đã bán
+    refresh_product_cards_on_commit(sold_products)
+
+
+def _aggregate_order_items(product_ids):
+    """{variant_id: (product_id, units_sold, revenue, units_returned)} tính lại từ order_items"""
+    from orders.models import OrderItem
+
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    rows = OrderItem.objects.filter(product_id__in=product_ids).values('product_id', 'variant_id').annotate(
+        units_sold=Coalesce(Sum('quantity', filter=Q(status__in=SOLD_STATUSES)), 0),
+        revenue=Coalesce(Sum('subtotal', filter=Q(status__in=SOLD_STATUSES)), zero),
+        units_returned=Coalesce(Sum('quantity', filter=Q(status__in=RETURNED_STATUSES)), 0),
+    ).order_by().values_list('variant_id', 'product_id', 'units_sold', 'revenue', 'units_returned')
+    return {variant_id: values for variant_id, *values in rows}
+
+
+def refresh_sales_rollup(product_ids):
+    """
+    Tính lại số liệu bán hàng (và sold_count) của các sản phẩm từ order_items,
+    trả về id các sản phẩm có sold_count thay đổi
+    """
+    product_ids = list(product_ids)
+    changed_product_ids = []
+
+    for start in range(0, len(product_ids), ROLLUP_BATCH_SIZE):
+        batch_ids = product_ids[start:start + ROLLUP_BATCH_SIZE]
+        variants = _aggregate_order_items(batch_ids)
+        totals = {product_id: [0, Decimal('0'), 0] for product_id in batch_ids}
+        for product_id, units_sold, revenue, units_returned in variants.values():
+            totals[product_id][0] += units_sold
+            totals[product_id][1] += revenue
+            totals[product_id][2] += units_returned
+
+        with transaction.atomic():
+            VariantSalesStats.objects.filter(product_id__in=batch_ids).exclude(variant_id__in=list(variants)).delete()
+            bulk_upsert(VariantSalesStats, [
+                VariantSalesStats(variant_id=variant_id, product_id=product_id, units_sold=units_sold,
+                                  revenue=revenue, units_returned=units_returned)
+                for variant_id, (product_id, units_sold, revenue, units_returned) in variants.items()
+            ], unique_fields=['variant'], update_fields=['units_sold', 'revenue', 'units_returned', 'updated_at'])
+
+            products = list(Product.objects.filter(id__in=batch_ids).only('id', 'sold_count'))
+            bulk_upsert(ProductSalesStats, [
+                ProductSalesStats(product_id=product.id, units_sold=totals[product.id][0],
+                                  revenue=totals[product.id][1], units_returned=totals[product.id][2])
+                for product in products
+            ], unique_fields=['product'], update_fields=['units_sold', 'revenue', 'units_returned', 'updated_at'])
+
+            changed = []
+            for product in products:
+                if product.sold_count != totals[product.id][0]:
+                    product.sold_count = totals[product.id][0]
+                    changed.append(product)
+            Product.objects.bulk_update(changed, ['sold_count'], batch_size=ROLLUP_BATCH_SIZE)
+        changed_product_ids.extend(product.id for product in changed)
+
+    if changed_product_ids:
+        refresh_product_cards(changed_product_ids)
+    return changed_product_ids
+
+
+def rebuild_sales_rollup(batch_size=ROLLUP_BATCH_SIZE, stdout=None):
+    """Dựng lại số liệu bán hàng cho toàn bộ sản phẩm theo lô (dùng cho dữ liệu cũ)"""
+    total = 0
+    last_id = 0
+    while True:
+        batch_ids = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch_ids:
+            break
+        refresh_sales_rollup(batch_ids)
+        total += len(batch_ids)
+        last_id = batch_ids[-1]
+        if stdout:
+            stdout.write(f"Đã cập nhật số liệu bán hàng cho {total} sản phẩm")
+    return total
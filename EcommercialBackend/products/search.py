@@ -0,0 +1,236 @@
+# products/search.py
+"""
+Chỉ mục ngược cho tìm kiếm sản phẩm.
+
+- Tách từ có bỏ dấu tiếng Việt ("áo thun" khớp với "ao thun")
+- Chấm điểm BM25 trên các trường có trọng số (tên, tag, mô tả, danh mục, cửa hàng)
+- Cập nhật từng sản phẩm khi lưu/xóa (xem products/signals.py)
+"""
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, IntegerField, Count, Avg
+
+from .models import Product, ProductTag, ProductSearchDocument, ProductSearchPosting
+
+# Trọng số của từng trường khi tính tần suất từ khóa
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'tags': 2.0,
+    'short_description': 1.5,
+    'category': 1.0,
+    'shop': 1.0,
+    'description': 1.0,
+}
+
+# Các trường của Product ảnh hưởng đến nội dung chỉ mục
+INDEXED_PRODUCT_FIELDS = {'name', 'short_description', 'description', 'category', 'category_id', 'shop', 'shop_id'}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Giới hạn số posting đọc cho mỗi từ khóa (posting được sắp theo tần suất giảm dần)
+MAX_POSTINGS_PER_TERM = 20000
+# Số kết quả tối đa trả về cho một truy vấn
+MAX_RESULTS = 1000
+MAX_TERM_LENGTH = 100
+
+STATS_CACHE_KEY = 'product_search:stats'
+DOC_FREQ_CACHE_PREFIX = 'product_search:df:'
+STATS_CACHE_TIMEOUT = 300
+
+INDEX_BATCH_SIZE = 500
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize_text(text):
+    """Chuyển về chữ thường và bỏ dấu tiếng Việt"""
+    if not text:
+        return ''
+    text = str(text).lower().replace('đ', 'd')
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+
+
+def tokenize(text):
+    """Tách văn bản thành danh sách từ khóa đã chuẩn hóa"""
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN_RE.findall(normalize_text(text))]
+
+
+def build_document(product, tag_names):
+    """
+    Tính tần suất có trọng số của từng từ khóa trong sản phẩm.
+    Trả về (dict term -> frequency, độ dài tài liệu)
+    """
+    fields = {
+        'name': product.name,
+        'tags': ' '.join(tag_names),
+        'short_description': product.short_description,
+        'category': product.category.name if product.category_id else '',
+        'shop': product.shop.name if product.shop_id else '',
+        'description': product.description,
+    }
+
+    frequencies = defaultdict(float)
+    length = 0.0
+    for field, text in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for token in tokenize(text):
+            frequencies[token] += weight
+            length += weight
+
+    return frequencies, length
+
+
+def index_products(product_ids):
+    """Đánh chỉ mục lại một nhóm sản phẩm (xóa posting cũ, ghi posting mới)"""
+    product_ids = list(product_ids)
+
+    for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+        batch_ids = product_ids[start:start + INDEX_BATCH_SIZE]
+        products = Product.objects.filter(id__in=batch_ids).select_related('shop', 'category')
+
+        tags_by_product = defaultdict(list)
+        for product_id, tag_name in ProductTag.objects.filter(
+            product_id__in=batch_ids
+        ).values_list('product_id', 'tag__name'):
+            tags_by_product[product_id].append(tag_name)
+
+        postings = []
+        documents = []
+        for product in products:
+            frequencies, length = build_document(product, tags_by_product[product.id])
+            documents.append(ProductSearchDocument(product_id=product.id, length=length))
+            postings.extend(
+                ProductSearchPosting(product_id=product.id, term=term, frequency=frequency, doc_length=length)
+                for term, frequency in frequencies.items()
+            )
+
+        with transaction.atomic():
+            # Sản phẩm đã bị xóa sẽ chỉ bị xóa posting, không ghi lại
+            ProductSearchPosting.objects.filter(product_id__in=batch_ids).delete()
+            ProductSearchDocument.objects.filter(product_id__in=batch_ids).delete()
+            ProductSearchDocument.objects.bulk_create(documents)
+            ProductSearchPosting.objects.bulk_create(postings, batch_size=2000)
+
+
+def index_product(product_id):
+    """Đánh chỉ mục lại một sản phẩm"""
+    index_products([product_id])
+
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE, stdout=None):
+    """Xây dựng lại toàn bộ chỉ mục theo từng lô id"""
+    last_id = 0
+    total = 0
+    while True:
+        batch_ids = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch_ids:
+            break
+        index_products(batch_ids)
+        total += len(batch_ids)
+        last_id = batch_ids[-1]
+        if stdout:
+            stdout.write(f"Đã đánh chỉ mục {total} sản phẩm")
+
+    # Xóa posting mồ côi (nếu có) và thống kê cũ
+    ProductSearchPosting.objects.exclude(product_id__in=Product.objects.values('id')).delete()
+    cache.delete(STATS_CACHE_KEY)
+    return total
+
+
+def _get_collection_stats():
+    """Số tài liệu và độ dài trung bình (được cache trong thời gian ngắn)"""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        aggregate = ProductSearchDocument.objects.aggregate(total=Count('id'), avg_length=Avg('length'))
+        stats = {
+            'total': aggregate['total'] or 0,
+            'avg_length': aggregate['avg_length'] or 0.0,
+        }
+        cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def _get_document_frequencies(terms):
+    """Số sản phẩm chứa mỗi từ khóa"""
+    keys = {DOC_FREQ_CACHE_PREFIX + term: term for term in terms}
+    cached = cache.get_many(list(keys))
+    frequencies = {keys[key]: value for key, value in cached.items()}
+
+    missing = [term for term in terms if term not in frequencies]
+    if missing:
+        rows = ProductSearchPosting.objects.filter(term__in=missing).values('term').annotate(df=Count('id'))
+        fresh = {term: 0 for term in missing}
+        fresh.update({row['term']: row['df'] for row in rows})
+        cache.set_many({DOC_FREQ_CACHE_PREFIX + term: df for term, df in fresh.items()}, STATS_CACHE_TIMEOUT)
+        frequencies.update(fresh)
+
+    return frequencies
+
+
+def search_products(query, shop_id=None, active_only=False, limit=MAX_RESULTS, category_ids=None):
+    """
+    Tìm kiếm sản phẩm theo BM25.
+    Trả về danh sách (product_id, score) sắp xếp theo điểm giảm dần.
+    shop_id/category_ids giới hạn ngay trên posting, để giới hạn limit tính trong phạm vi đó
+    chứ không phải trên toàn bộ sản phẩm
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+
+    stats = _get_collection_stats()
+    if not stats['total']:
+        return []
+    avg_length = stats['avg_length'] or 1.0
+    doc_freqs = _get_document_frequencies(terms)
+
+    scores = defaultdict(float)
+    for term in terms:
+        df = doc_freqs.get(term, 0)
+        if not df:
+            continue
+        idf = math.log(1 + (stats['total'] - df + 0.5) / (df + 0.5))
+
+        postings = ProductSearchPosting.objects.filter(term=term)
+        if shop_id:
+            postings = postings.filter(product__shop_id=shop_id)
+        if category_ids:
+            postings = postings.filter(product__category_id__in=list(category_ids))
+        if active_only:
+            postings = postings.filter(product__status='active')
+        postings = postings.order_by('-frequency').values_list(
+            'product_id', 'frequency', 'doc_length'
+        )[:MAX_POSTINGS_PER_TERM]
+
+        for product_id, frequency, doc_length in postings:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length)
+            scores[product_id] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit] if limit else ranked
+
+
+def search_product_ids(query, shop_id=None, active_only=False, limit=MAX_RESULTS, category_ids=None):
+    """Giống search_products nhưng chỉ trả về danh sách id"""
+    return [product_id for product_id, _ in search_products(query, shop_id, active_only, limit, category_ids)]
+
+
+def order_by_relevance(queryset, ranked_ids):
+    """Sắp xếp queryset theo thứ tự của danh sách id đã xếp hạng (annotate search_rank)"""
+    if not ranked_ids:
+        return queryset.order_by('id')
+    search_rank = Case(
+        *[When(id=product_id, then=position) for position, product_id in enumerate(ranked_ids)],
+        default=len(ranked_ids),
+        output_field=IntegerField()
+    )
+    return queryset.annotate(search_rank=search_rank).order_by('search_rank', 'id')
@@ -3,8 +3,10 @@ from shops.serializers import ShopListSerializer
 from .models import (
     Product, ProductImage, ProductVariant,
     Attribute, AttributeValue, VariantAttributeValue,
-    Tag, ProductTag, Category, Brand
+    Tag, ProductTag, Category, Brand, ProductImportJob
 )
+from core.derivatives import get_image_preferences, select_image_url
+from .cards import get_product_card
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -42,7 +44,7 @@ class AttributeValueSerializer(serializers.ModelSerializer):
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ['id', 'image_url', 'is_thumbnail', 'display_order', 'created_at']
+        fields = ['id', 'image_url', 'upload_status', 'is_thumbnail', 'display_order', 'created_at']
 
 
 class ProductVariantSerializer(serializers.ModelSerializer):
@@ -50,31 +52,54 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ProductVariant
-        fields = ['id', 'product', 'sku', 'price', 'sale_price',
+        fields = ['id', 'product', 'sku', 'price', 'sale_price', 'effective_price',
                   'stock', 'image_url', 'attribute_values', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'effective_price', 'created_at', 'updated_at']
 
 
 class ProductSerializer(serializers.ModelSerializer):
-    category_name = serializers.ReadOnlyField(source='category.name')
-    shop_name = serializers.ReadOnlyField(source='shop.name')
+    category_name = serializers.SerializerMethodField()
+    shop_name = serializers.SerializerMethodField()
     thumbnail = serializers.SerializerMethodField()
+    effective_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = ['id', 'shop', 'shop_name', 'category', 'category_name',
                   'name', 'slug','description', 'short_description', 'price', 'sale_price',
-                  'stock', 'product_type', 'status', 'featured',
+                  'effective_price', 'stock', 'product_type', 'status', 'featured',
                   'rating', 'view_count', 'sold_count', 'thumbnail',
                   'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    # Các trường dưới đây đọc từ thẻ sản phẩm (products/cards.py),
+    # view danh sách cần select_related('card') để không phát sinh truy vấn theo từng dòng
+    def get_category_name(self, obj):
+        card = get_product_card(obj)
+        return card.category_name if card else None
+
+    def get_shop_name(self, obj):
+        card = get_product_card(obj)
+        return card.shop_name if card else None
+
     def get_thumbnail(self, obj):
-        """Lấy URL hình ảnh đại diện của sản phẩm"""
-        thumbnail = obj.images.filter(is_thumbnail=True).first()
-        if thumbnail:
-            return thumbnail.image_url
-        return None
+        """
+        Lấy URL hình ảnh đại diện của sản phẩm theo kích thước/định dạng yêu cầu
+        (?image_size=thumb|card|large|original, ?image_format=webp|jpeg)
+        """
+        card = get_product_card(obj)
+        if not card:
+            return None
+        size, image_format = get_image_preferences(self.context)
+        return select_image_url(card.thumbnail_url, card.thumbnail_derivatives, size, image_format)
+
+    def get_effective_price(self, obj):
+        """
+        Giá "từ" của sản phẩm: giá hiệu lực thấp nhất trong các biến thể (min_price, đã gồm giá
+        khuyến mãi), sản phẩm chưa có biến thể thì là giá khuyến mãi hoặc giá gốc
+        """
+        card = get_product_card(obj)
+        return card.effective_price if card else None
 
 
 class ProductCreateSerializer(serializers.ModelSerializer):
@@ -170,4 +195,22 @@ class CategoryCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = ['name', 'description', 'image', 'status']
\ No newline at end of file
+        fields = ['name', 'description', 'image', 'status']
+
+class ProductImportJobSerializer(serializers.ModelSerializer):
+    """Serializer hiển thị trạng thái một lần nhập sản phẩm hàng loạt"""
+
+    class Meta:
+        model = ProductImportJob
+        fields = ['id', 'shop', 'file_name', 'file_format', 'status', 'processed_rows',
+                  'created_products', 'created_variants', 'failed_rows', 'errors', 'message',
+                  'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class ProductImportJobListSerializer(ProductImportJobSerializer):
+    """Serializer danh sách lần nhập, không kèm chi tiết lỗi (xem ở API chi tiết)"""
+
+    class Meta(ProductImportJobSerializer.Meta):
+        fields = [field for field in ProductImportJobSerializer.Meta.fields if field != 'errors']
+        read_only_fields = fields
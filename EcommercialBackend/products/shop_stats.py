@@ -0,0 +1,150 @@
+# products/shop_stats.py
+"""
+Thống kê sản phẩm của cửa hàng (số sản phẩm theo trạng thái, theo danh mục, tổng tồn kho).
+
+- Snapshot được dựng bằng một truy vấn GROUP BY (status, category) và cache theo cửa hàng
+- Khi sản phẩm được tạo hoặc đổi trạng thái, danh mục, tồn kho, snapshot trong cache được
+  cộng/trừ phần chênh lệch sau khi commit (xem products/signals.py)
+- Snapshot nằm dưới một thế hệ (generation) của cửa hàng; khi không thể cập nhật an toàn
+  (đang có cập nhật khác, chưa có snapshot, thao tác hàng loạt, xóa sản phẩm) thế hệ được
+  tăng để lần đọc sau dựng lại từ DB
+- Thế hệ, khóa và snapshot nằm trong cache dùng chung giữa các worker (core/cache.py),
+  nên thay đổi ghi nhận ở worker này được các worker khác đọc thấy
+- Tên danh mục lấy từ chỉ mục cây danh mục, nên khi cache còn nóng việc đọc thống kê
+  không truy vấn bảng sản phẩm
+"""
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from core.cache import shared_cache
+
+from .models import Product
+from .category_tree import get_category_tree
+
+STATS_CACHE_PREFIX = 'shop_stats:'
+STATS_GENERATION_PREFIX = 'shop_stats:generation:'
+STATS_LOCK_PREFIX = 'shop_stats:lock:'
+STATS_CACHE_TIMEOUT = 3600
+STATS_LOCK_TIMEOUT = 5
+
+# Các trường của Product ảnh hưởng đến thống kê cửa hàng
+STATS_PRODUCT_FIELDS = {'status', 'category', 'category_id', 'stock', 'shop', 'shop_id'}
+
+
+def _get_generation(shop_id):
+    key = f"{STATS_GENERATION_PREFIX}{shop_id}"
+    generation = shared_cache.get(key)
+    if generation is None:
+        shared_cache.add(key, 1, None)
+        generation = shared_cache.get(key, 1)
+    return generation
+
+
+def _cache_key(shop_id, generation):
+    return f"{STATS_CACHE_PREFIX}{shop_id}:{generation}"
+
+
+def invalidate_shop_stats(shop_ids):
+    """Bỏ snapshot hiện tại của các cửa hàng (lần đọc sau dựng lại)"""
+    for shop_id in set(shop_ids):
+        key = f"{STATS_GENERATION_PREFIX}{shop_id}"
+        try:
+            shared_cache.incr(key)
+        except ValueError:
+            shared_cache.set(key, 2, None)
+
+
+def invalidate_shop_stats_on_commit(shop_ids):
+    shop_ids = list(shop_ids)
+    if shop_ids:
+        transaction.on_commit(lambda: invalidate_shop_stats(shop_ids))
+
+
+def _add(snapshot, status, category_id, stock, sign):
+    snapshot['statuses'][status] = snapshot['statuses'].get(status, 0) + sign
+    snapshot['categories'][category_id] = snapshot['categories'].get(category_id, 0) + sign
+    snapshot['total_stock'] += sign * (stock or 0)
+
+
+def build_shop_stats(shop_id):
+    """Snapshot thống kê của cửa hàng từ một truy vấn GROUP BY"""
+    snapshot = {'statuses': {}, 'categories': {}, 'total_stock': 0}
+    rows = Product.objects.filter(shop_id=shop_id).values('status', 'category_id').annotate(
+        count=Count('id'), stock=Sum('stock')
+    ).order_by().values_list('status', 'category_id', 'count', 'stock')
+    for product_status, category_id, count, stock in rows:
+        snapshot['statuses'][product_status] = snapshot['statuses'].get(product_status, 0) + count
+        snapshot['categories'][category_id] = snapshot['categories'].get(category_id, 0) + count
+        snapshot['total_stock'] += stock or 0
+    return snapshot
+
+
+def has_shop_stats(shop_id):
+    """Cửa hàng đang có snapshot trong cache (cần ghi nhận thay đổi)"""
+    return shared_cache.get(_cache_key(shop_id, _get_generation(shop_id))) is not None
+
+
+def get_shop_stats(shop_id):
+    """Dữ liệu thống kê của cửa hàng (dựng snapshot nếu chưa có trong cache)"""
+    # Đọc thế hệ trước khi truy vấn: nếu có thay đổi trong lúc dựng, snapshot này bị bỏ qua
+    key = _cache_key(shop_id, _get_generation(shop_id))
+    snapshot = shared_cache.get(key)
+    if snapshot is None:
+        snapshot = build_shop_stats(shop_id)
+        shared_cache.set(key, snapshot, STATS_CACHE_TIMEOUT)
+
+    statuses = snapshot['statuses']
+    nodes = get_category_tree().nodes
+    return {
+        'total_products': sum(statuses.values()),
+        'active_products': statuses.get('active', 0),
+        'out_of_stock_products': statuses.get('out_of_stock', 0),
+        'inactive_products': statuses.get('inactive', 0),
+        'total_stock': snapshot['total_stock'],
+        'category_stats': [
+            {
+                'id': category_id,
+                'name': nodes[category_id]['name'] if category_id in nodes else None,
+                'count': count,
+            }
+            for category_id, count in sorted(snapshot['categories'].items()) if count > 0
+        ],
+    }
+
+
+def stats_row(product):
+    """(shop_id, status, category_id, stock) của sản phẩm - phần đóng góp vào thống kê"""
+    return product.shop_id, product.status, product.category_id, product.stock
+
+
+def apply_product_change(previous, current):
+    """
+    Cập nhật snapshot khi sản phẩm chuyển từ previous sang current (stats_row; None khi
+    sản phẩm mới tạo). Cửa hàng nào không cập nhật được thì bị tăng thế hệ
+    """
+    changes = {}
+    for row, sign in ((previous, -1), (current, 1)):
+        if row is not None:
+            changes.setdefault(row[0], []).append((row[1:], sign))
+
+    for shop_id, shop_changes in changes.items():
+        lock_key = f"{STATS_LOCK_PREFIX}{shop_id}"
+        if not shared_cache.add(lock_key, 1, STATS_LOCK_TIMEOUT):
+            invalidate_shop_stats([shop_id])
+            continue
+        try:
+            key = _cache_key(shop_id, _get_generation(shop_id))
+            snapshot = shared_cache.get(key)
+            if snapshot is None:
+                # Có thể đang được dựng từ dữ liệu trước thay đổi này
+                invalidate_shop_stats([shop_id])
+                continue
+            for (product_status, category_id, stock), sign in shop_changes:
+                _add(snapshot, product_status, category_id, stock, sign)
+            shared_cache.set(key, snapshot, STATS_CACHE_TIMEOUT)
+        finally:
+            shared_cache.delete(lock_key)
+
+
+def apply_product_change_on_commit(previous, current):
+    transaction.on_commit(lambda: apply_product_change(previous, current))
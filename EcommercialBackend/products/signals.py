@@ -0,0 +1,374 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from core.derivatives import derivatives_ready
+from shops.models import Shop
+from .models import Product, ProductTag, ProductImage, ProductVariant, Category, VariantAttributeValue
+from .search import index_product, index_products, INDEXED_PRODUCT_FIELDS
+from .facets import invalidate_facets, FACET_PRODUCT_FIELDS, FACET_PRODUCT_COLUMNS
+from .cards import refresh_product_cards_on_commit, CARD_PRODUCT_FIELDS
+from .category_tree import invalidate_category_tree, TREE_PRODUCT_FIELDS
+from .detail_cache import invalidate_product_detail, OVERLAY_ONLY_FIELDS, VARIANT_OVERLAY_ONLY_FIELDS
+from .featured import update_featured_pools_on_commit, FEATURED_IGNORED_FIELDS
+from .variant_index import refresh_variant_signatures_on_commit, invalidate_variant_matrix
+from .pricing import refresh_product_prices_on_commit, PRICE_FIELDS
+from .similar import refresh_feature_vectors_on_commit, invalidate_similar_index, SIMILAR_PRODUCT_FIELDS
+from .autocomplete import refresh_autocomplete_terms_on_commit, AUTOCOMPLETE_PRODUCT_FIELDS
+from .shop_stats import (
+    has_shop_stats, stats_row, apply_product_change_on_commit, invalidate_shop_stats_on_commit, STATS_PRODUCT_FIELDS
+)
+
+
+@receiver(post_save, sender=Product)
+def reindex_product_on_save(sender, instance, update_fields=None, **kwargs):
+    """
+    Cập nhật chỉ mục tìm kiếm khi sản phẩm thay đổi.
+    Bỏ qua các lần lưu không chạm đến trường được đánh chỉ mục (ví dụ view_count, stock)
+    """
+    if update_fields is not None and not (set(update_fields) & INDEXED_PRODUCT_FIELDS):
+        return
+    product_id = instance.id
+    transaction.on_commit(lambda: index_product(product_id))
+
+
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def reindex_product_on_tag_change(sender, instance, **kwargs):
+    """Cập nhật chỉ mục khi tag của sản phẩm thay đổi"""
+    product_id = instance.product_id
+    transaction.on_commit(lambda: index_product(product_id))
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Shop)
+def remember_previous_name(sender, instance, **kwargs):
+    """Ghi nhớ tên, trạng thái cũ để chỉ đánh chỉ mục lại khi chúng thay đổi"""
+    if instance.pk:
+        instance._previous_name, instance._previous_status = sender.objects.filter(
+            pk=instance.pk
+        ).values_list('name', 'status').first() or (None, None)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    """Tên danh mục nằm trong chỉ mục của các sản phẩm thuộc danh mục"""
+    if created or getattr(instance, '_previous_name', instance.name) == instance.name:
+        return
+    category_id = instance.id
+    transaction.on_commit(lambda: index_products(
+        Product.objects.filter(category_id=category_id).values_list('id', flat=True)
+    ))
+
+
+@receiver(post_save, sender=Shop)
+def reindex_shop_products(sender, instance, created, **kwargs):
+    """Tên cửa hàng nằm trong chỉ mục của các sản phẩm thuộc cửa hàng"""
+    if created or getattr(instance, '_previous_name', instance.name) == instance.name:
+        return
+    shop_id = instance.id
+    transaction.on_commit(lambda: index_products(
+        Product.objects.filter(shop_id=shop_id).values_list('id', flat=True)
+    ))
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_facet_values(sender, instance, update_fields=None, **kwargs):
+    """Ghi nhớ các giá trị facet cũ để chỉ làm mới chỉ mục facet khi chúng thực sự thay đổi"""
+    instance._previous_facet_values = None
+    if instance._state.adding:
+        return
+    if update_fields is not None and not (set(update_fields) & FACET_PRODUCT_FIELDS):
+        return
+    instance._previous_facet_values = Product.objects.filter(pk=instance.pk).values_list(
+        *FACET_PRODUCT_COLUMNS
+    ).first()
+
+
+@receiver(post_save, sender=Product)
+def invalidate_facets_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """Làm mới chỉ mục facet khi cửa hàng, danh mục, giá, đánh giá, trạng thái thay đổi"""
+    if update_fields is not None and not (set(update_fields) & FACET_PRODUCT_FIELDS):
+        return
+    previous = getattr(instance, '_previous_facet_values', None)
+    if not created and previous == tuple(getattr(instance, column) for column in FACET_PRODUCT_COLUMNS):
+        return
+    invalidate_facets()
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=VariantAttributeValue)
+@receiver(post_delete, sender=VariantAttributeValue)
+def invalidate_facets_on_change(sender, instance, **kwargs):
+    """Làm mới chỉ mục facet khi sản phẩm bị xóa hoặc thuộc tính biến thể thay đổi"""
+    invalidate_facets()
+
+
+@receiver(post_save, sender=Product)
+def refresh_card_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """Làm mới thẻ sản phẩm khi tạo mới hoặc khi giá, đánh giá, cửa hàng, danh mục thay đổi"""
+    if not created and update_fields is not None and not (set(update_fields) & CARD_PRODUCT_FIELDS):
+        return
+    refresh_product_cards_on_commit([instance.id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_card_on_image_change(sender, instance, **kwargs):
+    """Ảnh đại diện nằm trong thẻ sản phẩm"""
+    refresh_product_cards_on_commit([instance.product_id])
+
+
+@receiver(derivatives_ready)
+def refresh_cards_on_derivatives_ready(sender, source_url, **kwargs):
+    """Ảnh phái sinh của ảnh đại diện nằm trong thẻ sản phẩm"""
+    refresh_product_cards_on_commit(
+        ProductImage.objects.filter(image_url=source_url).values_list('product_id', flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Shop)
+def refresh_cards_on_rename(sender, instance, created, **kwargs):
+    """Tên cửa hàng/danh mục nằm trong thẻ của các sản phẩm liên quan"""
+    if created or getattr(instance, '_previous_name', instance.name) == instance.name:
+        return
+    lookup = 'category_id' if sender is Category else 'shop_id'
+    refresh_product_cards_on_commit(
+        Product.objects.filter(**{lookup: instance.id}).values_list('id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_tree_on_category_change(sender, instance, **kwargs):
+    """Cấu trúc cây thay đổi: làm mới chỉ mục cây và facet (facet theo danh mục gồm cả cây con)"""
+    invalidate_category_tree()
+    invalidate_facets()
+
+
+@receiver(post_save, sender=Product)
+def invalidate_tree_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """Số sản phẩm của danh mục thay đổi khi sản phẩm được tạo, đổi danh mục hoặc trạng thái"""
+    if not created and update_fields is not None and not (set(update_fields) & TREE_PRODUCT_FIELDS):
+        return
+    invalidate_category_tree()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_tree_on_product_delete(sender, instance, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+def update_featured_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Cập nhật pool sản phẩm nổi bật khi trạng thái, tên... thay đổi.
+    Thay đổi giá, đánh giá, đã bán, ảnh đã được cập nhật qua refresh_product_cards
+    """
+    if created or update_fields is None:
+        return
+    if set(update_fields) <= (CARD_PRODUCT_FIELDS | FEATURED_IGNORED_FIELDS):
+        return
+    update_featured_pools_on_commit([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def update_featured_on_product_delete(sender, instance, **kwargs):
+    update_featured_pools_on_commit([instance.id])
+
+
+def _invalidate_detail_on_commit(product_ids):
+    """Xóa cache chi tiết sau khi commit để không bị render lại từ dữ liệu cũ"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: invalidate_product_detail(product_ids))
+
+
+@receiver(post_save, sender=Product)
+def invalidate_detail_on_product_save(sender, instance, update_fields=None, **kwargs):
+    """Tồn kho, trạng thái, lượt xem... được ghi đè khi đọc nên không cần xóa cache"""
+    if update_fields is not None and set(update_fields) <= OVERLAY_ONLY_FIELDS:
+        return
+    _invalidate_detail_on_commit([instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_detail_on_product_delete(sender, instance, **kwargs):
+    _invalidate_detail_on_commit([instance.id])
+
+
+@receiver(post_save, sender=ProductVariant)
+def invalidate_detail_on_variant_save(sender, instance, update_fields=None, **kwargs):
+    """Thay đổi tồn kho của biến thể được ghi đè khi đọc nên không cần xóa cache"""
+    if update_fields is not None and set(update_fields) <= VARIANT_OVERLAY_ONLY_FIELDS:
+        return
+    _invalidate_detail_on_commit([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def invalidate_detail_on_related_change(sender, instance, **kwargs):
+    """Biến thể, hình ảnh, tag nằm trong payload chi tiết"""
+    _invalidate_detail_on_commit([instance.product_id])
+
+
+@receiver(post_save, sender=VariantAttributeValue)
+@receiver(post_delete, sender=VariantAttributeValue)
+def invalidate_detail_on_variant_attribute_change(sender, instance, **kwargs):
+    """Thuộc tính của biến thể nằm trong payload chi tiết"""
+    _invalidate_detail_on_commit(
+        ProductVariant.objects.filter(id=instance.variant_id).values_list('product_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Shop)
+def invalidate_detail_on_shop_or_category_save(sender, instance, created, **kwargs):
+    """Thông tin cửa hàng/danh mục được lồng trong payload chi tiết của các sản phẩm liên quan"""
+    if created:
+        return
+    lookup = 'category_id' if sender is Category else 'shop_id'
+    _invalidate_detail_on_commit(
+        Product.objects.filter(**{lookup: instance.id}).values_list('id', flat=True)
+    )
+
+
+@receiver(post_save, sender=VariantAttributeValue)
+@receiver(post_delete, sender=VariantAttributeValue)
+def refresh_signature_on_variant_attribute_change(sender, instance, **kwargs):
+    """Signature của biến thể được tính từ các giá trị thuộc tính của nó"""
+    refresh_variant_signatures_on_commit([instance.variant_id])
+
+
+@receiver(post_save, sender=ProductVariant)
+def invalidate_matrix_on_variant_create(sender, instance, created, **kwargs):
+    """Biến thể mới: ma trận biến thể của sản phẩm thay đổi (tồn kho luôn được đọc mới)"""
+    if created:
+        _invalidate_matrix_on_commit(instance.product_id)
+
+
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_matrix_on_variant_delete(sender, instance, **kwargs):
+    _invalidate_matrix_on_commit(instance.product_id)
+
+
+def _invalidate_matrix_on_commit(product_id):
+    transaction.on_commit(lambda: invalidate_variant_matrix([product_id]))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+def refresh_prices_on_price_change(sender, instance, created, update_fields=None, **kwargs):
+    """Giá hiệu lực của biến thể và khoảng giá của sản phẩm phụ thuộc vào giá sản phẩm/biến thể"""
+    if not created and update_fields is not None and not (set(update_fields) & PRICE_FIELDS):
+        return
+    refresh_product_prices_on_commit([instance.id if sender is Product else instance.product_id])
+
+
+@receiver(post_delete, sender=ProductVariant)
+def refresh_prices_on_variant_delete(sender, instance, **kwargs):
+    refresh_product_prices_on_commit([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+def refresh_feature_vector_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """Vector sản phẩm tương tự gồm danh mục, cửa hàng và trạng thái (giá: xem products/pricing.py)"""
+    if not created and update_fields is not None and not (set(update_fields) & SIMILAR_PRODUCT_FIELDS):
+        return
+    refresh_feature_vectors_on_commit([instance.id])
+
+
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def refresh_feature_vector_on_tag_change(sender, instance, **kwargs):
+    refresh_feature_vectors_on_commit([instance.product_id])
+
+
+@receiver(post_save, sender=VariantAttributeValue)
+@receiver(post_delete, sender=VariantAttributeValue)
+def refresh_feature_vector_on_variant_attribute_change(sender, instance, **kwargs):
+    """Giá trị thuộc tính của các biến thể nằm trong vector sản phẩm tương tự"""
+    refresh_feature_vectors_on_commit(
+        ProductVariant.objects.filter(id=instance.variant_id).values_list('product_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_similar_on_product_delete(sender, instance, **kwargs):
+    """Vector bị xóa theo sản phẩm; các tiến trình lọc sản phẩm đã xóa khi đọc và khi dựng lại chỉ mục"""
+    transaction.on_commit(invalidate_similar_index)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_stats(sender, instance, update_fields=None, **kwargs):
+    """
+    Ghi nhớ trạng thái, danh mục, tồn kho cũ để cập nhật thống kê cửa hàng theo chênh lệch.
+    Chỉ đọc lại khi cửa hàng đang có snapshot trong cache
+    """
+    instance._previous_stats = None
+    if instance._state.adding:
+        return
+    if update_fields is not None and not (set(update_fields) & STATS_PRODUCT_FIELDS):
+        return
+    if has_shop_stats(instance.shop_id):
+        instance._previous_stats = Product.objects.filter(pk=instance.pk).values_list(
+            'shop_id', 'status', 'category_id', 'stock'
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+def update_shop_stats_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """Cộng/trừ chênh lệch vào snapshot thống kê cửa hàng (không có giá trị cũ thì dựng lại)"""
+    if not created and update_fields is not None and not (set(update_fields) & STATS_PRODUCT_FIELDS):
+        return
+    current = stats_row(instance)
+    previous = getattr(instance, '_previous_stats', None)
+    if created:
+        apply_product_change_on_commit(None, current)
+    elif previous is None:
+        invalidate_shop_stats_on_commit([instance.shop_id])
+    elif previous != current:
+        apply_product_change_on_commit(previous, current)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_shop_stats_on_product_delete(sender, instance, **kwargs):
+    invalidate_shop_stats_on_commit([instance.shop_id])
+
+
+@receiver(post_save, sender=Product)
+def refresh_autocomplete_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    """Mục gợi ý của sản phẩm gồm tên và trạng thái (của sản phẩm và cửa hàng)"""
+    if not created and update_fields is not None and not (set(update_fields) & AUTOCOMPLETE_PRODUCT_FIELDS):
+        return
+    refresh_autocomplete_terms_on_commit('product', [instance.id])
+    if created:
+        # Danh mục/cửa hàng chỉ được gợi ý khi có sản phẩm đang bán
+        refresh_autocomplete_terms_on_commit('category', [instance.category_id] if instance.category_id else [])
+        refresh_autocomplete_terms_on_commit('shop', [instance.shop_id])
+
+
+@receiver(post_delete, sender=Product)
+def refresh_autocomplete_on_product_delete(sender, instance, **kwargs):
+    refresh_autocomplete_terms_on_commit('product', [instance.id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_autocomplete_on_category_change(sender, instance, **kwargs):
+    refresh_autocomplete_terms_on_commit('category', [instance.id])
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def refresh_autocomplete_on_shop_change(sender, instance, created=False, **kwargs):
+    """Sản phẩm chỉ được gợi ý khi cửa hàng đang hoạt động"""
+    refresh_autocomplete_terms_on_commit('shop', [instance.id])
+    if not created and getattr(instance, '_previous_status', instance.status) != instance.status:
+        refresh_autocomplete_terms_on_commit(
+            'product', Product.objects.filter(shop_id=instance.id).values_list('id', flat=True)
+        )
@@ -0,0 +1,396 @@
+# products/similar.py
+"""
+Gợi ý "sản phẩm tương tự" theo nội dung (dùng được cho sản phẩm mới, chưa có lịch sử mua).
+
+- Mỗi sản phẩm có một vector đặc trưng FEATURE_DIM chiều (feature hashing có dấu) gồm:
+  danh mục và các danh mục cha (trọng số giảm dần theo độ sâu), tag, giá trị thuộc tính
+  của các biến thể, khoảng giá (thang log) và cửa hàng. Mỗi nhóm được chuẩn hóa rồi nhân
+  trọng số, vector cuối cùng có độ dài 1 nên tích vô hướng là độ tương đồng cosine
+- Vector được lưu trong ProductFeatureVector và tính lại khi sản phẩm, tag, thuộc tính,
+  giá thay đổi (xem products/signals.py, products/pricing.py)
+- Mỗi tiến trình giữ một ma trận float32 trong bộ nhớ (N x FEATURE_DIM, khoảng 512MB với
+  1 triệu sản phẩm). Khi version trong cache dùng chung (core/cache.py) thay đổi, tiến trình
+  chỉ đọc lại các vector có updated_at mới hơn lần đồng bộ trước. Chỉ mục được dựng lại toàn
+  bộ sau INDEX_MAX_AGE ở luồng nền, các request vẫn dùng chỉ mục cũ trong lúc dựng. Truy vấn là phép nhân ma trận theo từng khối,
+  với chỉ mục lớn thì chỉ trên các ứng viên chọn bằng chữ ký SimHash (LSH chiếu ngẫu nhiên),
+  xem management command benchmark_similar_products
+- Thay đổi cấu trúc cây danh mục chỉ được phản ánh sau khi chạy rebuild_similar_index
+"""
+import itertools
+import logging
+import math
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+import numpy as np
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.cache import shared_cache
+from core.db import bulk_upsert
+from .models import Product, ProductTag, VariantAttributeValue, ProductFeatureVector
+from .category_tree import get_category_tree
+
+FEATURE_DIM = 128
+
+# Trọng số của từng nhóm đặc trưng (tổng bằng 1)
+FEATURE_WEIGHTS = {
+    'category': 0.35,
+    'tags': 0.25,
+    'attributes': 0.2,
+    'price': 0.1,
+    'shop': 0.1,
+}
+# Danh mục cha kém quan trọng hơn danh mục của sản phẩm
+CATEGORY_DEPTH_DECAY = 0.5
+MAX_CATEGORY_DEPTH = 5
+# Mỗi khoảng giá rộng gấp PRICE_BAND_RATIO lần khoảng trước; khoảng kề bên được tính một nửa
+PRICE_BAND_RATIO = 1.5
+
+# Các trường của Product ảnh hưởng đến vector (giá được xử lý qua products/pricing.py)
+SIMILAR_PRODUCT_FIELDS = {'category', 'category_id', 'shop', 'shop_id', 'status'}
+
+DEFAULT_SIMILAR_LIMIT = 10
+MAX_SIMILAR_LIMIT = 50
+
+SIMILAR_VERSION_KEY = 'similar_index:version'
+# Đọc lại các vector ghi gần thời điểm đồng bộ trước (transaction commit muộn)
+SYNC_OVERLAP = timedelta(seconds=60)
+# Dựng lại toàn bộ định kỳ để loại các sản phẩm đã bị xóa
+INDEX_MAX_AGE = 3600
+QUERY_CHUNK_SIZE = 131072
+# Trên ngưỡng này chỉ tính điểm chính xác cho các ứng viên chọn bằng SimHash
+EXACT_SEARCH_LIMIT = 100000
+LSH_CANDIDATES = 10000
+SIGNATURE_BITS = 64
+VECTOR_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_rebuild_thread = None
+
+
+def _hash_feature(name):
+    """(vị trí, dấu) của một đặc trưng; crc32 ổn định giữa các tiến trình"""
+    value = zlib.crc32(name.encode('utf-8'))
+    return (value >> 1) % FEATURE_DIM, 1.0 if value & 1 else -1.0
+
+
+# Các siêu phẳng ngẫu nhiên cố định cho chữ ký SimHash (giống nhau ở mọi tiến trình)
+_PROJECTION = np.random.default_rng(20240601).standard_normal((FEATURE_DIM, SIGNATURE_BITS)).astype(np.float32)
+_BIT_VALUES = np.left_shift(np.uint64(1), np.arange(SIGNATURE_BITS, dtype=np.uint64))
+
+
+def simhash(vectors):
+    """Chữ ký 64 bit của từng vector: bit i bằng 1 nếu vector nằm phía dương của siêu phẳng i"""
+    return np.bitwise_or.reduce(np.where((vectors @ _PROJECTION) > 0, _BIT_VALUES, np.uint64(0)), axis=1)
+
+
+def build_vector(groups):
+    """
+    Vector đặc trưng từ {tên nhóm: [(tên đặc trưng, trọng số)]}.
+    Trả về mảng float32 độ dài 1 (toàn 0 nếu không có đặc trưng)
+    """
+    vector = np.zeros(FEATURE_DIM, dtype=np.float32)
+    for group, features in groups.items():
+        if not features:
+            continue
+        part = np.zeros(FEATURE_DIM, dtype=np.float32)
+        for name, weight in features:
+            position, sign = _hash_feature(f"{group}:{name}")
+            part[position] += sign * weight
+        norm = np.linalg.norm(part)
+        if norm:
+            vector += part * (math.sqrt(FEATURE_WEIGHTS[group]) / norm)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _price_band(price):
+    if not price or price <= 0:
+        return None
+    return math.floor(math.log(float(price)) / math.log(PRICE_BAND_RATIO))
+
+
+def _category_features(tree, category_id):
+    features = []
+    weight = 1.0
+    for _ in range(MAX_CATEGORY_DEPTH):
+        if category_id is None:
+            break
+        features.append((category_id, weight))
+        node = tree.nodes.get(category_id)
+        category_id = node['parent_id'] if node else None
+        weight *= CATEGORY_DEPTH_DECAY
+    return features
+
+
+def compute_feature_vectors(product_ids):
+    """{product_id: (vector, is_active)} của các sản phẩm còn tồn tại (4 truy vấn cho cả lô)"""
+    rows = list(Product.objects.filter(id__in=product_ids).values_list(
+        'id', 'category_id', 'shop_id', 'status', 'min_price', 'price', 'sale_price'
+    ))
+    if not rows:
+        return {}
+
+    ids = [row[0] for row in rows]
+    tags = {product_id: [] for product_id in ids}
+    for product_id, tag_id in ProductTag.objects.filter(product_id__in=ids).values_list('product_id', 'tag_id'):
+        tags[product_id].append((tag_id, 1.0))
+    attributes = {product_id: set() for product_id in ids}
+    for product_id, value_id in VariantAttributeValue.objects.filter(
+        variant__product_id__in=ids
+    ).values_list('variant__product_id', 'attribute_value_id'):
+        attributes[product_id].add(value_id)
+
+    tree = get_category_tree()
+    vectors = {}
+    for product_id, category_id, shop_id, status, min_price, price, sale_price in rows:
+        band = _price_band(min_price if min_price is not None else (sale_price or price))
+        groups = {
+            'category': _category_features(tree, category_id),
+            'tags': tags[product_id],
+            'attributes': [(value_id, 1.0) for value_id in attributes[product_id]],
+            'price': [] if band is None else [(band, 1.0), (band - 1, 0.5), (band + 1, 0.5)],
+            'shop': [(shop_id, 1.0)],
+        }
+        vectors[product_id] = (build_vector(groups), status == 'active')
+    return vectors
+
+
+def refresh_feature_vectors(product_ids):
+    """Tính lại và lưu vector của các sản phẩm (theo lô), báo cho các tiến trình đồng bộ lại"""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), VECTOR_BATCH_SIZE):
+        vectors = compute_feature_vectors(product_ids[start:start + VECTOR_BATCH_SIZE])
+        bulk_upsert(ProductFeatureVector, [
+            ProductFeatureVector(product_id=product_id, vector=vector.tobytes(), is_active=is_active)
+            for product_id, (vector, is_active) in vectors.items()
+        ], unique_fields=['product'], update_fields=['vector', 'is_active', 'updated_at'])
+    if product_ids:
+        transaction.on_commit(invalidate_similar_index)
+
+
+def refresh_feature_vectors_on_commit(product_ids):
+    """Tính lại vector sau khi transaction hiện tại được commit"""
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: refresh_feature_vectors(product_ids))
+
+
+def rebuild_feature_vectors(batch_size=VECTOR_BATCH_SIZE, stdout=None):
+    """Tính lại vector cho toàn bộ sản phẩm theo lô (dùng cho dữ liệu cũ)"""
+    total = 0
+    last_id = 0
+    while True:
+        batch_ids = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch_ids:
+            break
+        refresh_feature_vectors(batch_ids)
+        total += len(batch_ids)
+        last_id = batch_ids[-1]
+        if stdout:
+            stdout.write(f"Đã cập nhật vector cho {total} sản phẩm")
+    return total
+
+
+class SimilarityIndex:
+    """
+    Ma trận vector của các sản phẩm, tìm top-K theo tích vô hướng.
+    Chỉ mục nhỏ được quét toàn bộ; chỉ mục lớn chọn trước LSH_CANDIDATES ứng viên có
+    chữ ký SimHash gần nhất (khoảng cách Hamming) rồi mới tính điểm chính xác
+    """
+
+    def __init__(self, capacity=1024):
+        self.matrix = np.zeros((capacity, FEATURE_DIM), dtype=np.float32)
+        self.signatures = np.zeros(capacity, dtype=np.uint64)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.positions = {}
+        self.size = 0
+        self.synced_at = None
+        self.built_at = time.time()
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self.matrix = np.resize(self.matrix, (capacity, FEATURE_DIM))
+        self.signatures = np.resize(self.signatures, capacity)
+        self.ids = np.resize(self.ids, capacity)
+
+    def upsert_many(self, product_ids, vectors, active):
+        """Thêm/thay vector của các sản phẩm; sản phẩm không active được lưu vector 0 (không bao giờ được chọn)"""
+        if not len(product_ids):
+            return
+        self._grow(self.size + len(product_ids))
+        positions = []
+        for product_id in product_ids:
+            position = self.positions.get(product_id)
+            if position is None:
+                position = self.size
+                self.positions[product_id] = position
+                self.ids[position] = product_id
+                self.size += 1
+            positions.append(position)
+        vectors = np.where(np.asarray(active, dtype=bool)[:, None], vectors, 0).astype(np.float32)
+        self.matrix[positions] = vectors
+        self.signatures[positions] = simhash(vectors)
+
+    def upsert(self, product_id, vector, is_active=True):
+        self.upsert_many([product_id], np.asarray(vector)[None, :], [is_active])
+
+    def vector(self, product_id):
+        position = self.positions.get(product_id)
+        return None if position is None else self.matrix[position]
+
+    def _candidates(self, vector):
+        """Vị trí các ứng viên có chữ ký gần chữ ký truy vấn nhất (ngưỡng Hamming theo histogram)"""
+        distances = np.bitwise_count(self.signatures[:self.size] ^ simhash(vector[None, :])[0])
+        threshold = np.searchsorted(np.cumsum(np.bincount(distances, minlength=SIGNATURE_BITS + 1)), LSH_CANDIDATES)
+        return np.flatnonzero(distances <= threshold)
+
+    def top_k(self, vector, k, exclude_ids=()):
+        """[(product_id, điểm)] giảm dần, chỉ gồm các sản phẩm có điểm > 0"""
+        wanted = k + len(exclude_ids)
+        if self.size > EXACT_SEARCH_LIMIT:
+            positions = self._candidates(vector)
+            blocks = [(self.matrix[positions], self.ids[positions])]
+        else:
+            # Lát cắt (không sao chép) theo từng khối
+            blocks = [
+                (self.matrix[start:end], self.ids[start:end])
+                for start, end in (
+                    (start, min(start + QUERY_CHUNK_SIZE, self.size)) for start in range(0, self.size, QUERY_CHUNK_SIZE)
+                )
+            ]
+
+        candidate_ids, candidate_scores = [], []
+        for matrix, ids in blocks:
+            scores = matrix @ vector
+            if len(scores) > wanted:
+                top = np.argpartition(scores, -wanted)[-wanted:]
+                scores, ids = scores[top], ids[top]
+            candidate_ids.append(ids)
+            candidate_scores.append(scores)
+        if not candidate_ids:
+            return []
+
+        ids, scores = np.concatenate(candidate_ids), np.concatenate(candidate_scores)
+        order = np.lexsort((ids, -scores))
+        result = []
+        for product_id, score in zip(ids[order].tolist(), scores[order].tolist()):
+            if score <= 0 or len(result) == k:
+                break
+            if product_id not in exclude_ids:
+                result.append((product_id, score))
+        return result
+
+
+def _sync_index(index):
+    """Đọc các vector đã thay đổi từ lần đồng bộ trước (toàn bộ nếu chỉ mục mới)"""
+    synced_at = timezone.now()
+    rows = ProductFeatureVector.objects.all()
+    if index.synced_at is not None:
+        rows = rows.filter(updated_at__gte=index.synced_at - SYNC_OVERLAP)
+    rows = rows.values_list('product_id', 'vector', 'is_active').iterator(chunk_size=VECTOR_BATCH_SIZE)
+    while True:
+        batch = list(itertools.islice(rows, VECTOR_BATCH_SIZE))
+        if not batch:
+            break
+        index.upsert_many(
+            [product_id for product_id, _, _ in batch],
+            np.stack([np.frombuffer(vector, dtype=np.float32) for _, vector, _ in batch]),
+            [is_active for _, _, is_active in batch],
+        )
+    index.synced_at = synced_at
+
+
+def _get_version():
+    version = shared_cache.get(SIMILAR_VERSION_KEY)
+    if version is None:
+        shared_cache.add(SIMILAR_VERSION_KEY, 1, None)
+        version = shared_cache.get(SIMILAR_VERSION_KEY, 1)
+    return version
+
+
+def invalidate_similar_index():
+    """Báo cho mọi tiến trình đồng bộ lại các vector đã thay đổi"""
+    try:
+        shared_cache.incr(SIMILAR_VERSION_KEY)
+    except ValueError:
+        shared_cache.set(SIMILAR_VERSION_KEY, 2, None)
+
+
+def _rebuild_in_background():
+    """Dựng lại toàn bộ chỉ mục ở luồng nền (loại các sản phẩm đã bị xóa) rồi thay chỉ mục cũ"""
+    global _rebuild_thread
+
+    def run():
+        global _index, _index_version
+        try:
+            # Version lấy trước khi đọc: thay đổi trong lúc dựng được đồng bộ tăng dần sau đó
+            version = _get_version()
+            index = SimilarityIndex()
+            _sync_index(index)
+            with _lock:
+                _index, _index_version = index, version
+        except Exception:
+            logger.exception("Không thể dựng lại chỉ mục sản phẩm tương tự")
+        finally:
+            connections.close_all()
+
+    with _lock:
+        if _rebuild_thread is not None and _rebuild_thread.is_alive():
+            return
+        _rebuild_thread = threading.Thread(target=run, name='similar-index-rebuild', daemon=True)
+        _rebuild_thread.start()
+
+
+def get_similarity_index():
+    """Chỉ mục của tiến trình hiện tại (đồng bộ tăng dần nếu version đã thay đổi)"""
+    global _index, _index_version
+
+    version = _get_version()
+    index = _index
+    if index is not None and time.time() - index.built_at >= INDEX_MAX_AGE:
+        _rebuild_in_background()
+    if index is not None and _index_version == version:
+        return index
+
+    with _lock:
+        # Lần đầu tiên của tiến trình: chưa có chỉ mục nào để dùng tạm nên dựng ngay
+        if _index is None:
+            _index = SimilarityIndex()
+            _index_version = None
+        if _index_version != version:
+            _sync_index(_index)
+            _index_version = version
+        return _index
+
+
+def find_similar_products(product_id, limit=DEFAULT_SIMILAR_LIMIT):
+    """
+    [(product_id, điểm)] các sản phẩm tương tự (có thể gồm sản phẩm vừa ngừng bán, cần lọc lại
+    khi đọc), None nếu sản phẩm không tồn tại
+    """
+    index = get_similarity_index()
+    vector = index.vector(product_id)
+    if vector is None or not vector.any():
+        # Sản phẩm chưa có vector hoặc không active: tính trực tiếp
+        vectors = compute_feature_vectors([product_id])
+        if product_id not in vectors:
+            return None
+        vector = vectors[product_id][0]
+    return index.top_k(vector, limit, exclude_ids={product_id})
@@ -0,0 +1,207 @@
+from unittest import mock
+
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.db import bulk_upsert
+from core.models import Address, User
+from orders.models import Order, OrderItem
+from shops.models import Shop
+from .cards import refresh_product_cards
+from .importer import ProductImporter
+from .recommendations import build_recommendations
+from .models import AttributeValue, Category, Product, ProductCard, ProductCoPurchase, ProductVariant
+from .variant_writer import AttributeResolver, build_attribute_specs, variant_attribute_pairs, write_variants
+
+
+class BulkUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('owner@example.com', 'pw', full_name='Owner', role='shop_owner')
+        cls.shop = Shop.objects.create(owner=owner, name='Cửa hàng')
+        cls.category = Category.objects.create(name='Áo thun')
+        cls.product = Product.objects.create(
+            shop=cls.shop, category=cls.category, name='Áo thun trắng', slug='ao-thun-trang', price=100000, stock=5
+        )
+
+    def test_refresh_product_cards_updates_existing_card(self):
+        refresh_product_cards([self.product.id])
+        Product.objects.filter(id=self.product.id).update(price=80000)
+        refresh_product_cards([self.product.id])
+
+        card = ProductCard.objects.get(product=self.product)
+        self.assertEqual(ProductCard.objects.filter(product=self.product).count(), 1)
+        self.assertEqual(card.effective_price, 80000)
+
+    def test_bulk_upsert_omits_unique_fields_without_conflict_target_support(self):
+        """MySQL (ON DUPLICATE KEY UPDATE) báo NotSupportedError nếu truyền unique_fields"""
+        card = ProductCard(product=self.product, shop_name='Cửa hàng')
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(QuerySet, 'bulk_create') as bulk_create:
+            bulk_upsert(ProductCard, [card], unique_fields=['product'], update_fields=['shop_name'])
+
+        kwargs = bulk_create.call_args.kwargs
+        self.assertTrue(kwargs['update_conflicts'])
+        self.assertNotIn('unique_fields', kwargs)
+        self.assertEqual(kwargs['update_fields'], ['shop_name'])
+
+    def test_bulk_upsert_passes_unique_fields_when_supported(self):
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', True), \
+                mock.patch.object(QuerySet, 'bulk_create') as bulk_create:
+            bulk_upsert(ProductCard, [ProductCard(product=self.product)], unique_fields=['product'],
+                        update_fields=['shop_name'])
+
+        self.assertEqual(bulk_create.call_args.kwargs['unique_fields'], ['product'])
+
+
+class ProductImporterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('importer@example.com', 'pw', full_name='Owner', role='shop_owner')
+        cls.shop = Shop.objects.create(owner=owner, name='Cửa hàng nhập')
+        cls.category = Category.objects.create(name='Quần')
+
+    def test_overlong_slug_is_reported_for_its_row_only(self):
+        rows = [
+            (1, {'name': 'Quần jean', 'slug': 'q' * 256, 'category_id': self.category.id, 'price': '200000'}),
+            (2, {'name': 'Quần kaki', 'slug': 'quan-kaki', 'category_id': self.category.id, 'price': '150000'}),
+        ]
+        importer = ProductImporter(self.shop)
+        importer._process_chunk(rows)
+
+        self.assertEqual(importer.stats['created_products'], 1)
+        self.assertEqual(importer.errors, [{'row': 1, 'errors': {'slug': 'Slug tối đa 255 ký tự'}}])
+        self.assertTrue(Product.objects.filter(slug='quan-kaki').exists())
+
+    def test_index_refresh_failure_does_not_mark_created_rows_as_errors(self):
+        rows = [(1, {'name': 'Quần short', 'slug': 'quan-short', 'category_id': self.category.id, 'price': '90000'})]
+        importer = ProductImporter(self.shop)
+        with mock.patch.object(importer, '_after_chunk', side_effect=RuntimeError('index down')), \
+                self.assertLogs('products.importer', level='ERROR'):
+            importer._process_chunk(rows)
+
+        self.assertEqual(importer.stats['created_products'], 1)
+        self.assertEqual(importer.errors, [])
+        self.assertTrue(Product.objects.filter(slug='quan-short').exists())
+
+
+class AttributeResolverTests(TestCase):
+    def test_numeric_values_match_existing_string_values(self):
+        specs = build_attribute_specs([{'name': 'size', 'type': 'size', 'values': [{'value': 42}]}])
+        first = AttributeResolver().resolve(specs)
+        second = AttributeResolver().resolve(specs)
+
+        self.assertEqual(AttributeValue.objects.filter(attribute__name='size').count(), 1)
+        self.assertEqual(first, second)
+        self.assertIn(variant_attribute_pairs({'size': 42})[0], second)
+
+
+class WriteVariantsTests(TestCase):
+    def test_rows_sharing_a_sku_keep_their_own_attributes(self):
+        owner = User.objects.create_user('variants@example.com', 'pw', full_name='Owner', role='shop_owner')
+        shop = Shop.objects.create(owner=owner, name='Cửa hàng biến thể')
+        product = Product.objects.create(
+            shop=shop, category=Category.objects.create(name='Áo'), name='Áo', slug='ao', price=100000
+        )
+        value_map = AttributeResolver().resolve(build_attribute_specs([
+            {'name': 'size', 'type': 'size', 'values': [{'value': 'M'}, {'value': 'L'}]}
+        ]))
+        size_m, size_l = value_map[('size', 'M')], value_map[('size', 'L')]
+
+        created = write_variants(product, [
+            {'sku': 'AO-1', 'stock': 1, 'attribute_value_ids': [size_m]},
+            {'sku': 'AO-1', 'stock': 2, 'attribute_value_ids': [size_l]},
+        ], taken_skus=set())
+
+        self.assertEqual([variant.stock for variant in created], [1, 2])
+        self.assertEqual(len({variant.id for variant in created}), 2)
+        for variant, value_id in zip(created, [size_m, size_l]):
+            self.assertEqual(
+                list(variant.attribute_values.values_list('attribute_value_id', flat=True)), [value_id]
+            )
+
+
+class IncrementalRecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('seller@example.com', 'pw', full_name='Owner', role='shop_owner')
+        cls.customer = User.objects.create_user('buyer@example.com', 'pw', full_name='Buyer', role='customer')
+        cls.address = Address.objects.create(
+            user=cls.customer, recipient_name='Buyer', phone='0900000000', province='HN', district='D', ward='W',
+            street_address='S'
+        )
+        shop = Shop.objects.create(owner=owner, name='Cửa hàng gợi ý')
+        category = Category.objects.create(name='Giày')
+        cls.products = []
+        for index in range(3):
+            product = Product.objects.create(
+                shop=shop, category=category, name=f'Giày {index}', slug=f'giay-{index}', price=100000, stock=5
+            )
+            ProductVariant.objects.create(product=product, sku=f'giay-{index}-1', price=100000, stock=5)
+            cls.products.append(product)
+
+    def _order(self, products, order_id=None):
+        order = Order.objects.create(
+            id=order_id, user=self.customer, address=self.address, total_amount=1, payment_method='cod'
+        )
+        for product in products:
+            OrderItem.objects.create(
+                order=order, product=product, variant=product.variants.first(), shop=product.shop,
+                quantity=1, price=1, subtotal=1
+            )
+        return order
+
+    def _co_purchases(self):
+        return {(row.product_id, row.other_id): row.count for row in ProductCoPurchase.objects.all()}
+
+    def test_order_committed_after_cursor_is_counted(self):
+        first, second, third = self.products
+        self._order([first, second])
+        build_recommendations(min_count=1)
+
+        # Đơn hàng có id nhỏ hơn chỉ hiện ra sau khi lần chạy tăng dần đã đọc id lớn hơn
+        late = self._order([second, third])
+        late_id = late.id
+        late.delete()
+        self._order([first, third])
+        build_recommendations(min_count=1)
+        self._order([second, third], order_id=late_id)
+        build_recommendations(min_count=1)
+        incremental = self._co_purchases()
+
+        build_recommendations(full=True, min_count=1)
+        self.assertEqual(incremental, self._co_purchases())
+        self.assertEqual(incremental[(second.id, third.id)], 1)
+
+
+class ShopProductsSalesVisibilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner@example.com', 'pw', full_name='Owner', role='shop_owner')
+        cls.customer = User.objects.create_user('customer@example.com', 'pw', full_name='Customer')
+        cls.shop = Shop.objects.create(owner=cls.owner, name='Cửa hàng')
+        category = Category.objects.create(name='Áo thun')
+        Product.objects.create(
+            shop=cls.shop, category=category, name='Áo thun trắng', slug='ao-thun-trang', price=100000, stock=5
+        )
+
+    def _get_product(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('shop-products', args=[self.shop.id]))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']['data']['products'][0]
+
+    def test_owner_sees_revenue_and_returns(self):
+        product = self._get_product(self.owner)
+        self.assertIn('revenue', product)
+        self.assertIn('total_returned', product)
+
+    def test_other_users_do_not_see_revenue_or_returns(self):
+        product = self._get_product(self.customer)
+        self.assertIn('total_sold', product)
+        self.assertNotIn('revenue', product)
+        self.assertNotIn('total_returned', product)
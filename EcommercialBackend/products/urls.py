@@ -17,6 +17,13 @@ urlpatterns = [
     # DELETE: Xóa sản phẩm
     path('<int:product_id>/', views.ProductDetailView.as_view(), name='product-detail'),
 
+    # GET: Các sản phẩm thường được mua cùng (?limit=)
+    path('<int:product_id>/also-bought/', views.ProductRecommendationsView.as_view(),
+         name='product-recommendations'),
+
+    # GET: Các sản phẩm tương tự theo nội dung (?limit=)
+    path('<int:product_id>/similar/', views.SimilarProductsView.as_view(), name='product-similar'),
+
     # QUẢN LÝ HÌNH ẢNH SẢN PHẨM
     # GET: Lấy tất cả hình ảnh của sản phẩm
     # POST: Thêm hình ảnh mới cho sản phẩm
@@ -32,12 +39,23 @@ urlpatterns = [
     # POST: Thêm biến thể mới cho sản phẩm
     path('<int:product_id>/variants/', views.ProductVariantManagementView.as_view(), name='product-variants'),
 
+    # GET: Tra cứu biến thể theo tổ hợp thuộc tính (?color=red&size=M) và các giá trị còn hàng
+    path('<int:product_id>/variants/resolve/', views.ProductVariantResolveView.as_view(),
+         name='product-variant-resolve'),
+
     # PUT: Cập nhật thông tin biến thể (giá, tồn kho, thuộc tính...)
     # DELETE: Xóa biến thể của sản phẩm
     path('<int:product_id>/variants/<int:variant_id>/', views.ProductVariantManagementView.as_view(),
          name='product-variant-detail'),
 
     # THỐNG KÊ VÀ THAO TÁC HÀNG LOẠT
+    # GET: Danh sách các lần nhập sản phẩm; POST: Tải lên file CSV/JSONL để nhập sản phẩm hàng loạt
+    path('shops/<int:shop_id>/products/import/', views.ProductImportView.as_view(), name='shop-product-import'),
+
+    # GET: Tiến độ và lỗi của một lần nhập sản phẩm
+    path('shops/<int:shop_id>/products/import/<int:job_id>/', views.ProductImportJobDetailView.as_view(),
+         name='shop-product-import-detail'),
+
     # GET: Lấy thống kê sản phẩm của cửa hàng (số lượng sản phẩm theo trạng thái, danh mục...)
     path('shops/<int:shop_id>/products/stats/', views.ShopProductStatsView.as_view(), name='shop-product-stats'),
 
@@ -50,14 +68,22 @@ urlpatterns = [
     path('categories/<int:category_id>/', views.CategoryDetailView.as_view(), name='category-detail'),
     path('categories/create/', views.CategoryDetailView.as_view(), name='category-create'),
 
+    # GET: Thông tin bộ đệm lượt xem; POST: ghi ngay các lượt xem đang chờ (quản trị viên)
+    path('view-counter/metrics/', views.ProductViewCounterMetricsView.as_view(), name='product-view-counter-metrics'),
+
     # API để lấy các sản phẩm nổi bật ngẫu nhiên
     path('featured-products/', views.FeaturedProductsView.as_view(), name='featured-products'),
+    path('categories/<int:category_id>/featured-products/', views.FeaturedProductsView.as_view(),
+         name='category-featured-products'),
 
     # URL pattern with category_id in the URL
     path('categories/<int:category_id>/products/', CategoryProductsView.as_view(), name='category-products'),
 
     path('products/by-category/', CategoryProductsView.as_view(), name='products-by-category'),
 
+    # GET: Gợi ý khi gõ (?q=&limit=) - sản phẩm, danh mục, cửa hàng, truy vấn phổ biến
+    path('autocomplete/', views.AutocompleteView.as_view(), name='product-autocomplete'),
+
     path('top-selling/', TopSellingProductsView.as_view(), name='top-selling-products'),
 
     # Admin User Management URLs
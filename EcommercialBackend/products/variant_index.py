@@ -0,0 +1,207 @@
+# products/variant_index.py
+"""
+Tra cứu biến thể theo tổ hợp thuộc tính (ví dụ color=red + size=M).
+
+- Mỗi ProductVariant lưu signature: băm của các id giá trị thuộc tính đã sắp xếp,
+  được tính khi tạo/cập nhật biến thể (xem products/variant_writer.py, products/signals.py).
+  Tổ hợp đầy đủ được tra bằng một truy vấn trên index (product, signature)
+- Ma trận khả dụng của từng sản phẩm (thuộc tính, giá trị, các biến thể và giá trị
+  của chúng) được cache; tồn kho luôn được đọc mới bằng một truy vấn.
+  Với lựa chọn chưa đầy đủ, các giá trị còn hàng được tính bằng phép AND trên bitmask
+  biến thể còn hàng của từng giá trị
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ProductVariant, VariantAttributeValue
+
+MATRIX_CACHE_PREFIX = 'variant_matrix:'
+MATRIX_CACHE_TIMEOUT = 600
+SIGNATURE_BATCH_SIZE = 1000
+
+
+def compute_signature(attribute_value_ids):
+    """Signature của một tổ hợp giá trị thuộc tính (không phụ thuộc thứ tự), rỗng nếu không có thuộc tính"""
+    ids = sorted({int(value_id) for value_id in attribute_value_ids})
+    if not ids:
+        return ''
+    return hashlib.sha1(','.join(str(value_id) for value_id in ids).encode('ascii')).hexdigest()
+
+
+def refresh_variant_signatures(variant_ids):
+    """Tính lại signature cho các biến thể từ liên kết thuộc tính hiện tại (theo lô)"""
+    variant_ids = list(variant_ids)
+    for start in range(0, len(variant_ids), SIGNATURE_BATCH_SIZE):
+        batch_ids = variant_ids[start:start + SIGNATURE_BATCH_SIZE]
+        value_ids = {variant_id: [] for variant_id in batch_ids}
+        for variant_id, value_id in VariantAttributeValue.objects.filter(
+            variant_id__in=batch_ids
+        ).values_list('variant_id', 'attribute_value_id'):
+            value_ids[variant_id].append(value_id)
+
+        variants = list(ProductVariant.objects.filter(id__in=batch_ids).only('id', 'product_id', 'signature'))
+        changed = []
+        for variant in variants:
+            signature = compute_signature(value_ids[variant.id])
+            if variant.signature != signature:
+                variant.signature = signature
+                changed.append(variant)
+        if changed:
+            ProductVariant.objects.bulk_update(changed, ['signature'])
+        invalidate_variant_matrix({variant.product_id for variant in variants})
+
+
+def refresh_variant_signatures_on_commit(variant_ids):
+    variant_ids = list(variant_ids)
+    if variant_ids:
+        transaction.on_commit(lambda: refresh_variant_signatures(variant_ids))
+
+
+def rebuild_variant_signatures(batch_size=SIGNATURE_BATCH_SIZE, stdout=None):
+    """Tính lại signature cho toàn bộ biến thể theo lô (dùng cho dữ liệu cũ)"""
+    total = 0
+    last_id = 0
+    while True:
+        batch_ids = list(
+            ProductVariant.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not batch_ids:
+            break
+        refresh_variant_signatures(batch_ids)
+        total += len(batch_ids)
+        last_id = batch_ids[-1]
+        if stdout:
+            stdout.write(f"Đã cập nhật signature cho {total} biến thể")
+    return total
+
+
+def _cache_key(product_id):
+    return f"{MATRIX_CACHE_PREFIX}{product_id}"
+
+
+def invalidate_variant_matrix(product_ids):
+    cache.delete_many([_cache_key(product_id) for product_id in product_ids])
+
+
+def build_variant_matrix(product_id):
+    """
+    Ma trận của sản phẩm (không kèm tồn kho):
+    {'attributes': [{id, name, display_name, values: [{id, value, display_value, color_code}]}],
+     'variants': [[variant_id, [id giá trị...]], ...]}
+    """
+    attributes = {}
+    variants = {
+        variant_id: []
+        for variant_id in ProductVariant.objects.filter(product_id=product_id).order_by('id').values_list('id', flat=True)
+    }
+    rows = VariantAttributeValue.objects.filter(variant__product_id=product_id).order_by(
+        'attribute_value__attribute_id', 'attribute_value_id'
+    ).values_list(
+        'variant_id', 'attribute_value_id', 'attribute_value__value', 'attribute_value__display_value',
+        'attribute_value__color_code', 'attribute_value__attribute_id', 'attribute_value__attribute__name',
+        'attribute_value__attribute__display_name'
+    )
+    for variant_id, value_id, value, display_value, color_code, attribute_id, name, display_name in rows:
+        variants[variant_id].append(value_id)
+        attribute = attributes.setdefault(attribute_id, {
+            'id': attribute_id, 'name': name, 'display_name': display_name, 'values': {}
+        })
+        attribute['values'].setdefault(value_id, {
+            'id': value_id, 'value': value, 'display_value': display_value, 'color_code': color_code
+        })
+
+    return {
+        'attributes': [
+            {**attribute, 'values': list(attribute['values'].values())} for attribute in attributes.values()
+        ],
+        'variants': [[variant_id, value_ids] for variant_id, value_ids in variants.items()],
+    }
+
+
+def get_variant_matrix(product_id):
+    key = _cache_key(product_id)
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = build_variant_matrix(product_id)
+        cache.set(key, matrix, MATRIX_CACHE_TIMEOUT)
+    return matrix
+
+
+class SelectionError(ValueError):
+    """Thuộc tính hoặc giá trị được chọn không thuộc sản phẩm"""
+
+
+def parse_selection(matrix, selection):
+    """
+    Chuyển lựa chọn {tên thuộc tính: giá trị} (so khớp value hoặc display_value, không phân biệt hoa thường)
+    thành {id thuộc tính: id giá trị}
+    """
+    attributes = {attribute['name'].lower(): attribute for attribute in matrix['attributes']}
+    selected = {}
+    for name, value in selection.items():
+        attribute = attributes.get(str(name).lower())
+        if attribute is None:
+            raise SelectionError(f"Sản phẩm không có thuộc tính '{name}'")
+        lookup = str(value).lower()
+        match = next((
+            item for item in attribute['values']
+            if item['value'].lower() == lookup or (item['display_value'] or '').lower() == lookup
+        ), None)
+        if match is None:
+            raise SelectionError(f"Giá trị '{value}' không hợp lệ cho thuộc tính '{name}'")
+        selected[attribute['id']] = match['id']
+    return selected
+
+
+def selection_from_value_ids(matrix, value_ids):
+    """Chuyển danh sách id giá trị thuộc tính thành {id thuộc tính: id giá trị}"""
+    owners = {item['id']: attribute['id'] for attribute in matrix['attributes'] for item in attribute['values']}
+    selected = {}
+    for value_id in value_ids:
+        if value_id not in owners:
+            raise SelectionError(f"Giá trị thuộc tính {value_id} không thuộc sản phẩm")
+        selected[owners[value_id]] = value_id
+    return selected
+
+
+def get_available_values(matrix, selected, stock):
+    """
+    {id thuộc tính: [id giá trị còn hàng]} khi giữ nguyên lựa chọn ở các thuộc tính khác.
+    stock: {variant_id: tồn kho}
+    """
+    # Bitmask các biến thể còn hàng chứa từng giá trị
+    value_masks = {}
+    in_stock_mask = 0
+    for position, (variant_id, value_ids) in enumerate(matrix['variants']):
+        if stock.get(variant_id, 0) <= 0:
+            continue
+        bit = 1 << position
+        in_stock_mask |= bit
+        for value_id in value_ids:
+            value_masks[value_id] = value_masks.get(value_id, 0) | bit
+
+    available = {}
+    for attribute in matrix['attributes']:
+        mask = in_stock_mask
+        for attribute_id, value_id in selected.items():
+            if attribute_id != attribute['id']:
+                mask &= value_masks.get(value_id, 0)
+        available[attribute['id']] = [
+            item['id'] for item in attribute['values'] if mask & value_masks.get(item['id'], 0)
+        ]
+    return available
+
+
+def resolve_variant(product, selected):
+    """
+    Biến thể ứng với lựa chọn đầy đủ (một truy vấn theo signature), None nếu lựa chọn
+    chưa đủ hoặc không có biến thể ứng với tổ hợp
+    """
+    matrix = get_variant_matrix(product.id)
+    if not matrix['attributes'] or len(selected) < len(matrix['attributes']):
+        return None
+    return ProductVariant.objects.filter(
+        product_id=product.id, signature=compute_signature(selected.values())
+    ).order_by('id').first()
@@ -0,0 +1,290 @@
+# products/variant_writer.py
+"""
+Ghi thuộc tính và biến thể sản phẩm theo tập hợp (set-based).
+
+Thay vì get_or_create / create cho từng thuộc tính, giá trị, biến thể và liên kết:
+- một truy vấn lấy các Attribute / AttributeValue đã có, một bulk_create cho phần còn thiếu
+- một bulk_create cho biến thể, một bulk_create cho liên kết biến thể - giá trị thuộc tính
+- SKU mặc định được sinh từ slug sản phẩm + giá trị thuộc tính (không cần COUNT)
+- signature của biến thể (xem products/variant_index.py) được tính ngay khi ghi
+"""
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from .models import Attribute, AttributeValue, ProductVariant, VariantAttributeValue
+from .facets import invalidate_facets
+from .detail_cache import invalidate_product_detail
+from .variant_index import compute_signature, refresh_variant_signatures, invalidate_variant_matrix
+from .pricing import refresh_product_prices_on_commit
+
+ATTRIBUTE_TYPES = {choice for choice, _ in Attribute.ATTRIBUTE_TYPE_CHOICES}
+SKU_MAX_LENGTH = 100
+
+
+def parse_json_list(data):
+    """
+    Chuẩn hóa dữ liệu dạng danh sách gửi lên qua multipart/JSON:
+    chuỗi JSON, danh sách chứa một chuỗi JSON hoặc danh sách thật
+    """
+    if isinstance(data, list) and len(data) == 1 and isinstance(data[0], str):
+        data = data[0]
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            data = []
+    return data if isinstance(data, list) else []
+
+
+class AttributeResolver:
+    """
+    Ánh xạ (tên thuộc tính, giá trị) -> id AttributeValue, tạo phần còn thiếu theo lô.
+    Giữ cache giữa các lần gọi (dùng lại được cho nhiều lô khi nhập hàng loạt)
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+        self.attribute_ids = {}
+        self.value_ids = {}
+
+    def resolve(self, specs):
+        """
+        specs: {tên thuộc tính: {'type': ..., 'values': {giá trị: {'display': ..., 'color_code': ...}}}}
+        Trả về {(tên thuộc tính, giá trị): id AttributeValue}, tên và giá trị là chuỗi như trong DB
+        """
+        specs = {
+            str(name): {**spec, 'values': {str(value): value_spec for value, value_spec in spec['values'].items()}}
+            for name, spec in specs.items()
+        }
+        self._resolve_attributes(specs)
+        self._resolve_values(specs)
+        return {
+            (name, value): self.value_ids[(self.attribute_ids[name], value)]
+            for name, spec in specs.items() for value in spec['values']
+        }
+
+    def _resolve_attributes(self, specs):
+        missing = [name for name in specs if name not in self.attribute_ids]
+        if not missing:
+            return
+
+        for attribute_id, name in Attribute.objects.filter(
+            name__in=missing
+        ).order_by('id').values_list('id', 'name'):
+            self.attribute_ids.setdefault(name, attribute_id)
+
+        to_create = []
+        for name in missing:
+            if name in self.attribute_ids:
+                continue
+            attribute_type = specs[name].get('type') or (name if name in ATTRIBUTE_TYPES else 'other')
+            to_create.append(Attribute(
+                name=name,
+                display_name=name.title(),
+                attribute_type=attribute_type if attribute_type in ATTRIBUTE_TYPES else 'other'
+            ))
+
+        if to_create:
+            # bulk_create trên MySQL không trả về id nên đọc lại theo tên
+            Attribute.objects.bulk_create(to_create, batch_size=self.batch_size)
+            for attribute_id, name in Attribute.objects.filter(
+                name__in=[attribute.name for attribute in to_create]
+            ).order_by('id').values_list('id', 'name'):
+                self.attribute_ids.setdefault(name, attribute_id)
+
+    def _resolve_values(self, specs):
+        missing = {
+            (self.attribute_ids[name], value): (specs[name], value_spec)
+            for name, spec in specs.items() for value, value_spec in spec['values'].items()
+            if (self.attribute_ids[name], value) not in self.value_ids
+        }
+        if not missing:
+            return
+
+        def load(pairs):
+            for value_id, attribute_id, value in AttributeValue.objects.filter(
+                attribute_id__in={attribute_id for attribute_id, _ in pairs},
+                value__in={value for _, value in pairs}
+            ).order_by('id').values_list('id', 'attribute_id', 'value'):
+                self.value_ids.setdefault((attribute_id, value), value_id)
+
+        load(missing)
+        to_create = []
+        for (attribute_id, value), (attribute_spec, value_spec) in missing.items():
+            if (attribute_id, value) in self.value_ids:
+                continue
+            value_spec = value_spec or {}
+            to_create.append(AttributeValue(
+                attribute_id=attribute_id,
+                value=value,
+                display_value=value_spec.get('display') or value,
+                color_code=value_spec.get('color_code') if attribute_spec.get('type') == 'color' else None
+            ))
+
+        if to_create:
+            AttributeValue.objects.bulk_create(to_create, batch_size=self.batch_size)
+            load({(item.attribute_id, item.value) for item in to_create})
+
+
+def build_attribute_specs(attributes_data):
+    """Chuyển dữ liệu 'attributes' của request thành specs cho AttributeResolver"""
+    specs = {}
+    for attr_data in attributes_data:
+        if not isinstance(attr_data, dict) or not attr_data.get('name'):
+            continue
+        spec = specs.setdefault(str(attr_data['name']), {'type': attr_data.get('type', 'other'), 'values': {}})
+        for value_data in attr_data.get('values', []):
+            if isinstance(value_data, dict) and value_data.get('value') not in (None, ''):
+                # Giá trị số trong JSON (42) phải khớp với giá trị chuỗi đọc từ DB ('42')
+                value = str(value_data['value'])
+                spec['values'][value] = {
+                    'display': str(value_data.get('display') or value),
+                    'color_code': value_data.get('color_code'),
+                }
+    return specs
+
+
+def variant_attribute_pairs(variant_attributes):
+    """Danh sách (tên, giá trị) dạng chuỗi của biến thể, hỗ trợ dạng {tên: giá trị} và [{name, value}]"""
+    if isinstance(variant_attributes, dict):
+        pairs = variant_attributes.items()
+    elif isinstance(variant_attributes, list):
+        pairs = [
+            (item.get('name'), item.get('value'))
+            for item in variant_attributes if isinstance(item, dict)
+        ]
+    else:
+        return []
+    return [(str(name), str(value)) for name, value in pairs if name is not None and value is not None]
+
+
+def generate_sku(product, labels, position, taken):
+    """
+    SKU xác định từ slug sản phẩm và giá trị thuộc tính (ví dụ ao-thun-red-m),
+    nếu không có thuộc tính thì dùng vị trí biến thể. Thêm hậu tố khi trùng
+    """
+    suffix = slugify('-'.join(str(label) for label in labels)) if labels else f"v{position + 1}"
+    base = f"{product.slug}-{suffix}"[:SKU_MAX_LENGTH]
+    sku = base
+    counter = 2
+    while sku in taken:
+        tail = f"-{counter}"
+        sku = f"{base[:SKU_MAX_LENGTH - len(tail)]}{tail}"
+        counter += 1
+    taken.add(sku)
+    return sku
+
+
+def existing_skus(product):
+    """SKU đã có của sản phẩm (một truy vấn)"""
+    return set(ProductVariant.objects.filter(product=product).values_list('sku', flat=True))
+
+
+def write_variants(product, variant_rows, taken_skus=None):
+    """
+    Tạo biến thể và liên kết thuộc tính theo lô.
+    variant_rows: danh sách dict gồm sku (có thể rỗng), price, sale_price, stock, image_url,
+    labels (dùng sinh SKU), attribute_value_ids
+    """
+    if not variant_rows:
+        return []
+
+    taken = existing_skus(product) if taken_skus is None else taken_skus
+    variants = []
+    for position, row in enumerate(variant_rows):
+        sku = row.get('sku')
+        if sku:
+            taken.add(sku)
+        else:
+            sku = generate_sku(product, row.get('labels', []), position, taken)
+        row['sku'] = sku
+        variants.append(ProductVariant(
+            product=product,
+            sku=sku,
+            price=row.get('price', product.price),
+            sale_price=row.get('sale_price', product.sale_price),
+            stock=row.get('stock', 0),
+            image_url=row.get('image_url'),
+            signature=compute_signature(row.get('attribute_value_ids', [])),
+        ))
+
+    ProductVariant.objects.bulk_create(variants)
+
+    # Đọc lại id theo SKU (MySQL không trả về id khi bulk_create). Một SKU có thể xuất hiện
+    # nhiều lần (trong request hoặc đã có từ trước): các dòng cùng SKU nhận id mới nhất theo
+    # đúng thứ tự tạo (id tăng dần theo thứ tự các dòng trong bulk_create)
+    rows_by_sku = defaultdict(list)
+    for index, row in enumerate(variant_rows):
+        rows_by_sku[row['sku']].append(index)
+    variants_by_sku = defaultdict(list)
+    for variant in ProductVariant.objects.filter(product=product, sku__in=list(rows_by_sku)).order_by('id'):
+        variants_by_sku[variant.sku].append(variant)
+
+    created = [None] * len(variant_rows)
+    for sku, indexes in rows_by_sku.items():
+        for index, variant in zip(indexes, variants_by_sku[sku][-len(indexes):]):
+            created[index] = variant
+
+    links = {
+        (created[index].id, attribute_value_id)
+        for index, row in enumerate(variant_rows) for attribute_value_id in row.get('attribute_value_ids', [])
+    }
+    VariantAttributeValue.objects.bulk_create(
+        [VariantAttributeValue(variant_id=variant_id, attribute_value_id=value_id) for variant_id, value_id in links],
+        ignore_conflicts=True
+    )
+
+    _after_write(product.id)
+    return created
+
+
+def set_variant_attribute_values(variant, attribute_value_ids):
+    """Thay toàn bộ giá trị thuộc tính của một biến thể (bỏ qua id không tồn tại)"""
+    valid_ids = valid_attribute_value_ids(attribute_value_ids)
+    VariantAttributeValue.objects.filter(variant=variant).delete()
+    add_variant_attribute_values(variant, valid_ids, validated=True)
+
+
+def add_variant_attribute_values(variant, attribute_value_ids, validated=False):
+    """Gắn các giá trị thuộc tính cho một biến thể bằng một bulk_create"""
+    valid_ids = attribute_value_ids if validated else valid_attribute_value_ids(attribute_value_ids)
+    VariantAttributeValue.objects.bulk_create(
+        [VariantAttributeValue(variant=variant, attribute_value_id=value_id) for value_id in valid_ids],
+        ignore_conflicts=True
+    )
+    refresh_variant_signatures([variant.id])
+    _after_write(variant.product_id)
+
+
+def parse_ids(values):
+    """Chuyển danh sách id gửi lên thành số nguyên (bỏ giá trị không hợp lệ và trùng lặp)"""
+    ids = []
+    for value in values or []:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))
+
+
+def load_attribute_values(attribute_value_ids):
+    """Tra cứu các AttributeValue theo id (một truy vấn), trả về {id: giá trị} theo thứ tự yêu cầu"""
+    requested = parse_ids(attribute_value_ids)
+    values = dict(AttributeValue.objects.filter(id__in=requested).values_list('id', 'value'))
+    return {value_id: values[value_id] for value_id in requested if value_id in values}
+
+
+def valid_attribute_value_ids(attribute_value_ids):
+    """Lọc các id AttributeValue tồn tại, giữ nguyên thứ tự"""
+    return list(load_attribute_values(attribute_value_ids))
+
+
+def _after_write(product_id):
+    """bulk_create không phát signal: làm mới facet, cache chi tiết, ma trận biến thể và giá sau khi commit"""
+    transaction.on_commit(invalidate_facets)
+    transaction.on_commit(lambda: invalidate_product_detail([product_id]))
+    transaction.on_commit(lambda: invalidate_variant_matrix([product_id]))
+    refresh_product_prices_on_commit([product_id])
@@ -0,0 +1,184 @@
+# products/view_counter.py
+"""
+Bộ đệm ghi sau (write-behind) cho lượt xem sản phẩm.
+
+Mỗi lượt xem chỉ cộng vào một dict trong bộ nhớ của tiến trình; một luồng nền
+định kỳ ghi dồn xuống DB bằng các câu UPDATE ... SET view_count = view_count + n
+(gom các sản phẩm có cùng n vào một câu lệnh) và cộng vào ProductAnalytic.views
+của ngày hiện tại.
+
+Số lượt xem có thể mất khi tiến trình bị kill được giới hạn bởi
+FLUSH_INTERVAL giây hoặc MAX_PENDING_INCREMENTS lượt (tùy điều kiện nào đến trước);
+khi tiến trình tắt bình thường bộ đệm được ghi nốt (atexit).
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.db import transaction, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Chu kỳ ghi dồn (giây)
+FLUSH_INTERVAL = 10
+# Ghi ngay khi số lượt xem đang chờ vượt ngưỡng này
+MAX_PENDING_INCREMENTS = 5000
+# Khi DB lỗi, giữ lại tối đa chừng này lượt xem để ghi lại lần sau
+MAX_RETAINED_INCREMENTS = 100000
+
+
+class ViewCounterBuffer:
+    """Bộ đếm lượt xem trong bộ nhớ, ghi dồn xuống DB theo lô"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING_INCREMENTS):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._pending_total = 0
+        self._worker = None
+        self._stats = {
+            'flushed_increments': 0,
+            'flush_count': 0,
+            'failed_flushes': 0,
+            'dropped_increments': 0,
+            'last_flush_at': None,
+            'last_flush_duration_ms': None,
+            'last_error': None,
+        }
+
+    def record(self, product_id, count=1):
+        """Ghi nhận lượt xem, trả về số lượt xem đang chờ của sản phẩm"""
+        self._ensure_worker()
+        with self._lock:
+            self._pending[product_id] += count
+            self._pending_total += count
+            pending = self._pending[product_id]
+            should_flush = self._pending_total >= self.max_pending
+
+        if should_flush:
+            self.flush()
+        return pending
+
+    def pending_for(self, product_id):
+        """Số lượt xem chưa ghi xuống DB của một sản phẩm"""
+        with self._lock:
+            return self._pending.get(product_id, 0)
+
+    def _drain(self):
+        with self._lock:
+            pending = dict(self._pending)
+            self._pending.clear()
+            self._pending_total = 0
+        return pending
+
+    def _restore(self, pending):
+        """Trả lại các lượt xem chưa ghi được vào bộ đệm (có giới hạn)"""
+        with self._lock:
+            for product_id, count in pending.items():
+                if self._pending_total + count > MAX_RETAINED_INCREMENTS:
+                    self._stats['dropped_increments'] += count
+                    continue
+                self._pending[product_id] += count
+                self._pending_total += count
+
+    def flush(self):
+        """Ghi toàn bộ lượt xem đang chờ xuống DB, trả về số lượt đã ghi"""
+        with self._flush_lock:
+            pending = self._drain()
+            if not pending:
+                return 0
+
+            started = time.monotonic()
+            try:
+                flushed = _write_view_counts(pending)
+            except Exception as e:
+                logger.exception("Không thể ghi lượt xem sản phẩm")
+                self._restore(pending)
+                with self._lock:
+                    self._stats['failed_flushes'] += 1
+                    self._stats['last_error'] = str(e)
+                return 0
+
+            with self._lock:
+                self._stats['flushed_increments'] += flushed
+                self._stats['flush_count'] += 1
+                self._stats['last_flush_at'] = timezone.now()
+                self._stats['last_flush_duration_ms'] = round((time.monotonic() - started) * 1000, 2)
+                self._stats['last_error'] = None
+            return flushed
+
+    def metrics(self):
+        """Thông tin về bộ đệm: số lượt xem/sản phẩm đang chờ và kết quả các lần ghi"""
+        with self._lock:
+            return {
+                'pending_increments': self._pending_total,
+                'pending_products': len(self._pending),
+                'flush_interval': self.flush_interval,
+                'max_pending': self.max_pending,
+                'worker_alive': bool(self._worker and self._worker.is_alive()),
+                **self._stats,
+            }
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='product-view-counter', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                # Luồng nền tự mở kết nối DB riêng, đóng lại sau mỗi lần ghi
+                connections.close_all()
+
+
+def _write_view_counts(pending):
+    """
+    Ghi dồn lượt xem: một câu UPDATE cho mỗi nhóm sản phẩm có cùng số lượt tăng,
+    cộng vào cả Product.view_count và ProductAnalytic.views của ngày hôm nay
+    """
+    from analytics.models import ProductAnalytic
+
+    product_ids = list(Product.objects.filter(id__in=list(pending)).values_list('id', flat=True))
+    if not product_ids:
+        return 0
+
+    groups = defaultdict(list)
+    for product_id in product_ids:
+        groups[pending[product_id]].append(product_id)
+
+    today = timezone.localdate()
+    with transaction.atomic():
+        # Đảm bảo có bản ghi thống kê của ngày hôm nay cho các sản phẩm
+        ProductAnalytic.objects.bulk_create(
+            [ProductAnalytic(product_id=product_id, date=today) for product_id in product_ids],
+            ignore_conflicts=True
+        )
+        for increment, ids in groups.items():
+            Product.objects.filter(id__in=ids).update(view_count=F('view_count') + increment)
+            ProductAnalytic.objects.filter(product_id__in=ids, date=today).update(
+                views=F('views') + increment,
+                updated_at=timezone.now()
+            )
+
+    return sum(pending[product_id] for product_id in product_ids)
+
+
+view_counter = ViewCounterBuffer()
+
+# Ghi nốt các lượt xem còn lại khi tiến trình tắt bình thường
+atexit.register(view_counter.flush)
@@ -1,7 +1,5 @@
 import logging
-import random
 
-import cloudinary.uploader
 from django.core.paginator import PageNotAnInteger
 from django.utils.text import slugify
 from django.db import transaction
@@ -14,22 +12,49 @@ from rest_framework import status, permissions
 from rest_framework.parsers import MultiPartParser, FormParser
 from core.permission import IsShopOwner, IsActiveUser
 from core.views import IsAdminUser
+from core.pagination import KeysetPagination
+from core.responses.exceptions import CustomError
 from shops.models import Shop
 from .models import (
     Product, ProductImage, ProductVariant,
     Attribute, AttributeValue, VariantAttributeValue,
-    Tag, ProductTag, Category, Brand
+    Tag, ProductTag, Category, Brand, ProductImportJob, ProductRecommendation
 )
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from orders.models import OrderItem
 import time
 import logging
 from .serializers import (
     ProductSerializer, ProductDetailSerializer, ProductCreateSerializer,
     ProductVariantSerializer, ProductImageSerializer, CategoryListSerializer, CategoryTreeSerializer,
-    CategoryCreateSerializer
+    CategoryCreateSerializer, ProductImportJobSerializer, ProductImportJobListSerializer
+)
+from django.db.models import Count
+from .search import search_product_ids, order_by_relevance
+from .facets import invalidate_facets
+from .category_tree import get_category_tree, get_descendant_ids, invalidate_category_tree
+from .view_counter import view_counter
+from .detail_cache import get_product_detail, render_product_detail
+from .images import prepare_product_images, create_product_images
+from .pricing import get_variant_price, price_range_filter
+from .featured import sample_featured_products, update_featured_pools_on_commit, ALL_SCOPE
+from .leaderboard import get_top_sellers, LEADERBOARD_WINDOWS, DEFAULT_LEADERBOARD_LIMIT
+from .cards import get_card_payload
+from .recommendations import TOP_K as RECOMMENDATION_TOP_K
+from .shop_stats import get_shop_stats, invalidate_shop_stats_on_commit
+from .autocomplete import (
+    suggest, record_search_query, refresh_autocomplete_terms_on_commit, DEFAULT_SUGGESTION_LIMIT
+)
+from .similar import find_similar_products, refresh_feature_vectors_on_commit, DEFAULT_SIMILAR_LIMIT, MAX_SIMILAR_LIMIT
+from .variant_index import (
+    get_variant_matrix, parse_selection, selection_from_value_ids, get_available_values, resolve_variant,
+    SelectionError
+)
+from core.derivatives import get_image_preferences
+from .importer import detect_format, start_import_job
+from .variant_writer import (
+    AttributeResolver, parse_json_list, parse_ids, build_attribute_specs, variant_attribute_pairs,
+    write_variants, load_attribute_values, existing_skus, generate_sku,
+    add_variant_attribute_values, set_variant_attribute_values
 )
-from django.db.models import Sum, Count
 
 
 class TopSellingProductsView(APIView):
@@ -37,36 +62,33 @@ class TopSellingProductsView(APIView):
 
     def get(self, request):
         """
-        Get the top 3 best-selling products based on order quantities
+        Get the best-selling products (default top 3, all time) from the daily sales buckets.
+        Optional: ?shop_id=, ?days=7|30|90, ?limit=
         """
         shop_id = request.query_params.get('shop_id')
+        days = request.query_params.get('days')
+        limit = request.query_params.get('limit', DEFAULT_LEADERBOARD_LIMIT)
 
-        # Changed 'product_variant__product' to 'variant__product'
-        query = OrderItem.objects.values('variant__product')
-
-        if shop_id:
-            # Changed product_variant to variant
-            query = query.filter(variant__product__shop_id=shop_id)
+        try:
+            shop_id = int(shop_id) if shop_id else None
+            days = int(days) if days else None
+            limit = int(limit)
+        except ValueError:
+            return Response({
+                'status': 'error',
+                'message': 'Tham số shop_id, days, limit phải là số nguyên'
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-        top_selling_products = query.annotate(
-            total_sold=Sum('quantity')
-        ).order_by('-total_sold')[:3]
+        if days is not None and days not in LEADERBOARD_WINDOWS:
+            return Response({
+                'status': 'error',
+                'message': f"days chỉ nhận các giá trị {', '.join(str(d) for d in LEADERBOARD_WINDOWS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if limit <= 0:
+            limit = DEFAULT_LEADERBOARD_LIMIT
 
-        result = []
-        for item in top_selling_products:
-            # Changed 'product_variant__product' to 'variant__product'
-            product_id = item['variant__product']
-            try:
-                product = Product.objects.get(id=product_id)
-                product_data = {
-                    'id': product.id,
-                    'name': product.name,
-                    'total_sold': item['total_sold'],
-                    # Add more product details as needed
-                }
-                result.append(product_data)
-            except Product.DoesNotExist:
-                continue
+        size, image_format = get_image_preferences({'request': request})
+        result = get_top_sellers(shop_id, days, limit, size, image_format)
 
         return Response(result, status=status.HTTP_200_OK)
 
@@ -74,10 +96,11 @@ class TopSellingProductsView(APIView):
 class FeaturedProductsView(APIView):
     """
     API để lấy các sản phẩm nổi bật ngẫu nhiên dựa trên đánh giá và số lượt mua
+    (toàn bộ hoặc theo danh mục, lấy từ pool dựng sẵn trong cache - xem products/featured.py)
     """
     permission_classes = [permissions.AllowAny]
 
-    def get(self, request):
+    def get(self, request, category_id=None):
         # Lấy tham số từ request
         limit = request.query_params.get('limit', 10)
         try:
@@ -87,23 +110,139 @@ class FeaturedProductsView(APIView):
         except ValueError:
             limit = 10
 
-        # Lấy các sản phẩm có trạng thái active và featured=True
-        products = Product.objects.filter(
-            status='active'
-        ).order_by('-rating', '-sold_count')
+        # Pool theo danh mục (gồm cả danh mục con) hoặc toàn bộ sản phẩm
+        category_id = category_id or request.query_params.get('category_id')
+        scope = ALL_SCOPE
+        if category_id:
+            try:
+                scope = int(category_id)
+            except (TypeError, ValueError):
+                scope = None
+            if scope is None or scope not in get_category_tree():
+                return Response({
+                    'status': 'error',
+                    'message': 'Không tìm thấy danh mục'
+                }, status=status.HTTP_404_NOT_FOUND)
+
+        # Chọn ngẫu nhiên trong top (limit * 3) của pool, không truy vấn DB
+        size, image_format = get_image_preferences({'request': request})
+        selected_products = sample_featured_products(limit, scope, size, image_format)
 
-        # Lấy 3 lần số lượng yêu cầu để có thể chọn ngẫu nhiên sau này
-        products_pool = list(products[:limit * 3])
+        return Response(selected_products, status=status.HTTP_200_OK)
 
-        # Nếu không đủ sản phẩm, lấy hết những sản phẩm có sẵn
-        if len(products_pool) <= limit:
-            selected_products = products_pool
-        else:
-            # Chọn ngẫu nhiên các sản phẩm từ pool
-            selected_products = random.sample(products_pool, limit)
 
-        serializer = ProductSerializer(selected_products, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+class ProductRecommendationsView(APIView):
+    """
+    API "khách hàng cũng mua": các sản phẩm thường được mua cùng sản phẩm này
+    (dựng sẵn bởi job build_recommendations - xem products/recommendations.py)
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, product_id):
+        limit = request.query_params.get('limit', 10)
+        try:
+            limit = int(limit)
+            if limit <= 0:
+                limit = 10
+        except ValueError:
+            limit = 10
+        limit = min(limit, RECOMMENDATION_TOP_K)
+
+        # Một truy vấn: danh sách gợi ý theo index (product, rank) kèm sản phẩm và thẻ
+        recommendations = list(
+            ProductRecommendation.objects.filter(
+                product_id=product_id, recommended__status='active'
+            ).select_related('recommended__card').order_by('rank')[:limit]
+        )
+        if not recommendations and not Product.objects.filter(id=product_id).exists():
+            return Response({
+                'status': 'error',
+                'message': 'Không tìm thấy sản phẩm'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        size, image_format = get_image_preferences({'request': request})
+        data = [
+            {
+                **get_card_payload(recommendation.recommended, size, image_format),
+                'score': recommendation.score,
+                'co_count': recommendation.co_count,
+            }
+            for recommendation in recommendations
+        ]
+
+        return Response({
+            'status': 'success',
+            'message': 'Lấy sản phẩm thường được mua cùng thành công',
+            'data': data
+        }, status=status.HTTP_200_OK)
+
+
+class SimilarProductsView(APIView):
+    """
+    API sản phẩm tương tự theo nội dung (danh mục, tag, thuộc tính, khoảng giá, cửa hàng),
+    tìm trên chỉ mục vector trong bộ nhớ - xem products/similar.py
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, product_id):
+        limit = request.query_params.get('limit', DEFAULT_SIMILAR_LIMIT)
+        try:
+            limit = int(limit)
+            if limit <= 0:
+                limit = DEFAULT_SIMILAR_LIMIT
+        except ValueError:
+            limit = DEFAULT_SIMILAR_LIMIT
+        limit = min(limit, MAX_SIMILAR_LIMIT)
+
+        # Lấy dư để bù các sản phẩm vừa ngừng bán/bị xóa sau lần đồng bộ chỉ mục
+        similar = find_similar_products(product_id, limit * 2)
+        if similar is None:
+            return Response({
+                'status': 'error',
+                'message': 'Không tìm thấy sản phẩm'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        products = Product.objects.filter(status='active').select_related('card').in_bulk(
+            [similar_id for similar_id, _ in similar]
+        )
+        size, image_format = get_image_preferences({'request': request})
+        data = [
+            {**get_card_payload(products[similar_id], size, image_format), 'score': round(score, 4)}
+            for similar_id, score in similar if similar_id in products
+        ][:limit]
+
+        return Response({
+            'status': 'success',
+            'message': 'Lấy sản phẩm tương tự thành công',
+            'data': data
+        }, status=status.HTTP_200_OK)
+
+
+class AutocompleteView(APIView):
+    """
+    API gợi ý khi gõ: tên sản phẩm, danh mục, cửa hàng và truy vấn phổ biến có tiền tố khớp
+    với chuỗi đang gõ (không phân biệt dấu), xếp theo độ phổ biến - xem products/autocomplete.py
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        limit = request.query_params.get('limit', DEFAULT_SUGGESTION_LIMIT)
+        try:
+            limit = int(limit)
+            if limit <= 0:
+                limit = DEFAULT_SUGGESTION_LIMIT
+        except ValueError:
+            limit = DEFAULT_SUGGESTION_LIMIT
+
+        return Response({
+            'status': 'success',
+            'message': 'Lấy gợi ý tìm kiếm thành công',
+            'data': {
+                'query': query,
+                'suggestions': suggest(query, limit),
+            }
+        }, status=status.HTTP_200_OK)
 
 
 class ShopProductsView(APIView):
@@ -115,70 +254,60 @@ class ShopProductsView(APIView):
         """Lấy danh sách sản phẩm thuộc cửa hàng kèm tổng số đã bán"""
         shop = get_object_or_404(Shop, id=shop_id)
 
-        # Bắt đầu với tất cả sản phẩm của cửa hàng
-        products = Product.objects.filter(shop=shop)
-
-        # Annotate với số lượng đã bán
-        products = products.annotate(
-            total_sold=Sum(
-                'variants__order_items__quantity',  # Changed from 'orderitem' to 'order_items'
-                filter=Q(variants__order_items__status='completed'),  # Also changed here
-                default=0
-            )
-        )
+        # Bắt đầu với tất cả sản phẩm của cửa hàng (kèm số liệu bán hàng cộng dồn)
+        products = Product.objects.filter(shop=shop).select_related('card', 'sales_stats')
 
         # Lọc theo status, category, tìm kiếm tên
         product_status = request.query_params.get('status')
         category_id = request.query_params.get('category_id')
         search_query = request.query_params.get('search')
-        sort_by = request.query_params.get('sort_by', 'created_at')
+        sort_by = request.query_params.get('sort_by', 'relevance' if search_query else 'created_at')
         sort_order = request.query_params.get('sort_order', 'desc')
 
         if product_status:
             products = products.filter(status=product_status)
 
         if category_id:
-            products = products.filter(category_id=category_id)
+            products = products.filter(category_id__in=get_descendant_ids(category_id))
 
+        ranked_ids = []
         if search_query:
-            products = products.filter(name__icontains=search_query)
+            ranked_ids = search_product_ids(search_query, shop_id=shop.id)
+            products = products.filter(id__in=ranked_ids)
 
         # Sắp xếp
         order_prefix = '-' if sort_order.lower() == 'desc' else ''
-        if sort_by in ['name', 'price', 'stock', 'created_at', 'updated_at', 'sold_count', 'view_count']:
+        if sort_by == 'relevance' and search_query:
+            products = order_by_relevance(products, ranked_ids)
+        elif sort_by in ['name', 'price', 'stock', 'created_at', 'updated_at', 'sold_count', 'view_count']:
             products = products.order_by(f"{order_prefix}{sort_by}")
 
-        # Phân trang
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-        total_count = products.count()
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_products = products[start:end]
+        # Phân trang (keyset nếu có tham số cursor, ngược lại theo số trang)
+        paginated_products, pagination = KeysetPagination.paginate(request, products, default_page_size=10)
 
         # Serialize dữ liệu
-        serializer = ProductSerializer(paginated_products, many=True)
+        serializer = ProductSerializer(paginated_products, many=True, context={'request': request})
         serialized_data = serializer.data
 
-        # Thêm total_sold vào từng sản phẩm
+        # Thêm số liệu bán hàng vào từng sản phẩm (xem products/sales_rollup.py);
+        # doanh thu và số lượng trả lại chỉ dành cho chủ cửa hàng và quản trị viên
+        can_view_sales = shop.owner == request.user or getattr(request.user, 'role', None) == 'admin'
         for i, product in enumerate(paginated_products):
-            serialized_data[i]['total_sold'] = product.total_sold or 0
+            serialized_data[i]['total_sold'] = product.sold_count
+            if can_view_sales:
+                sales_stats = getattr(product, 'sales_stats', None)
+                serialized_data[i]['revenue'] = sales_stats.revenue if sales_stats else 0
+                serialized_data[i]['total_returned'] = sales_stats.units_returned if sales_stats else 0
 
         return Response({
             'status': 'success',
             'message': 'Đã lấy danh sách sản phẩm thành công',
             'data': {
                 'products': serialized_data,
-                'pagination': {
-                    'total': total_count,
-                    'page': page,
-                    'page_size': page_size,
-                    'total_pages': (total_count + page_size - 1) // page_size
-                }
+                'pagination': pagination
             }
         }, status=status.HTTP_200_OK)
 
-    @transaction.atomic
     def post(self, request, shop_id):
         """Tạo sản phẩm mới cho cửa hàng"""
         shop = get_object_or_404(Shop, id=shop_id)
@@ -199,22 +328,6 @@ class ShopProductsView(APIView):
             timestamp = str(int(time.time()))
             data['slug'] = slugify(data.get('name', '')) + '-' + str(shop.id) + '-' + timestamp
 
-        # Xử lý hình ảnh
-        images_data = []
-        if 'images' in request.FILES:
-            images = request.FILES.getlist('images')
-            for index, image_file in enumerate(images):
-                upload_result = cloudinary.uploader.upload(
-                    image_file,
-                    folder=f"shops/{shop.id}/products",
-                )
-                image_url = upload_result.get('secure_url')
-                images_data.append({
-                    'image_url': image_url,
-                    'is_thumbnail': index == 0,  # Đặt ảnh đầu tiên làm ảnh đại diện
-                    'display_order': index
-                })
-
         # Xử lý thuộc tính và biến thể
         attributes_data = data.pop('attributes', [])
         variants_data = data.pop('variants', [])
@@ -223,25 +336,29 @@ class ShopProductsView(APIView):
         serializer = ProductCreateSerializer(data=data)
 
         if serializer.is_valid():
-            # Lưu sản phẩm
-            product = serializer.save()
+            # Tải lên hình ảnh song song (chế độ bất đồng bộ: tải lên nền sau khi transaction commit)
+            # trước khi mở transaction để không giữ khóa DB trong lúc chờ dịch vụ media
+            image_batch = prepare_product_images(shop.id, request.FILES.getlist('images'))
 
-            # Lưu hình ảnh sản phẩm
-            for image_data in images_data:
-                ProductImage.objects.create(product=product, **image_data)
+            with transaction.atomic():
+                # Lưu sản phẩm
+                product = serializer.save()
 
-            # Xử lý thuộc tính và biến thể
-            self._process_attributes_and_variants(
-                product, attributes_data, variants_data
-            )
+                # Lưu hình ảnh sản phẩm, ảnh đầu tiên làm ảnh đại diện
+                create_product_images(product, image_batch, thumbnail_index=0)
 
-            # Lấy thông tin chi tiết sản phẩm đã tạo
-            detail_serializer = ProductDetailSerializer(product)
+                # Xử lý thuộc tính và biến thể
+                self._process_attributes_and_variants(
+                    product, attributes_data, variants_data
+                )
+
+            # Lấy thông tin chi tiết sản phẩm đã tạo (tải trước biến thể, thuộc tính, hình ảnh)
+            detail_data = render_product_detail(product.id)
 
             return Response({
                 'status': 'success',
                 'message': 'Đã tạo sản phẩm thành công',
-                'data': detail_serializer.data
+                'data': detail_data
             }, status=status.HTTP_201_CREATED)
 
         return Response({
@@ -251,124 +368,115 @@ class ShopProductsView(APIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
     def _process_attributes_and_variants(self, product, attributes_data, variants_data):
-        """Xử lý thuộc tính và biến thể cho sản phẩm"""
-        import json
+        """Xử lý thuộc tính và biến thể cho sản phẩm (ghi theo lô)"""
+        attributes_data = parse_json_list(attributes_data)
+        variants_data = parse_json_list(variants_data)
 
-        if isinstance(attributes_data, list) and len(attributes_data) == 1 and isinstance(attributes_data[0], str):
-            attributes_data = attributes_data[0]
+        # Xử lý thuộc tính: một lần tra cứu, một bulk_create cho phần còn thiếu
+        attribute_value_map = AttributeResolver().resolve(build_attribute_specs(attributes_data))
 
-        # Parse attributes_data if it's a string (JSON)
-        if isinstance(attributes_data, str):
-            try:
-                attributes_data = json.loads(attributes_data)
-            except json.JSONDecodeError:
-                attributes_data = []
-
-        if isinstance(variants_data, list) and len(variants_data) == 1 and isinstance(variants_data[0], str):
-            variants_data = variants_data[0]
-        # Parse variants_data if it's a string (JSON)
-        if isinstance(variants_data, str):
-            try:
-                variants_data = json.loads(variants_data)
-            except json.JSONDecodeError:
-                variants_data = []
-
-        # Ensure we have lists
-        if not isinstance(attributes_data, list):
-            attributes_data = []
-        if not isinstance(variants_data, list):
-            variants_data = []
-
-        # Xử lý thuộc tính
-        attribute_map = {}  # Map attribute name -> attribute object
-        attribute_value_map = {}  # Map (attribute_name, value) -> attribute_value object
-
-        for attr_data in attributes_data:
-            if not isinstance(attr_data, dict):
+        # Xử lý biến thể
+        variant_rows = []
+        for variant_data in variants_data:
+            if not isinstance(variant_data, dict):
                 continue
 
-            attr_name = attr_data.get('name')
-            attr_type = attr_data.get('type', 'other')
-            attr_values = attr_data.get('values', [])
+            # Gắn các giá trị thuộc tính cho biến thể (hỗ trợ dạng {tên: giá trị} và [{name, value}])
+            pairs = [
+                pair for pair in variant_attribute_pairs(variant_data.get('attributes', {}))
+                if pair in attribute_value_map
+            ]
+            variant_rows.append({
+                'sku': variant_data.get('sku'),
+                'price': variant_data.get('price', product.price),
+                'sale_price': variant_data.get('sale_price', product.sale_price),
+                'stock': variant_data.get('stock', 0),
+                'image_url': variant_data.get('image_url'),
+                'labels': [value for _, value in pairs],
+                'attribute_value_ids': [attribute_value_map[pair] for pair in pairs],
+            })
 
-            # Tạo hoặc lấy thuộc tính
-            attribute, _ = Attribute.objects.get_or_create(
-                name=attr_name,
-                defaults={
-                    'display_name': attr_name.title() if attr_name else '',
-                    'attribute_type': attr_type
-                }
-            )
-            attribute_map[attr_name] = attribute
+        # Sản phẩm vừa tạo chưa có biến thể nên không cần tra cứu SKU đã có
+        write_variants(product, variant_rows, taken_skus=set())
 
-            # Tạo các giá trị thuộc tính
-            for value_data in attr_values:
-                if not isinstance(value_data, dict):
-                    continue
 
-                value = value_data.get('value')
-                display = value_data.get('display', value)
-                color_code = value_data.get('color_code') if attr_type == 'color' else None
-
-                # Tạo hoặc lấy giá trị thuộc tính
-                attr_value, _ = AttributeValue.objects.get_or_create(
-                    attribute=attribute,
-                    value=value,
-                    defaults={
-                        'display_value': display,
-                        'color_code': color_code
-                    }
-                )
-                attribute_value_map[(attr_name, value)] = attr_value
+class ProductImportView(APIView):
+    """API nhập sản phẩm hàng loạt từ file CSV/JSONL cho chủ cửa hàng"""
+    permission_classes = [IsShopOwner]
+    parser_classes = (MultiPartParser, FormParser)
 
-        # Xử lý biến thể
-        for variant_data in variants_data:
-            if not isinstance(variant_data, dict):
-                continue
+    def get(self, request, shop_id):
+        """Lấy danh sách các lần nhập gần đây của cửa hàng"""
+        shop = get_object_or_404(Shop, id=shop_id)
 
-            sku = variant_data.get('sku', f"{product.slug}-{len(variants_data)}")
-            price = variant_data.get('price', product.price)
-            sale_price = variant_data.get('sale_price', product.sale_price)
-            stock = variant_data.get('stock', 0)
-            image_url = variant_data.get('image_url')
-
-        # Tạo biến thể
-            variant = ProductVariant.objects.create(
-                product=product,
-                sku=sku,
-                price=price,
-                sale_price=sale_price,
-                stock=stock,
-                image_url=image_url
-            )
+        if shop.owner != request.user:
+            return Response({
+                'status': 'error',
+                'message': 'Bạn không có quyền xem dữ liệu nhập của cửa hàng này'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        jobs = ProductImportJob.objects.filter(shop=shop).defer('errors')[:20]
+        serializer = ProductImportJobListSerializer(jobs, many=True)
+
+        return Response({
+            'status': 'success',
+            'message': 'Đã lấy danh sách lần nhập sản phẩm',
+            'data': serializer.data
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request, shop_id):
+        """
+        Tải lên file CSV/JSONL để nhập sản phẩm. File được xử lý trong nền,
+        client theo dõi tiến độ qua API chi tiết của lần nhập
+        """
+        shop = get_object_or_404(Shop, id=shop_id)
+
+        if shop.owner != request.user:
+            return Response({
+                'status': 'error',
+                'message': 'Bạn không có quyền nhập sản phẩm cho cửa hàng này'
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        if 'file' not in request.FILES:
+            return Response({
+                'status': 'error',
+                'message': 'Không có file được cung cấp'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        uploaded_file = request.FILES['file']
+        job = ProductImportJob.objects.create(
+            shop=shop,
+            created_by=request.user,
+            file_name=uploaded_file.name[:255],
+            file_format=detect_format(uploaded_file.name, request.data.get('format'))
+        )
+        start_import_job(job, uploaded_file)
+
+        return Response({
+            'status': 'success',
+            'message': 'Đã bắt đầu nhập sản phẩm',
+            'data': ProductImportJobSerializer(job).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class ProductImportJobDetailView(APIView):
+    """API xem tiến độ và lỗi của một lần nhập sản phẩm"""
+    permission_classes = [IsShopOwner]
+
+    def get(self, request, shop_id, job_id):
+        job = get_object_or_404(ProductImportJob, id=job_id, shop_id=shop_id)
+
+        if job.shop.owner != request.user:
+            return Response({
+                'status': 'error',
+                'message': 'Bạn không có quyền xem lần nhập này'
+            }, status=status.HTTP_403_FORBIDDEN)
 
-            logging.debug(f"Creating variant: SKU={sku}, price={price}, sale_price={sale_price}, stock={stock}")
-
-            # Gắn các giá trị thuộc tính cho biến thể
-            variant_attributes = variant_data.get('attributes', {})
-            # Log for debugging
-            logging.debug(f"Attributes cho biến thể {sku}: {variant_attributes}")
-
-            # Handle both dictionary format and list format
-            if isinstance(variant_attributes, dict):
-                # Dictionary format (name: value)
-                for attr_name, attr_value in variant_attributes.items():
-                    if attr_name in attribute_map and (attr_name, attr_value) in attribute_value_map:
-                        VariantAttributeValue.objects.create(
-                            variant=variant,
-                            attribute_value=attribute_value_map[(attr_name, attr_value)]
-                        )
-            elif isinstance(variant_attributes, list):
-                # List format [{name: ..., value: ...}, ...]
-                for attr_item in variant_attributes:
-                    if isinstance(attr_item, dict):
-                        attr_name = attr_item.get('name')
-                        attr_value = attr_item.get('value')
-                        if attr_name in attribute_map and (attr_name, attr_value) in attribute_value_map:
-                            VariantAttributeValue.objects.create(
-                                variant=variant,
-                                attribute_value=attribute_value_map[(attr_name, attr_value)]
-                            )
+        return Response({
+            'status': 'success',
+            'message': 'Đã lấy thông tin lần nhập sản phẩm',
+            'data': ProductImportJobSerializer(job).data
+        }, status=status.HTTP_200_OK)
 
 
 class ProductDetailView(APIView):
@@ -380,19 +488,17 @@ class ProductDetailView(APIView):
         """Lấy thông tin chi tiết của một sản phẩm"""
         product = get_object_or_404(Product, id=product_id)
 
-        # Tăng số lượt xem
-        product.view_count += 1
-        product.save(update_fields=['view_count'])
-
-        serializer = ProductDetailSerializer(product)
+        # Tăng số lượt xem qua bộ đệm (ghi dồn xuống DB theo chu kỳ),
+        # cộng thêm các lượt xem đang chờ để số hiển thị không bị chậm
+        product.view_count += view_counter.record(product.id)
 
+        # Payload chi tiết lấy từ cache, tồn kho và các bộ đếm được ghi đè từ bản ghi vừa đọc
         return Response({
             'status': 'success',
             'message': 'Đã lấy thông tin chi tiết sản phẩm thành công',
-            'data': serializer.data
+            'data': get_product_detail(product)
         }, status=status.HTTP_200_OK)
 
-    @transaction.atomic
     def put(self, request, product_id):
         """Cập nhật thông tin sản phẩm"""
         product = get_object_or_404(Product, id=product_id)
@@ -408,37 +514,32 @@ class ProductDetailView(APIView):
         serializer = ProductSerializer(product, data=request.data, partial=True)
 
         if serializer.is_valid():
-            product = serializer.save()
-
-            # Xử lý hình ảnh mới (nếu có)
+            # Tải lên hình ảnh mới (nếu có) trước khi mở transaction
+            image_batch = None
             if 'images' in request.FILES:
-                images = request.FILES.getlist('images')
-                for index, image_file in enumerate(images):
-                    upload_result = cloudinary.uploader.upload(
-                        image_file,
-                        folder=f"shops/{product.shop.id}/products",
-                    )
-                    image_url = upload_result.get('secure_url')
-
-                    # Tạo hình ảnh mới
-                    ProductImage.objects.create(
-                        product=product,
-                        image_url=image_url,
-                        is_thumbnail=False,  # Không đặt là thumbnail mặc định
-                        display_order=ProductImage.objects.filter(product=product).count() + index
+                image_batch = prepare_product_images(product.shop_id, request.FILES.getlist('images'))
+
+            with transaction.atomic():
+                product = serializer.save()
+
+                # Lưu hình ảnh mới, không đặt là thumbnail mặc định
+                if image_batch is not None:
+                    create_product_images(
+                        product, image_batch,
+                        start_order=ProductImage.objects.filter(product=product).count()
                     )
 
-            # Cập nhật biến thể (nếu có)
-            if 'variants' in request.data:
-                self._update_variants(product, request.data.get('variants', []))
+                # Cập nhật biến thể (nếu có)
+                if 'variants' in request.data:
+                    self._update_variants(product, request.data.get('variants', []))
 
-            # Lấy thông tin chi tiết sản phẩm đã cập nhật
-            updated_serializer = ProductDetailSerializer(product)
+            # Lấy thông tin chi tiết sản phẩm đã cập nhật (tải trước biến thể, thuộc tính, hình ảnh)
+            updated_data = render_product_detail(product.id)
 
             return Response({
                 'status': 'success',
                 'message': 'Đã cập nhật sản phẩm thành công',
-                'data': updated_serializer.data
+                'data': updated_data
             }, status=status.HTTP_200_OK)
 
         return Response({
@@ -473,54 +574,56 @@ class ProductDetailView(APIView):
         }, status=status.HTTP_200_OK)
 
     def _update_variants(self, product, variants_data):
-        """Cập nhật các biến thể của sản phẩm"""
-        # Check if variants_data is a string (JSON) and parse it
-        if isinstance(variants_data, str):
-            try:
-                import json
-                variants_data = json.loads(variants_data)
-            except json.JSONDecodeError:
-                # Handle invalid JSON
-                return
+        """Thêm các biến thể mới cho sản phẩm (ghi theo lô)"""
+        variants_data = [variant_data for variant_data in parse_json_list(variants_data) if isinstance(variant_data, dict)]
+        if not variants_data:
+            return
 
-        # Xóa tất cả biến thể hiện có của sản phẩm
-        # ProductVariant.objects.filter(product=product).delete()
+        # Tra cứu toàn bộ giá trị thuộc tính được tham chiếu bằng một truy vấn
+        attribute_values = load_attribute_values([
+            value_id for variant_data in variants_data for value_id in variant_data.get('attribute_values', [])
+        ])
 
-        # Thêm các biến thể mới
+        variant_rows = []
         for variant_data in variants_data:
-            # Make sure variant_data is a dictionary
-            if not isinstance(variant_data, dict):
-                continue
+            # Bỏ qua giá trị thuộc tính không tồn tại
+            value_ids = [
+                value_id for value_id in parse_ids(variant_data.get('attribute_values', []))
+                if value_id in attribute_values
+            ]
+            variant_rows.append({
+                'sku': variant_data.get('sku'),
+                'price': variant_data.get('price', product.price),
+                'sale_price': variant_data.get('sale_price', product.sale_price),
+                'stock': variant_data.get('stock', 0),
+                'image_url': variant_data.get('image_url'),
+                'labels': [attribute_values[value_id] for value_id in value_ids],
+                'attribute_value_ids': value_ids,
+            })
+
+        write_variants(product, variant_rows)
 
-            # Tạo biến thể mới
-            sku = variant_data.get('sku', f"{product.slug}-{ProductVariant.objects.filter(product=product).count() + 1}")
-            price = variant_data.get('price', product.price)
-            sale_price = variant_data.get('sale_price', product.sale_price)
-            stock = variant_data.get('stock', 0)
-            image_url = variant_data.get('image_url')
-
-            # Tạo biến thể mới
-            variant = ProductVariant.objects.create(
-                product=product,
-                sku=sku,
-                price=price,
-                sale_price=sale_price,
-                stock=stock,
-                image_url=image_url
-            )
 
-            # Xử lý các giá trị thuộc tính của biến thể
-            if 'attribute_values' in variant_data:
-                for attr_value_id in variant_data.get('attribute_values', []):
-                    try:
-                        attr_value = AttributeValue.objects.get(id=attr_value_id)
-                        VariantAttributeValue.objects.create(
-                            variant=variant,
-                            attribute_value=attr_value
-                        )
-                    except AttributeValue.DoesNotExist:
-                        # Bỏ qua nếu giá trị thuộc tính không tồn tại
-                        pass
+class ProductViewCounterMetricsView(APIView):
+    """API theo dõi bộ đệm lượt xem sản phẩm (chỉ dành cho quản trị viên)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """Số lượt xem đang chờ ghi và kết quả các lần ghi dồn của tiến trình hiện tại"""
+        return Response({
+            'status': 'success',
+            'message': 'Đã lấy thông tin bộ đệm lượt xem',
+            'data': view_counter.metrics()
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """Ghi ngay các lượt xem đang chờ xuống cơ sở dữ liệu"""
+        flushed = view_counter.flush()
+        return Response({
+            'status': 'success',
+            'message': f'Đã ghi {flushed} lượt xem',
+            'data': view_counter.metrics()
+        }, status=status.HTTP_200_OK)
 
 
 class ProductImageManagementView(APIView):
@@ -546,26 +649,21 @@ class ProductImageManagementView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         image_file = request.FILES['image']
-        is_thumbnail = request.data.get('is_thumbnail', False)
+        is_thumbnail = str(request.data.get('is_thumbnail', 'false')).lower() == 'true'
 
-        # Tải lên hình ảnh vào Cloudinary
-        upload_result = cloudinary.uploader.upload(
-            image_file,
-            folder=f"shops/{product.shop.id}/products",
-        )
-        image_url = upload_result.get('secure_url')
+        # Tải lên hình ảnh qua dịch vụ media
+        image_batch = prepare_product_images(product.shop_id, [image_file])
 
         # Nếu đặt làm ảnh đại diện, cập nhật các ảnh khác
         if is_thumbnail:
             ProductImage.objects.filter(product=product, is_thumbnail=True).update(is_thumbnail=False)
 
         # Tạo bản ghi hình ảnh mới
-        image = ProductImage.objects.create(
-            product=product,
-            image_url=image_url,
-            is_thumbnail=is_thumbnail,
-            display_order=ProductImage.objects.filter(product=product).count()
-        )
+        image = create_product_images(
+            product, image_batch,
+            start_order=ProductImage.objects.filter(product=product).count(),
+            thumbnail_index=0 if is_thumbnail else None
+        )[0]
 
         serializer = ProductImageSerializer(image)
 
@@ -637,6 +735,74 @@ class ProductImageManagementView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class ProductVariantResolveView(APIView):
+    """
+    API tra cứu biến thể theo tổ hợp thuộc tính, ví dụ ?color=red&size=M
+    (hoặc ?attribute_value_ids=1,5). Trả về biến thể (giá, tồn kho) nếu lựa chọn đầy đủ
+    và các giá trị còn hàng của từng thuộc tính với lựa chọn hiện tại
+    """
+    permission_classes = [permissions.AllowAny]
+    # Tham số không phải tên thuộc tính
+    reserved_params = {'attribute_value_ids', 'image_size', 'image_format'}
+
+    def get(self, request, product_id):
+        product = get_object_or_404(Product.objects.only('id', 'price', 'sale_price'), id=product_id)
+        matrix = get_variant_matrix(product.id)
+
+        try:
+            if 'attribute_value_ids' in request.query_params:
+                value_ids = parse_ids(request.query_params.get('attribute_value_ids', '').split(','))
+                selected = selection_from_value_ids(matrix, value_ids)
+            else:
+                selection = {
+                    name: value for name, value in request.query_params.items()
+                    if name not in self.reserved_params and value != ''
+                }
+                selected = parse_selection(matrix, selection)
+        except SelectionError as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        stock = dict(ProductVariant.objects.filter(product_id=product.id).values_list('id', 'stock'))
+        available = get_available_values(matrix, selected, stock)
+        variant = resolve_variant(product, selected)
+
+        values = {item['id']: item for attribute in matrix['attributes'] for item in attribute['values']}
+        variant_data = None
+        if variant is not None:
+            variant_data = {
+                'id': variant.id,
+                'sku': variant.sku,
+                'price': variant.price,
+                'sale_price': variant.sale_price,
+                'effective_price': get_variant_price(variant, product),
+                'stock': variant.stock,
+                'in_stock': variant.stock > 0,
+                'image_url': variant.image_url,
+            }
+
+        return Response({
+            'status': 'success',
+            'message': 'Đã tra cứu biến thể thành công' if variant_data else 'Chưa có biến thể ứng với lựa chọn',
+            'data': {
+                'product_id': product.id,
+                'selection': {
+                    attribute['name']: values[selected[attribute['id']]]['value']
+                    for attribute in matrix['attributes'] if attribute['id'] in selected
+                },
+                'complete': len(selected) == len(matrix['attributes']),
+                'variant': variant_data,
+                'available': {
+                    attribute['name']: [values[value_id]['value'] for value_id in available[attribute['id']]]
+                    for attribute in matrix['attributes']
+                },
+                'attributes': matrix['attributes'],
+            }
+        }, status=status.HTTP_200_OK)
+
+
 class ProductVariantManagementView(APIView):
     """API để quản lý biến thể sản phẩm"""
     permission_classes = [IsShopOwner]
@@ -656,9 +822,13 @@ class ProductVariantManagementView(APIView):
         data = request.data.copy()
         data['product'] = product_id
 
-        # Tạo SKU tự động nếu không được cung cấp
+        # Tra cứu các giá trị thuộc tính của biến thể bằng một truy vấn
+        attribute_values = load_attribute_values(data.get('attribute_values', []))
+
+        # Tạo SKU tự động nếu không được cung cấp (từ slug và giá trị thuộc tính)
         if 'sku' not in data or not data['sku']:
-            data['sku'] = f"{product.slug}-{ProductVariant.objects.filter(product=product).count() + 1}"
+            taken = existing_skus(product)
+            data['sku'] = generate_sku(product, list(attribute_values.values()), len(taken), taken)
 
         # Serializer cho biến thể
         serializer = ProductVariantSerializer(data=data)
@@ -666,18 +836,9 @@ class ProductVariantManagementView(APIView):
         if serializer.is_valid():
             variant = serializer.save()
 
-            # Xử lý các giá trị thuộc tính của biến thể
-            if 'attribute_values' in data:
-                for attr_value_id in data.get('attribute_values', []):
-                    try:
-                        attr_value = AttributeValue.objects.get(id=attr_value_id)
-                        VariantAttributeValue.objects.create(
-                            variant=variant,
-                            attribute_value=attr_value
-                        )
-                    except AttributeValue.DoesNotExist:
-                        # Bỏ qua nếu giá trị thuộc tính không tồn tại
-                        pass
+            # Gắn các giá trị thuộc tính của biến thể (bỏ qua id không tồn tại)
+            if attribute_values:
+                add_variant_attribute_values(variant, list(attribute_values), validated=True)
 
             return Response({
                 'status': 'success',
@@ -713,20 +874,8 @@ class ProductVariantManagementView(APIView):
 
             # Cập nhật các giá trị thuộc tính của biến thể
             if 'attribute_values' in request.data:
-                # Xóa các giá trị thuộc tính hiện tại
-                VariantAttributeValue.objects.filter(variant=variant).delete()
-
-                # Thêm các giá trị thuộc tính mới
-                for attr_value_id in request.data.get('attribute_values', []):
-                    try:
-                        attr_value = AttributeValue.objects.get(id=attr_value_id)
-                        VariantAttributeValue.objects.create(
-                            variant=variant,
-                            attribute_value=attr_value
-                        )
-                    except AttributeValue.DoesNotExist:
-                        # Bỏ qua nếu giá trị thuộc tính không tồn tại
-                        pass
+                # Thay các giá trị thuộc tính hiện tại (bỏ qua id không tồn tại)
+                set_variant_attribute_values(variant, request.data.get('attribute_values', []))
 
             return Response({
                 'status': 'success',
@@ -786,39 +935,11 @@ class ShopProductStatsView(APIView):
                 'message': 'Bạn không có quyền xem thống kê cửa hàng này'
             }, status=status.HTTP_403_FORBIDDEN)
 
-        # Tính toán các thống kê
-        total_products = Product.objects.filter(shop=shop).count()
-        active_products = Product.objects.filter(shop=shop, status='active').count()
-        out_of_stock_products = Product.objects.filter(shop=shop, status='out_of_stock').count()
-        inactive_products = Product.objects.filter(shop=shop, status='inactive').count()
-
-        # Thống kê theo danh mục
-        category_stats = []
-        categories = Category.objects.filter(products__shop=shop).distinct()
-        for category in categories:
-            category_stats.append({
-                'id': category.id,
-                'name': category.name,
-                'count': Product.objects.filter(shop=shop, category=category).count()
-            })
-
-        # Tính tổng số lượng hàng tồn kho
-        total_stock = Product.objects.filter(shop=shop).aggregate(total=models.Sum('stock'))['total'] or 0
-
-        # Tính tổng doanh số (nếu có dữ liệu đơn hàng)
-        # (Ở đây bạn có thể tích hợp với mô hình đơn hàng của bạn)
-
+        # Snapshot dựng bằng một truy vấn GROUP BY, cache theo cửa hàng và cập nhật tăng dần
         return Response({
             'status': 'success',
             'message': 'Đã lấy thống kê sản phẩm của cửa hàng',
-            'data': {
-                'total_products': total_products,
-                'active_products': active_products,
-                'out_of_stock_products': out_of_stock_products,
-                'inactive_products': inactive_products,
-                'total_stock': total_stock,
-                'category_stats': category_stats
-            }
+            'data': get_shop_stats(shop.id)
         }, status=status.HTTP_200_OK)
 
 
@@ -855,6 +976,8 @@ class ProductBulkActionView(APIView):
                 'message': 'Không tìm thấy sản phẩm nào khớp với yêu cầu'
             }, status=status.HTTP_404_NOT_FOUND)
 
+        affected_ids = list(products.values_list('id', flat=True))
+
         if action == 'activate':
             # Kích hoạt sản phẩm
             products.update(status='active')
@@ -886,6 +1009,15 @@ class ProductBulkActionView(APIView):
                 'message': 'Hành động không hợp lệ'
             }, status=status.HTTP_400_BAD_REQUEST)
 
+        # update() không phát signal nên cần làm mới facet, số sản phẩm của danh mục,
+        # pool sản phẩm nổi bật, vector sản phẩm tương tự, thống kê cửa hàng và gợi ý thủ công
+        invalidate_facets()
+        invalidate_category_tree()
+        update_featured_pools_on_commit(affected_ids)
+        refresh_feature_vectors_on_commit(affected_ids)
+        invalidate_shop_stats_on_commit([shop.id])
+        refresh_autocomplete_terms_on_commit('product', affected_ids)
+
         return Response({
             'status': 'success',
             'message': message
@@ -897,25 +1029,34 @@ class ProductBulkActionView(APIView):
 class CategoryListView(APIView):
     """API để lấy danh sách tất cả danh mục sản phẩm"""
     permission_classes = [permissions.AllowAny]
+
+    def perform_content_negotiation(self, request, force=False):
+        # DRF coi ?format= là định dạng renderer (format=tree sẽ trả 404),
+        # ở đây format dùng để chọn kiểu dữ liệu nên luôn dùng renderer mặc định
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request):
         """Lấy danh sách tất cả danh mục"""
         # Lấy tham số truy vấn
         format_type = request.query_params.get('format', 'flat')
         status_filter = request.query_params.get('status', 'active')
 
+        # Dạng cây được lấy từ chỉ mục cây trong bộ nhớ (không truy vấn theo từng nút)
+        if format_type == 'tree':
+            tree_status = status_filter if status_filter != 'all' else None
+            return Response({
+                'status': 'success',
+                'message': 'Đã lấy danh sách danh mục thành công',
+                'data': get_category_tree().tree_data(tree_status)
+            }, status=status.HTTP_200_OK)
+
         # Lọc danh mục theo trạng thái nếu được chỉ định
         if status_filter and status_filter != 'all':
             categories = Category.objects.filter(status=status_filter)
         else:
             categories = Category.objects.all()
 
-        # Trả về danh sách phẳng hoặc cấu trúc cây tùy thuộc vào tham số format
-        if format_type == 'tree':
-            # Chỉ lấy danh mục gốc (không có danh mục cha)
-            root_categories = categories.filter(parent=None)
-            serializer = CategoryTreeSerializer(root_categories, many=True)
-        else:
-            serializer = CategoryListSerializer(categories, many=True)
+        serializer = CategoryListSerializer(categories, many=True)
 
         return Response({
             'status': 'success',
@@ -936,9 +1077,9 @@ class CategoryDetailView(APIView):
         include_children = request.query_params.get('include_children', 'false').lower() == 'true'
 
         if include_children:
-            serializer = CategoryTreeSerializer(category)
+            category_data = get_category_tree().subtree_data(category.id) or CategoryTreeSerializer(category).data
         else:
-            serializer = CategoryListSerializer(category)
+            category_data = CategoryListSerializer(category).data
 
         # Lấy tổng số sản phẩm trong danh mục này
         product_count = Product.objects.filter(category=category).count()
@@ -955,7 +1096,7 @@ class CategoryDetailView(APIView):
             'status': 'success',
             'message': 'Đã lấy thông tin danh mục thành công',
             'data': {
-                **serializer.data,
+                **category_data,
                 'product_count': product_count,
                 'parent': parent
             }
@@ -998,8 +1139,10 @@ from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from django.db.models import Q, Count, Avg
+from django.db.models import Q, Count, Avg, Exists, OuterRef, Value
+from django.db.models.functions import Coalesce
 from products.models import Product, Category
+from .facets import FacetCounter, get_facet_index, ATTRIBUTE_FACET_TYPES
 
 
 class CategoryProductsView(APIView):
@@ -1025,9 +1168,8 @@ class CategoryProductsView(APIView):
                         'image': category.image,
                         'parent_id': category.parent.id if category.parent else None
                     }
-                    category_ids = [category.id]
-                    child_ids = Category.objects.filter(parent=category).values_list('id', flat=True)
-                    category_ids.extend(child_ids)
+                    # Toàn bộ cây con của danh mục (lấy từ chỉ mục cây)
+                    category_ids = get_descendant_ids(category.id)
                 except Category.DoesNotExist:
                     return Response({
                         'status': 'error',
@@ -1035,74 +1177,133 @@ class CategoryProductsView(APIView):
                     }, status=status.HTTP_404_NOT_FOUND)
 
             # Lọc theo danh mục (nếu có)
-            products = Product.objects.filter(status='active')
+            products = Product.objects.filter(status='active').select_related('card')
             if category_ids:
                 products = products.filter(category_id__in=category_ids)
 
-            # Lọc tìm kiếm theo tên, mô tả
+            # Lọc theo shop (sản phẩm chưa có thương hiệu nên không lọc được theo brand_id,
+            # kể cả trong facet)
+            shop_id = request.query_params.get('shop_id')
+            if request.query_params.get('brand_id'):
+                return Response({
+                    'status': 'error',
+                    'message': 'Sản phẩm chưa có thương hiệu, không hỗ trợ lọc theo brand_id'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                shop_id = int(shop_id) if shop_id else None
+            except ValueError:
+                return Response({
+                    'status': 'error',
+                    'message': 'Tham số shop_id phải là số nguyên'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            if shop_id is not None:
+                products = products.filter(shop_id=shop_id)
+
+            # Tìm kiếm qua chỉ mục ngược, lấy danh sách id đã xếp hạng theo BM25
+            # (trong phạm vi danh mục và shop đang lọc)
             search = request.query_params.get('q')
+            ranked_ids = []
             if search:
-                products = products.filter(
-                    Q(name__icontains=search)
-                )
-
-            # Lọc theo giá
+                ranked_ids = search_product_ids(search, shop_id=shop_id, active_only=True,
+                                                category_ids=category_ids)
+                products = products.filter(id__in=ranked_ids)
+                # Truy vấn có kết quả được đếm cho gợi ý "truy vấn phổ biến" (chỉ tính trang đầu)
+                if ranked_ids and 'cursor' not in request.query_params and \
+                        request.query_params.get('page', '1') == '1':
+                    record_search_query(search)
+
+            # Lọc theo giá hiệu lực (giá khách hàng thực trả, gồm giá khuyến mãi và giá biến thể)
             min_price = request.query_params.get('min_price')
             max_price = request.query_params.get('max_price')
 
+            min_price_value = None
+            max_price_value = None
+
             if min_price:
                 try:
-                    products = products.filter(price__gte=float(min_price))
+                    min_price_value = float(min_price)
                 except ValueError:
                     pass
 
             if max_price:
                 try:
-                    products = products.filter(price__lte=float(max_price))
+                    max_price_value = float(max_price)
                 except ValueError:
                     pass
 
-            # Lọc theo shop hoặc brand
-            shop_id = request.query_params.get('shop_id')
-            brand_id = request.query_params.get('brand_id')
+            if min_price_value is not None or max_price_value is not None:
+                products = products.filter(price_range_filter(min_price_value, max_price_value))
 
-            if shop_id:
-                products = products.filter(shop_id=shop_id)
-            if brand_id:
-                products = products.filter(brand_id=brand_id)
+            # Lọc theo đánh giá tối thiểu
+            min_rating = request.query_params.get('min_rating')
+            min_rating_value = None
+            if min_rating:
+                try:
+                    min_rating_value = float(min_rating)
+                    products = products.filter(rating__gte=min_rating_value)
+                except ValueError:
+                    pass
+
+            # Lọc theo thuộc tính biến thể (vd: ?color=red,blue&size=M)
+            attribute_filters = {}
+            for attribute_type in ATTRIBUTE_FACET_TYPES:
+                raw_values = request.query_params.get(attribute_type)
+                if not raw_values:
+                    continue
+                values = [value.strip() for value in raw_values.split(',') if value.strip()]
+                if not values:
+                    continue
+                attribute_filters[attribute_type] = values
+                products = products.filter(Exists(VariantAttributeValue.objects.filter(
+                    variant__product=OuterRef('pk'),
+                    attribute_value__attribute__attribute_type=attribute_type,
+                    attribute_value__value__in=values
+                )))
+
+
+            # Đếm facet trên chỉ mục bitmap của danh mục
+            facets = None
+            if request.query_params.get('facets', 'true').lower() != 'false':
+                counter = FacetCounter(get_facet_index(category_id, category_ids))
+                if search:
+                    counter.restrict_to_ids(ranked_ids)
+                if shop_id is not None:
+                    counter.filter_shop(shop_id)
+                if min_price_value is not None or max_price_value is not None:
+                    counter.filter_price(min_price_value, max_price_value)
+                if min_rating_value is not None:
+                    counter.filter_rating(min_rating_value)
+                for attribute_type, values in attribute_filters.items():
+                    counter.filter_attribute(attribute_type, values)
+                facets = counter.counts()
 
             # Annotate dữ liệu cần thiết
             products = products.annotate(
-                avg_rating=Avg('reviews__rating'),
-                total_sold=Count('order_items', filter=Q(order_items__status__in=[
-                    'delivered', 'received', 'received_reviewed'
-                ]))
+                avg_rating=Coalesce(Avg('reviews__rating'), Value(0.0))
             )
 
             # Sắp xếp
-            sort_by = request.query_params.get('sort_by', 'latest')
+            sort_by = request.query_params.get('sort_by', 'relevance' if search else 'latest')
             sort_map = {
-                'price_asc': 'price',
-                'price_desc': '-price',
+                'price_asc': 'min_price',
+                'price_desc': '-max_price',
                 'name_asc': 'name',
                 'name_desc': '-name',
                 'rating': '-avg_rating',
-                'popular': '-total_sold',
+                # Số lượng đã bán lấy từ số liệu cộng dồn (xem products/sales_rollup.py)
+                'popular': '-sold_count',
                 'latest': '-created_at'
             }
-            sort_field = sort_map.get(sort_by, '-created_at')
-            products = products.order_by(sort_field)
+            if sort_by == 'relevance' and search:
+                products = order_by_relevance(products, ranked_ids)
+            else:
+                sort_field = sort_map.get(sort_by, '-created_at')
+                products = products.order_by(sort_field)
 
-            # Phân trang
-            page = int(request.query_params.get('page', 1))
-            page_size = int(request.query_params.get('page_size', 20))
-            paginator = Paginator(products, page_size)
-            total_count = paginator.count
-
-            try:
-                paginated_products = paginator.page(page)
-            except (PageNotAnInteger, EmptyPage):
-                paginated_products = paginator.page(1)
+            # Phân trang (keyset nếu có tham số cursor, ngược lại theo số trang)
+            paginated_products, pagination = KeysetPagination.paginate(request, products, default_page_size=20)
 
             serializer = ProductSerializer(paginated_products, many=True, context={'request': request})
 
@@ -1112,23 +1313,22 @@ class CategoryProductsView(APIView):
                 'data': {
                     'category': category_info,
                     'products': serializer.data,
-                    'pagination': {
-                        'total': total_count,
-                        'page': page,
-                        'page_size': page_size,
-                        'total_pages': paginator.num_pages
-                    },
+                    'pagination': pagination,
                     'filters': {
                         'min_price': min_price,
                         'max_price': max_price,
                         'shop_id': shop_id,
-                        'brand_id': brand_id,
+                        'min_rating': min_rating,
+                        'attributes': attribute_filters,
                         'search': search,
                         'sort_by': sort_by
-                    }
+                    },
+                    'facets': facets
                 }
             }, status=status.HTTP_200_OK)
 
+        except CustomError:
+            raise
         except Exception as e:
             return Response({
                 'status': 'error',
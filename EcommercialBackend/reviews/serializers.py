@@ -2,6 +2,8 @@
 from rest_framework import serializers
 from .models import Review, ReviewLike, OrderReview
 from products.models import Product
+from core.derivatives import get_image_preferences
+from products.cards import get_product_thumbnail
 from orders.models import OrderItem, Order
 import json
 
@@ -33,8 +35,8 @@ class OrderReviewDetailSerializer(serializers.ModelSerializer):
         if not product_id:
             return None
 
-        # Tìm sản phẩm trong đơn hàng
-        item = obj.order.items.filter(product_id=product_id).first()
+        # Tìm sản phẩm trong đơn hàng (duyệt trên dữ liệu đã prefetch)
+        item = next((item for item in obj.order.items.all() if str(item.product_id) == str(product_id)), None)
         if not item:
             return None
 
@@ -42,7 +44,7 @@ class OrderReviewDetailSerializer(serializers.ModelSerializer):
         return {
             'id': product.id,
             'name': product.name,
-            'thumbnail': product.images.filter(is_thumbnail=True).first().image_url if product.images.filter(is_thumbnail=True).exists() else None
+            'thumbnail': get_product_thumbnail(product, *get_image_preferences(self.context))
         }
 
     def get_images(self, obj):
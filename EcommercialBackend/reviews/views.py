@@ -7,7 +7,11 @@ from django.shortcuts import get_object_or_404
 from .models import Review, ReviewLike, OrderReview
 from .serializers import ReviewSerializer, ReviewLikeSerializer, OrderReviewSerializer, OrderReviewDetailSerializer
 from orders.models import Order, OrderItem
-import cloudinary.uploader
+from core.pagination import KeysetPagination
+from products.cards import get_product_thumbnail
+from products.sales_rollup import order_item_rows, record_status_change
+from core.derivatives import get_image_preferences
+from core.media import media_service
 import json
 
 
@@ -35,7 +39,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
             return Response({"detail": "product_id là bắt buộc"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Lọc theo sản phẩm và chỉ lấy các đánh giá đã được phê duyệt
-        queryset = OrderReview.objects.filter(product_id=product_id, status='approved')
+        queryset = Review.objects.filter(product_id=product_id, status='approved')
 
         # Lọc theo rating
         rating_filter = request.query_params.get('rating')
@@ -70,19 +74,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
         else:
             queryset = queryset.order_by(f'-{sort_by}')
 
-        # Phân trang
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-
-        # Đếm tổng số đánh giá trước khi phân trang
-        total_count = queryset.count()
-
-        # Tạo slice cho phân trang
-        start = (page - 1) * page_size
-        end = start + page_size
-
-        # Thực hiện phân trang
-        queryset = queryset[start:end]
+        # Phân trang (keyset nếu có tham số cursor, ngược lại theo số trang)
+        queryset, pagination = KeysetPagination.paginate(request, queryset, default_page_size=10)
 
         # Thêm thông tin về người dùng và số lượt thích
         serializer = self.get_serializer(queryset, many=True)
@@ -103,20 +96,19 @@ class ReviewViewSet(viewsets.ModelViewSet):
             status='approved'
         ).aggregate(Avg('rating'))['rating__avg'] or 0
 
+        # Khi client bỏ qua đếm (skip_count) thì không có khóa total_reviews
+        summary = {
+            'average_rating': round(avg_rating, 1),
+            'rating_distribution': rating_counts
+        }
+        if pagination['total'] is not None:
+            summary['total_reviews'] = pagination['total']
+
         # Chuẩn bị dữ liệu phản hồi
         response_data = {
             'reviews': serializer.data,
-            'pagination': {
-                'total': total_count,
-                'page': page,
-                'page_size': page_size,
-                'total_pages': (total_count + page_size - 1) // page_size
-            },
-            'summary': {
-                'average_rating': round(avg_rating, 1),
-                'total_reviews': total_count,
-                'rating_distribution': rating_counts
-            },
+            'pagination': pagination,
+            'summary': summary,
             'filters': {
                 'product_id': product_id,
                 'rating': rating_filter,
@@ -243,13 +235,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
 
             if first_item:
                 product = first_item.variant.product
-                thumbnail = product.images.filter(is_thumbnail=True).first()
-                if thumbnail:
-                    product_image = thumbnail.image_url
-                else:
-                    first_image = product.images.first()
-                    if first_image:
-                        product_image = first_image.image_url
+                product_image = get_product_thumbnail(product, *get_image_preferences({'request': request}))
 
                 product_name = product.name
 
@@ -311,24 +297,16 @@ class ReviewViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Bạn đã đánh giá đơn hàng này rồi"},
                             status=status.HTTP_400_BAD_REQUEST)
 
+        # Upload ảnh (tối đa 3 ảnh, song song) trước khi mở transaction
+        # để không giữ khóa DB trong lúc chờ dịch vụ lưu trữ
+        uploaded_image_urls = media_service.upload_many(
+            request.FILES.getlist('images')[:3],
+            f"reviews/orders/{order.id}"
+        )
+
         # Sử dụng transaction để đảm bảo tính nhất quán của dữ liệu
         from django.db import transaction
         with transaction.atomic():
-            # Xử lý upload ảnh lên Cloudinary
-            uploaded_image_urls = []
-            if 'images' in request.FILES:
-                images = request.FILES.getlist('images')
-                # Giới hạn tối đa 3 ảnh
-                for image in images[:3]:
-                    # Upload ảnh lên Cloudinary
-                    upload_result = cloudinary.uploader.upload(
-                        image,
-                        folder=f"reviews/orders/{order.id}",
-                    )
-                    # Lấy URL ảnh đã upload
-                    image_url = upload_result.get('secure_url')
-                    uploaded_image_urls.append(image_url)
-
             # Tạo đánh giá đơn hàng mới
             order_review = OrderReview.objects.create(
                 order=order,
@@ -390,7 +368,9 @@ class ReviewViewSet(viewsets.ModelViewSet):
             )
 
             # Cập nhật các order item cùng lúc
+            sales_rows = order_item_rows(order.items.all())
             order.items.all().update(status='received_reviewed')
+            record_status_change(sales_rows, 'received_reviewed')
 
         serializer = OrderReviewSerializer(order_review)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -435,20 +415,11 @@ class ReviewViewSet(viewsets.ModelViewSet):
             return Response({"detail": "You have already reviewed this order item"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Xử lý upload ảnh lên Cloudinary
-        uploaded_image_urls = []
-        if 'images' in request.FILES:
-            images = request.FILES.getlist('images')
-            # Giới hạn tối đa 3 ảnh
-            for image in images[:3]:
-                # Upload ảnh lên Cloudinary
-                upload_result = cloudinary.uploader.upload(
-                    image,
-                    folder=f"reviews/{order_item.variant.product.id}",
-                )
-                # Lấy URL ảnh đã upload
-                image_url = upload_result.get('secure_url')
-                uploaded_image_urls.append(image_url)
+        # Upload ảnh (tối đa 3 ảnh, song song)
+        uploaded_image_urls = media_service.upload_many(
+            request.FILES.getlist('images')[:3],
+            f"reviews/{order_item.variant.product.id}"
+        )
 
         # Tạo đánh giá mới
         review_data = {
@@ -482,7 +453,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
         queryset = OrderReview.objects.filter(
             order__in=relevant_orders,
             status='approved'
-        ).select_related('user', 'order').prefetch_related('order__items', 'order__items__product', 'order__items__product__images')
+        ).select_related('user', 'order').prefetch_related('order__items', 'order__items__product', 'order__items__product__card')
         
         # Lọc theo rating
         rating_filter = request.query_params.get('rating')
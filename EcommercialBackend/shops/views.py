@@ -1,5 +1,4 @@
 # shops/views.py
-import cloudinary.uploader
 from django.http import Http404
 from rest_framework.parsers import MultiPartParser, FormParser
 from datetime import datetime, timedelta
@@ -17,7 +16,8 @@ from .models import ShopFollower
 from .serializers import ShopFollowerSerializer, ShopSettingSerializer
 from .models import ShopSetting
 from .serializers import ShopSettingUpdateSerializer, ShopUpdateSerializer
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from core.pagination import AdminKeysetPagination
+from core.media import media_service
 from core.models import User
 from django.utils import timezone
 
@@ -173,25 +173,14 @@ class ShopCreateView(APIView):
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request):
-        # Xử lý tải lên logo vào Cloudinary
-        if 'logo' in request.FILES:
-            logo_file = request.FILES['logo']
-            upload_result = cloudinary.uploader.upload(
-                logo_file,
-                folder=f"shops/{request.user.id}/logos",
-            )
-            logo_url = upload_result.get('secure_url')
-            request.data['logo'] = logo_url  # Gán lại vào data
-
-        # Xử lý tải lên banner vào Cloudinary
-        if 'banner' in request.FILES:
-            banner_file = request.FILES['banner']
-            upload_result = cloudinary.uploader.upload(
-                banner_file,
-                folder=f"shops/{request.user.id}/banners",
-            )
-            banner_url = upload_result.get('secure_url')
-            request.data['banner'] = banner_url  # Gán lại vào data
+        # Tải lên logo và banner song song qua dịch vụ media
+        uploads = [
+            (field, request.FILES[field], f"shops/{request.user.id}/{field}s")
+            for field in ('logo', 'banner') if field in request.FILES
+        ]
+        urls = media_service.upload_all((file, folder) for _, file, folder in uploads)
+        for (field, _, _), url in zip(uploads, urls):
+            request.data[field] = url  # Gán lại vào data
 
         serializer = ShopCreateSerializer(data=request.data, context={'request': request})
 
@@ -572,23 +561,14 @@ class ShopManagementView(APIView):
         serializer = ShopUpdateSerializer(shop, data=request.data)
 
         if serializer.is_valid():
-            # Xử lý cập nhật logo
-            if 'logo' in request.FILES:
-                logo_file = request.FILES['logo']
-                upload_result = cloudinary.uploader.upload(
-                    logo_file,
-                    folder=f"shops/{shop.owner.id}/logos",
-                )
-                shop.logo = upload_result.get('secure_url')
-
-            # Xử lý cập nhật banner
-            if 'banner' in request.FILES:
-                banner_file = request.FILES['banner']
-                upload_result = cloudinary.uploader.upload(
-                    banner_file,
-                    folder=f"shops/{shop.owner.id}/banners",
-                )
-                shop.banner = upload_result.get('secure_url')
+            # Xử lý cập nhật logo và banner (tải lên song song)
+            uploads = [
+                (field, request.FILES[field], f"shops/{shop.owner.id}/{field}s")
+                for field in ('logo', 'banner') if field in request.FILES
+            ]
+            urls = media_service.upload_all((file, folder) for _, file, folder in uploads)
+            for (field, _, _), url in zip(uploads, urls):
+                setattr(shop, field, url)
 
             # Lưu dữ liệu đã xác thực
             shop = serializer.save()
@@ -907,15 +887,8 @@ class AdminShopListView(APIView):
         else:
             shops = shops.order_by('-created_at')
 
-        # Pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 10))
-
-        paginator = Paginator(shops, page_size)
-        try:
-            shops_page = paginator.page(page)
-        except (PageNotAnInteger, EmptyPage):
-            shops_page = paginator.page(1)
+        # Pagination (keyset mode when a cursor parameter is given)
+        shops_page, pagination = AdminKeysetPagination.paginate(request, shops, default_page_size=10)
 
         serializer = AdminShopListSerializer(shops_page, many=True)
 
@@ -924,12 +897,7 @@ class AdminShopListView(APIView):
             'message': 'Danh sách cửa hàng được lấy thành công',
             'data': {
                 'shops': serializer.data,
-                'pagination': {
-                    'total': paginator.count,
-                    'pages': paginator.num_pages,
-                    'current_page': page,
-                    'page_size': page_size
-                }
+                'pagination': pagination
             }
         })
 